@@ -0,0 +1,313 @@
+"""
+Backend Benchmark Runner
+Loads (or reuses) the synthetic dataset in a dedicated MongoDB database,
+drives the FastAPI app in-process over ASGI with the benchmark scenarios and
+writes a JSON report with p50/p95/p99 latency and MongoDB query counts per
+operation, tagged with the git commit and dataset fingerprint so reports
+from different commits can be compared.
+
+Requests run without the uvicorn stack and without the startup background
+workers; the Redis response cache is disabled unless --cache is given, so
+numbers measure the handlers and their queries.
+
+Usage (from backend/):
+    python -m benchmark.runner                          # all scenarios, 550 rooms x 3 years
+    python -m benchmark.runner --scenarios dashboard_storm ari_polling --iterations 5
+    python -m benchmark.runner --rooms 120 --years 1 --output bench.json
+    python -m benchmark.runner --compare baseline.json --fail-on-regression
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmark.dataset import DatasetSpec, load_dataset, mark_dirty  # noqa: E402
+from benchmark.scenarios import SCENARIOS, BenchRequest, Scenario, get_scenarios  # noqa: E402
+from request_metrics import LatencyHistogram  # noqa: E402
+
+REPORT_VERSION = 1
+DEFAULT_DB_NAME = 'hotel_pms_bench'
+# Regression thresholds for --compare
+P95_REGRESSION_PCT = 15.0
+QUERY_REGRESSION = 0.5
+
+
+class BenchContext:
+    """What scenarios see: database, dataset spec and per-tenant credentials"""
+
+    def __init__(self, db, spec: DatasetSpec, tenants: List[Dict[str, Any]], client):
+        self.db = db
+        self.spec = spec
+        self.tenants = tenants
+        self.client = client
+
+    def headers(self, request: BenchRequest) -> Dict[str, str]:
+        tenant = self.tenants[request.tenant_index]
+        if request.auth == 'api_key':
+            return {'X-API-Key': tenant['api_key']}
+        return {'Authorization': f"Bearer {tenant['token']}"}
+
+
+class OperationStats:
+    """Latency histogram, query counts and status codes of one operation"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.queries: List[int] = []
+        self.db_time_us = 0
+        self.statuses: Counter = Counter()
+        self.shapes: Counter = Counter()
+
+    def record(self, elapsed_ms: float, status: int, profile):
+        self.latency.record_ms(elapsed_ms)
+        self.statuses[status] += 1
+        self.queries.append(profile.query_count)
+        self.db_time_us += profile.db_time_us
+        self.shapes.update(profile.shapes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        count = len(self.queries) or 1
+        return {
+            'latency_ms': self.latency.summary(),
+            'queries': {
+                'avg': round(sum(self.queries) / count, 2),
+                'max': max(self.queries, default=0),
+                'total': sum(self.queries),
+            },
+            'db_time_ms_avg': round(self.db_time_us / count / 1000, 2),
+            'status_codes': {str(code): n for code, n in sorted(self.statuses.items())},
+            'errors': sum(n for code, n in self.statuses.items() if code >= 400),
+            'top_query_shapes': [{'shape': s, 'count': n} for s, n in self.shapes.most_common(5)],
+        }
+
+
+def git_info() -> Dict[str, Any]:
+    def run(*args) -> Optional[str]:
+        try:
+            return subprocess.run(['git', *args], cwd=BACKEND_DIR, capture_output=True, text=True,
+                                  timeout=10).stdout.strip()
+        except Exception:
+            return None
+    return {
+        'commit': run('rev-parse', 'HEAD'),
+        'subject': run('log', '-1', '--format=%s'),
+        'dirty': bool(run('status', '--porcelain', '--untracked-files=no')),
+    }
+
+
+async def run_scenario(ctx: BenchContext, scenario: Scenario) -> Dict[str, Any]:
+    """Issue the scenario's requests with its concurrency; stats per operation"""
+    from endpoint_profiler import RequestProfile, _active_profile
+
+    await scenario.setup(ctx)
+    requests = scenario.requests(ctx)
+    stats: Dict[str, OperationStats] = {}
+    semaphore = asyncio.Semaphore(scenario.concurrency)
+
+    async def issue(request: BenchRequest):
+        async with semaphore:
+            # The profiler's command listener charges this task's queries to the profile
+            profile = RequestProfile(request.method, request.path, request.operation)
+            token = _active_profile.set(profile)
+            started = time.perf_counter()
+            try:
+                response = await ctx.client.request(request.method, request.path, params=request.params,
+                                                    headers=ctx.headers(request))
+                status = response.status_code
+            except Exception as e:
+                print(f"❌ {request.operation} {request.path}: {e}")
+                status = 599
+            finally:
+                _active_profile.reset(token)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats.setdefault(request.operation, OperationStats()).record(elapsed_ms, status, profile)
+
+    if scenario.mutates:
+        await mark_dirty(ctx.db, ctx.spec, scenario.name)
+    started = time.perf_counter()
+    await asyncio.gather(*[issue(r) for r in requests])
+    wall = time.perf_counter() - started
+
+    overall = OperationStats()
+    for op in stats.values():
+        overall.latency.merge(op.latency)
+    return {
+        'description': scenario.description,
+        'concurrency': scenario.concurrency,
+        'iterations': scenario.iterations,
+        'requests': len(requests),
+        'wall_seconds': round(wall, 2),
+        'throughput_rps': round(len(requests) / wall, 1) if wall else 0,
+        'latency_ms': overall.latency.summary(),
+        'operations': {name: op.to_dict() for name, op in sorted(stats.items())},
+    }
+
+
+async def tenant_credentials(db, spec: DatasetSpec, create_token) -> List[Dict[str, Any]]:
+    tenants = []
+    for index in range(spec.tenants):
+        tenant_id = spec.tenant_id(index)
+        admin = await db.users.find_one({'tenant_id': tenant_id, 'role': 'admin'}, {'_id': 0, 'id': 1})
+        tenants.append({'tenant_id': tenant_id, 'token': create_token(admin['id'], tenant_id),
+                        'api_key': spec.api_key(index)})
+    return tenants
+
+
+def _anchor(value: str) -> str:
+    """--anchor value, YYYY-MM-DD or 'today'"""
+    if value == 'today':
+        return datetime.now(timezone.utc).date().isoformat()
+    return date.fromisoformat(value).isoformat()
+
+
+async def run(args) -> Dict[str, Any]:
+    spec = DatasetSpec(seed=args.seed, tenants=args.tenants, rooms=args.rooms, years=args.years,
+                       **({'anchor': _anchor(args.anchor)} if args.anchor else {}))
+    scenarios = get_scenarios(args.scenarios, args.iterations)
+
+    # server.py binds its client at import time: point it at the benchmark database first
+    os.environ['MONGO_URL'] = args.mongo_url
+    os.environ['DB_NAME'] = args.db_name
+    import httpx
+    import server
+    from cache_manager import cache
+    from index_registry import get_index_registry
+
+    db = server.db
+    print(f"📦 Dataset {spec.fingerprint()} in {args.db_name} "
+          f"({spec.tenants} x {spec.rooms} rooms, {spec.years} years, anchor {spec.anchor})")
+    if spec.anchor != datetime.now(timezone.utc).date().isoformat():
+        print("  ⚠️  Anchor is not today: clock-bound endpoints (dashboards, night audit, check-in) "
+              "read a day outside the data")
+    started = time.perf_counter()
+    dataset = await load_dataset(db, spec, fresh=args.fresh)
+    await get_index_registry(db).migrate()
+    print(f"  ✓ ready in {time.perf_counter() - started:.1f}s: "
+          + ', '.join(f"{k}={v}" for k, v in sorted(dataset['counts'].items())))
+
+    cache.enabled = cache.enabled and args.cache
+    tenants = await tenant_credentials(db, spec, server.create_token)
+    build_info = await db.command('buildInfo')
+
+    report = {
+        'report_version': REPORT_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'git': git_info(),
+        'dataset': {'fingerprint': dataset['_id'], 'spec': dataset['spec'], 'counts': dataset['counts']},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'mongodb': build_info.get('version'),
+            'response_cache': cache.enabled,
+        },
+        'scenarios': {},
+    }
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=300) as client:
+        ctx = BenchContext(db, spec, tenants, client)
+        for scenario in scenarios:
+            print(f"\n🏁 {scenario.name}: {scenario.description}")
+            result = await run_scenario(ctx, scenario)
+            report['scenarios'][scenario.name] = result
+            print_scenario(scenario.name, result)
+
+    # Mutating scenarios consumed today's arrivals and posted charges: reload next time
+    if any(s.mutates for s in scenarios):
+        print("\nℹ️  Dataset was modified by mutating scenarios; the next run reloads it")
+    return report
+
+
+def print_scenario(name: str, result: Dict[str, Any]):
+    print(f"  {result['requests']} requests in {result['wall_seconds']}s ({result['throughput_rps']} req/s)")
+    print(f"  {'operation':<26}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'queries':>9}{'errors':>8}")
+    for op, data in result['operations'].items():
+        lat = data['latency_ms']
+        print(f"  {op:<26}{lat.get('count', 0):>7}{lat.get('p50_ms', 0):>10}{lat.get('p95_ms', 0):>10}"
+              f"{lat.get('p99_ms', 0):>10}{data['queries']['avg']:>9}{data['errors']:>8}")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], p95_pct: float = P95_REGRESSION_PCT) -> List[str]:
+    """Print p95 and query-count deltas against a baseline report; returns regressions"""
+    regressions = []
+    base_commit = (baseline.get('git') or {}).get('commit') or 'unknown'
+    print(f"\n📊 Compared with {base_commit[:10]} ({baseline.get('created_at', '?')})")
+    if baseline.get('dataset', {}).get('fingerprint') != report['dataset']['fingerprint']:
+        print("  ⚠️  Different dataset fingerprint: deltas include data changes")
+    print(f"  {'scenario/operation':<42}{'p95 base':>10}{'p95 now':>10}{'Δ%':>8}{'q base':>8}{'q now':>8}")
+    for name, result in report['scenarios'].items():
+        base_ops = (baseline.get('scenarios', {}).get(name) or {}).get('operations', {})
+        for op, data in result['operations'].items():
+            base = base_ops.get(op)
+            if not base:
+                continue
+            p95, base_p95 = data['latency_ms'].get('p95_ms', 0), base['latency_ms'].get('p95_ms', 0)
+            delta = round((p95 - base_p95) / base_p95 * 100, 1) if base_p95 else 0.0
+            queries, base_queries = data['queries']['avg'], base['queries']['avg']
+            flags = []
+            if delta > p95_pct:
+                flags.append('p95')
+            if queries - base_queries >= QUERY_REGRESSION:
+                flags.append('queries')
+            label = f"{name}/{op}"
+            print(f"  {label:<42}{base_p95:>10}{p95:>10}{delta:>8}{base_queries:>8}{queries:>8}"
+                  + (f"  ❌ {'+'.join(flags)}" if flags else ''))
+            if flags:
+                regressions.append(f"{label}: {', '.join(flags)}")
+    print(f"  {len(regressions)} regression(s)" if regressions else "  ✅ No regressions")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Hotel PMS backend benchmark')
+    parser.add_argument('--scenarios', nargs='*', choices=list(SCENARIOS), help='default: all')
+    parser.add_argument('--iterations', type=int, default=3, help='rounds for repeatable scenarios')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--tenants', type=int, default=1)
+    parser.add_argument('--rooms', type=int, default=550)
+    parser.add_argument('--years', type=float, default=3.0)
+    parser.add_argument('--anchor', help="business date of the dataset, YYYY-MM-DD or 'today' (default: today); "
+                                         "dashboards, night audit and check-in read the server clock, "
+                                         "so other dates leave them outside the data")
+    parser.add_argument('--fresh', action='store_true', help='reload the dataset even if present')
+    parser.add_argument('--cache', action='store_true', help='keep the Redis response cache enabled')
+    parser.add_argument('--mongo-url', default=os.environ.get('BENCH_MONGO_URL', 'mongodb://localhost:27017'))
+    parser.add_argument('--db-name', default=os.environ.get('BENCH_DB_NAME', DEFAULT_DB_NAME))
+    parser.add_argument('--output', help='report path (default: benchmark-<commit>.json)')
+    parser.add_argument('--compare', help='baseline report to compare against')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+
+    output = args.output or f"benchmark-{(report['git']['commit'] or 'local')[:10]}.json"
+    Path(output).write_text(json.dumps(report, indent=2))
+    print(f"\n💾 Report written to {output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(report, baseline)
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
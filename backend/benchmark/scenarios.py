@@ -0,0 +1,150 @@
+"""
+Benchmark Scenarios
+Load shapes replayed against the in-process app: the morning check-in rush,
+the night audit, channel-manager ARI polling and a dashboard refresh storm.
+Each scenario resolves its targets from the dataset in setup() and yields
+the requests to issue; the runner executes them with the scenario's
+concurrency and records latency and query count per operation.
+"""
+
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+
+@dataclass
+class BenchRequest:
+    """One HTTP call of a scenario; `operation` groups calls in the report"""
+    operation: str
+    method: str
+    path: str
+    tenant_index: int = 0
+    params: Dict[str, Any] = field(default_factory=dict)
+    auth: str = 'user'  # 'user' (JWT) or 'api_key' (channel manager)
+
+
+class Scenario:
+    """Base scenario: read-only unless `mutates` is set"""
+
+    name = 'scenario'
+    description = ''
+    concurrency = 10
+    mutates = False
+
+    def __init__(self, iterations: int = 1):
+        self.iterations = iterations
+
+    async def setup(self, ctx) -> None:
+        """Resolve scenario targets from the dataset"""
+
+    def requests(self, ctx) -> List[BenchRequest]:
+        raise NotImplementedError
+
+
+class DashboardStorm(Scenario):
+    """Every dashboard a property's managers keep open, refreshed at once"""
+
+    name = 'dashboard_storm'
+    description = 'Concurrent refresh of GM, front desk, housekeeping, finance and portfolio dashboards'
+    concurrency = 50
+    endpoints = [
+        ('pms_dashboard', '/api/pms/dashboard', {}),
+        ('role_based_dashboard', '/api/dashboard/role-based', {}),
+        ('executive_kpi_snapshot', '/api/executive/kpi-snapshot', {}),
+        ('daily_flash', '/api/reports/daily-flash', {}),
+        ('finance_snapshot', '/api/reports/finance-snapshot', {}),
+        ('housekeeping_boards', '/api/housekeeping/boards', {}),
+        ('portfolio_dashboard', '/api/multi-property/dashboard', {}),
+        ('arrivals', '/api/frontdesk/arrivals', {}),
+    ]
+
+    def requests(self, ctx) -> List[BenchRequest]:
+        return [
+            BenchRequest(operation, 'GET', path, tenant_index, dict(params))
+            for _ in range(self.iterations)
+            for tenant_index in range(ctx.spec.tenants)
+            for operation, path, params in self.endpoints
+        ]
+
+
+class AriPolling(Scenario):
+    """Channel managers pulling rolling availability/rate windows"""
+
+    name = 'ari_polling'
+    description = 'Channel-manager ARI pulls (v1 and v2) over rolling 30-day windows'
+    concurrency = 25
+    window_days = 30
+
+    def requests(self, ctx) -> List[BenchRequest]:
+        anchor = ctx.spec.anchor_date
+        horizon = max(ctx.spec.future_days - self.window_days, 1)
+        result = []
+        for i in range(self.iterations * 10):
+            start = anchor + timedelta(days=(i * 7) % horizon)
+            params = {'start_date': start.isoformat(),
+                      'end_date': (start + timedelta(days=self.window_days - 1)).isoformat()}
+            for tenant_index in range(ctx.spec.tenants):
+                result.append(BenchRequest('cm_ari', 'GET', '/api/cm/ari', tenant_index, params, 'api_key'))
+                result.append(BenchRequest('cm_ari_v2', 'GET', '/api/cm/ari/v2', tenant_index, params, 'api_key'))
+        return result
+
+
+class CheckInRush(Scenario):
+    """Front desk checking in today's arrivals while agents poll the arrivals list"""
+
+    name = 'check_in_rush'
+    description = "Check in every arrival of the day with concurrent arrivals-list polling"
+    concurrency = 20
+    mutates = True
+
+    def __init__(self, iterations: int = 1):
+        super().__init__(iterations)
+        self.arrivals: List[tuple] = []
+
+    async def setup(self, ctx) -> None:
+        anchor = ctx.spec.anchor
+        self.arrivals = []
+        for tenant_index, tenant in enumerate(ctx.tenants):
+            bookings = await ctx.db.bookings.find(
+                {'tenant_id': tenant['tenant_id'], 'status': {'$in': ['confirmed', 'guaranteed']},
+                 'check_in': {'$gte': anchor, '$lt': anchor + 'T99'}},
+                {'_id': 0, 'id': 1}
+            ).to_list(None)
+            self.arrivals.extend((tenant_index, b['id']) for b in bookings)
+
+    def requests(self, ctx) -> List[BenchRequest]:
+        result = []
+        for n, (tenant_index, booking_id) in enumerate(self.arrivals):
+            result.append(BenchRequest('check_in', 'POST', f'/api/frontdesk/checkin/{booking_id}', tenant_index))
+            # One arrivals-list refresh for every few check-ins
+            if n % 5 == 0:
+                result.append(BenchRequest('arrivals', 'GET', '/api/frontdesk/arrivals', tenant_index))
+        return result
+
+
+class NightAudit(Scenario):
+    """Room charge posting followed by the reports the auditor prints"""
+
+    name = 'night_audit'
+    description = 'Post room charges for all in-house stays, then run the daily flash report'
+    concurrency = 1
+    mutates = True
+
+    def requests(self, ctx) -> List[BenchRequest]:
+        result = []
+        for tenant_index in range(ctx.spec.tenants):
+            result.append(BenchRequest('post_room_charges', 'POST', '/api/night-audit/post-room-charges',
+                                       tenant_index))
+            result.append(BenchRequest('daily_flash', 'GET', '/api/reports/daily-flash', tenant_index))
+        return result
+
+
+# Read-only scenarios first so mutations never leak into them
+SCENARIOS = {s.name: s for s in (DashboardStorm, AriPolling, CheckInRush, NightAudit)}
+
+
+def get_scenarios(names: Optional[List[str]] = None, iterations: int = 1) -> List[Scenario]:
+    unknown = [n for n in names or [] if n not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"Unknown scenario(s): {', '.join(unknown)}; available: {', '.join(SCENARIOS)}")
+    return [cls(iterations) for name, cls in SCENARIOS.items() if not names or name in names]
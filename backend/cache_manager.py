@@ -12,6 +12,8 @@ import asyncio
 from datetime import timedelta
 import logging
 
+from request_metrics import record_cache_operation
+
 logger = logging.getLogger(__name__)
 
 class CacheManager:
@@ -44,6 +46,7 @@ class CacheManager:
         
         try:
             value = self.client.get(key)
+            record_cache_operation('redis', value is not None)
             if value:
                 return json.loads(value)
             return None
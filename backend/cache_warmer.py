@@ -1,210 +1,476 @@
 """
-Cache Warmer - Pre-warm critical endpoints for instant response
-Runs on startup and periodically refreshes cache
+Cache Warmer - tenant-aware, priority-driven pre-warming of hot views
+Endpoints report every lookup of a warmable view (rooms list, bookings list,
+PMS dashboard, arrivals, departures, in-house). A scheduler turns those
+observations into per-(tenant, view) priorities by hour of day, boosts the
+views of the morning arrivals rush and the night audit, and writes complete
+results to the shared Redis cache within a memory budget. One worker warms
+per cycle (Redis lock); every worker reports its lookups, so coverage and
+hit rates are portfolio-wide.
 """
+
 import asyncio
-from datetime import datetime, timezone, timedelta
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import socket
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+from fastapi import APIRouter, HTTPException
+
+from pagination_utils import SORT_CHECK_IN_DESC, SORT_ROOM_NUMBER
+from request_metrics import record_cache_operation
+
+CACHE_WARMER_INTERVAL_SECONDS = int(os.environ.get('CACHE_WARMER_INTERVAL_SECONDS', '20'))
+CACHE_WARMER_MEMORY_MB = float(os.environ.get('CACHE_WARMER_MEMORY_MB', '64'))
+CACHE_WARMER_MAX_LOADS_PER_CYCLE = int(os.environ.get('CACHE_WARMER_MAX_LOADS_PER_CYCLE', '200'))
+CACHE_WARMER_CONCURRENCY = int(os.environ.get('CACHE_WARMER_CONCURRENCY', '4'))
+# Lookups over the past week below which a view is left to the endpoint
+CACHE_WARMER_MIN_ACCESSES = int(os.environ.get('CACHE_WARMER_MIN_ACCESSES', '3'))
+# Property local time for the arrivals / night audit windows
+PROPERTY_UTC_OFFSET_HOURS = int(os.environ.get('PROPERTY_UTC_OFFSET_HOURS', '3'))
+
+# Bookings list endpoint serves cached_data[:limit]; larger limits go to the database
+BOOKINGS_WARM_LIMIT = 200
+ACCESS_RETENTION_SECONDS = 8 * 24 * 3600
+
+cache_warmer_router = APIRouter(prefix="/api/monitoring/cache-warmer", tags=["Cache Warmer"])
+
+
+# ============= VIEW LOADERS =============
+
+def _today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _day_bounds(day: str) -> Tuple[str, str]:
+    target = datetime.fromisoformat(day).date()
+    return (datetime.combine(target, datetime.min.time()).isoformat(),
+            datetime.combine(target, datetime.max.time()).isoformat())
+
+
+async def _by_id(collection, ids, projection: Optional[Dict[str, int]] = None) -> Dict[str, Dict[str, Any]]:
+    ids = list({i for i in ids if i})
+    if not ids:
+        return {}
+    docs = await collection.find({'id': {'$in': ids}}, {'_id': 0, **(projection or {})}).to_list(len(ids))
+    return {d['id']: d for d in docs}
+
+
+async def load_rooms(db, tenant_id: str) -> List[Dict[str, Any]]:
+    """Every active room in room-number order (the unfiltered /pms/rooms view)"""
+    projection = {'_id': 0, 'id': 1, 'room_number': 1, 'room_type': 1, 'status': 1, 'floor': 1, 'capacity': 1,
+                  'max_occupancy': 1, 'base_price': 1, 'tenant_id': 1, 'amenities': 1, 'view': 1, 'bed_type': 1,
+                  'images': 1}
+    rooms = await db.rooms.find(
+        {'tenant_id': tenant_id, '$or': [{'is_active': True}, {'is_active': {'$exists': False}}]}, projection
+    ).sort(SORT_ROOM_NUMBER).to_list(None)
+    for room in rooms:
+        try:
+            room['floor'] = int(room.get('floor', 1))
+        except (TypeError, ValueError):
+            room['floor'] = 1
+        room.setdefault('capacity', room.get('max_occupancy', 2))
+    return rooms
+
+
+async def load_bookings(db, tenant_id: str) -> List[Dict[str, Any]]:
+    """Most recent bookings by check-in (the unfiltered /pms/bookings view)"""
+    bookings = await db.bookings.find({'tenant_id': tenant_id}, {'_id': 0}).sort(SORT_CHECK_IN_DESC) \
+        .limit(BOOKINGS_WARM_LIMIT).to_list(BOOKINGS_WARM_LIMIT)
+    guests, rooms = await asyncio.gather(
+        _by_id(db.guests, [b.get('guest_id') for b in bookings if not b.get('guest_name')],
+               {'id': 1, 'first_name': 1, 'last_name': 1}),
+        _by_id(db.rooms, [b.get('room_id') for b in bookings if not b.get('room_number')],
+               {'id': 1, 'room_number': 1}),
+    )
+    for booking in bookings:
+        guest = guests.get(booking.get('guest_id'))
+        if not booking.get('guest_name') and guest:
+            booking['guest_name'] = (f"{guest.get('first_name', '')} {guest.get('last_name', '')}".strip()
+                                     or 'Unknown Guest')
+        room = rooms.get(booking.get('room_id'))
+        if not booking.get('room_number') and room:
+            booking['room_number'] = room.get('room_number', 'Unknown Room')
+    return bookings
+
+
+async def load_dashboard(db, tenant_id: str) -> Dict[str, Any]:
+    """PMS dashboard counters"""
+    start, end = _day_bounds(_today())
+    room_stats, today_checkins, total_guests = await asyncio.gather(
+        db.rooms.aggregate([
+            {'$match': {'tenant_id': tenant_id}},
+            {'$group': {'_id': None, 'total_rooms': {'$sum': 1},
+                        'occupied_rooms': {'$sum': {'$cond': [{'$eq': ['$status', 'occupied']}, 1, 0]}}}},
+        ]).to_list(1),
+        db.bookings.count_documents({'tenant_id': tenant_id, 'check_in': {'$gte': start, '$lte': end}}),
+        db.guests.count_documents({'tenant_id': tenant_id}),
+    )
+    total_rooms = room_stats[0]['total_rooms'] if room_stats else 0
+    occupied_rooms = room_stats[0]['occupied_rooms'] if room_stats else 0
+    return {
+        'total_rooms': total_rooms,
+        'occupied_rooms': occupied_rooms,
+        'available_rooms': total_rooms - occupied_rooms,
+        'occupancy_rate': round((occupied_rooms / total_rooms * 100), 2) if total_rooms > 0 else 0,
+        'today_checkins': today_checkins,
+        'total_guests': total_guests,
+    }
+
+
+async def _with_guest_and_room(db, bookings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    guests, rooms = await asyncio.gather(
+        _by_id(db.guests, [b.get('guest_id') for b in bookings]),
+        _by_id(db.rooms, [b.get('room_id') for b in bookings]),
+    )
+    return [{**b, 'guest': guests.get(b.get('guest_id')), 'room': rooms.get(b.get('room_id'))} for b in bookings]
+
+
+async def load_arrivals(db, tenant_id: str, day: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Bookings arriving on the day with guest and room"""
+    start, end = _day_bounds(day or _today())
+    bookings = await db.bookings.find({'tenant_id': tenant_id, 'status': {'$in': ['confirmed', 'checked_in']},
+                                       'check_in': {'$gte': start, '$lte': end}}, {'_id': 0}).to_list(1000)
+    return await _with_guest_and_room(db, bookings)
+
+
+async def load_departures(db, tenant_id: str, day: Optional[str] = None) -> List[Dict[str, Any]]:
+    """In-house bookings departing on the day with guest, room and folio balance"""
+    start, end = _day_bounds(day or _today())
+    bookings = await db.bookings.find({'tenant_id': tenant_id, 'status': 'checked_in',
+                                       'check_out': {'$gte': start, '$lte': end}}, {'_id': 0}).to_list(1000)
+    ids = [b['id'] for b in bookings]
+    enriched, charges, payments = await asyncio.gather(
+        _with_guest_and_room(db, bookings),
+        db.folio_charges.aggregate([
+            {'$match': {'booking_id': {'$in': ids}}},
+            {'$group': {'_id': '$booking_id', 'total': {'$sum': '$total'}}},
+        ]).to_list(None),
+        db.payments.aggregate([
+            {'$match': {'booking_id': {'$in': ids}, 'status': 'paid'}},
+            {'$group': {'_id': '$booking_id', 'total': {'$sum': '$amount'}}},
+        ]).to_list(None),
+    )
+    charged = {r['_id']: r['total'] for r in charges}
+    paid = {r['_id']: r['total'] for r in payments}
+    return [{**b, 'balance': charged.get(b['id'], 0) - paid.get(b['id'], 0)} for b in enriched]
+
+
+async def load_inhouse(db, tenant_id: str) -> List[Dict[str, Any]]:
+    """Checked-in bookings with guest and room"""
+    bookings = await db.bookings.find({'tenant_id': tenant_id, 'status': 'checked_in'}, {'_id': 0}).to_list(1000)
+    return await _with_guest_and_room(db, bookings)
+
+
+class WarmTarget:
+    """A warmable view: loader, TTL, base weight and the local hours it is boosted in"""
+
+    def __init__(self, name: str, loader: Callable[..., Awaitable[Any]], ttl: int, weight: float = 1.0,
+                 peak_hours: Tuple[int, ...] = (), estimated_bytes: int = 64 * 1024):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.weight = weight
+        self.peak_hours = set(peak_hours)
+        self.estimated_bytes = estimated_bytes
+
+
+MORNING_ARRIVALS = tuple(range(6, 12))
+NIGHT_AUDIT = (22, 23, 0, 1, 2, 3)
+
+TARGETS: Dict[str, WarmTarget] = {t.name: t for t in [
+    WarmTarget('dashboard', load_dashboard, ttl=30, weight=1.5, peak_hours=MORNING_ARRIVALS + NIGHT_AUDIT,
+               estimated_bytes=512),
+    WarmTarget('rooms', load_rooms, ttl=45, weight=1.2, peak_hours=MORNING_ARRIVALS),
+    WarmTarget('bookings', load_bookings, ttl=60),
+    WarmTarget('arrivals', load_arrivals, ttl=60, weight=1.2, peak_hours=MORNING_ARRIVALS),
+    WarmTarget('departures', load_departures, ttl=60, weight=1.2, peak_hours=MORNING_ARRIVALS),
+    WarmTarget('inhouse', load_inhouse, ttl=60, peak_hours=NIGHT_AUDIT),
+]}
+PEAK_BOOST = 3.0
+
+
+# ============= SCHEDULER =============
 
 class CacheWarmer:
-    """Pre-warm cache for instant response"""
-    
-    def __init__(self, db):
+    """Observes view lookups and keeps the hottest tenant views warm in Redis"""
+
+    def __init__(self, db, interval: int = CACHE_WARMER_INTERVAL_SECONDS,
+                 memory_budget_bytes: int = int(CACHE_WARMER_MEMORY_MB * 1024 * 1024)):
         self.db = db
-        self.cache = {}
-        self.last_refresh = {}
-    
-    async def warm_all_caches(self, tenant_id: str):
-        """Warm all critical caches"""
-        print(f"🔥 Warming caches for tenant: {tenant_id}")
-        
-        # Run all warming tasks in parallel
-        await asyncio.gather(
-            self.warm_rooms_cache(tenant_id),
-            self.warm_bookings_cache(tenant_id),
-            self.warm_dashboard_cache(tenant_id),
-            self.warm_kpi_cache(tenant_id),
-            return_exceptions=True
-        )
-        
-        print(f"✅ Cache warming complete for tenant: {tenant_id}")
-    
-    async def warm_rooms_cache(self, tenant_id: str):
-        """Pre-warm rooms cache"""
-        try:
-            projection = {
-                '_id': 0, 'id': 1, 'room_number': 1, 'room_type': 1,
-                'status': 1, 'floor': 1, 'capacity': 1, 'base_price': 1, 'max_occupancy': 1, 'tenant_id': 1
-            }
-            # First, check total count
-            total_rooms = await self.db.rooms.count_documents({})
-            print(f"  🔍 Total rooms in DB: {total_rooms}")
-            
-            # Try without tenant filter if none found
-            rooms = await self.db.rooms.find({}, projection).limit(100).to_list(100)
-            
-            if rooms and len(rooms) > 0:
-                # Cache for all tenants found
-                tenants = set(room.get('tenant_id') for room in rooms if room.get('tenant_id'))
-                for t_id in tenants:
-                    tenant_rooms = [r for r in rooms if r.get('tenant_id') == t_id]
-                    cache_key = f"rooms:{t_id}"
-                    self.cache[cache_key] = {
-                        'data': tenant_rooms,
-                        'expires_at': datetime.utcnow() + timedelta(seconds=20)  # Shorter expiry for fresh data
-                    }
-                    print(f"  ✅ Rooms cache warmed for tenant {t_id[:8]}: {len(tenant_rooms)} rooms")
-            else:
-                print(f"  ⚠️ No rooms found in database")
-        except Exception as e:
-            print(f"  ❌ Rooms cache warming failed: {e}")
-    
-    async def warm_bookings_cache(self, tenant_id: str):
-        """Pre-warm bookings cache"""
-        try:
-            # Check total bookings
-            total_bookings = await self.db.bookings.count_documents({})
-            print(f"  🔍 Total bookings in DB: {total_bookings}")
-            
-            today = datetime.now(timezone.utc)
-            start = (today - timedelta(days=30)).isoformat()  # Wider range
-            end = (today + timedelta(days=30)).isoformat()
-            
-            projection = {
-                '_id': 0, 'id': 1, 'guest_id': 1, 'room_id': 1,
-                'check_in': 1, 'check_out': 1, 'status': 1, 'total_amount': 1,
-                'rate_type': 1, 'market_segment': 1, 'booking_source': 1, 'tenant_id': 1
-            }
-            
-            # Get all bookings without date filter if none found
-            bookings = await self.db.bookings.find({}, projection).limit(50).to_list(50)
-            
-            if bookings and len(bookings) > 0:
-                # Cache for all tenants
-                tenants = set(b.get('tenant_id') for b in bookings if b.get('tenant_id'))
-                for t_id in tenants:
-                    tenant_bookings = [b for b in bookings if b.get('tenant_id') == t_id]
-                    cache_key = f"bookings:{t_id}"
-                    self.cache[cache_key] = {
-                        'data': tenant_bookings,
-                        'expires_at': datetime.utcnow() + timedelta(seconds=20)  # Aggressive refresh
-                    }
-                    print(f"  ✅ Bookings cache warmed for tenant {t_id[:8]}: {len(tenant_bookings)} bookings")
-            else:
-                print(f"  ⚠️ No bookings found in database")
-        except Exception as e:
-            print(f"  ❌ Bookings cache warming failed: {e}")
-    
-    async def warm_dashboard_cache(self, tenant_id: str):
-        """Pre-warm dashboard cache"""
+        self.interval = interval
+        self.memory_budget_bytes = memory_budget_bytes
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # Unflushed lookups of this worker: (tenant_id, target, utc hour) -> n, and target -> hits/misses
+        self._accesses: Counter = Counter()
+        self._hits: Counter = Counter()
+        self._misses: Counter = Counter()
+        self._sizes: Dict[Tuple[str, str], int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self._cycle_lock = asyncio.Lock()
+        self.last_cycle: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def _redis():
+        from redis_cache import redis_cache
+        return redis_cache
+
+    # ------------------------------------------------------------ lifecycle
+
+    async def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._task = asyncio.create_task(self._scheduler(), name='cache-warmer')
+        print(f"🔥 Cache warmer scheduled every {self.interval}s "
+              f"(budget {self.memory_budget_bytes // (1024 * 1024)} MB)")
+
+    async def stop(self):
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._flush_stats()
+
+    async def _scheduler(self):
+        while self._running:
+            try:
+                await self.run_cycle()
+            except Exception as e:
+                print(f"⚠️ Cache warming cycle failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    # ------------------------------------------------------------ endpoint side
+
+    def get_cached(self, cache_key: str) -> Optional[Any]:
+        """Warmed '<target>:<tenant_id>' view from the shared cache; records the lookup"""
+        target, _, tenant_id = cache_key.partition(':')
+        self._accesses[(tenant_id, target, datetime.now(timezone.utc).hour)] += 1
+        redis = self._redis()
+        value = None
+        if redis:
+            try:
+                payload = redis.redis_client.get(f"warm:{cache_key}")
+                value = orjson.loads(payload) if payload else None
+            except Exception as e:
+                print(f"⚠️ Warm cache read failed for {cache_key}: {e}")
+        (self._hits if value is not None else self._misses)[target] += 1
+        record_cache_operation('warm', value is not None)
+        return value
+
+    def invalidate(self, tenant_id: str, targets: List[str]):
+        """Drop warmed views a write made stale; the next cycle or request rebuilds them"""
+        redis = self._redis()
+        if redis:
+            for target in targets:
+                redis.delete(f"warm:{target}:{tenant_id}")
+
+    # ------------------------------------------------------------ shared state
+
+    def _flush_stats(self):
+        """Publish this worker's lookups and hit/miss counts to Redis"""
+        redis = self._redis()
+        if not redis or not (self._accesses or self._hits or self._misses):
+            return
+        accesses, hits, misses = self._accesses, self._hits, self._misses
+        self._accesses, self._hits, self._misses = Counter(), Counter(), Counter()
         try:
-            # Room stats
-            pipeline = [
-                {'$match': {'tenant_id': tenant_id}},
-                {'$group': {
-                    '_id': None,
-                    'total_rooms': {'$sum': 1},
-                    'occupied_rooms': {'$sum': {'$cond': [{'$eq': ['$status', 'occupied']}, 1, 0]}}
-                }}
-            ]
-            room_stats = await self.db.rooms.aggregate(pipeline).to_list(1)
-            
-            total_rooms = room_stats[0]['total_rooms'] if room_stats else 0
-            occupied_rooms = room_stats[0]['occupied_rooms'] if room_stats else 0
-            
-            # Quick counts
-            today = datetime.now(timezone.utc).replace(hour=0, minute=0).isoformat()
-            today_checkins = await self.db.bookings.count_documents({
-                'tenant_id': tenant_id, 'check_in': {'$gte': today}
-            })
-            total_guests = await self.db.guests.count_documents({'tenant_id': tenant_id})
-            
-            dashboard_data = {
-                'total_rooms': total_rooms,
-                'occupied_rooms': occupied_rooms,
-                'available_rooms': total_rooms - occupied_rooms,
-                'occupancy_rate': round((occupied_rooms / total_rooms * 100), 2) if total_rooms > 0 else 0,
-                'today_checkins': today_checkins,
-                'total_guests': total_guests
-            }
-            
-            cache_key = f"dashboard:{tenant_id}"
-            self.cache[cache_key] = {
-                'data': dashboard_data,
-                'expires_at': datetime.utcnow() + timedelta(seconds=20)  # Aggressive refresh
-            }
-            print(f"  ✅ Dashboard cache warmed")
+            pipe = redis.redis_client.pipeline(transaction=False)
+            for (tenant_id, target, hour), n in accesses.items():
+                pipe.hincrby(f"warm:access:{hour:02d}", f"{tenant_id}|{target}", n)
+                pipe.expire(f"warm:access:{hour:02d}", ACCESS_RETENTION_SECONDS)
+            for target, n in hits.items():
+                pipe.hincrby('warm:stats', f"{target}|hits", n)
+            for target, n in misses.items():
+                pipe.hincrby('warm:stats', f"{target}|misses", n)
+            pipe.execute()
         except Exception as e:
-            print(f"  ❌ Dashboard cache warming failed: {e}")
-    
-    async def warm_kpi_cache(self, tenant_id: str):
-        """Pre-warm KPI cache"""
-        try:
-            # Pre-calculate KPIs
-            total_rooms = await self.db.rooms.count_documents({'tenant_id': tenant_id}) or 50
-            occupied_rooms = await self.db.rooms.count_documents({
-                'tenant_id': tenant_id, 'status': 'occupied'
-            })
-            
-            kpi_data = {
-                'occupancy_pct': round((occupied_rooms / total_rooms * 100), 2),
-                'total_revenue': 15000,  # Estimated
-                'adr': 150,  # Estimated
-                'revpar': 112.5,  # Estimated
-                'nps_score': 85,  # Estimated
-                'cash_balance': 150000,  # Estimated
-                'total_rooms': total_rooms,
-                'occupied_rooms': occupied_rooms
+            print(f"⚠️ Cache warmer stats flush failed: {e}")
+
+    def _access_profile(self) -> Dict[Tuple[str, str], Dict[int, int]]:
+        """(tenant_id, target) -> {utc hour: lookups} over the retention window"""
+        redis = self._redis()
+        pipe = redis.redis_client.pipeline(transaction=False)
+        for hour in range(24):
+            pipe.hgetall(f"warm:access:{hour:02d}")
+        profile: Dict[Tuple[str, str], Dict[int, int]] = {}
+        for hour, counts in enumerate(pipe.execute()):
+            for field, n in (counts or {}).items():
+                tenant_id, _, target = (field.decode() if isinstance(field, bytes) else field).partition('|')
+                profile.setdefault((tenant_id, target), {})[hour] = int(n)
+        return profile
+
+    def _acquire(self) -> bool:
+        """One warming worker per cycle across the deployment"""
+        client = self._redis().redis_client
+        if client.set('warm:lock', self.worker_id, nx=True, ex=self.interval * 2):
+            return True
+        owner = client.get('warm:lock')
+        if owner and owner.decode() == self.worker_id:
+            client.expire('warm:lock', self.interval * 2)
+            return True
+        return False
+
+    # ------------------------------------------------------------ planning
+
+    def plan(self, profile: Dict[Tuple[str, str], Dict[int, int]], now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Candidate views ordered by priority for the current hour"""
+        now = now or datetime.now(timezone.utc)
+        hour, next_hour = now.hour, (now.hour + 1) % 24
+        local_hour = (hour + PROPERTY_UTC_OFFSET_HOURS) % 24
+        candidates = []
+        for (tenant_id, name), by_hour in profile.items():
+            target = TARGETS.get(name)
+            total = sum(by_hour.values())
+            if not target or not tenant_id or total < CACHE_WARMER_MIN_ACCESSES:
+                continue
+            # This hour and the next one on past days, plus a share of all-day demand
+            demand = by_hour.get(hour, 0) + 0.5 * by_hour.get(next_hour, 0) + total / 24
+            boost = PEAK_BOOST if local_hour in target.peak_hours else 1.0
+            candidates.append({'tenant_id': tenant_id, 'target': name,
+                               'score': round(demand * target.weight * boost, 2), 'lookups': total})
+        candidates.sort(key=lambda c: c['score'], reverse=True)
+        return candidates
+
+    async def _warm(self, tenant_id: str, target: WarmTarget) -> int:
+        value = await target.loader(self.db, tenant_id)
+        payload = orjson.dumps(value)
+        self._redis().redis_client.setex(f"warm:{target.name}:{tenant_id}", target.ttl, payload)
+        self._sizes[(tenant_id, target.name)] = len(payload)
+        return len(payload)
+
+    async def run_cycle(self, force: bool = False) -> Dict[str, Any]:
+        """Flush lookups, then (on the lock holder) rewarm expiring views by priority within the budget"""
+        self._flush_stats()
+        if not self._redis():
+            return {'status': 'disabled', 'message': 'Shared Redis cache not available'}
+        if not force and not self._acquire():
+            return {'status': 'standby', 'message': 'Another worker is warming'}
+
+        async with self._cycle_lock:
+            started = time.perf_counter()
+            client = self._redis().redis_client
+            candidates = self.plan(self._access_profile())
+            pipe = client.pipeline(transaction=False)
+            for c in candidates:
+                pipe.ttl(f"warm:{c['target']}:{c['tenant_id']}")
+            ttls = pipe.execute() if candidates else []
+
+            used, loads = 0, []
+            counts = Counter()
+            for c, ttl in zip(candidates, ttls):
+                target = TARGETS[c['target']]
+                size = self._sizes.get((c['tenant_id'], c['target']), target.estimated_bytes)
+                if used + size > self.memory_budget_bytes:
+                    c['state'] = 'over_budget'
+                elif ttl is not None and ttl > self.interval and not force:
+                    c['state'] = 'warm'
+                    used += size
+                elif len(loads) >= CACHE_WARMER_MAX_LOADS_PER_CYCLE:
+                    c['state'] = 'deferred'
+                else:
+                    c['state'] = 'warming'
+                    used += size
+                    loads.append(c)
+
+            semaphore = asyncio.Semaphore(CACHE_WARMER_CONCURRENCY)
+
+            async def warm(c):
+                async with semaphore:
+                    try:
+                        c['bytes'] = await self._warm(c['tenant_id'], TARGETS[c['target']])
+                        c['state'] = 'warmed'
+                    except Exception as e:
+                        c['state'] = 'failed'
+                        c['error'] = str(e)
+
+            await asyncio.gather(*[warm(c) for c in loads])
+            for c in candidates:
+                counts[c['state']] += 1
+
+            covered = counts['warm'] + counts['warmed']
+            result = {
+                'status': 'ok',
+                'worker': self.worker_id,
+                'finished_at': datetime.now(timezone.utc).isoformat(),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+                'candidates': len(candidates),
+                'states': dict(counts),
+                'coverage_pct': round(covered / len(candidates) * 100, 1) if candidates else 100.0,
+                'memory': {'budget_bytes': self.memory_budget_bytes,
+                           'used_bytes': sum(self._sizes.get((c['tenant_id'], c['target']), 0)
+                                             for c in candidates if c['state'] in ('warm', 'warmed'))},
+                'top': candidates[:20],
             }
-            
-            cache_key = f"kpi:{tenant_id}"
-            self.cache[cache_key] = {
-                'data': kpi_data,
-                'expires_at': datetime.utcnow() + timedelta(seconds=20)  # Aggressive refresh
+            self.last_cycle = result
+            client.setex('warm:last_cycle', ACCESS_RETENTION_SECONDS, orjson.dumps(result))
+            if counts['warmed'] or counts['failed']:
+                print(f"🔥 Warmed {counts['warmed']} views ({counts['failed']} failed, "
+                      f"{counts['over_budget']} over budget) in {result['duration_ms']} ms")
+            return result
+
+    # ------------------------------------------------------------ reporting
+
+    def report(self) -> Dict[str, Any]:
+        """Last cycle's coverage and memory use plus hit rates per view"""
+        self._flush_stats()
+        redis = self._redis()
+        report = {'running': self._running, 'interval_seconds': self.interval, 'shared_cache': bool(redis),
+                  'memory_budget_bytes': self.memory_budget_bytes, 'last_cycle': self.last_cycle, 'targets': {}}
+        if not redis:
+            return report
+        client = redis.redis_client
+        last = client.get('warm:last_cycle')
+        if last:
+            report['last_cycle'] = orjson.loads(last)
+        stats = {(k.decode() if isinstance(k, bytes) else k): int(v)
+                 for k, v in (client.hgetall('warm:stats') or {}).items()}
+        for name, target in TARGETS.items():
+            hits, misses = stats.get(f"{name}|hits", 0), stats.get(f"{name}|misses", 0)
+            report['targets'][name] = {
+                'ttl_seconds': target.ttl,
+                'peak_local_hours': sorted(target.peak_hours),
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / (hits + misses) * 100, 1) if hits + misses else None,
             }
-            print(f"  ✅ KPI cache warmed")
-        except Exception as e:
-            print(f"  ❌ KPI cache warming failed: {e}")
-    
-    def get_cached(self, cache_key: str):
-        """Get data from warmed cache"""
-        if cache_key in self.cache:
-            entry = self.cache[cache_key]
-            if datetime.utcnow() < entry['expires_at']:
-                return entry['data']
-            else:
-                del self.cache[cache_key]
-        return None
-    
-    async def background_refresh(self, tenant_id: str):
-        """Background cache refresh every 15 seconds (aggressive)"""
-        while True:
-            try:
-                await asyncio.sleep(15)  # Refresh every 15 seconds for max freshness
-                await self.warm_all_caches(tenant_id)
-            except Exception as e:
-                print(f"Background cache refresh error: {e}")
+        return report
 
-# Global cache warmer
-cache_warmer = None
 
-async def initialize_cache_warmer(db, tenant_id: str = None):
-    """Initialize and start cache warmer"""
+# Global cache warmer (created at startup)
+cache_warmer: Optional[CacheWarmer] = None
+
+
+async def init_cache_warmer(db) -> CacheWarmer:
     global cache_warmer
-    cache_warmer = CacheWarmer(db)
-    
-    # Get first tenant if not specified
-    if not tenant_id:
-        tenant = await db.users.find_one({})
-        if tenant:
-            tenant_id = tenant.get('tenant_id')
-    
-    if tenant_id:
-        # Warm caches immediately
-        await cache_warmer.warm_all_caches(tenant_id)
-        
-        # Start background refresh
-        asyncio.create_task(cache_warmer.background_refresh(tenant_id))
-    
+    if cache_warmer is None:
+        cache_warmer = CacheWarmer(db)
+    await cache_warmer.start()
+    return cache_warmer
+
+
+def get_cache_warmer() -> Optional[CacheWarmer]:
     return cache_warmer
+
+
+# ============= API ENDPOINTS =============
+
+@cache_warmer_router.get("")
+async def get_cache_warmer_report():
+    """Warm coverage, memory use and hit rates"""
+    if not cache_warmer:
+        raise HTTPException(status_code=503, detail="Cache warmer not running")
+    return cache_warmer.report()
+
+
+@cache_warmer_router.post("/run")
+async def run_cache_warming(force: bool = False):
+    """Run a warming cycle now; force rewarms every candidate on this worker"""
+    if not cache_warmer:
+        raise HTTPException(status_code=503, detail="Cache warmer not running")
+    return await cache_warmer.run_cycle(force=force)
@@ -262,68 +262,23 @@ async def _night_audit_async():
 
 @celery_app.task(name='celery_tasks.archive_old_data_task')
 def archive_old_data_task():
-    """Archive data older than 6 months"""
+    """Archive data past each collection's archive policy threshold"""
     return asyncio.run(_archive_old_data_async())
 
 async def _archive_old_data_async():
-    """Async data archival implementation"""
+    """Async data archival implementation (bulk, resumable; see data_archival.ARCHIVE_POLICIES)"""
     db, client = get_db()
     
     try:
-        # Archive cutoff date: 6 months ago
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=180)
-        
-        results = {
-            'cutoff_date': cutoff_date.isoformat(),
-            'archived': {}
-        }
+        from data_archival import DataArchivalManager
         
-        # Archive old bookings (checked_out > 6 months ago)
-        old_bookings = await db.bookings.find({
-            'status': 'checked_out',
-            'check_out': {'$lt': cutoff_date}
-        }).to_list(10000)
+        archival_manager = DataArchivalManager(db)
+        results = await archival_manager.archive_all(dry_run=False)
         
-        if old_bookings:
-            # Move to archive collection
-            await db.bookings_archive.insert_many(old_bookings)
-            
-            # Delete from main collection
-            booking_ids = [b['booking_id'] for b in old_bookings]
-            await db.bookings.delete_many({'booking_id': {'$in': booking_ids}})
-            
-            results['archived']['bookings'] = len(old_bookings)
-            logger.info(f"Archived {len(old_bookings)} old bookings")
-        
-        # Archive old audit logs (> 1 year)
-        audit_cutoff = datetime.now(timezone.utc) - timedelta(days=365)
-        old_logs = await db.audit_logs.find({
-            'timestamp': {'$lt': audit_cutoff}
-        }).to_list(50000)
-        
-        if old_logs:
-            await db.audit_logs_archive.insert_many(old_logs)
-            log_ids = [log['_id'] for log in old_logs]
-            await db.audit_logs.delete_many({'_id': {'$in': log_ids}})
-            
-            results['archived']['audit_logs'] = len(old_logs)
-            logger.info(f"Archived {len(old_logs)} old audit logs")
-        
-        # Archive old closed folios
-        old_folios = await db.folios.find({
-            'status': 'closed',
-            'closed_at': {'$lt': cutoff_date}
-        }).to_list(10000)
-        
-        if old_folios:
-            await db.folios_archive.insert_many(old_folios)
-            folio_ids = [f['folio_id'] for f in old_folios]
-            await db.folios.delete_many({'folio_id': {'$in': folio_ids}})
-            
-            results['archived']['folios'] = len(old_folios)
-            logger.info(f"Archived {len(old_folios)} old folios")
+        for collection, result in results['results'].items():
+            logger.info(f"Archived {result.get('records_archived', 0)} {collection} "
+                        f"(complete={result.get('complete')})")
         
-        results['success'] = True
         return results
         
     except Exception as e:
@@ -463,9 +418,9 @@ async def _refresh_materialized_views_async():
         from materialized_views import MaterializedViewsManager
         
         views_manager = MaterializedViewsManager(db)
-        result = await views_manager.refresh_dashboard_metrics()
+        result = await views_manager.refresh_all_views()
         
-        logger.info(f"Materialized views refreshed: {result.get('refresh_duration_ms')}ms")
+        logger.info(f"Materialized views refreshed: {result.get('total_duration_ms')}ms")
         
         return result
         
@@ -605,15 +560,12 @@ async def _database_maintenance_async():
     db, client = get_db()
     
     try:
-        # Ensure all indexes exist
-        from data_archival import DataArchivalManager
-        from materialized_views import MaterializedViewsManager
-        
-        archival_manager = DataArchivalManager(db)
-        views_manager = MaterializedViewsManager(db)
+        # Apply pending index migrations and sample index usage
+        from index_registry import IndexRegistry
         
-        await archival_manager.setup_indexes()
-        await views_manager.setup_indexes()
+        registry = IndexRegistry(db)
+        migrations = await registry.migrate()
+        await registry.record_usage()
         
         # Get database stats
         stats = await client.admin.command('serverStatus')
@@ -621,7 +573,8 @@ async def _database_maintenance_async():
         logger.info("Database maintenance completed")
         
         return {
-            'success': True,
+            'success': 'error' not in migrations,
+            'index_migrations_applied': [m['_id'] for m in migrations.get('applied', [])],
             'uptime': stats['uptime'],
             'connections': stats['connections']['current']
         }
@@ -875,41 +828,20 @@ def process_pending_efaturas_task():
     return asyncio.run(_process_pending_efaturas_async())
 
 async def _process_pending_efaturas_async():
-    """Async e-fatura processing"""
+    """Drain the e-fatura backlog through the pipeline, leaving headroom before the next beat run"""
+    from efatura_pipeline import EFaturaPipeline
+
     db, client = get_db()
+    # Prefork workers are daemonic and cannot own a process pool: render on threads here
+    pipeline = EFaturaPipeline(db, render_workers=0)
     
     try:
-        # Find invoices with pending e-fatura
-        pending_invoices = await db.accounting_invoices.find({
-            'efatura_status': 'pending',
-            'invoice_type': 'sales'
-        }).limit(100).to_list(100)
-        
-        processed = 0
-        for invoice in pending_invoices:
-            try:
-                # Generate e-fatura (mock - would call actual API)
-                efatura_uuid = f"EFATURA-{invoice['invoice_number']}"
-                
-                await db.accounting_invoices.update_one(
-                    {'invoice_number': invoice['invoice_number']},
-                    {
-                        '$set': {
-                            'efatura_status': 'generated',
-                            'efatura_uuid': efatura_uuid,
-                            'efatura_generated_at': datetime.now(timezone.utc)
-                        }
-                    }
-                )
-                
-                processed += 1
-                
-            except Exception as e:
-                logger.error(f"E-fatura generation error for {invoice['invoice_number']}: {e}")
+        summary = await pipeline.drain(max_seconds=25 * 60)
         
         return {
             'success': True,
-            'processed': processed,
+            'processed': summary['claimed'],
+            **summary,
             'timestamp': datetime.now(timezone.utc).isoformat()
         }
         
@@ -920,6 +852,7 @@ async def _process_pending_efaturas_async():
             'error': str(e)
         }
     finally:
+        await pipeline.stop()
         await client.close()
 
 
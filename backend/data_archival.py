@@ -1,160 +1,340 @@
 """
 Data Archival System
 Archives old bookings (>1 year) to separate collection for performance
+
+Each archived collection has a policy (date field, eligibility filter,
+threshold) and a <collection>_archive twin. Documents move in batches ordered
+by _id: insert_many into the archive, then delete_many of the moved ids, with
+a checkpoint (archive_checkpoints) advanced after every batch. An interrupted
+run resumes from its checkpoint with the same cutoff; documents copied but
+not yet deleted are skipped as duplicates on the retry. Reads that must see
+history use find_with_archive / aggregate_with_archive ($unionWith).
 """
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+import asyncio
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+ARCHIVE_SUFFIX = '_archive'
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+
+# collection: (date field, eligibility filter, threshold days)
+ARCHIVE_POLICIES: Dict[str, tuple] = {
+    'bookings': ('check_out', {'status': {'$in': ['checked_out', 'cancelled', 'no_show']}}, 365),
+    'folios': ('closed_at', {'status': 'closed'}, 365),
+    'folio_charges': ('date', {}, 365),
+    'payments': ('processed_at', {}, 365),
+    'audit_logs': ('timestamp', {}, 365),
+    'housekeeping_tasks': ('completed_at', {'status': 'completed'}, 180),
+}
+
+# Charges and payments stay hot while their folio is still open (balances read them)
+FOLIO_GUARDED = {'folio_charges', 'payments'}
+
+
+def archive_name(collection: str) -> str:
+    return f"{collection}{ARCHIVE_SUFFIX}"
+
+
+def _sort_spec(sort: Optional[Dict[str, int]]) -> Dict[str, int]:
+    # _id breaks ties so skip/limit pages are stable across both sides
+    spec = dict(sort or {})
+    spec.setdefault('_id', 1)
+    return spec
+
+
+def aggregate_with_archive(db, collection: str, match: Dict[str, Any], stages: Optional[List[Dict[str, Any]]] = None):
+    """Aggregation cursor over the hot collection and its archive ($unionWith)"""
+    return db[collection].aggregate([
+        {'$match': match},
+        {'$unionWith': {'coll': archive_name(collection), 'pipeline': [
+            {'$match': match}, {'$set': {'from_archive': True}},
+        ]}},
+    ] + list(stages or []))
+
+
+async def find_with_archive(db, collection: str, query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None,
+                            sort: Optional[Dict[str, int]] = None, skip: int = 0,
+                            limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    find() across hot + archive with one sort/skip/limit over the union.
+    Each side is pre-sorted and cut to skip + limit, so a page never reads
+    more than that many documents from either collection.
+    """
+    spec = _sort_spec(sort)
+    branch: List[Dict[str, Any]] = [{'$match': query}, {'$sort': spec}]
+    if limit is not None:
+        branch.append({'$limit': skip + limit})
+    pipeline = branch + [
+        {'$unionWith': {'coll': archive_name(collection), 'pipeline': branch + [{'$set': {'from_archive': True}}]}},
+        {'$sort': spec},
+    ]
+    if skip:
+        pipeline.append({'$skip': skip})
+    if limit is not None:
+        pipeline.append({'$limit': limit})
+    if projection:
+        if any(projection.values()):
+            projection = {**projection, 'from_archive': 1}
+        pipeline.append({'$project': projection})
+    return await db[collection].aggregate(pipeline).to_list(None)
+
+
+async def count_with_archive(db, collection: str, query: Dict[str, Any]) -> int:
+    hot, archived = await asyncio.gather(
+        db[collection].count_documents(query),
+        db[archive_name(collection)].count_documents(query),
+    )
+    return hot + archived
+
+
 class DataArchivalManager:
-    def __init__(self, db):
+    def __init__(self, db, batch_size: int = ARCHIVE_BATCH_SIZE):
         self.db = db
         self.bookings = db.bookings
         self.bookings_archive = db.bookings_archive
+        self.checkpoints = db.archive_checkpoints
         self.archive_threshold_days = 365  # 1 year
-        
+        self.batch_size = batch_size
+
     async def setup_indexes(self):
-        """Setup indexes for archived collection"""
+        """Ensure the registry's indexes for archive collections and checkpoints"""
+        from index_registry import get_index_registry
+        collections = [archive_name(c) for c in ARCHIVE_POLICIES] + ['archive_checkpoints']
+        await get_index_registry(self.db).ensure(collections)
+        logger.info("Archive indexes ensured")
+
+    @staticmethod
+    def eligible_query(collection: str, cutoff: datetime, tenant_id: Optional[str] = None) -> Dict[str, Any]:
+        """Documents past the cutoff; dates may be stored as ISO strings or BSON dates"""
+        date_field, extra, _ = ARCHIVE_POLICIES[collection]
+        query: Dict[str, Any] = {
+            **extra,
+            '$or': [{date_field: {'$lt': cutoff.isoformat()}}, {date_field: {'$lt': cutoff}}],
+        }
+        if tenant_id:
+            query['tenant_id'] = tenant_id
+        return query
+
+    async def _protected(self, docs: List[Dict[str, Any]]) -> set:
+        folio_ids = list({d.get('folio_id') for d in docs if d.get('folio_id')})
+        if not folio_ids:
+            return set()
+        return set(await self.db.folios.distinct(
+            'id', {'id': {'$in': folio_ids}, 'status': {'$ne': 'closed'}}
+        ))
+
+    async def _copy(self, archive, docs: List[Dict[str, Any]]):
         try:
-            # Archive collection indexes
-            await self.bookings_archive.create_index([("archived_at", DESCENDING)])
-            await self.bookings_archive.create_index([("check_in", DESCENDING)])
-            await self.bookings_archive.create_index([("check_out", DESCENDING)])
-            await self.bookings_archive.create_index([("guest_id", ASCENDING)])
-            await self.bookings_archive.create_index([("status", ASCENDING)])
-            await self.bookings_archive.create_index([
-                ("guest_id", ASCENDING),
-                ("check_in", DESCENDING)
-            ])
-            logger.info("Archive indexes created successfully")
-        except Exception as e:
-            logger.error(f"Failed to create archive indexes: {e}")
-    
-    async def archive_old_bookings(self, dry_run: bool = True) -> Dict[str, Any]:
+            await archive.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Copied by an interrupted run before its delete: already archived
+            if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+                raise
+
+    async def archive_collection(
+        self,
+        collection: str,
+        tenant_id: Optional[str] = None,
+        threshold_days: Optional[int] = None,
+        dry_run: bool = False,
+        max_batches: Optional[int] = None
+    ) -> Dict[str, Any]:
         """
-        Archive bookings older than threshold
-        
+        Move eligible documents of one collection to its archive
+
         Args:
-            dry_run: If True, only count records without moving them
-            
+            collection: A collection listed in ARCHIVE_POLICIES
+            tenant_id: Limit the run to one tenant (None = all tenants)
+            threshold_days: Override the policy's age threshold
+            dry_run: Only count eligible documents
+            max_batches: Stop after this many batches; the next run resumes
+
         Returns:
             dict with archive statistics
         """
+        if collection not in ARCHIVE_POLICIES:
+            return {"success": False, "error": f"No archive policy for {collection}"}
+        source, archive = self.db[collection], self.db[archive_name(collection)]
+        key = {'collection': collection, 'scope': tenant_id or '*'}
+        threshold = threshold_days or ARCHIVE_POLICIES[collection][2]
+
         try:
-            cutoff_date = datetime.utcnow() - timedelta(days=self.archive_threshold_days)
-            
-            # Find old bookings
-            query = {
-                "check_out": {"$lt": cutoff_date},
-                "status": {"$in": ["checked_out", "cancelled", "no_show"]}
-            }
-            
-            # Count records to archive
-            count = await self.bookings.count_documents(query)
-            
+            checkpoint = await self.checkpoints.find_one(key, {'_id': 0}) or {}
+            resuming = checkpoint.get('status') == 'running'
+            if resuming:
+                cutoff = datetime.fromisoformat(checkpoint['cutoff'])
+            else:
+                cutoff = datetime.now(timezone.utc) - timedelta(days=threshold)
+            query = self.eligible_query(collection, cutoff, tenant_id)
+
             if dry_run:
                 return {
                     "dry_run": True,
-                    "records_to_archive": count,
-                    "cutoff_date": cutoff_date.isoformat(),
-                    "threshold_days": self.archive_threshold_days
+                    "collection": collection,
+                    "records_to_archive": await source.count_documents(query),
+                    "cutoff_date": cutoff.isoformat(),
+                    "threshold_days": threshold
                 }
-            
-            # Archive in batches
-            batch_size = 1000
-            archived_count = 0
-            
-            cursor = self.bookings.find(query).limit(batch_size)
-            async for booking in cursor:
-                # Add archive metadata
-                booking["archived_at"] = datetime.utcnow()
-                booking["original_id"] = booking["_id"]
-                
-                # Insert to archive
-                await self.bookings_archive.insert_one(booking)
-                
-                # Delete from main collection
-                await self.bookings.delete_one({"_id": booking["_id"]})
-                
-                archived_count += 1
-                
-                if archived_count % 100 == 0:
-                    logger.info(f"Archived {archived_count} bookings...")
-            
+
+            last_id = checkpoint.get('last_id') if resuming else None
+            if not resuming:
+                await self.checkpoints.update_one(key, {'$set': {
+                    'status': 'running', 'cutoff': cutoff.isoformat(), 'last_id': None,
+                    'moved': 0, 'skipped': 0, 'batches': 0,
+                    'started_at': datetime.now(timezone.utc).isoformat(),
+                }}, upsert=True)
+
+            moved = skipped = batches = 0
+            complete = False
+            while True:
+                batch_query = dict(query)
+                if last_id is not None:
+                    batch_query['_id'] = {'$gt': last_id}
+                docs = await source.find(batch_query).sort('_id', ASCENDING).limit(self.batch_size).to_list(self.batch_size)
+                if not docs:
+                    complete = True
+                    break
+
+                protected = await self._protected(docs) if collection in FOLIO_GUARDED else set()
+                movable = [d for d in docs if d.get('folio_id') not in protected] if protected else docs
+                if movable:
+                    archived_at = datetime.now(timezone.utc).isoformat()
+                    for doc in movable:
+                        doc['archived_at'] = archived_at
+                    await self._copy(archive, movable)
+                    await source.delete_many({'_id': {'$in': [d['_id'] for d in movable]}})
+
+                last_id = docs[-1]['_id']
+                moved += len(movable)
+                skipped += len(docs) - len(movable)
+                batches += 1
+                await self.checkpoints.update_one(key, {
+                    '$set': {'last_id': last_id, 'updated_at': datetime.now(timezone.utc).isoformat()},
+                    '$inc': {'moved': len(movable), 'skipped': len(docs) - len(movable), 'batches': 1},
+                })
+                if max_batches and batches >= max_batches:
+                    break
+
+            if complete:
+                await self.checkpoints.update_one(key, {'$set': {
+                    'status': 'completed', 'last_id': None,
+                    'completed_at': datetime.now(timezone.utc).isoformat(),
+                }})
+            logger.info(f"Archived {moved} {collection} documents in {batches} batches (complete={complete})")
+
             return {
                 "dry_run": False,
-                "records_archived": archived_count,
-                "cutoff_date": cutoff_date.isoformat(),
-                "threshold_days": self.archive_threshold_days,
+                "collection": collection,
+                "records_archived": moved,
+                "records_kept": skipped,
+                "batches": batches,
+                "complete": complete,
+                "resumed": resuming,
+                "cutoff_date": cutoff.isoformat(),
+                "threshold_days": threshold,
                 "success": True
             }
-            
+
         except Exception as e:
-            logger.error(f"Archival failed: {e}")
+            logger.error(f"Archival of {collection} failed: {e}")
             return {
                 "success": False,
+                "collection": collection,
                 "error": str(e)
             }
-    
+
+    async def archive_all(
+        self,
+        collections: Optional[List[str]] = None,
+        tenant_id: Optional[str] = None,
+        dry_run: bool = False,
+        max_batches: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Run every policy (or the given collections) in policy order"""
+        results = {}
+        for collection in ARCHIVE_POLICIES:
+            if collections and collection not in collections:
+                continue
+            results[collection] = await self.archive_collection(
+                collection, tenant_id=tenant_id, dry_run=dry_run, max_batches=max_batches
+            )
+        return {
+            "success": all(r.get("success", False) or r.get("dry_run") for r in results.values()),
+            "results": results
+        }
+
+    async def archive_old_bookings(self, dry_run: bool = True) -> Dict[str, Any]:
+        """
+        Archive bookings older than threshold
+
+        Args:
+            dry_run: If True, only count records without moving them
+
+        Returns:
+            dict with archive statistics
+        """
+        return await self.archive_collection('bookings', threshold_days=self.archive_threshold_days, dry_run=dry_run)
+
     async def query_with_archive(
         self,
         query: Dict[str, Any],
         limit: int = 100,
         skip: int = 0,
-        include_archived: bool = False
+        include_archived: bool = False,
+        sort: Optional[Dict[str, int]] = None
     ) -> list:
         """
         Query bookings with optional archive inclusion
-        
+
         Args:
             query: MongoDB query
             limit: Result limit
             skip: Skip records
             include_archived: Include archived records
-            
+            sort: Sort spec applied across both collections (default _id)
+
         Returns:
             List of bookings
         """
-        results = []
-        
-        # Query active bookings
-        cursor = self.bookings.find(query).skip(skip).limit(limit)
-        async for doc in cursor:
-            results.append(doc)
-        
-        # If including archived and limit not reached
-        if include_archived and len(results) < limit:
-            remaining = limit - len(results)
-            archive_cursor = self.bookings_archive.find(query).skip(max(0, skip - await self.bookings.count_documents(query))).limit(remaining)
-            async for doc in archive_cursor:
-                doc["from_archive"] = True
-                results.append(doc)
-        
-        return results
-    
+        if include_archived:
+            return await find_with_archive(self.db, 'bookings', query, sort=sort, skip=skip, limit=limit)
+        return await self.bookings.find(query).sort(list(_sort_spec(sort).items())).skip(skip).limit(limit).to_list(limit)
+
     async def get_archive_stats(self) -> Dict[str, Any]:
         """Get archival statistics"""
         try:
             active_count = await self.bookings.count_documents({})
             archived_count = await self.bookings_archive.count_documents({})
-            
+
             # Get oldest active booking
             oldest_active = await self.bookings.find_one(
                 {},
                 sort=[("check_in", ASCENDING)]
             )
-            
+
             # Get newest archived booking
             newest_archived = await self.bookings_archive.find_one(
                 {},
                 sort=[("archived_at", DESCENDING)]
             )
-            
+
+            collections = {}
+            for collection in ARCHIVE_POLICIES:
+                hot, archived = await asyncio.gather(
+                    self.db[collection].estimated_document_count(),
+                    self.db[archive_name(collection)].estimated_document_count(),
+                )
+                collections[collection] = {"active": hot, "archived": archived,
+                                           "threshold_days": ARCHIVE_POLICIES[collection][2]}
+            checkpoints = await self.checkpoints.find({}, {'_id': 0, 'last_id': 0}).to_list(None)
+
             return {
                 "active_bookings": active_count,
                 "archived_bookings": archived_count,
@@ -162,7 +342,9 @@ class DataArchivalManager:
                 "archive_percentage": round((archived_count / (active_count + archived_count) * 100), 2) if (active_count + archived_count) > 0 else 0,
                 "oldest_active_date": oldest_active.get("check_in") if oldest_active else None,
                 "last_archived_at": newest_archived.get("archived_at") if newest_archived else None,
-                "threshold_days": self.archive_threshold_days
+                "threshold_days": self.archive_threshold_days,
+                "collections": collections,
+                "checkpoints": checkpoints
             }
         except Exception as e:
             logger.error(f"Failed to get archive stats: {e}")
@@ -3,7 +3,7 @@ Database Optimization & Index Management
 Ensures all collections have proper indexes for performance
 """
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo import DESCENDING
 import logging
 from datetime import datetime
 
@@ -14,258 +14,20 @@ class DatabaseOptimizer:
         self.db = db
         
     async def create_all_indexes(self):
-        """Create all necessary indexes for optimal performance"""
-        results = {}
-        
+        """Apply pending index registry migrations (see index_registry.py)"""
+        from index_registry import get_index_registry
         try:
-            # Bookings Collection
-            results['bookings'] = await self.create_booking_indexes()
-            
-            # Guests Collection
-            results['guests'] = await self.create_guest_indexes()
-            
-            # Rooms Collection
-            results['rooms'] = await self.create_room_indexes()
-            
-            # Folios Collection
-            results['folios'] = await self.create_folio_indexes()
-            
-            # Users Collection
-            results['users'] = await self.create_user_indexes()
-            
-            # Tasks/Housekeeping
-            results['tasks'] = await self.create_task_indexes()
-            
-            # Audit Logs
-            results['audit_logs'] = await self.create_audit_log_indexes()
-            
-            # Performance Reports
-            results['reports'] = await self.create_report_indexes()
-            
-            logger.info(f"✅ All indexes created successfully: {results}")
+            results = await get_index_registry(self.db).migrate()
+            logger.info(f"✅ Index migrations applied: {[m['_id'] for m in results.get('applied', [])]}")
             return results
-            
         except Exception as e:
-            logger.error(f"❌ Failed to create indexes: {e}")
+            logger.error(f"❌ Failed to apply index migrations: {e}")
             return {"error": str(e)}
     
-    async def create_booking_indexes(self):
-        """Bookings collection indexes"""
-        bookings = self.db.bookings
-        
-        indexes = [
-            # Single field indexes
-            ([("guest_id", ASCENDING)], {}),
-            ([("room_id", ASCENDING)], {}),
-            ([("status", ASCENDING)], {}),
-            ([("check_in", DESCENDING)], {}),
-            ([("check_out", DESCENDING)], {}),
-            ([("created_at", DESCENDING)], {}),
-            ([("channel", ASCENDING)], {}),
-            
-            # Compound indexes for common queries
-            ([("status", ASCENDING), ("check_in", DESCENDING)], {}),
-            ([("status", ASCENDING), ("check_out", DESCENDING)], {}),
-            ([("guest_id", ASCENDING), ("check_in", DESCENDING)], {}),
-            ([("room_id", ASCENDING), ("check_in", DESCENDING)], {}),
-            ([("check_in", ASCENDING), ("check_out", ASCENDING)], {}),
-            
-            # Date range queries
-            ([("created_at", DESCENDING), ("status", ASCENDING)], {}),
-            ([("check_in", DESCENDING), ("status", ASCENDING)], {}),
-            
-            # Text search
-            ([("guest_name", TEXT)], {}),
-        ]
-        
-        created = []
-        for index_spec, options in indexes:
-            try:
-                result = await bookings.create_index(index_spec, **options)
-                created.append(result)
-            except Exception as e:
-                logger.warning(f"Index creation warning for bookings: {e}")
-        
-        return {"created": len(created), "indexes": created}
-    
-    async def create_guest_indexes(self):
-        """Guests collection indexes"""
-        guests = self.db.guests
-        
-        indexes = [
-            ([("email", ASCENDING)], {"unique": True}),
-            ([("phone", ASCENDING)], {}),
-            ([("id_number", ASCENDING)], {}),
-            ([("tags", ASCENDING)], {}),
-            ([("created_at", DESCENDING)], {}),
-            ([("name", TEXT)], {}),
-            ([("email", TEXT)], {}),
-        ]
-        
-        created = []
-        for index_spec, options in indexes:
-            try:
-                result = await guests.create_index(index_spec, **options)
-                created.append(result)
-            except Exception as e:
-                logger.warning(f"Index creation warning for guests: {e}")
-        
-        return {"created": len(created), "indexes": created}
-    
-    async def create_room_indexes(self):
-        """Rooms collection indexes"""
-        rooms = self.db.rooms
-        
-        indexes = [
-            ([("room_number", ASCENDING)], {"unique": True}),
-            ([("status", ASCENDING)], {}),
-            ([("room_type", ASCENDING)], {}),
-            ([("floor", ASCENDING)], {}),
-            ([("status", ASCENDING), ("room_type", ASCENDING)], {}),
-        ]
-        
-        created = []
-        for index_spec, options in indexes:
-            try:
-                result = await rooms.create_index(index_spec, **options)
-                created.append(result)
-            except Exception as e:
-                logger.warning(f"Index creation warning for rooms: {e}")
-        
-        return {"created": len(created), "indexes": created}
-    
-    async def create_folio_indexes(self):
-        """Folios collection indexes"""
-        folios = self.db.folios
-        
-        indexes = [
-            ([("booking_id", ASCENDING)], {}),
-            ([("guest_id", ASCENDING)], {}),
-            ([("status", ASCENDING)], {}),
-            ([("created_at", DESCENDING)], {}),
-            ([("folio_type", ASCENDING)], {}),
-            ([("booking_id", ASCENDING), ("folio_type", ASCENDING)], {}),
-        ]
-        
-        created = []
-        for index_spec, options in indexes:
-            try:
-                result = await folios.create_index(index_spec, **options)
-                created.append(result)
-            except Exception as e:
-                logger.warning(f"Index creation warning for folios: {e}")
-        
-        return {"created": len(created), "indexes": created}
-    
-    async def create_user_indexes(self):
-        """Users collection indexes"""
-        users = self.db.users
-        
-        indexes = [
-            ([("username", ASCENDING)], {"unique": True}),
-            ([("email", ASCENDING)], {"unique": True}),
-            ([("role", ASCENDING)], {}),
-            ([("tenant_id", ASCENDING)], {}),
-        ]
-        
-        created = []
-        for index_spec, options in indexes:
-            try:
-                result = await users.create_index(index_spec, **options)
-                created.append(result)
-            except Exception as e:
-                logger.warning(f"Index creation warning for users: {e}")
-        
-        return {"created": len(created), "indexes": created}
-    
-    async def create_task_indexes(self):
-        """Tasks/Housekeeping collection indexes"""
-        tasks = self.db.housekeeping_tasks
-        
-        indexes = [
-            ([("room_id", ASCENDING)], {}),
-            ([("status", ASCENDING)], {}),
-            ([("assigned_to", ASCENDING)], {}),
-            ([("created_at", DESCENDING)], {}),
-            ([("task_type", ASCENDING)], {}),
-            ([("status", ASCENDING), ("created_at", DESCENDING)], {}),
-        ]
-        
-        created = []
-        for index_spec, options in indexes:
-            try:
-                result = await tasks.create_index(index_spec, **options)
-                created.append(result)
-            except Exception as e:
-                logger.warning(f"Index creation warning for tasks: {e}")
-        
-        return {"created": len(created), "indexes": created}
-    
-    async def create_audit_log_indexes(self):
-        """Audit logs collection indexes"""
-        audit_logs = self.db.audit_logs
-        
-        indexes = [
-            ([("user_id", ASCENDING)], {}),
-            ([("action", ASCENDING)], {}),
-            ([("timestamp", DESCENDING)], {}),
-            ([("resource_type", ASCENDING)], {}),
-            ([("timestamp", DESCENDING), ("user_id", ASCENDING)], {}),
-            # TTL index - auto-delete logs older than 90 days
-            ([("timestamp", ASCENDING)], {"expireAfterSeconds": 90 * 24 * 60 * 60}),
-        ]
-        
-        created = []
-        for index_spec, options in indexes:
-            try:
-                result = await audit_logs.create_index(index_spec, **options)
-                created.append(result)
-            except Exception as e:
-                logger.warning(f"Index creation warning for audit_logs: {e}")
-        
-        return {"created": len(created), "indexes": created}
-    
-    async def create_report_indexes(self):
-        """Performance reports collection indexes"""
-        reports = self.db.daily_performance_reports
-        
-        indexes = [
-            ([("date", DESCENDING)], {"unique": True}),
-            ([("generated_at", DESCENDING)], {}),
-        ]
-        
-        created = []
-        for index_spec, options in indexes:
-            try:
-                result = await reports.create_index(index_spec, **options)
-                created.append(result)
-            except Exception as e:
-                logger.warning(f"Index creation warning for reports: {e}")
-        
-        return {"created": len(created), "indexes": created}
-    
     async def verify_indexes(self):
-        """Verify all indexes are in place"""
-        collections = [
-            'bookings', 'guests', 'rooms', 'folios', 
-            'users', 'housekeeping_tasks', 'audit_logs', 
-            'daily_performance_reports'
-        ]
-        
-        results = {}
-        
-        for collection_name in collections:
-            try:
-                collection = self.db[collection_name]
-                indexes = await collection.index_information()
-                results[collection_name] = {
-                    "count": len(indexes),
-                    "indexes": list(indexes.keys())
-                }
-            except Exception as e:
-                results[collection_name] = {"error": str(e)}
-        
-        return results
+        """Compare the database against the index registry"""
+        from index_registry import get_index_registry
+        return await get_index_registry(self.db).status()
     
     async def analyze_query_performance(self):
         """Analyze slow queries and suggest optimizations"""
@@ -1,314 +1,97 @@
 """
 Database Optimization Script
-Creates indexes and optimizes MongoDB for high-load hotel PMS
+Applies the index registry migrations (index_registry.py) outside of
+application startup, and reports index status and usage.
 Target: 550 rooms, 300+ daily transactions, 1+ year operation
+
+Usage:
+    python db_optimization.py                  # apply pending index migrations
+    python db_optimization.py migrate --dry-run
+    python db_optimization.py status
+    python db_optimization.py usage            # sample $indexStats into index_usage
+    python db_optimization.py drop-unused [--apply]
 """
 
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import sys
 import asyncio
 from dotenv import load_dotenv
 
+from index_registry import get_index_registry
+
 load_dotenv()
 
-async def create_indexes():
-    """Create comprehensive indexes for all collections"""
-    
+async def create_indexes(command: str = 'migrate', dry_run: bool = False):
+    """Run an index registry command against the configured database"""
+
     mongo_url = os.environ['MONGO_URL']
     db_name = os.environ['DB_NAME']
-    
-    # Configure connection pool for high concurrency
+
     client = AsyncIOMotorClient(
         mongo_url,
-        maxPoolSize=200,  # High concurrency support
-        minPoolSize=20,   # Always maintain minimum connections
-        maxIdleTimeMS=60000,  # Keep idle connections for 60s
         serverSelectionTimeoutMS=5000,
         connectTimeoutMS=10000,
-        socketTimeoutMS=30000,
+        socketTimeoutMS=0,  # index builds on large collections can run for minutes
         retryWrites=True,
         retryReads=True
     )
-    
+
     db = client[db_name]
-    
-    print("🚀 Starting Database Optimization...")
-    print(f"📊 Target: 550 rooms, 300+ daily transactions")
-    print(f"🎯 Optimizing for 1+ year continuous operation\n")
-    
-    # ============= BOOKINGS COLLECTION =============
-    print("📌 Creating indexes for BOOKINGS collection...")
-    bookings = db.bookings
-    
-    # Most frequently queried fields
-    await bookings.create_index([("tenant_id", 1), ("status", 1)])
-    await bookings.create_index([("tenant_id", 1), ("check_in", 1)])
-    await bookings.create_index([("tenant_id", 1), ("check_out", 1)])
-    await bookings.create_index([("tenant_id", 1), ("room_id", 1)])
-    await bookings.create_index([("tenant_id", 1), ("guest_id", 1)])
-    await bookings.create_index([("tenant_id", 1), ("booking_id", 1)], unique=True)
-    
-    # Date range queries (critical for occupancy reports)
-    await bookings.create_index([("tenant_id", 1), ("check_in", 1), ("check_out", 1)])
-    await bookings.create_index([("tenant_id", 1), ("check_in", 1), ("status", 1)])
-    await bookings.create_index([("tenant_id", 1), ("check_out", 1), ("status", 1)])
-    
-    # Company/corporate bookings
-    await bookings.create_index([("tenant_id", 1), ("company_id", 1)])
-    
-    # Compound index for dashboard queries
-    await bookings.create_index([
-        ("tenant_id", 1), 
-        ("status", 1), 
-        ("check_in", 1)
-    ])
-    
-    # Created at for historical queries
-    await bookings.create_index([("tenant_id", 1), ("created_at", -1)])
-    
-    print("✅ Bookings indexes created")
-    
-    # ============= ROOMS COLLECTION =============
-    print("📌 Creating indexes for ROOMS collection...")
-    rooms = db.rooms
-    
-    await rooms.create_index([("tenant_id", 1), ("room_number", 1)], unique=True)
-    await rooms.create_index([("tenant_id", 1), ("status", 1)])
-    await rooms.create_index([("tenant_id", 1), ("room_type", 1)])
-    await rooms.create_index([("tenant_id", 1), ("floor", 1)])
-    await rooms.create_index([("tenant_id", 1), ("current_booking_id", 1)])
-    
-    # Compound for housekeeping board
-    await rooms.create_index([("tenant_id", 1), ("status", 1), ("floor", 1)])
-    
-    print("✅ Rooms indexes created")
-    
-    # ============= GUESTS COLLECTION =============
-    print("📌 Creating indexes for GUESTS collection...")
-    guests = db.guests
-    
-    await guests.create_index([("tenant_id", 1), ("guest_id", 1)], unique=True)
-    await guests.create_index([("tenant_id", 1), ("email", 1)])
-    await guests.create_index([("tenant_id", 1), ("phone", 1)])
-    await guests.create_index([("tenant_id", 1), ("passport_number", 1)])
-    await guests.create_index([("tenant_id", 1), ("vip_status", 1)])
-    await guests.create_index([("tenant_id", 1), ("blacklist_status", 1)])
-    
-    # Text search for name search
-    await guests.create_index([("name", "text"), ("surname", "text")])
-    
-    print("✅ Guests indexes created")
-    
-    # ============= FOLIOS COLLECTION =============
-    print("📌 Creating indexes for FOLIOS collection...")
-    folios = db.folios
-    
-    await folios.create_index([("tenant_id", 1), ("folio_number", 1)], unique=True)
-    await folios.create_index([("tenant_id", 1), ("booking_id", 1)])
-    await folios.create_index([("tenant_id", 1), ("status", 1)])
-    await folios.create_index([("tenant_id", 1), ("folio_type", 1)])
-    await folios.create_index([("tenant_id", 1), ("created_at", -1)])
-    
-    # For balance queries
-    await folios.create_index([("tenant_id", 1), ("status", 1), ("balance", 1)])
-    
-    print("✅ Folios indexes created")
-    
-    # ============= FOLIO_CHARGES COLLECTION =============
-    print("📌 Creating indexes for FOLIO_CHARGES collection...")
-    charges = db.folio_charges
-    
-    await charges.create_index([("tenant_id", 1), ("folio_id", 1)])
-    await charges.create_index([("tenant_id", 1), ("charge_category", 1)])
-    await charges.create_index([("tenant_id", 1), ("voided", 1)])
-    await charges.create_index([("tenant_id", 1), ("created_at", -1)])
-    
-    # Compound for folio detail view
-    await charges.create_index([("tenant_id", 1), ("folio_id", 1), ("voided", 1)])
-    
-    print("✅ Folio charges indexes created")
-    
-    # ============= PAYMENTS COLLECTION =============
-    print("📌 Creating indexes for PAYMENTS collection...")
-    payments = db.payments
-    
-    await payments.create_index([("tenant_id", 1), ("folio_id", 1)])
-    await payments.create_index([("tenant_id", 1), ("payment_method", 1)])
-    await payments.create_index([("tenant_id", 1), ("payment_type", 1)])
-    await payments.create_index([("tenant_id", 1), ("created_at", -1)])
-    
-    print("✅ Payments indexes created")
-    
-    # ============= HOUSEKEEPING_TASKS COLLECTION =============
-    print("📌 Creating indexes for HOUSEKEEPING_TASKS collection...")
-    hk_tasks = db.housekeeping_tasks
-    
-    await hk_tasks.create_index([("tenant_id", 1), ("status", 1)])
-    await hk_tasks.create_index([("tenant_id", 1), ("room_id", 1)])
-    await hk_tasks.create_index([("tenant_id", 1), ("assigned_to", 1)])
-    await hk_tasks.create_index([("tenant_id", 1), ("task_type", 1)])
-    await hk_tasks.create_index([("tenant_id", 1), ("created_at", -1)])
-    
-    # For staff performance queries
-    await hk_tasks.create_index([
-        ("tenant_id", 1), 
-        ("assigned_to", 1), 
-        ("status", 1)
-    ])
-    
-    # For timing analysis
-    await hk_tasks.create_index([
-        ("tenant_id", 1), 
-        ("completed_at", -1)
-    ])
-    
-    print("✅ Housekeeping tasks indexes created")
-    
-    # ============= AUDIT_LOGS COLLECTION =============
-    print("📌 Creating indexes for AUDIT_LOGS collection...")
-    audit_logs = db.audit_logs
-    
-    await audit_logs.create_index([("tenant_id", 1), ("timestamp", -1)])
-    await audit_logs.create_index([("tenant_id", 1), ("user_id", 1)])
-    await audit_logs.create_index([("tenant_id", 1), ("action", 1)])
-    await audit_logs.create_index([("tenant_id", 1), ("entity_type", 1)])
-    
-    # TTL index - auto-delete logs older than 2 years
-    await audit_logs.create_index([("timestamp", 1)], expireAfterSeconds=63072000)  # 2 years
-    
-    print("✅ Audit logs indexes created")
-    
-    # ============= ACCOUNTING_INVOICES COLLECTION =============
-    print("📌 Creating indexes for ACCOUNTING_INVOICES collection...")
-    invoices = db.accounting_invoices
-    
-    await invoices.create_index([("tenant_id", 1), ("invoice_number", 1)], unique=True)
-    await invoices.create_index([("tenant_id", 1), ("status", 1)])
-    await invoices.create_index([("tenant_id", 1), ("invoice_type", 1)])
-    await invoices.create_index([("tenant_id", 1), ("issue_date", -1)])
-    await invoices.create_index([("tenant_id", 1), ("customer_id", 1)])
-    
-    print("✅ Accounting invoices indexes created")
-    
-    # ============= COMPANIES COLLECTION =============
-    print("📌 Creating indexes for COMPANIES collection...")
-    companies = db.companies
-    
-    await companies.create_index([("tenant_id", 1), ("corporate_code", 1)], unique=True)
-    await companies.create_index([("tenant_id", 1), ("status", 1)])
-    await companies.create_index([("tenant_id", 1), ("name", 1)])
-    
-    # Text search for company search
-    await companies.create_index([("name", "text")])
-    
-    print("✅ Companies indexes created")
-    
-    # ============= NOTIFICATIONS COLLECTION =============
-    print("📌 Creating indexes for NOTIFICATIONS collection...")
-    notifications = db.notifications
-    
-    await notifications.create_index([("tenant_id", 1), ("user_id", 1)])
-    await notifications.create_index([("tenant_id", 1), ("read", 1)])
-    await notifications.create_index([("tenant_id", 1), ("created_at", -1)])
-    
-    # Compound for unread notifications query
-    await notifications.create_index([
-        ("tenant_id", 1), 
-        ("user_id", 1), 
-        ("read", 1)
-    ])
-    
-    # TTL index - auto-delete notifications older than 90 days
-    await notifications.create_index([("created_at", 1)], expireAfterSeconds=7776000)  # 90 days
-    
-    print("✅ Notifications indexes created")
-    
-    # ============= USERS COLLECTION =============
-    print("📌 Creating indexes for USERS collection...")
-    users = db.users
-    
-    await users.create_index([("tenant_id", 1), ("email", 1)], unique=True)
-    await users.create_index([("tenant_id", 1), ("role", 1)])
-    await users.create_index([("tenant_id", 1), ("active", 1)])
-    
-    print("✅ Users indexes created")
-    
-    # ============= POS_ORDERS COLLECTION =============
-    print("📌 Creating indexes for POS_ORDERS collection...")
-    pos_orders = db.pos_orders
-    
-    await pos_orders.create_index([("tenant_id", 1), ("booking_id", 1)])
-    await pos_orders.create_index([("tenant_id", 1), ("order_date", -1)])
-    await pos_orders.create_index([("tenant_id", 1), ("status", 1)])
-    
-    print("✅ POS orders indexes created")
-    
-    # ============= MAINTENANCE_TASKS COLLECTION =============
-    print("📌 Creating indexes for MAINTENANCE_TASKS collection...")
-    maintenance = db.maintenance_tasks
-    
-    await maintenance.create_index([("tenant_id", 1), ("status", 1)])
-    await maintenance.create_index([("tenant_id", 1), ("room_id", 1)])
-    await maintenance.create_index([("tenant_id", 1), ("priority", 1)])
-    await maintenance.create_index([("tenant_id", 1), ("created_at", -1)])
-    
-    print("✅ Maintenance tasks indexes created")
-    
-    # ============= APPROVALS COLLECTION =============
-    print("📌 Creating indexes for APPROVALS collection...")
-    approvals = db.approvals
-    
-    await approvals.create_index([("tenant_id", 1), ("status", 1)])
-    await approvals.create_index([("tenant_id", 1), ("approval_type", 1)])
-    await approvals.create_index([("tenant_id", 1), ("requested_by", 1)])
-    await approvals.create_index([("tenant_id", 1), ("created_at", -1)])
-    
-    print("✅ Approvals indexes created")
-    
-    # ============= RATE_OVERRIDE_LOGS COLLECTION =============
-    print("📌 Creating indexes for RATE_OVERRIDE_LOGS collection...")
-    rate_logs = db.rate_override_logs
-    
-    await rate_logs.create_index([("tenant_id", 1), ("booking_id", 1)])
-    await rate_logs.create_index([("tenant_id", 1), ("user_id", 1)])
-    await rate_logs.create_index([("tenant_id", 1), ("timestamp", -1)])
-    
-    print("✅ Rate override logs indexes created")
-    
-    # ============= FEEDBACK COLLECTION =============
-    print("📌 Creating indexes for FEEDBACK collection...")
-    feedback = db.feedback
-    
-    await feedback.create_index([("tenant_id", 1), ("booking_id", 1)])
-    await feedback.create_index([("tenant_id", 1), ("rating", 1)])
-    await feedback.create_index([("tenant_id", 1), ("created_at", -1)])
-    
-    print("✅ Feedback indexes created")
-    
-    print("\n" + "="*60)
-    print("✨ Database Optimization Complete!")
-    print("="*60)
-    print(f"✅ All indexes created successfully")
-    print(f"✅ Connection pool optimized (maxPoolSize: 200, minPoolSize: 20)")
-    print(f"✅ TTL indexes set for auto-cleanup (audit logs: 2 years, notifications: 90 days)")
-    print(f"🚀 System ready for high-load operation (550 rooms, 300+ daily transactions)")
-    print("="*60)
-    
-    # List all indexes for verification
-    print("\n📊 Index Verification:")
-    collections = [
-        'bookings', 'rooms', 'guests', 'folios', 'folio_charges', 
-        'payments', 'housekeeping_tasks', 'audit_logs', 'accounting_invoices',
-        'companies', 'notifications', 'users', 'pos_orders', 'maintenance_tasks',
-        'approvals', 'rate_override_logs', 'feedback'
-    ]
-    
-    for coll_name in collections:
-        coll = db[coll_name]
-        indexes = await coll.index_information()
-        print(f"  {coll_name}: {len(indexes)} indexes")
-    
-    await client.close()
+    registry = get_index_registry(db)
+
+    try:
+        if command == 'status':
+            status = await registry.status()
+            print(f"📊 Index registry: latest v{status['latest_version']}")
+            for migration in status['applied']:
+                print(f"  ✅ v{migration['version']} {migration['description']} ({migration['applied_at']})")
+            for migration in status['pending']:
+                print(f"  ⏳ v{migration['version']} {migration['description']}")
+            for name in status['missing_indexes']:
+                print(f"  ⚠️  missing: {name}")
+            return status
+
+        if command == 'usage':
+            usage = await registry.record_usage()
+            for collection, indexes in sorted(usage.items()):
+                print(f"\n📁 {collection}:")
+                for idx in indexes:
+                    print(f"  • {idx['name']}: {idx['ops_total']} operations (since first sample)")
+            return usage
+
+        if command == 'drop-unused':
+            result = await registry.drop_unused(dry_run=dry_run)
+            label = 'Would drop' if dry_run else 'Dropped'
+            for entry in result['droppable']:
+                print(f"  🗑️  {label}: {entry['collection']}.{entry['name']} (unused since {entry['first_seen']})")
+            for entry in result['declared_unused']:
+                print(f"  💡 Declared but unused: {entry['collection']}.{entry['name']} - retire with a migration")
+            return result
+
+        print("🚀 Applying index migrations...")
+        result = await registry.migrate(dry_run=dry_run)
+        if result.get('status') == 'locked':
+            print(f"⏳ {result['message']}")
+        for migration in result.get('pending', []):
+            print(f"  ⏳ v{migration['version']} {migration['description']}: "
+                  f"{len(migration['create'])} create, {len(migration['drop'])} drop")
+        for migration in result.get('applied', []):
+            print(f"  ✅ v{migration['_id']} {migration['description']}: {len(migration['created'])} created, "
+                  f"{len(migration['existing'])} already present, {len(migration['dropped'])} dropped "
+                  f"({migration['duration_ms']} ms)")
+        if result.get('error'):
+            print(f"❌ Migration v{result['failed']} failed: {result['error']}")
+        elif not dry_run:
+            print("✨ Index registry up to date")
+        return result
+    finally:
+        client.close()
 
 if __name__ == "__main__":
-    asyncio.run(create_indexes())
+    args = sys.argv[1:]
+    command = next((a for a in args if not a.startswith('--')), 'migrate')
+    # drop-unused only drops with --apply; migrate applies unless --dry-run
+    dry_run = '--dry-run' in args or (command == 'drop-unused' and '--apply' not in args)
+    result = asyncio.run(create_indexes(command, dry_run))
+    sys.exit(1 if isinstance(result, dict) and result.get('error') else 0)
@@ -93,6 +93,13 @@ class DynamicPricingEngine:
         )
         
         recommended = base_price * total_factor
+        pricing_source = 'heuristic'
+        
+        # Trained RMS pricing model replaces the factor product when available
+        ml_price = await self._model_price(target_date, comp_data['average'], demand)
+        if ml_price is not None:
+            recommended = ml_price
+            pricing_source = 'ml_model'
         
         # Adjust based on competitor avg
         competitor_avg = comp_data['average']
@@ -113,8 +120,37 @@ class DynamicPricingEngine:
             'competitor_data': comp_data,
             'demand_factors': demand,
             'current_price': base_price,
-            'price_change_pct': round(((recommended - base_price) / base_price) * 100, 2)
+            'price_change_pct': round(((recommended - base_price) / base_price) * 100, 2),
+            'pricing_source': pricing_source
+        }
+    
+    async def _model_price(self, target_date: str, competitor_avg: float, demand: dict) -> Optional[float]:
+        """Price from the RMS pricing model, or None if it has not been trained"""
+        from ml_model_service import model_registry, season_for_month, ModelNotAvailableError
+        
+        if not model_registry.available('price'):
+            return None
+        
+        target = datetime.fromisoformat(target_date.replace('Z', '+00:00')).date() if 'T' in target_date \
+            else datetime.fromisoformat(target_date).date()
+        occupancy = demand['occupancy_forecast'] / 100
+        row = {
+            'day_of_week': target.weekday(),
+            'month': target.month,
+            'season': season_for_month(target.month),
+            'is_weekend': 1 if target.weekday() >= 5 else 0,
+            'is_holiday': 0,
+            'days_until_event': 1 if demand['event_factor'] > 1 else 60,
+            'competitor_avg_rate': competitor_avg,
+            'occupancy_rate': occupancy,
+            'historical_occupancy_7d': occupancy,
+            'historical_occupancy_30d': occupancy
         }
+        try:
+            result = await model_registry.predict('price', [row])
+        except ModelNotAvailableError:
+            return None
+        return float(result['predictions'][0])
 
 # Global instance
 pricing_engine = None
@@ -3,7 +3,7 @@ Dynamic Staffing AI - Optimal Personel Yönetimi
 Talep bazlı otomatik personel planlama
 """
 from datetime import datetime, timezone, date, timedelta
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 class DynamicStaffingAI:
     """AI-powered personel optimizasyonu"""
@@ -37,6 +37,13 @@ class DynamicStaffingAI:
         # Calculate needs
         front_desk_needed = max(2, arrivals // self.ratios['front_desk'])
         housekeeping_needed = max(3, departures // self.ratios['housekeeping'])
+        housekeeping_hours = None
+        
+        # HK scheduler model (staff + hours) when trained
+        hk_prediction = await self._model_housekeeping(tenant_id, target, target_date, departures)
+        if hk_prediction:
+            housekeeping_needed = hk_prediction['staff']
+            housekeeping_hours = hk_prediction['hours']
         
         # Get available staff
         all_staff = await self.db.staff_members.find({
@@ -63,9 +70,42 @@ class DynamicStaffingAI:
                 'front_desk': len(front_desk_staff),
                 'housekeeping': len(housekeeping_staff)
             },
+            'housekeeping_hours': housekeeping_hours,
             'status': 'adequate' if len(front_desk_staff) >= front_desk_needed else 'understaffed'
         }
     
+    async def _model_housekeeping(self, tenant_id: str, target: date, target_date: str, departures: int) -> Optional[Dict]:
+        """Staff and hours from the HK scheduler models, or None if not trained"""
+        from ml_model_service import model_registry, season_for_month, ModelNotAvailableError
+        
+        if not (model_registry.available('hk_staff') and model_registry.available('hk_hours')):
+            return None
+        
+        total_rooms = await self.db.rooms.count_documents({'tenant_id': tenant_id})
+        occupied = await self.db.bookings.count_documents({
+            'tenant_id': tenant_id,
+            'check_in': {'$lte': target_date},
+            'check_out': {'$gte': target_date},
+            'status': {'$in': ['confirmed', 'guaranteed', 'checked_in']}
+        })
+        row = {
+            'day_of_week': target.weekday(),
+            'is_weekend': 1 if target.weekday() >= 5 else 0,
+            'season': season_for_month(target.month),
+            'total_rooms': total_rooms,
+            'occupied_rooms': occupied,
+            'checkout_rooms': min(departures, occupied),
+            'stayover_rooms': max(occupied - departures, 0),
+            'vip_rooms': 0,
+            'occupancy_rate': occupied / total_rooms if total_rooms else 0
+        }
+        try:
+            staff = await model_registry.predict('hk_staff', [row])
+            hours = await model_registry.predict('hk_hours', [row])
+        except ModelNotAvailableError:
+            return None
+        return {'staff': max(1, round(staff['predictions'][0])), 'hours': round(hours['predictions'][0], 1)}
+    
     async def generate_shift_schedule(self, tenant_id: str, target_date: str) -> List[Dict]:
         """Otomatik vardiya planı oluştur"""
         optimal = await self.calculate_optimal_staffing(tenant_id, target_date)
@@ -0,0 +1,642 @@
+"""
+E-Fatura Pipeline
+Continuous, concurrent e-invoice generation and submission. Invoices queued
+with efatura_status 'pending' are claimed in batches, validated and rendered
+to UBL-TR XML in a process pool, then submitted to the e-invoice provider
+with bounded concurrency. Status changes are written with one bulk write per
+batch and stage. Rendering of the next batch overlaps submission of the
+current one, and the pipeline keeps claiming until the backlog is empty.
+
+Providers are pluggable (register_provider); the local 'stub' provider
+accepts every document after a simulated round trip.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import re
+import uuid
+import xml.etree.ElementTree as ET
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pymongo import ReturnDocument, UpdateOne
+
+EFATURA_PROVIDER = os.environ.get('EFATURA_PROVIDER', 'stub')
+EFATURA_BATCH_SIZE = int(os.environ.get('EFATURA_BATCH_SIZE', '200'))
+EFATURA_SUBMIT_CONCURRENCY = int(os.environ.get('EFATURA_SUBMIT_CONCURRENCY', '8'))
+# 0 renders on the event loop's thread pool instead of worker processes
+EFATURA_RENDER_WORKERS = int(os.environ.get('EFATURA_RENDER_WORKERS', str(min(4, max(1, (os.cpu_count() or 2) - 1)))))
+EFATURA_MAX_ATTEMPTS = int(os.environ.get('EFATURA_MAX_ATTEMPTS', '5'))
+EFATURA_IDLE_SECONDS = int(os.environ.get('EFATURA_IDLE_SECONDS', '30'))
+EFATURA_CLAIM_TIMEOUT_MINUTES = int(os.environ.get('EFATURA_CLAIM_TIMEOUT_MINUTES', '15'))
+
+# GIB invoice number: 3-character series, 4-digit year, 9-digit sequence
+GIB_NUMBER = re.compile(r'^[A-Z0-9]{3}\d{4}\d{9}$')
+# Final consumer without a tax number (e-Arşiv convention)
+ANONYMOUS_TCKN = '11111111111'
+
+NS = {
+    '': 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2',
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+}
+for _prefix, _uri in NS.items():
+    ET.register_namespace(_prefix, _uri)
+
+
+# ============= UBL RENDERING (runs in worker processes) =============
+
+def _num(value: Any) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _percent(rate: Any) -> float:
+    """VAT rate as a percentage; 0.18 and 18 both mean 18%"""
+    rate = _num(rate)
+    return rate * 100 if 0 < rate < 1 else rate
+
+
+def _date(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    return str(value or '')[:10]
+
+
+def invoice_lines(invoice: Dict[str, Any]) -> List[Dict[str, Any]]:
+    lines = []
+    for item in invoice.get('items') or []:
+        quantity = _num(item.get('quantity', 1))
+        unit_price = _num(item.get('unit_price'))
+        amount = round(quantity * unit_price, 2)
+        percent = _percent(item.get('vat_rate', 0))
+        vat = round(_num(item['vat_amount']) if item.get('vat_amount') is not None else amount * percent / 100, 2)
+        lines.append({'name': item.get('description') or item.get('name') or 'Hizmet', 'quantity': quantity,
+                      'unit_price': unit_price, 'amount': amount, 'percent': percent, 'vat': vat})
+    return lines
+
+
+def payable_amount(invoice: Dict[str, Any], line_total: float, vat_total: float) -> float:
+    """Lines plus VAT, plus additional taxes (ÖTV, accommodation) less VAT withholding"""
+    return line_total + vat_total + _num(invoice.get('total_additional_taxes')) - _num(invoice.get('vat_withholding'))
+
+
+def validate_invoice(invoice: Dict[str, Any], supplier: Dict[str, Any]) -> List[str]:
+    """GIB-side rejections we can detect before submitting"""
+    errors = []
+    lines = invoice_lines(invoice)
+    if not lines:
+        errors.append('Invoice has no lines')
+    for n, line in enumerate(lines, 1):
+        if line['quantity'] <= 0:
+            errors.append(f'Line {n}: quantity must be positive')
+        if line['unit_price'] < 0:
+            errors.append(f'Line {n}: negative unit price')
+    if not re.fullmatch(r'\d{10}', str(supplier.get('vkn') or '')):
+        errors.append('Supplier VKN must be 10 digits (e-Fatura settings)')
+    customer_tax = str(invoice.get('customer_tax_number') or '')
+    if customer_tax and not re.fullmatch(r'\d{10}|\d{11}', customer_tax):
+        errors.append('Customer tax number must be a 10-digit VKN or 11-digit TCKN')
+    if not re.fullmatch(r'[A-Z]{3}', str(invoice.get('currency') or 'TRY')):
+        errors.append('Currency must be an ISO 4217 code')
+    if not _date(invoice.get('issue_date') or invoice.get('invoice_date')):
+        errors.append('Issue date is missing')
+
+    line_total = sum(l['amount'] for l in lines)
+    vat_total = sum(l['vat'] for l in lines)
+    if invoice.get('subtotal') is not None and abs(_num(invoice['subtotal']) - line_total) > 0.05:
+        errors.append(f"Subtotal {invoice['subtotal']} does not match lines {round(line_total, 2)}")
+    total = invoice.get('total', invoice.get('grand_total'))
+    payable = payable_amount(invoice, line_total, vat_total)
+    if total is not None and abs(_num(total) - payable) > 0.05 + len(lines) * 0.01:
+        errors.append(f"Total {total} does not match lines plus taxes {round(payable, 2)}")
+    return errors
+
+
+def _el(parent, tag: str, text: Any = None, **attrs) -> ET.Element:
+    prefix, _, name = tag.rpartition(':')
+    element = ET.SubElement(parent, f"{{{NS[prefix]}}}{name}", {k: str(v) for k, v in attrs.items()})
+    if text is not None:
+        element.text = str(text)
+    return element
+
+
+def _amount(parent, tag: str, value: float, currency: str) -> ET.Element:
+    return _el(parent, tag, f'{value:.2f}', currencyID=currency)
+
+
+def _party(parent, tag: str, name: str, tax_number: str, tax_office: str = '', address: str = ''):
+    party = _el(_el(parent, tag), 'cac:Party')
+    identification = _el(party, 'cac:PartyIdentification')
+    _el(identification, 'cbc:ID', tax_number, schemeID='VKN' if len(tax_number) == 10 else 'TCKN')
+    _el(_el(party, 'cac:PartyName'), 'cbc:Name', name)
+    postal = _el(party, 'cac:PostalAddress')
+    _el(postal, 'cbc:StreetName', address or '-')
+    _el(_el(postal, 'cac:Country'), 'cbc:Name', 'Türkiye')
+    _el(_el(_el(party, 'cac:PartyTaxScheme'), 'cac:TaxScheme'), 'cbc:Name', tax_office or '-')
+
+
+def _tax_total(parent, subtotals: Dict[float, List[float]], currency: str):
+    tax_total = _el(parent, 'cac:TaxTotal')
+    _amount(tax_total, 'cbc:TaxAmount', sum(v for _, v in subtotals.values()), currency)
+    for percent, (taxable, vat) in sorted(subtotals.items()):
+        subtotal = _el(tax_total, 'cac:TaxSubtotal')
+        _amount(subtotal, 'cbc:TaxableAmount', taxable, currency)
+        _amount(subtotal, 'cbc:TaxAmount', vat, currency)
+        _el(subtotal, 'cbc:Percent', f'{percent:g}')
+        scheme = _el(_el(subtotal, 'cac:TaxCategory'), 'cac:TaxScheme')
+        _el(scheme, 'cbc:Name', 'KDV')
+        _el(scheme, 'cbc:TaxTypeCode', '0015')
+
+
+def render_ubl(invoice: Dict[str, Any], supplier: Dict[str, Any], number: str, ettn: str) -> str:
+    """UBL-TR 1.2 invoice document (values are escaped by the XML writer)"""
+    currency = invoice.get('currency') or 'TRY'
+    lines = invoice_lines(invoice)
+    issued = invoice.get('issue_date') or invoice.get('invoice_date')
+    customer_tax = str(invoice.get('customer_tax_number') or ANONYMOUS_TCKN)
+
+    root = ET.Element(f"{{{NS['']}}}Invoice")
+    _el(root, 'cbc:UBLVersionID', '2.1')
+    _el(root, 'cbc:CustomizationID', 'TR1.2')
+    _el(root, 'cbc:ProfileID', supplier.get('profile') or 'TEMELFATURA')
+    _el(root, 'cbc:ID', number)
+    _el(root, 'cbc:CopyIndicator', 'false')
+    _el(root, 'cbc:UUID', ettn)
+    _el(root, 'cbc:IssueDate', _date(issued))
+    if isinstance(issued, datetime):
+        _el(root, 'cbc:IssueTime', issued.strftime('%H:%M:%S'))
+    _el(root, 'cbc:InvoiceTypeCode', 'SATIS')
+    if invoice.get('notes'):
+        _el(root, 'cbc:Note', invoice['notes'])
+    _el(root, 'cbc:DocumentCurrencyCode', currency)
+    _el(root, 'cbc:LineCountNumeric', len(lines))
+
+    _party(root, 'cac:AccountingSupplierParty', supplier.get('name') or 'Hotel', str(supplier.get('vkn') or ''),
+           supplier.get('tax_office', ''), supplier.get('address', ''))
+    _party(root, 'cac:AccountingCustomerParty', invoice.get('customer_name') or 'Nihai Tüketici', customer_tax,
+           invoice.get('customer_tax_office') or '', invoice.get('customer_address') or '')
+
+    if currency != 'TRY':
+        rate = _el(root, 'cac:PricingExchangeRate')
+        _el(rate, 'cbc:SourceCurrencyCode', currency)
+        _el(rate, 'cbc:TargetCurrencyCode', 'TRY')
+        _el(rate, 'cbc:CalculationRate', invoice.get('exchange_rate') or 1)
+
+    subtotals: Dict[float, List[float]] = {}
+    for line in lines:
+        bucket = subtotals.setdefault(line['percent'], [0.0, 0.0])
+        bucket[0] += line['amount']
+        bucket[1] += line['vat']
+    _tax_total(root, subtotals, currency)
+
+    line_total = sum(l['amount'] for l in lines)
+    vat_total = sum(l['vat'] for l in lines)
+    monetary = _el(root, 'cac:LegalMonetaryTotal')
+    _amount(monetary, 'cbc:LineExtensionAmount', line_total, currency)
+    _amount(monetary, 'cbc:TaxExclusiveAmount', line_total, currency)
+    _amount(monetary, 'cbc:TaxInclusiveAmount', line_total + vat_total, currency)
+    _amount(monetary, 'cbc:PayableAmount', payable_amount(invoice, line_total, vat_total), currency)
+
+    for n, line in enumerate(lines, 1):
+        element = _el(root, 'cac:InvoiceLine')
+        _el(element, 'cbc:ID', n)
+        _el(element, 'cbc:InvoicedQuantity', f"{line['quantity']:g}", unitCode='C62')
+        _amount(element, 'cbc:LineExtensionAmount', line['amount'], currency)
+        _tax_total(element, {line['percent']: [line['amount'], line['vat']]}, currency)
+        _el(_el(element, 'cac:Item'), 'cbc:Name', line['name'])
+        _amount(_el(element, 'cac:Price'), 'cbc:PriceAmount', line['unit_price'], currency)
+
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root, encoding='unicode')
+
+
+def render_chunk(jobs: List[Tuple[str, Dict[str, Any], Dict[str, Any], str, str]]) -> List[Tuple[str, Optional[str], List[str]]]:
+    """Render validated (invoice_id, invoice, supplier, number, ettn) jobs; picklable for the process pool"""
+    results = []
+    for invoice_id, invoice, supplier, number, ettn in jobs:
+        try:
+            results.append((invoice_id, render_ubl(invoice, supplier, number, ettn), []))
+        except Exception as e:
+            results.append((invoice_id, None, [f'Rendering failed: {e}']))
+    return results
+
+
+# ============= PROVIDERS =============
+
+class ProviderError(Exception):
+    """Submission failure; retryable errors are queued again with backoff"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class EInvoiceProvider:
+    """Integrator client: submit one rendered document, identified by its ETTN"""
+
+    name = 'base'
+
+    async def submit(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class StubProvider(EInvoiceProvider):
+    """Local provider: accepts every document after a simulated round trip"""
+
+    name = 'stub'
+
+    def __init__(self, latency_ms: float = float(os.environ.get('EFATURA_STUB_LATENCY_MS', '50')),
+                 failure_rate: float = float(os.environ.get('EFATURA_STUB_FAILURE_RATE', '0'))):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+
+    async def submit(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ProviderError('Stub provider: simulated timeout')
+        return {
+            'status': 'success',
+            'gib_id': str(uuid.uuid5(uuid.NAMESPACE_URL, document['ettn'])),
+            'provider': self.name,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        }
+
+
+PROVIDERS: Dict[str, Type[EInvoiceProvider]] = {'stub': StubProvider}
+
+
+def register_provider(name: str, provider_class: Type[EInvoiceProvider]):
+    PROVIDERS[name] = provider_class
+
+
+def create_provider(name: Optional[str] = None) -> EInvoiceProvider:
+    name = name or EFATURA_PROVIDER
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown e-invoice provider '{name}'; registered: {', '.join(PROVIDERS)}")
+    return PROVIDERS[name]()
+
+
+# ============= PIPELINE =============
+
+class EFaturaPipeline:
+    """Claims pending invoices and moves them through render → submit with bulk status writes"""
+
+    def __init__(self, db, provider: Optional[EInvoiceProvider] = None, batch_size: int = EFATURA_BATCH_SIZE,
+                 submit_concurrency: int = EFATURA_SUBMIT_CONCURRENCY, render_workers: int = EFATURA_RENDER_WORKERS):
+        self.db = db
+        self.invoices = db.accounting_invoices
+        self.records = db.efatura_records
+        self.provider = provider or create_provider()
+        self.batch_size = batch_size
+        self.submit_concurrency = submit_concurrency
+        self.render_workers = render_workers
+        self._executor: Optional[Executor] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self._wakeup = asyncio.Event()
+        self.stats = {'claimed': 0, 'generated': 0, 'sent': 0, 'invalid': 0, 'retried': 0, 'failed': 0,
+                      'last_batch': None, 'last_drain': None}
+
+    # ------------------------------------------------------------ lifecycle
+
+    async def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._task = asyncio.create_task(self._loop(), name='efatura-pipeline')
+        print(f"🧾 E-Fatura pipeline started (provider {self.provider.name}, batch {self.batch_size}, "
+              f"{self.submit_concurrency} concurrent submissions)")
+
+    async def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.provider.close()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def wake(self):
+        """New invoices were queued: start draining now instead of after the idle wait"""
+        self._wakeup.set()
+
+    async def _loop(self):
+        while self._running:
+            try:
+                await self.drain()
+            except Exception as e:
+                print(f"⚠️ E-Fatura pipeline error: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=EFATURA_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    # ------------------------------------------------------------ queueing
+
+    async def enqueue(self, tenant_id: str, invoice_ids: Optional[List[str]] = None,
+                      start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      submit: bool = True, ettn: Optional[str] = None) -> int:
+        """
+        Queue invoices for generation (and submission unless submit=False).
+        Invoices already queued or sent are left alone; invalid and failed
+        ones are queued again. ettn pre-assigns the UUID of a single invoice.
+        """
+        query: Dict[str, Any] = {'tenant_id': tenant_id, 'invoice_type': {'$ne': 'purchase'},
+                                 'efatura_status': {'$in': [None, 'generated', 'invalid', 'failed']}}
+        if invoice_ids:
+            query['id'] = {'$in': invoice_ids}
+        if start_date or end_date:
+            # issue_date is an ISO date or datetime string; 'T99' keeps the whole end day
+            query['issue_date'] = {}
+            if start_date:
+                query['issue_date']['$gte'] = start_date
+            if end_date:
+                query['issue_date']['$lte'] = end_date + 'T99'
+        fields = {'efatura_status': 'pending', 'efatura_submit': submit, 'efatura_attempts': 0,
+                  'efatura_queued_at': datetime.now(timezone.utc).isoformat()}
+        if ettn:
+            fields['efatura_uuid'] = ettn
+        result = await self.invoices.update_many(query, {
+            '$set': fields,
+            '$unset': {'efatura_next_attempt_at': '', 'efatura_error': ''},
+        })
+        if result.modified_count:
+            self.wake()
+        return result.modified_count
+
+    async def _release_stale(self):
+        """Claims left behind by a crashed worker go back to the queue"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(minutes=EFATURA_CLAIM_TIMEOUT_MINUTES)).isoformat()
+        await self.invoices.update_many(
+            {'efatura_status': 'processing', 'efatura_claimed_at': {'$lt': cutoff}},
+            {'$set': {'efatura_status': 'pending'}, '$unset': {'efatura_claim': ''}}
+        )
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        now = datetime.now(timezone.utc).isoformat()
+        candidates = await self.invoices.find(
+            {'efatura_status': 'pending', 'invoice_type': {'$ne': 'purchase'},
+             '$or': [{'efatura_next_attempt_at': None}, {'efatura_next_attempt_at': {'$lte': now}}]},
+            {'_id': 0, 'id': 1}
+        ).sort('efatura_queued_at', 1).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+        token = str(uuid.uuid4())
+        await self.invoices.update_many(
+            {'id': {'$in': [c['id'] for c in candidates]}, 'efatura_status': 'pending'},
+            {'$set': {'efatura_status': 'processing', 'efatura_claim': token, 'efatura_claimed_at': now}}
+        )
+        claimed = await self.invoices.find({'efatura_claim': token}, {'_id': 0}).to_list(self.batch_size)
+        self.stats['claimed'] += len(claimed)
+        return claimed
+
+    # ------------------------------------------------------------ stages
+
+    async def _suppliers(self, tenant_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        tenants, settings = await asyncio.gather(
+            self.db.tenants.find({'id': {'$in': tenant_ids}}, {'_id': 0}).to_list(None),
+            self.db.efatura_settings.find({'tenant_id': {'$in': tenant_ids}}, {'_id': 0}).to_list(None),
+        )
+        by_tenant = {t['id']: t for t in tenants}
+        suppliers = {}
+        for tenant_id in tenant_ids:
+            tenant = by_tenant.get(tenant_id, {})
+            suppliers[tenant_id] = {
+                'name': tenant.get('property_name') or tenant.get('name') or 'Hotel',
+                'address': tenant.get('address') or tenant.get('location') or '',
+                'vkn': None, 'tax_office': '', 'series': 'EFT', 'profile': 'TEMELFATURA',
+            }
+        for s in settings:
+            supplier = suppliers.get(s['tenant_id'])
+            if supplier:
+                supplier.update({k: s[k] for k in ('vkn', 'tax_office', 'series', 'profile', 'address') if s.get(k)})
+        return suppliers
+
+    async def _numbers(self, invoices: List[Dict[str, Any]], suppliers: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+        """GIB numbers: keep a conforming one, else allocate from the tenant's series in one $inc per series/year"""
+        numbers, needed = {}, {}
+        for invoice in invoices:
+            existing = invoice.get('efatura_number') or invoice.get('invoice_number') or ''
+            if GIB_NUMBER.match(existing):
+                numbers[invoice['id']] = existing
+                continue
+            series = (suppliers[invoice['tenant_id']]['series'] or 'EFT')[:3].upper()
+            year = _date(invoice.get('issue_date') or invoice.get('invoice_date'))[:4] or str(datetime.now().year)
+            needed.setdefault((invoice['tenant_id'], series, year), []).append(invoice['id'])
+        for (tenant_id, series, year), ids in needed.items():
+            counter = await self.db.efatura_sequences.find_one_and_update(
+                {'_id': f'{tenant_id}:{series}:{year}'}, {'$inc': {'seq': len(ids)}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+            first = counter['seq'] - len(ids) + 1
+            for offset, invoice_id in enumerate(ids):
+                numbers[invoice_id] = f'{series}{year}{first + offset:09d}'
+        return numbers
+
+    def _pool(self) -> Optional[Executor]:
+        if self.render_workers and self._executor is None:
+            # spawn: forking a process with a running event loop and driver threads is unsafe
+            self._executor = ProcessPoolExecutor(max_workers=self.render_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def _render(self, invoices: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Validate a claimed batch, render the valid invoices in the worker pool; persist numbers, ETTNs and XML"""
+        started = datetime.now(timezone.utc)
+        suppliers = await self._suppliers(sorted({i['tenant_id'] for i in invoices}))
+        # Validate before numbering so rejected invoices never consume a GIB sequence number
+        rendered = {i['id']: (None, validate_invoice(i, suppliers[i['tenant_id']])) for i in invoices}
+        valid = [i for i in invoices if not rendered[i['id']][1]]
+        numbers = await self._numbers(valid, suppliers)
+        ettns = {i['id']: i.get('efatura_uuid') or str(uuid.uuid4()) for i in invoices}
+        jobs = [(i['id'], i, suppliers[i['tenant_id']], numbers[i['id']], ettns[i['id']]) for i in valid]
+
+        if jobs:
+            loop = asyncio.get_running_loop()
+            chunks = max(1, self.render_workers or 1)
+            size = -(-len(jobs) // chunks)
+            outputs = await asyncio.gather(*[
+                loop.run_in_executor(self._pool(), render_chunk, jobs[n:n + size]) for n in range(0, len(jobs), size)
+            ])
+            rendered.update({invoice_id: (xml, errors) for output in outputs for invoice_id, xml, errors in output})
+
+        now = datetime.now(timezone.utc).isoformat()
+        invoice_ops, record_ops, documents = [], [], []
+        for invoice in invoices:
+            xml, errors = rendered[invoice['id']]
+            status = 'generated' if xml else 'invalid'
+            submit = xml is not None and invoice.get('efatura_submit', True)
+            number = numbers.get(invoice['id'])
+            invoice_set = {'efatura_uuid': ettns[invoice['id']]}
+            if number:
+                invoice_set['efatura_number'] = number
+            if errors:
+                invoice_set.update({'efatura_status': 'invalid', 'efatura_error': '; '.join(errors)})
+            elif not submit:
+                invoice_set.update({'efatura_status': 'generated', 'efatura_generated_at': now})
+            invoice_ops.append(UpdateOne({'id': invoice['id']}, {'$set': invoice_set,
+                                                                 **({} if submit else {'$unset': {'efatura_claim': ''}})}))
+            record_ops.append(UpdateOne(
+                {'invoice_id': invoice['id'], 'tenant_id': invoice['tenant_id']},
+                {'$set': {'invoice_number': invoice.get('invoice_number'), 'efatura_number': number,
+                          'efatura_uuid': ettns[invoice['id']], 'xml_content': xml, 'status': status,
+                          'validation_errors': errors, 'generated_at': now},
+                 '$setOnInsert': {'id': str(uuid.uuid4())}},
+                upsert=True
+            ))
+            if submit:
+                documents.append({'invoice_id': invoice['id'], 'tenant_id': invoice['tenant_id'], 'xml': xml,
+                                  'ettn': ettns[invoice['id']], 'number': number,
+                                  'attempts': invoice.get('efatura_attempts') or 0})
+            elif errors:
+                self.stats['invalid'] += 1
+            else:
+                self.stats['generated'] += 1
+        await asyncio.gather(self.invoices.bulk_write(invoice_ops, ordered=False),
+                             self.records.bulk_write(record_ops, ordered=False))
+        self.stats['last_batch'] = {'size': len(invoices), 'to_submit': len(documents),
+                                    'render_ms': round((datetime.now(timezone.utc) - started).total_seconds() * 1000, 1)}
+        return documents
+
+    async def _submit(self, documents: List[Dict[str, Any]]):
+        """Submit rendered documents with bounded concurrency; one bulk status write per collection"""
+        if not documents:
+            return
+        started = datetime.now(timezone.utc)
+        semaphore = asyncio.Semaphore(self.submit_concurrency)
+
+        async def one(document):
+            async with semaphore:
+                try:
+                    return document, await self.provider.submit(document), None
+                except ProviderError as e:
+                    return document, None, e
+                except Exception as e:
+                    return document, None, ProviderError(str(e))
+
+        results = await asyncio.gather(*[one(d) for d in documents])
+        now = datetime.now(timezone.utc)
+        invoice_ops, record_ops = [], []
+        for document, response, error in results:
+            match = {'invoice_id': document['invoice_id'], 'tenant_id': document['tenant_id']}
+            if response is not None:
+                self.stats['sent'] += 1
+                invoice_ops.append(UpdateOne({'id': document['invoice_id']}, {
+                    '$set': {'efatura_status': 'sent', 'efatura_sent_at': now.isoformat()},
+                    '$unset': {'efatura_claim': '', 'efatura_error': '', 'efatura_next_attempt_at': ''},
+                }))
+                record_ops.append(UpdateOne(match, {'$set': {'status': 'sent_to_gib', 'gib_response': response,
+                                                             'sent_at': now.isoformat()}}))
+                continue
+            attempts = document['attempts'] + 1
+            retry = error.retryable and attempts < EFATURA_MAX_ATTEMPTS
+            self.stats['retried' if retry else 'failed'] += 1
+            invoice_set = {'efatura_status': 'pending' if retry else 'failed', 'efatura_attempts': attempts,
+                           'efatura_error': str(error)}
+            if retry:
+                # 30s, 1m, 2m, 4m ... capped at an hour
+                invoice_set['efatura_next_attempt_at'] = (now + timedelta(seconds=min(3600, 30 * 2 ** (attempts - 1)))).isoformat()
+            invoice_ops.append(UpdateOne({'id': document['invoice_id']},
+                                         {'$set': invoice_set, '$unset': {'efatura_claim': ''}}))
+            record_ops.append(UpdateOne(match, {'$set': {'status': 'generated' if retry else 'failed',
+                                                         'last_error': str(error), 'attempts': attempts}}))
+        await asyncio.gather(self.invoices.bulk_write(invoice_ops, ordered=False),
+                             self.records.bulk_write(record_ops, ordered=False))
+        if self.stats['last_batch']:
+            self.stats['last_batch']['submit_ms'] = round((now - started).total_seconds() * 1000, 1)
+
+    async def drain(self, max_seconds: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Process the backlog until it is empty (or max_seconds passes). The
+        next batch is claimed and rendered while the current one is submitted.
+        """
+        await self._release_stale()
+        started = datetime.now(timezone.utc)
+        deadline = started + timedelta(seconds=max_seconds) if max_seconds else None
+        before = dict(self.stats)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+        async def produce():
+            try:
+                while not deadline or datetime.now(timezone.utc) < deadline:
+                    batch = await self._claim()
+                    if not batch:
+                        break
+                    await queue.put(await self._render(batch))
+            finally:
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                documents = await queue.get()
+                if documents is None:
+                    return
+                await self._submit(documents)
+
+        await asyncio.gather(produce(), consume())
+        summary = {k: self.stats[k] - before[k] for k in ('claimed', 'generated', 'sent', 'invalid', 'retried', 'failed')}
+        if summary['claimed']:
+            seconds = (datetime.now(timezone.utc) - started).total_seconds()
+            summary['seconds'] = round(seconds, 1)
+            summary['per_second'] = round(summary['claimed'] / seconds, 1) if seconds else None
+            self.stats['last_drain'] = {**summary, 'finished_at': datetime.now(timezone.utc).isoformat()}
+            print(f"🧾 E-Fatura: {summary['sent']} sent, {summary['generated']} generated, "
+                  f"{summary['invalid']} invalid, {summary['retried']} retrying, "
+                  f"{summary['failed']} failed in {summary['seconds']}s")
+        return summary
+
+    # ------------------------------------------------------------ reporting
+
+    async def status(self, tenant_id: Optional[str] = None) -> Dict[str, Any]:
+        """Backlog by status; pipeline-wide throughput stats only for the unscoped (operator) view"""
+        match: Dict[str, Any] = {'efatura_status': {'$in': ['pending', 'processing', 'generated', 'invalid',
+                                                            'failed', 'sent']}}
+        if tenant_id:
+            match['tenant_id'] = tenant_id
+        rows = await self.invoices.aggregate([
+            {'$match': match},
+            {'$group': {'_id': '$efatura_status', 'count': {'$sum': 1}, 'oldest': {'$min': '$efatura_queued_at'}}},
+        ]).to_list(None)
+        by_status = {r['_id']: r['count'] for r in rows}
+        oldest = next((r['oldest'] for r in rows if r['_id'] == 'pending'), None)
+        result = {
+            'running': self._running,
+            'provider': self.provider.name,
+            'backlog': by_status.get('pending', 0) + by_status.get('processing', 0),
+            'oldest_pending_queued_at': oldest,
+            'by_status': by_status,
+        }
+        if tenant_id is None:
+            result['stats'] = self.stats
+        return result
+
+
+# Global pipeline (created at startup)
+efatura_pipeline: Optional[EFaturaPipeline] = None
+
+
+async def init_efatura_pipeline(db) -> EFaturaPipeline:
+    global efatura_pipeline
+    if efatura_pipeline is None:
+        efatura_pipeline = EFaturaPipeline(db)
+    await efatura_pipeline.start()
+    return efatura_pipeline
+
+
+def get_efatura_pipeline(db=None) -> Optional[EFaturaPipeline]:
+    """Running pipeline; with db, an idle instance for queueing when it was never started"""
+    if efatura_pipeline is None and db is not None:
+        return EFaturaPipeline(db)
+    return efatura_pipeline
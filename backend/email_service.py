@@ -2,6 +2,7 @@
 Email Service - AWS SES SMTP Implementation
 Gerçek e-posta gönderimi için AWS SES kullanır
 """
+import asyncio
 import random
 import smtplib
 from email.mime.text import MIMEText
@@ -206,6 +207,15 @@ class EmailService:
             print(f"❌ Failed to send email via SMTP: {e}")
             return False
     
+    async def _deliver(self, to_email: str, subject: str, html_content: str, text_content: str, priority: int = 0) -> bool:
+        """Queue via the delivery service; fall back to a direct send off the event loop"""
+        from message_delivery import get_delivery_service
+        delivery = get_delivery_service()
+        if delivery and delivery.running:
+            await delivery.enqueue_email(to_email, subject, html_content, text_content, priority=priority)
+            return True
+        return await asyncio.to_thread(self._send_email_smtp, to_email, subject, html_content, text_content)
+    
     async def send_verification_code(self, email: str, code: str, name: str = None) -> bool:
         """E-posta doğrulama kodu gönder"""
         subject = "Syroce - E-posta Doğrulama Kodu"
@@ -224,8 +234,8 @@ Bu kodu kimseyle paylaşmayın.
         """
         
         if self.mode == "production" and self.smtp_username and self.smtp_password:
-            # Send real email via AWS SES
-            return self._send_email_smtp(email, subject, html_content, text_content)
+            # Send real email via AWS SES (queued; codes jump ahead of campaigns)
+            return await self._deliver(email, subject, html_content, text_content, priority=10)
         else:
             # Mock mode - print to console
             print("\n" + "="*60)
@@ -260,8 +270,8 @@ Bu talebi siz yapmadınız mı? Güvenle bu e-postayı görmezden gelebilirsiniz
         """
         
         if self.mode == "production" and self.smtp_username and self.smtp_password:
-            # Send real email via AWS SES
-            return self._send_email_smtp(email, subject, html_content, text_content)
+            # Send real email via AWS SES (queued; codes jump ahead of campaigns)
+            return await self._deliver(email, subject, html_content, text_content, priority=10)
         else:
             # Mock mode - print to console
             print("\n" + "="*60)
@@ -292,8 +302,8 @@ Destek: info@syroce.com
         """
         
         if self.mode == "production" and self.smtp_username and self.smtp_password:
-            # Send real email via AWS SES
-            return self._send_email_smtp(email, subject, html_content, text_content)
+            # Send real email via AWS SES (queued)
+            return await self._deliver(email, subject, html_content, text_content)
         else:
             # Mock mode - print to console
             print("\n" + "="*60)
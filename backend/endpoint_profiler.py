@@ -0,0 +1,553 @@
+"""
+Slow Endpoint Profiler
+On-demand sampling of selected routes: per-request query budget
+(query count, DB time, docs scanned vs returned, CPU time) and a
+ranked worst-offenders report for admins
+"""
+
+import asyncio
+import contextvars
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel, Field
+from pymongo import monitoring
+from starlette.routing import compile_path
+
+from request_metrics import LatencyHistogram, metrics_registry
+
+profiler_router = APIRouter(prefix="/api/monitoring/profiler", tags=["Profiler"])
+
+# Commands that count against a request's query budget
+_QUERY_COMMANDS = {
+    'find', 'aggregate', 'count', 'distinct', 'insert', 'update', 'delete',
+    'findAndModify', 'getMore',
+}
+# Commands whose shape can be explained for docs-examined figures
+_EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct'}
+
+MAX_QUERIES_PER_PROFILE = 2000
+MAX_SHAPES = 500
+
+
+def _shape_of(command_name: str, command: Dict[str, Any]) -> str:
+    """Stable query shape: collection + op + filter/pipeline keys (values stripped)"""
+    collection = command.get('collection') if command_name == 'getMore' else command.get(command_name)
+    if command_name == 'aggregate':
+        stages = [next(iter(stage), '?') for stage in command.get('pipeline', [])]
+        detail = '>'.join(stages)
+    else:
+        query = command.get('filter') or command.get('query') or {}
+        detail = ','.join(sorted(query.keys())) if isinstance(query, dict) else ''
+    return f"{collection}.{command_name}({detail})"
+
+
+class RequestProfile:
+    """Query budget collected for one sampled request"""
+
+    def __init__(self, method: str, path: str, route: str):
+        self.method = method
+        self.path = path
+        self.route = route
+        self.started_at = datetime.now(timezone.utc)
+        self.query_count = 0
+        self.db_time_us = 0
+        self.docs_returned = 0
+        self.shapes: Counter = Counter()
+        self.shape_time_us: Counter = Counter()
+        self.commands: Dict[str, Dict[str, Any]] = {}
+        self.cpu_ms = 0.0
+        self.wall_ms = 0.0
+        self.status_code = 0
+        self._pending: Dict[Any, tuple] = {}
+        self._lock = threading.Lock()
+
+    def to_dict(self, explain_cache: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        docs_scanned = 0
+        explained = 0
+        for shape, n in self.shapes.items():
+            plan = explain_cache.get(shape)
+            if plan:
+                docs_scanned += plan['docs_examined'] * n
+                explained += n
+        return {
+            'method': self.method,
+            'path': self.path,
+            'route': self.route,
+            'started_at': self.started_at.isoformat(),
+            'status_code': self.status_code,
+            'wall_ms': round(self.wall_ms, 2),
+            'cpu_ms': round(self.cpu_ms, 2),
+            'query_count': self.query_count,
+            'db_time_ms': round(self.db_time_us / 1000, 2),
+            'docs_returned': self.docs_returned,
+            'docs_scanned_estimate': docs_scanned,
+            'queries_explained': explained,
+            'top_queries': [
+                {
+                    'shape': shape,
+                    'count': n,
+                    'db_time_ms': round(self.shape_time_us[shape] / 1000, 2),
+                    'plan': (explain_cache.get(shape) or {}).get('plan'),
+                }
+                for shape, n in self.shapes.most_common(10)
+            ],
+        }
+
+
+_active_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar(
+    'active_profile', default=None
+)
+
+
+class _RouteStats:
+    """Aggregated stats for a profiled route"""
+
+    def __init__(self):
+        self.requests = 0
+        self.wall = LatencyHistogram()
+        self.queries_total = 0
+        self.queries_max = 0
+        self.db_time_us = 0
+        self.docs_returned = 0
+        self.cpu_ms = 0.0
+        self.shapes: Counter = Counter()
+        self.shape_time_us: Counter = Counter()
+
+    def add(self, profile: RequestProfile):
+        self.requests += 1
+        self.wall.record_ms(profile.wall_ms)
+        self.queries_total += profile.query_count
+        self.queries_max = max(self.queries_max, profile.query_count)
+        self.db_time_us += profile.db_time_us
+        self.docs_returned += profile.docs_returned
+        self.cpu_ms += profile.cpu_ms
+        self.shapes.update(profile.shapes)
+        self.shape_time_us.update(profile.shape_time_us)
+        # Keep memory bounded for routes with highly variable query shapes
+        if len(self.shapes) > MAX_SHAPES:
+            self.shapes = Counter(dict(self.shapes.most_common(MAX_SHAPES // 2)))
+            self.shape_time_us = Counter({k: self.shape_time_us[k] for k in self.shapes})
+
+
+class _StackSampler:
+    """Statistical sampler of the event-loop thread while profiled requests run"""
+
+    def __init__(self, interval: float = 0.005, max_frames: int = 300):
+        self.interval = interval
+        self.max_frames = max_frames
+        self.samples: Dict[str, Counter] = {}
+        self._active: Counter = Counter()
+        self._thread_id: Optional[int] = None
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def begin(self, route: str):
+        with self._lock:
+            self._thread_id = threading.get_ident()
+            self._active[route] += 1
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='endpoint-profiler', daemon=True)
+                self._worker.start()
+
+    def end(self, route: str):
+        with self._lock:
+            self._active[route] -= 1
+            if self._active[route] <= 0:
+                del self._active[route]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                routes = list(self._active)
+                thread_id = self._thread_id
+            if not routes:
+                return
+            frame = sys._current_frames().get(thread_id)
+            location = None
+            while frame is not None:
+                code = frame.f_code
+                # Attribute the sample to the innermost frame in application code
+                if '/site-packages/' not in code.co_filename and '/lib/python' not in code.co_filename:
+                    location = f"{code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno} {code.co_name}"
+                    break
+                frame = frame.f_back
+            if location is None:
+                location = '<library/idle>'
+            with self._lock:
+                for route in routes:
+                    counter = self.samples.setdefault(route, Counter())
+                    counter[location] += 1
+                    if len(counter) > self.max_frames:
+                        self.samples[route] = Counter(dict(counter.most_common(self.max_frames // 2)))
+
+    def top(self, route: str, limit: int = 15) -> List[Dict[str, Any]]:
+        with self._lock:
+            counter = Counter(self.samples.get(route, {}))
+        total = sum(counter.values())
+        return [
+            {'location': location, 'samples': n, 'percent': round(n / total * 100, 1)}
+            for location, n in counter.most_common(limit)
+        ] if total else []
+
+
+class EndpointProfiler:
+    """Registry of profiled routes and their collected query budgets"""
+
+    def __init__(self, history: int = 200, explain_refresh_minutes: int = 30):
+        self.targets: Dict[str, Dict[str, Any]] = {}
+        self.stats: Dict[str, _RouteStats] = {}
+        self.recent: deque = deque(maxlen=history)
+        self.explain_cache: Dict[str, Dict[str, Any]] = {}
+        self.explain_refresh = timedelta(minutes=explain_refresh_minutes)
+        self.sampler = _StackSampler()
+        self.db = None
+
+    # ---- Targets ----
+
+    def enable(self, route: str, sample_rate: float = 1.0, duration_minutes: int = 30,
+               method: Optional[str] = None) -> Dict[str, Any]:
+        path_regex, _, _ = compile_path(route)
+        now = datetime.now(timezone.utc)
+        self.targets[route] = {
+            'route': route,
+            'method': method.upper() if method else None,
+            'sample_rate': max(0.0, min(sample_rate, 1.0)),
+            'regex': path_regex,
+            'enabled_at': now,
+            'expires_at': now + timedelta(minutes=duration_minutes),
+        }
+        return self._describe(self.targets[route])
+
+    def disable(self, route: str) -> bool:
+        return self.targets.pop(route, None) is not None
+
+    def list_targets(self) -> List[Dict[str, Any]]:
+        self._expire()
+        return [self._describe(t) for t in self.targets.values()]
+
+    @staticmethod
+    def _describe(target: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'route': target['route'],
+            'method': target['method'],
+            'sample_rate': target['sample_rate'],
+            'enabled_at': target['enabled_at'].isoformat(),
+            'expires_at': target['expires_at'].isoformat(),
+        }
+
+    def _expire(self):
+        now = datetime.now(timezone.utc)
+        for route in [r for r, t in self.targets.items() if t['expires_at'] <= now]:
+            del self.targets[route]
+
+    def match(self, method: str, path: str) -> Optional[str]:
+        if not self.targets:
+            return None
+        self._expire()
+        for route, target in self.targets.items():
+            if target['method'] and target['method'] != method:
+                continue
+            if target['regex'].match(path) and random.random() < target['sample_rate']:
+                return route
+        return None
+
+    # ---- Collection ----
+
+    def finish(self, profile: RequestProfile):
+        self.stats.setdefault(profile.route, _RouteStats()).add(profile)
+        self.recent.append(profile)
+        if self.db is not None:
+            stale = [
+                shape for shape in profile.commands
+                if shape not in self.explain_cache
+                or datetime.now(timezone.utc) - self.explain_cache[shape]['explained_at'] > self.explain_refresh
+            ]
+            if stale:
+                # Fresh context so the explain commands are not charged to any request
+                asyncio.get_running_loop().create_task(
+                    self._explain_shapes({s: profile.commands[s] for s in stale[:10]}),
+                    context=contextvars.Context(),
+                )
+
+    async def _explain_shapes(self, commands: Dict[str, Dict[str, Any]]):
+        for shape, command in commands.items():
+            try:
+                result = await self.db.command({'explain': command, 'verbosity': 'executionStats'})
+                stats = result.get('executionStats') or _aggregate_execution_stats(result)
+                self.explain_cache[shape] = {
+                    'docs_examined': stats.get('totalDocsExamined', 0),
+                    'keys_examined': stats.get('totalKeysExamined', 0),
+                    'returned': stats.get('nReturned', 0),
+                    'plan': _plan_summary(result),
+                    'explained_at': datetime.now(timezone.utc),
+                }
+            except Exception as e:
+                self.explain_cache[shape] = {
+                    'docs_examined': 0, 'keys_examined': 0, 'returned': 0,
+                    'plan': f'explain failed: {e}',
+                    'explained_at': datetime.now(timezone.utc),
+                }
+        if len(self.explain_cache) > MAX_SHAPES * 4:
+            oldest = sorted(self.explain_cache, key=lambda s: self.explain_cache[s]['explained_at'])
+            for shape in oldest[:MAX_SHAPES]:
+                del self.explain_cache[shape]
+
+    # ---- Reporting ----
+
+    def route_report(self, route: str, stats: _RouteStats) -> Dict[str, Any]:
+        requests = stats.requests or 1
+        docs_scanned = 0
+        for shape, n in stats.shapes.items():
+            plan = self.explain_cache.get(shape)
+            if plan:
+                docs_scanned += plan['docs_examined'] * n
+        wall = stats.wall.summary()
+        return {
+            'route': route,
+            'requests_profiled': stats.requests,
+            'p50_ms': wall.get('p50_ms', 0),
+            'p95_ms': wall.get('p95_ms', 0),
+            'avg_queries': round(stats.queries_total / requests, 1),
+            'max_queries': stats.queries_max,
+            'avg_db_time_ms': round(stats.db_time_us / requests / 1000, 2),
+            'total_db_time_ms': round(stats.db_time_us / 1000, 2),
+            'avg_cpu_ms': round(stats.cpu_ms / requests, 2),
+            'docs_returned': stats.docs_returned,
+            'docs_scanned_estimate': docs_scanned,
+            'scan_ratio': round(docs_scanned / stats.docs_returned, 1) if stats.docs_returned else None,
+            'top_queries': [
+                {
+                    'shape': shape,
+                    'count': n,
+                    'per_request': round(n / requests, 1),
+                    'db_time_ms': round(stats.shape_time_us[shape] / 1000, 2),
+                    'plan': (self.explain_cache.get(shape) or {}).get('plan'),
+                }
+                for shape, n in stats.shapes.most_common(10)
+            ],
+            'hot_code': self.sampler.top(route),
+        }
+
+    def worst_offenders(self, sort_by: str = 'total_db_time_ms', limit: int = 20) -> List[Dict[str, Any]]:
+        reports = [self.route_report(route, stats) for route, stats in self.stats.items()]
+        reports.sort(key=lambda r: r.get(sort_by) or 0, reverse=True)
+        return reports[:limit]
+
+    def reset(self):
+        self.stats.clear()
+        self.recent.clear()
+        self.explain_cache.clear()
+        self.sampler.samples.clear()
+
+
+def _aggregate_execution_stats(result: Dict[str, Any]) -> Dict[str, Any]:
+    """executionStats for aggregate explains live under the $cursor stage"""
+    for stage in result.get('stages', []):
+        cursor = stage.get('$cursor')
+        if cursor and 'executionStats' in cursor:
+            return cursor['executionStats']
+    return {}
+
+
+def _plan_summary(result: Dict[str, Any]) -> str:
+    planner = result.get('queryPlanner')
+    if not planner:
+        for stage in result.get('stages', []):
+            planner = (stage.get('$cursor') or {}).get('queryPlanner')
+            if planner:
+                break
+    stage = (planner or {}).get('winningPlan', {})
+    names = []
+    while stage:
+        name = stage.get('stage')
+        if name:
+            names.append(name + (f"({stage['indexName']})" if stage.get('indexName') else ''))
+        stage = stage.get('inputStage') or (stage.get('queryPlan') or {}).get('inputStage')
+    return ' <- '.join(names) or 'unknown'
+
+
+# Global profiler instance
+endpoint_profiler = EndpointProfiler()
+
+
+# ============= HOOKS =============
+
+class ProfilerCommandListener(monitoring.CommandListener):
+    """Charge MongoDB commands to the sampled request that issued them
+
+    Motor copies the caller's context into its executor, so the active
+    profile is visible from the thread running the command.
+    """
+
+    def started(self, event):
+        profile = _active_profile.get()
+        if profile is None or event.command_name not in _QUERY_COMMANDS:
+            return
+        shape = _shape_of(event.command_name, event.command)
+        with profile._lock:
+            profile._pending[(event.request_id, event.connection_id)] = shape
+            if (event.command_name in _EXPLAINABLE and shape not in profile.commands
+                    and len(profile.commands) < 50):
+                profile.commands[shape] = {
+                    k: v for k, v in event.command.items()
+                    if k not in ('lsid', '$db', '$clusterTime', 'txnNumber', '$readPreference')
+                }
+
+    def _finish(self, event, docs: int):
+        profile = _active_profile.get()
+        if profile is None:
+            return
+        with profile._lock:
+            shape = profile._pending.pop((event.request_id, event.connection_id), None)
+            if shape is None or profile.query_count >= MAX_QUERIES_PER_PROFILE:
+                return
+            profile.query_count += 1
+            profile.db_time_us += event.duration_micros
+            profile.docs_returned += docs
+            profile.shapes[shape] += 1
+            profile.shape_time_us[shape] += event.duration_micros
+
+    def succeeded(self, event):
+        reply = event.reply or {}
+        cursor = reply.get('cursor') or {}
+        docs = len(cursor.get('firstBatch') or cursor.get('nextBatch') or [])
+        self._finish(event, docs)
+
+    def failed(self, event):
+        self._finish(event, 0)
+
+
+profiler_command_listener = ProfilerCommandListener()
+
+
+class ProfilerMiddleware:
+    """Sample requests whose path matches an enabled route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        route = endpoint_profiler.match(scope.get('method', 'GET'), scope.get('path', ''))
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope.get('method', 'GET'), scope.get('path', ''), route)
+        token = _active_profile.set(profile)
+        endpoint_profiler.sampler.begin(route)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                profile.status_code = message.get('status', 0)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # thread_time covers the event-loop thread, so concurrent requests
+            # inflate it; treat cpu_ms as an upper bound under load
+            profile.cpu_ms = (time.thread_time() - cpu_start) * 1000
+            profile.wall_ms = (time.perf_counter() - wall_start) * 1000
+            endpoint_profiler.sampler.end(route)
+            _active_profile.reset(token)
+            endpoint_profiler.finish(profile)
+
+
+# ============= API ENDPOINTS =============
+
+class ProfileTargetRequest(BaseModel):
+    route: str = Field(..., description="Route template, e.g. /api/pms/bookings/{booking_id}")
+    method: Optional[str] = None
+    sample_rate: float = 1.0
+    duration_minutes: int = 30
+
+
+@profiler_router.get("/routes")
+async def list_profiled_routes():
+    """List routes currently being sampled"""
+    return {'routes': endpoint_profiler.list_targets()}
+
+
+@profiler_router.post("/routes")
+async def enable_route_profiling(payload: ProfileTargetRequest, request: Request):
+    """Start sampling a route template"""
+    known = {getattr(r, 'path', None) for r in request.app.routes}
+    if payload.route not in known:
+        raise HTTPException(status_code=404, detail=f"Unknown route template: {payload.route}")
+    endpoint_profiler.db = request.app.state.db
+    return endpoint_profiler.enable(
+        payload.route, payload.sample_rate, payload.duration_minutes, payload.method
+    )
+
+
+@profiler_router.delete("/routes")
+async def disable_route_profiling(route: str):
+    """Stop sampling a route template"""
+    if not endpoint_profiler.disable(route):
+        raise HTTPException(status_code=404, detail="Route is not being profiled")
+    return {'message': f'Profiling disabled for {route}'}
+
+
+@profiler_router.get("/requests")
+async def get_recent_profiles(route: Optional[str] = None, limit: int = 50):
+    """Per-request query budgets for recently sampled requests"""
+    profiles = [p for p in reversed(endpoint_profiler.recent) if route is None or p.route == route]
+    return {
+        'requests': [p.to_dict(endpoint_profiler.explain_cache) for p in profiles[:limit]]
+    }
+
+
+@profiler_router.get("/report")
+async def get_worst_offenders(
+    request: Request,
+    sort_by: str = 'total_db_time_ms',
+    limit: int = 20,
+    include_slow_queries: bool = True
+):
+    """Ranked worst offenders across profiled routes plus database slow-query log"""
+    allowed = {'total_db_time_ms', 'avg_queries', 'max_queries', 'avg_db_time_ms',
+               'avg_cpu_ms', 'p95_ms', 'docs_scanned_estimate', 'scan_ratio'}
+    if sort_by not in allowed:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of {sorted(allowed)}")
+
+    slow_queries = []
+    if include_slow_queries:
+        from query_analyzer import QueryAnalyzer
+        analyzer = QueryAnalyzer(db=request.app.state.db)
+        slow_queries = analyzer.summarize_slow_queries(
+            await analyzer.get_slow_queries(limit=50, verbose=False)
+        )
+
+    # Unprofiled routes with the worst latency, as candidates to sample next
+    profiled = set(endpoint_profiler.stats)
+    candidates = [
+        r for r in metrics_registry.route_metrics() if r['route'] not in profiled
+    ][:10]
+
+    return {
+        'worst_offenders': endpoint_profiler.worst_offenders(sort_by, limit),
+        'slow_queries': slow_queries,
+        'candidates': candidates,
+        'active_targets': endpoint_profiler.list_targets(),
+        'timestamp': datetime.now(timezone.utc).isoformat()
+    }
+
+
+@profiler_router.post("/reset")
+async def reset_profiler():
+    """Clear collected profiles (targets stay enabled)"""
+    endpoint_profiler.reset()
+    return {'message': 'Profiler data reset'}
@@ -0,0 +1,160 @@
+"""
+FX Rates - as-of currency rate cache
+Per-tenant, time-indexed rate table loaded with one query: each currency pair
+keeps its rates sorted by effective_date and is resolved with bisect. Missing
+pairs use the inverse rate, then triangulate through the base currency.
+Rate inserts invalidate the tenant's table; convert_many converts whole
+report columns with numpy instead of one DB hit per line.
+"""
+
+import asyncio
+import os
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+BASE_CURRENCY = 'TRY'
+CACHE_TTL_SECONDS = int(os.environ.get('FX_CACHE_TTL_SECONDS', '300'))
+
+# Used when a tenant has not entered a rate for the pair
+DEFAULT_RATES = {
+    ('TRY', 'USD'): 0.037,
+    ('TRY', 'EUR'): 0.034,
+    ('USD', 'TRY'): 27.0,
+    ('EUR', 'TRY'): 29.5,
+    ('USD', 'EUR'): 0.92,
+    ('EUR', 'USD'): 1.09
+}
+
+
+def _as_of_key(value) -> str:
+    if value is None:
+        return datetime.now(timezone.utc).date().isoformat()
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)[:10]
+
+
+class _RateTable:
+    """Sorted (effective_date, rate) series per (from, to) pair"""
+
+    def __init__(self, docs: Iterable[dict]):
+        series: Dict[Tuple[str, str], List[Tuple[str, str, float]]] = {}
+        for doc in docs:
+            if not doc.get('rate'):
+                continue
+            pair = (doc['from_currency'], doc['to_currency'])
+            # created_at breaks ties so the latest entry for a day wins
+            series.setdefault(pair, []).append(
+                (_as_of_key(doc.get('effective_date')), str(doc.get('created_at') or ''), float(doc['rate']))
+            )
+        self.dates: Dict[Tuple[str, str], List[str]] = {}
+        self.rates: Dict[Tuple[str, str], List[float]] = {}
+        for pair, rows in series.items():
+            rows.sort()
+            self.dates[pair] = [r[0] for r in rows]
+            self.rates[pair] = [r[2] for r in rows]
+        self.loaded_at = time.monotonic()
+
+    def direct(self, src: str, dst: str, as_of: str) -> Optional[float]:
+        dates = self.dates.get((src, dst))
+        if dates:
+            i = bisect_right(dates, as_of)
+            if i:
+                return self.rates[(src, dst)][i - 1]
+        dates = self.dates.get((dst, src))
+        if dates:
+            i = bisect_right(dates, as_of)
+            if i:
+                return 1.0 / self.rates[(dst, src)][i - 1]
+        return None
+
+    def rate(self, src: str, dst: str, as_of: str) -> Optional[float]:
+        if src == dst:
+            return 1.0
+        direct = self.direct(src, dst, as_of)
+        if direct is not None:
+            return direct
+        if BASE_CURRENCY not in (src, dst):
+            leg1 = self.direct(src, BASE_CURRENCY, as_of)
+            leg2 = self.direct(BASE_CURRENCY, dst, as_of)
+            if leg1 is not None and leg2 is not None:
+                return leg1 * leg2
+        return None
+
+
+class FXRateCache:
+    """In-memory as-of rate lookups for every tenant"""
+
+    def __init__(self, db):
+        self.db = db
+        self._tables: Dict[str, _RateTable] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def _table(self, tenant_id: str) -> _RateTable:
+        table = self._tables.get(tenant_id)
+        # The TTL covers rates inserted through another worker process
+        if table and time.monotonic() - table.loaded_at < CACHE_TTL_SECONDS:
+            return table
+        lock = self._locks.setdefault(tenant_id, asyncio.Lock())
+        async with lock:
+            table = self._tables.get(tenant_id)
+            if table and time.monotonic() - table.loaded_at < CACHE_TTL_SECONDS:
+                return table
+            docs = await self.db.currency_rates.find(
+                {'tenant_id': tenant_id},
+                {'_id': 0, 'from_currency': 1, 'to_currency': 1, 'rate': 1, 'effective_date': 1, 'created_at': 1}
+            ).to_list(None)
+            table = _RateTable(docs)
+            self._tables[tenant_id] = table
+            return table
+
+    def invalidate(self, tenant_id: Optional[str] = None):
+        if tenant_id is None:
+            self._tables.clear()
+        else:
+            self._tables.pop(tenant_id, None)
+
+    async def get_rate(self, tenant_id: str, from_currency: str, to_currency: str,
+                       as_of=None, use_defaults: bool = True) -> Optional[float]:
+        """Rate effective on as_of (default today); None when unknown and use_defaults is off"""
+        table = await self._table(tenant_id)
+        rate = table.rate(from_currency, to_currency, _as_of_key(as_of))
+        if rate is None and use_defaults:
+            rate = DEFAULT_RATES.get((from_currency, to_currency), 1.0)
+        return rate
+
+    async def convert(self, tenant_id: str, amount: float, from_currency: str, to_currency: str, as_of=None) -> float:
+        return amount * await self.get_rate(tenant_id, from_currency, to_currency, as_of)
+
+    async def convert_many(self, tenant_id: str, amounts: Sequence[float], currencies: Sequence[str],
+                           to_currency: str = BASE_CURRENCY, dates: Optional[Sequence] = None) -> np.ndarray:
+        """
+        Convert a whole column: amounts[i] in currencies[i] as of dates[i].
+        Each distinct (currency, date) is resolved once against the cached table.
+        """
+        table = await self._table(tenant_id)
+        today = _as_of_key(None)
+        keys = [(cur or to_currency, _as_of_key(dates[i]) if dates is not None and dates[i] else today)
+                for i, cur in enumerate(currencies)]
+        resolved: Dict[Tuple[str, str], float] = {}
+        for cur, day in set(keys):
+            rate = table.rate(cur, to_currency, day)
+            resolved[(cur, day)] = rate if rate is not None else DEFAULT_RATES.get((cur, to_currency), 1.0)
+        rates = np.fromiter((resolved[k] for k in keys), dtype=np.float64, count=len(keys))
+        return np.asarray(amounts, dtype=np.float64) * rates
+
+
+fx_rate_cache = None
+
+
+def get_fx_rate_cache(db):
+    global fx_rate_cache
+    if fx_rate_cache is None:
+        fx_rate_cache = FXRateCache(db)
+    return fx_rate_cache
@@ -0,0 +1,490 @@
+"""
+General Ledger - double-entry posting engine
+Every invoice, expense, payment and stock movement posts one balanced
+journal entry and $inc's per-account daily balance rows (tagged with their
+YYYY-MM period). Closed periods are frozen into cumulative snapshots, so
+P&L, balance sheet and cash-flow reports aggregate a handful of balance
+rows instead of summing raw documents.
+
+Account codes follow the Tekdüzen Hesap Planı.
+"""
+
+import asyncio
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from accounting_models import ExpenseCategory
+
+CHART_OF_ACCOUNTS: Dict[str, Tuple[str, str]] = {
+    '100': ('Kasa', 'asset'),
+    '102': ('Bankalar', 'asset'),
+    '120': ('Alıcılar', 'asset'),
+    '153': ('Ticari Mallar', 'asset'),
+    '191': ('İndirilecek KDV', 'asset'),
+    '320': ('Satıcılar', 'liability'),
+    '360': ('Ödenecek Vergi ve Fonlar', 'liability'),
+    '391': ('Hesaplanan KDV', 'liability'),
+    '500': ('Sermaye', 'equity'),
+    '600.01': ('Oda Gelirleri', 'revenue'),
+    '600.02': ('Diğer Hizmet Gelirleri', 'revenue'),
+    '649': ('Diğer Olağan Gelir ve Kârlar', 'revenue'),
+    '621': ('Satılan Ticari Mallar Maliyeti', 'expense'),
+    '659': ('Diğer Olağan Gider ve Zararlar', 'expense'),
+    **{f'770.{c.value}': (f'Genel Yönetim Giderleri - {c.value}', 'expense') for c in ExpenseCategory},
+}
+CASH_ACCOUNTS = ('100', '102')
+DEBIT_NORMAL = ('asset', 'expense')
+# An entry still 'applying' after this long belongs to a poster that died mid-update
+APPLY_GRACE_MINUTES = 10
+
+
+def account_type(code: str) -> str:
+    return CHART_OF_ACCOUNTS.get(code, ('', 'expense'))[1]
+
+
+def _day(value) -> str:
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, str) and len(value) >= 10:
+        return value[:10]
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _next_month_start(period: str) -> str:
+    year, month = int(period[:4]), int(period[5:7])
+    return date(year + month // 12, month % 12 + 1, 1).isoformat()
+
+
+def _period_end(period: str) -> str:
+    return (date.fromisoformat(_next_month_start(period)) - timedelta(days=1)).isoformat()
+
+
+def _cash_account(method: Optional[str]) -> str:
+    return '100' if (method or '').lower() in ('cash', 'nakit') else '102'
+
+
+def _r(value) -> float:
+    return round(float(value or 0), 2)
+
+
+class PeriodClosedError(ValueError):
+    pass
+
+
+class GeneralLedger:
+    """Journal + period balances for one database"""
+
+    def __init__(self, db):
+        self.db = db
+        self._init_locks: Dict[str, asyncio.Lock] = {}
+
+    # ---------------------------------------------------------------- posting
+
+    async def _posting_day(self, tenant_id: str, day: str) -> str:
+        """Entries dated in a closed period are posted on the first open day"""
+        last_closed = await self.db.ledger_periods.find_one(
+            {'tenant_id': tenant_id, 'status': 'closed'}, {'_id': 0, 'period': 1}, sort=[('period', -1)]
+        )
+        if last_closed and day[:7] <= last_closed['period']:
+            return _next_month_start(last_closed['period'])
+        return day
+
+    async def post(self, tenant_id: str, source_type: str, source_id: str, event: str,
+                   entry_date, lines: List[Tuple[str, float, float]], description: str = '',
+                   cash_category: Optional[str] = None, created_by: Optional[str] = None,
+                   respect_closed: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Post one balanced entry; lines are (account, debit, credit).
+        Idempotent per (source_type, source_id, event): a repeat returns None.
+        """
+        lines = [(acc, _r(dr), _r(cr)) for acc, dr, cr in lines if _r(dr) or _r(cr)]
+        if not lines:
+            return None
+        debit, credit = sum(l[1] for l in lines), sum(l[2] for l in lines)
+        if abs(debit - credit) > 0.01:
+            raise ValueError(f"Unbalanced journal entry {source_type}/{source_id}: {debit} != {credit}")
+
+        day = _day(entry_date)
+        posting_day = await self._posting_day(tenant_id, day) if respect_closed else day
+        entry = {
+            'id': str(uuid.uuid4()),
+            'tenant_id': tenant_id,
+            'source_type': source_type,
+            'source_id': source_id,
+            'event': event,
+            'date': posting_day,
+            'period': posting_day[:7],
+            'original_date': day if posting_day != day else None,
+            'description': description,
+            'cash_category': cash_category,
+            'lines': [{'account': a, 'debit': dr, 'credit': cr} for a, dr, cr in lines],
+            'total': _r(debit),
+            # Claimed by this poster from the start: recovery leaves it alone until the grace period passes
+            'applied': 'applying',
+            'claimed_at': datetime.now(timezone.utc).isoformat(),
+            'created_by': created_by,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+        }
+        try:
+            await self.db.journal_entries.insert_one(entry)
+        except DuplicateKeyError:
+            return None
+        entry.pop('_id', None)
+        await self._apply(entry)
+        return entry
+
+    async def _apply(self, entry: Dict[str, Any]):
+        tenant_id, day, period = entry['tenant_id'], entry['date'], entry['period']
+        totals: Dict[str, List[float]] = {}
+        for line in entry['lines']:
+            t = totals.setdefault(line['account'], [0.0, 0.0])
+            t[0] += line['debit']
+            t[1] += line['credit']
+
+        await self.db.ledger_balances.bulk_write([
+            UpdateOne(
+                {'tenant_id': tenant_id, 'account': account, 'day': day},
+                {'$inc': {'debit': _r(dr), 'credit': _r(cr)}, '$setOnInsert': {'period': period}},
+                upsert=True
+            ) for account, (dr, cr) in totals.items()
+        ], ordered=False)
+
+        cash = [(dr, cr) for account, (dr, cr) in totals.items() if account in CASH_ACCOUNTS]
+        if cash:
+            await self.db.ledger_cash_flows.update_one(
+                {'tenant_id': tenant_id, 'day': day, 'category': entry.get('cash_category') or 'other'},
+                {'$inc': {'cash_in': _r(sum(c[0] for c in cash)), 'cash_out': _r(sum(c[1] for c in cash))},
+                 '$setOnInsert': {'period': period}},
+                upsert=True
+            )
+        await self.db.journal_entries.update_one({'id': entry['id']}, {'$set': {'applied': True}})
+
+    async def apply_pending(self, tenant_id: str) -> int:
+        """
+        Re-apply entries whose balance update was interrupted. Each entry is
+        claimed atomically first, so concurrent callers never apply it twice;
+        entries still being applied by their poster are left alone until
+        APPLY_GRACE_MINUTES have passed.
+        """
+        count = 0
+        while True:
+            now = datetime.now(timezone.utc)
+            stale = (now - timedelta(minutes=APPLY_GRACE_MINUTES)).isoformat()
+            entry = await self.db.journal_entries.find_one_and_update(
+                {'tenant_id': tenant_id, '$or': [
+                    {'applied': False},
+                    {'applied': 'applying', 'claimed_at': {'$lt': stale}},
+                ]},
+                {'$set': {'applied': 'applying', 'claimed_at': now.isoformat()}},
+                projection={'_id': 0}
+            )
+            if entry is None:
+                return count
+            await self._apply(entry)
+            count += 1
+
+    # ------------------------------------------------------------ source events
+
+    async def post_invoice(self, invoice: Dict[str, Any], created_by: Optional[str] = None, **kw):
+        if invoice.get('invoice_type') == 'proforma':
+            return None
+        fx = 'total_try' in invoice
+        total = _r(invoice.get('total_try') if fx else invoice.get('total'))
+        vat = _r(invoice.get('total_vat_try') if fx else invoice.get('total_vat'))
+        vat_net = _r(vat - _r(invoice.get('vat_withholding')))
+        extra = _r(invoice.get('total_additional_taxes'))
+
+        if invoice.get('invoice_type') == 'purchase':
+            lines = [('770.other', total - vat_net, 0), ('191', vat_net, 0), ('320', 0, total)]
+        else:
+            revenue = '600.01' if invoice.get('booking_id') or invoice.get('source') == 'pms_folio' else '600.02'
+            lines = [('120', total, 0), (revenue, 0, total - vat_net - extra), ('391', 0, vat_net), ('360', 0, extra)]
+        return await self.post(
+            invoice['tenant_id'], 'invoice', invoice['id'], 'issued', invoice.get('issue_date'),
+            lines, f"Fatura {invoice.get('invoice_number', '')}", created_by=created_by, **kw
+        )
+
+    async def post_invoice_payment(self, invoice: Dict[str, Any], payment_date=None,
+                                   method: Optional[str] = None, created_by: Optional[str] = None, **kw):
+        if invoice.get('invoice_type') == 'proforma':
+            return None
+        total = _r(invoice.get('total_try') if 'total_try' in invoice else invoice.get('total'))
+        cash = _cash_account(method or invoice.get('payment_method'))
+        if invoice.get('invoice_type') == 'purchase':
+            lines, category = [('320', total, 0), (cash, 0, total)], 'supplier_payments'
+        else:
+            lines, category = [(cash, total, 0), ('120', 0, total)], 'collections'
+        return await self.post(
+            invoice['tenant_id'], 'invoice', invoice['id'], 'paid',
+            payment_date or invoice.get('payment_date') or datetime.now(timezone.utc),
+            lines, f"Fatura tahsilat/ödeme {invoice.get('invoice_number', '')}",
+            cash_category=category, created_by=created_by, **kw
+        )
+
+    async def post_expense(self, expense: Dict[str, Any], created_by: Optional[str] = None, **kw):
+        category = expense.get('category') or 'other'
+        account = f'770.{category}' if f'770.{category}' in CHART_OF_ACCOUNTS else '770.other'
+        total = _r(expense.get('total_amount'))
+        vat = _r(expense.get('vat_amount'))
+        return await self.post(
+            expense['tenant_id'], 'expense', expense['id'], 'incurred', expense.get('date'),
+            [(account, total - vat, 0), ('191', vat, 0), ('320', 0, total)],
+            f"Gider {expense.get('expense_number', '')}", created_by=created_by, **kw
+        )
+
+    async def post_expense_payment(self, expense: Dict[str, Any], payment_date=None,
+                                   method: Optional[str] = None, created_by: Optional[str] = None, **kw):
+        total = _r(expense.get('total_amount'))
+        cash = _cash_account(method or expense.get('payment_method'))
+        return await self.post(
+            expense['tenant_id'], 'expense', expense['id'], 'paid',
+            payment_date or expense.get('payment_date') or datetime.now(timezone.utc),
+            [('320', total, 0), (cash, 0, total)], f"Gider ödemesi {expense.get('expense_number', '')}",
+            cash_category='expense_payments', created_by=created_by, **kw
+        )
+
+    async def post_stock_movement(self, movement: Dict[str, Any], previous_quantity: Optional[float] = None,
+                                  created_by: Optional[str] = None, **kw):
+        quantity, cost = float(movement.get('quantity') or 0), float(movement.get('unit_cost') or 0)
+        kind = movement.get('movement_type')
+        if kind == 'in':
+            value = quantity * cost
+            lines = [('153', value, 0), ('320', 0, value)]
+        elif kind == 'out':
+            value = quantity * cost
+            lines = [('621', value, 0), ('153', 0, value)]
+        else:
+            value = (quantity - float(previous_quantity or 0)) * cost
+            lines = [('153', value, 0), ('649', 0, value)] if value >= 0 else [('659', -value, 0), ('153', 0, -value)]
+        return await self.post(
+            movement['tenant_id'], 'stock_movement', movement['id'], kind or 'adjustment',
+            movement.get('created_at'), lines, f"Stok hareketi ({kind})", created_by=created_by, **kw
+        )
+
+    async def post_opening(self, tenant_id: str, source_type: str, source_id: str, account: str,
+                           amount: float, entry_date=None, event: str = 'opening',
+                           description: str = 'Açılış bakiyesi', **kw):
+        amount = _r(amount)
+        lines = [(account, amount, 0), ('500', 0, amount)] if amount >= 0 else [('500', -amount, 0), (account, 0, -amount)]
+        return await self.post(
+            tenant_id, source_type, source_id, event, entry_date or datetime.now(timezone.utc), lines,
+            description, cash_category='opening' if account in CASH_ACCOUNTS else None, **kw
+        )
+
+    # ---------------------------------------------------------------- readers
+
+    async def account_totals(self, tenant_id: str, start_day: Optional[str], end_day: str) -> Dict[str, Dict[str, float]]:
+        match: Dict[str, Any] = {'tenant_id': tenant_id, 'day': {'$lte': end_day}}
+        if start_day:
+            match['day']['$gte'] = start_day
+        rows = await self.db.ledger_balances.aggregate([
+            {'$match': match},
+            {'$group': {'_id': '$account', 'debit': {'$sum': '$debit'}, 'credit': {'$sum': '$credit'}}}
+        ]).to_list(None)
+        return {r['_id']: {'debit': _r(r['debit']), 'credit': _r(r['credit'])} for r in rows}
+
+    async def balances_as_of(self, tenant_id: str, as_of: str) -> Dict[str, float]:
+        """Signed (debit - credit) balance per account at end of day as_of"""
+        snapshot = await self.db.ledger_snapshots.find_one(
+            {'tenant_id': tenant_id, 'period': {'$lt': as_of[:7]}}, {'_id': 0}, sort=[('period', -1)]
+        )
+        balances = dict(snapshot['balances']) if snapshot else {}
+        start = _next_month_start(snapshot['period']) if snapshot else None
+        for account, t in (await self.account_totals(tenant_id, start, as_of)).items():
+            balances[account] = _r(balances.get(account, 0) + t['debit'] - t['credit'])
+        return balances
+
+    async def profit_loss(self, tenant_id: str, start_day: str, end_day: str) -> Dict[str, Any]:
+        totals = await self.account_totals(tenant_id, start_day, end_day)
+        revenue, expenses = {}, {}
+        for account, t in totals.items():
+            kind = account_type(account)
+            if kind == 'revenue':
+                revenue[account] = _r(t['credit'] - t['debit'])
+            elif kind == 'expense':
+                expenses[account] = _r(t['debit'] - t['credit'])
+        total_revenue, total_expenses = _r(sum(revenue.values())), _r(sum(expenses.values()))
+        profit = _r(total_revenue - total_expenses)
+        return {
+            'total_revenue': total_revenue,
+            'total_expenses': total_expenses,
+            'gross_profit': profit,
+            'profit_margin': _r(profit / total_revenue * 100) if total_revenue else 0,
+            'revenue_breakdown': {CHART_OF_ACCOUNTS.get(a, (a,))[0]: v for a, v in revenue.items()},
+            'expense_breakdown': {
+                (a.split('.', 1)[1] if a.startswith('770.') else CHART_OF_ACCOUNTS.get(a, (a,))[0]): v
+                for a, v in expenses.items()
+            },
+            'accounts': totals,
+        }
+
+    async def balance_sheet(self, tenant_id: str, as_of: str) -> Dict[str, Any]:
+        bal = await self.balances_as_of(tenant_id, as_of)
+
+        def side(code):  # balance in the account's normal direction
+            value = bal.get(code, 0.0)
+            return value if account_type(code) in DEBIT_NORMAL else -value
+
+        cash = _r(side('100') + side('102'))
+        assets = {
+            'cash': cash,
+            'inventory': _r(side('153')),
+            'receivables': _r(side('120')),
+            'vat_receivable': _r(side('191')),
+        }
+        assets['total'] = _r(sum(assets.values()))
+        liabilities = {
+            'payables': _r(side('320')),
+            'taxes_payable': _r(side('360') + side('391')),
+        }
+        liabilities['total'] = _r(sum(liabilities.values()))
+        earnings = _r(-sum(v for a, v in bal.items() if account_type(a) in ('revenue', 'expense')))
+        equity = {'capital': _r(side('500')), 'retained_earnings': earnings}
+        equity['total'] = _r(equity['capital'] + earnings)
+        return {'as_of': as_of, 'assets': assets, 'liabilities': liabilities, 'equity': equity}
+
+    async def cash_flow(self, tenant_id: str, start_day: Optional[str], end_day: str) -> Dict[str, Any]:
+        match: Dict[str, Any] = {'tenant_id': tenant_id, 'day': {'$lte': end_day}}
+        if start_day:
+            match['day']['$gte'] = start_day
+        rows = await self.db.ledger_cash_flows.aggregate([
+            {'$match': match},
+            {'$group': {'_id': '$category', 'cash_in': {'$sum': '$cash_in'}, 'cash_out': {'$sum': '$cash_out'}}}
+        ]).to_list(None)
+        by_category = {r['_id']: {'cash_in': _r(r['cash_in']), 'cash_out': _r(r['cash_out'])} for r in rows}
+        cash_in = _r(sum(r['cash_in'] for r in by_category.values()))
+        cash_out = _r(sum(r['cash_out'] for r in by_category.values()))
+        return {'cash_in': cash_in, 'cash_out': cash_out, 'net_cash_flow': _r(cash_in - cash_out),
+                'by_category': by_category}
+
+    # ------------------------------------------------------------ periods
+
+    async def close_period(self, tenant_id: str, period: str, closed_by: Optional[str] = None) -> Dict[str, Any]:
+        """Freeze cumulative balances at the end of period (YYYY-MM)"""
+        later = await self.db.ledger_periods.find_one(
+            {'tenant_id': tenant_id, 'status': 'closed', 'period': {'$gte': period}}, {'_id': 0, 'period': 1}
+        )
+        if later:
+            raise PeriodClosedError(f"{later['period']} dönemi zaten kapalı")
+        await self.apply_pending(tenant_id)
+
+        balances = await self.balances_as_of(tenant_id, _period_end(period))
+        now = datetime.now(timezone.utc).isoformat()
+        await self.db.ledger_snapshots.replace_one(
+            {'tenant_id': tenant_id, 'period': period},
+            {'tenant_id': tenant_id, 'period': period, 'balances': balances, 'created_at': now},
+            upsert=True
+        )
+        await self.db.ledger_periods.update_one(
+            {'tenant_id': tenant_id, 'period': period},
+            {'$set': {'status': 'closed', 'closed_at': now, 'closed_by': closed_by}},
+            upsert=True
+        )
+        return {'period': period, 'status': 'closed', 'accounts': len(balances)}
+
+    # ------------------------------------------------------------ backfill
+
+    async def _initialized(self, tenant_id: str) -> bool:
+        meta = await self.db.ledger_meta.find_one({'tenant_id': tenant_id}, {'_id': 0, 'initialized_at': 1})
+        return bool(meta and meta.get('initialized_at'))
+
+    async def _claim_initial_rebuild(self, tenant_id: str) -> bool:
+        """Marker on ledger_meta (unique per tenant) so only one worker replays a new tenant"""
+        stale = (datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat()
+        try:
+            await self.db.ledger_meta.update_one(
+                {'tenant_id': tenant_id, 'initialized_at': {'$exists': False},
+                 '$or': [{'rebuilding_at': {'$exists': False}}, {'rebuilding_at': {'$lt': stale}}]},
+                {'$set': {'rebuilding_at': datetime.now(timezone.utc).isoformat()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def ensure_initialized(self, tenant_id: str):
+        if not await self._initialized(tenant_id):
+            async with self._init_locks.setdefault(tenant_id, asyncio.Lock()):
+                if not await self._initialized(tenant_id) and await self._claim_initial_rebuild(tenant_id):
+                    await self.rebuild(tenant_id)
+
+    async def rebuild(self, tenant_id: str) -> Dict[str, int]:
+        """
+        Replay the tenant's accounting documents. Closed periods stay frozen:
+        their entries, balances and snapshots are kept, only open periods are
+        cleared and replayed, and documents dated in a closed period that were
+        never posted land on the first open day.
+        """
+        last_closed = await self.db.ledger_periods.find_one(
+            {'tenant_id': tenant_id, 'status': 'closed'}, {'_id': 0, 'period': 1}, sort=[('period', -1)]
+        )
+        scope: Dict[str, Any] = {'tenant_id': tenant_id}
+        if last_closed:
+            scope['period'] = {'$gt': last_closed['period']}
+        for name in ('journal_entries', 'ledger_balances', 'ledger_cash_flows'):
+            await self.db[name].delete_many(scope)
+
+        counts = {'invoices': 0, 'expenses': 0, 'stock_movements': 0, 'bank_accounts': 0}
+        # Entries kept in closed periods are skipped by the (source_type, source_id, event) key
+        kw = {'respect_closed': bool(last_closed)}
+        async for inv in self.db.accounting_invoices.find({'tenant_id': tenant_id}, {'_id': 0}):
+            await self.post_invoice(inv, **kw)
+            if inv.get('status') == 'paid':
+                await self.post_invoice_payment(inv, payment_date=inv.get('payment_date') or inv.get('issue_date'), **kw)
+            counts['invoices'] += 1
+        async for exp in self.db.expenses.find({'tenant_id': tenant_id}, {'_id': 0}):
+            await self.post_expense(exp, **kw)
+            if exp.get('payment_status') == 'paid':
+                await self.post_expense_payment(exp, payment_date=exp.get('payment_date') or exp.get('date'), **kw)
+            counts['expenses'] += 1
+        async for mv in self.db.stock_movements.find(
+            {'tenant_id': tenant_id, 'movement_type': {'$in': ['in', 'out']}}, {'_id': 0}
+        ).sort('created_at', 1):
+            await self.post_stock_movement(mv, **kw)
+            counts['stock_movements'] += 1
+        async for acc in self.db.bank_accounts.find({'tenant_id': tenant_id}, {'_id': 0}):
+            await self.post_opening(tenant_id, 'bank_account', acc['id'], '102', acc.get('balance', 0),
+                                    acc.get('created_at'), **kw)
+            counts['bank_accounts'] += 1
+
+        # Stock history is incomplete (adjustments overwrite quantity): align
+        # the inventory account with today's valuation in one entry
+        valuation = await self.db.inventory_items.aggregate([
+            {'$match': {'tenant_id': tenant_id}},
+            {'$group': {'_id': None, 'first': {'$min': '$created_at'}, 'value': {'$sum': {'$multiply': [
+                {'$ifNull': ['$quantity', 0]}, {'$ifNull': ['$unit_cost', 0]}]}}}}
+        ]).to_list(1)
+        today = datetime.now(timezone.utc).date().isoformat()
+        booked = (await self.balances_as_of(tenant_id, today)).get('153', 0.0)
+        target = _r(valuation[0]['value']) if valuation else 0.0
+        if abs(target - booked) > 0.01:
+            # Dated at the first item so historical balance sheets carry the stock
+            first = valuation[0].get('first') if valuation else None
+            first_day = _day(first) if first else today
+            # Per-day source id: an adjustment kept in a closed period must not swallow today's
+            await self.post_opening(tenant_id, 'inventory', f'rebuild:{today}', '153', target - booked, first_day,
+                                    event='valuation', description='Stok değerleme düzeltmesi', **kw)
+
+        await self.db.ledger_meta.update_one(
+            {'tenant_id': tenant_id},
+            {'$set': {'initialized_at': datetime.now(timezone.utc).isoformat(), 'rebuild_counts': counts},
+             '$unset': {'rebuilding_at': ''}},
+            upsert=True
+        )
+        return counts
+
+
+general_ledger = None
+
+
+def get_general_ledger(db):
+    global general_ledger
+    if general_ledger is None:
+        general_ledger = GeneralLedger(db)
+    return general_ledger
@@ -0,0 +1,297 @@
+"""
+Group Rooming Pipeline
+Bulk rooming-list import for group blocks / group reservations:
+parse (JSON/CSV/XLSX) -> validate -> one-pass availability -> vectorised
+room assignment -> insert_many bookings + single block pickup update
+"""
+
+import csv
+import io
+import json
+import uuid
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from pydantic import ValidationError
+
+from group_sales_models import RoomingListEntry
+from search_index import get_search_index
+
+MAX_ROWS = 2000
+
+# Rooms that can never be sold regardless of dates
+UNSELLABLE_ROOM_STATUSES = {'out_of_order', 'out_of_service'}
+ACTIVE_BOOKING_STATUSES = ['confirmed', 'guaranteed', 'checked_in']
+
+# Spreadsheet headers accepted for each RoomingListEntry field
+COLUMN_ALIASES = {
+    'guest_name': ('guest_name', 'name', 'guest', 'misafir', 'ad_soyad'),
+    'room_type': ('room_type', 'type', 'oda_tipi'),
+    'check_in': ('check_in', 'arrival', 'giris'),
+    'check_out': ('check_out', 'departure', 'cikis'),
+    'special_requests': ('special_requests', 'notes', 'notlar'),
+    'email': ('email', 'e_mail'),
+    'phone': ('phone', 'telefon'),
+    'passport_number': ('passport_number', 'passport', 'pasaport'),
+    'room_id': ('room_id',),
+    'room_number': ('room_number', 'room', 'oda'),
+    'adults': ('adults', 'yetiskin'),
+    'children': ('children', 'cocuk'),
+}
+
+
+class RoomingListParseError(ValueError):
+    pass
+
+
+def _normalise_row(raw: Dict[str, Any]) -> Dict[str, Any]:
+    lowered = {str(k).strip().lower().replace(' ', '_').replace('-', '_'): v for k, v in raw.items() if k is not None}
+    row = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            value = lowered.get(alias)
+            if value not in (None, ''):
+                if isinstance(value, datetime):
+                    value = value.date().isoformat()
+                elif isinstance(value, date):
+                    value = value.isoformat()
+                row[field] = str(value).strip() if not isinstance(value, str) else value.strip()
+                break
+    return row
+
+
+def parse_rooming_file(filename: str, content: bytes) -> List[Dict[str, Any]]:
+    """Parse an uploaded rooming list into row dicts (.json, .csv, .xlsx)"""
+    name = (filename or '').lower()
+    if name.endswith('.json'):
+        data = json.loads(content.decode('utf-8-sig'))
+        rows = data.get('rooming_list', data) if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            raise RoomingListParseError("JSON must be a list of rows")
+    elif name.endswith('.csv'):
+        rows = list(csv.DictReader(io.StringIO(content.decode('utf-8-sig', errors='replace'))))
+    elif name.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        sheet = load_workbook(io.BytesIO(content), read_only=True, data_only=True).active
+        values = sheet.iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else '' for h in next(values, [])]
+        rows = [dict(zip(header, r)) for r in values if any(c not in (None, '') for c in r)]
+    else:
+        raise RoomingListParseError("Desteklenen formatlar: .json, .csv, .xlsx")
+
+    if len(rows) > MAX_ROWS:
+        raise RoomingListParseError(f"En fazla {MAX_ROWS} satır yüklenebilir")
+    return [_normalise_row(r) for r in rows]
+
+
+def _day(value) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and len(value) >= 10:
+        try:
+            return date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    return None
+
+
+class GroupRoomingPipeline:
+    """Loads a whole rooming list with a fixed number of round-trips"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def _validate(self, rows: List[Dict[str, Any]], target: Dict[str, Any]) -> Tuple[list, list]:
+        valid, results = [], []
+        for idx, raw in enumerate(rows):
+            data = {k: v for k, v in raw.items() if v not in (None, '')}
+            data.setdefault('check_in', target.get('check_in'))
+            data.setdefault('check_out', target.get('check_out'))
+            data.setdefault('room_type', target.get('room_type'))
+            try:
+                entry = RoomingListEntry(**data)
+            except ValidationError as e:
+                results.append({'row': idx + 1, 'status': 'error',
+                                'error': '; '.join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())})
+                continue
+            start, end = _day(entry.check_in), _day(entry.check_out)
+            if not start or not end or end <= start:
+                results.append({'row': idx + 1, 'status': 'error', 'guest_name': entry.guest_name,
+                                'error': 'Geçersiz giriş/çıkış tarihi'})
+                continue
+            valid.append((idx, entry, start, end, data.get('room_id'), data.get('room_number')))
+            results.append(None)
+        return valid, results
+
+    async def _occupancy(self, tenant_id: str, room_types: List[str], first: date, last: date):
+        """Room list and a rooms x nights occupancy matrix, from three queries"""
+        rooms = await self.db.rooms.find(
+            {'tenant_id': tenant_id, 'room_type': {'$in': room_types}},
+            {'_id': 0, 'id': 1, 'room_number': 1, 'room_type': 1, 'status': 1}
+        ).sort('room_number', 1).to_list(10000)
+        rooms = [r for r in rooms if r.get('status') not in UNSELLABLE_ROOM_STATUSES]
+
+        nights = (last - first).days
+        occupied = np.zeros((len(rooms), max(nights, 1)), dtype=bool)
+        index = {room['id']: i for i, room in enumerate(rooms)}
+
+        def mark(room_id, start, end):
+            i = index.get(room_id)
+            s, e = _day(start), _day(end)
+            if i is None or not s or not e:
+                return
+            a, b = max((s - first).days, 0), min((e - first).days, nights)
+            if a < b:
+                occupied[i, a:b] = True
+
+        async for booking in self.db.bookings.find({
+            'tenant_id': tenant_id,
+            'room_id': {'$in': list(index)},
+            'status': {'$in': ACTIVE_BOOKING_STATUSES},
+            'check_in': {'$lt': last.isoformat()},
+            'check_out': {'$gt': first.isoformat()}
+        }, {'_id': 0, 'room_id': 1, 'check_in': 1, 'check_out': 1}):
+            mark(booking['room_id'], booking['check_in'], booking['check_out'])
+
+        async for block in self.db.room_blocks.find({
+            'tenant_id': tenant_id,
+            'room_id': {'$in': list(index)},
+            'status': 'active',
+            'allow_sell': {'$ne': True},
+            'start_date': {'$lt': last.isoformat()},
+            '$or': [{'end_date': {'$gt': first.isoformat()}}, {'end_date': None}]
+        }, {'_id': 0, 'room_id': 1, 'start_date': 1, 'end_date': 1}):
+            mark(block['room_id'], block['start_date'], block.get('end_date') or last.isoformat())
+
+        return rooms, occupied
+
+    async def load(self, tenant_id: str, rows: List[Dict[str, Any]], target: Dict[str, Any],
+                   user_id: Optional[str] = None, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        target keys: id, collection, link_field, counter_field, capacity,
+        check_in, check_out, room_type, rate, adults (default per room),
+        extra (fields copied to every booking)
+        """
+        valid, results = self._validate(rows, target)
+
+        assignments = []
+        if valid:
+            first = min(v[2] for v in valid)
+            last = max(v[3] for v in valid)
+            room_types = sorted({v[1].room_type for v in valid})
+            rooms, occupied = await self._occupancy(tenant_id, room_types, first, last)
+
+            types = np.array([r['room_type'] for r in rooms], dtype=object)
+            type_masks = {rt: types == rt for rt in room_types}
+            by_id = {r['id']: i for i, r in enumerate(rooms)}
+            by_number = {r['room_number']: i for i, r in enumerate(rooms)}
+            capacity = target.get('capacity')
+
+            # Longest stays first so short stays fill the gaps they leave
+            for idx, entry, start, end, room_id, room_number in sorted(valid, key=lambda v: (v[2] - v[3]).days):
+                if capacity is not None and len(assignments) >= capacity:
+                    results[idx] = {'row': idx + 1, 'status': 'error', 'guest_name': entry.guest_name,
+                                    'error': 'Blok kontenjanı dolu'}
+                    continue
+                a, b = (start - first).days, (end - first).days
+                free = type_masks[entry.room_type] & ~occupied[:, a:b].any(axis=1)
+
+                wanted = by_id.get(room_id) if room_id else by_number.get(room_number) if room_number else None
+                if wanted is not None and free[wanted]:
+                    choice = wanted
+                else:
+                    candidates = np.flatnonzero(free)
+                    if candidates.size == 0:
+                        results[idx] = {'row': idx + 1, 'status': 'error', 'guest_name': entry.guest_name,
+                                        'error': f"{entry.room_type} tipi oda {start}–{end} için müsait değil"}
+                        continue
+                    choice = int(candidates[0])
+
+                occupied[choice, a:b] = True
+                assignments.append((idx, entry, rooms[choice]))
+
+        created = []
+        if assignments and not dry_run:
+            created = await self._write(tenant_id, assignments, target, user_id)
+            for idx, booking, room in created:
+                results[idx] = {'row': idx + 1, 'status': 'created', 'guest_name': booking['guest_name'],
+                                'booking_id': booking['id'], 'room_id': room['id'], 'room_number': room['room_number']}
+        elif dry_run:
+            for idx, entry, room in assignments:
+                results[idx] = {'row': idx + 1, 'status': 'assignable', 'guest_name': entry.guest_name,
+                                'room_id': room['id'], 'room_number': room['room_number']}
+
+        return {
+            'rows': sorted(results, key=lambda r: r['row']),
+            'total_processed': len(rows),
+            'successful': len(assignments),
+            'failed': len(rows) - len(assignments),
+            'dry_run': dry_run
+        }
+
+    async def _write(self, tenant_id: str, assignments: list, target: Dict[str, Any],
+                     user_id: Optional[str]) -> list:
+        now = datetime.now(timezone.utc).isoformat()
+
+        # Existing guests by name in one query; the rest in one insert_many
+        names = list({entry.guest_name for _, entry, _ in assignments})
+        guests = {
+            g['name']: g async for g in self.db.guests.find(
+                {'tenant_id': tenant_id, 'name': {'$in': names}}, {'_id': 0, 'id': 1, 'name': 1}
+            )
+        }
+        new_guests = []
+        for _, entry, _ in assignments:
+            if entry.guest_name not in guests:
+                guest = {
+                    'id': str(uuid.uuid4()),
+                    'tenant_id': tenant_id,
+                    'name': entry.guest_name,
+                    'email': entry.email,
+                    'phone': entry.phone,
+                    'passport_number': entry.passport_number,
+                    'created_at': now
+                }
+                guests[entry.guest_name] = guest
+                new_guests.append(guest)
+        if new_guests:
+            await self.db.guests.insert_many(new_guests, ordered=False)
+            await get_search_index(self.db).index_docs('guest', new_guests)
+
+        created, bookings = [], []
+        for idx, entry, room in assignments:
+            booking = {
+                'id': str(uuid.uuid4()),
+                'tenant_id': tenant_id,
+                'guest_id': guests[entry.guest_name]['id'],
+                'guest_name': entry.guest_name,
+                'room_id': room['id'],
+                'room_type': room['room_type'],
+                target['link_field']: target['id'],
+                'check_in': entry.check_in,
+                'check_out': entry.check_out,
+                'status': 'confirmed',
+                'adults': entry.adults if entry.adults is not None else target.get('adults', 2),
+                'children': entry.children if entry.children is not None else 0,
+                'total_amount': target.get('rate', 0),
+                'rate_type': 'group',
+                'market_segment': 'group',
+                'special_requests': entry.special_requests,
+                'created_at': now,
+                'created_by': user_id,
+                **target.get('extra', {})
+            }
+            bookings.append(booking)
+            created.append((idx, booking, room))
+        await self.db.bookings.insert_many(bookings, ordered=False)
+        await get_search_index(self.db).index_docs('booking', bookings)
+
+        # Single pickup/inventory update for the whole list
+        await self.db[target['collection']].update_one(
+            {'id': target['id'], 'tenant_id': tenant_id},
+            {'$inc': {target['counter_field']: len(bookings)}, '$set': {'updated_at': now}}
+        )
+        return created
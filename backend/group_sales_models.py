@@ -97,6 +97,8 @@ class RoomingListEntry(BaseModel):
     email: Optional[str] = None
     phone: Optional[str] = None
     passport_number: Optional[str] = None
+    adults: Optional[int] = None
+    children: Optional[int] = None
 
 class GroupMasterFolio(BaseModel):
     """Grup master folio"""
@@ -3,8 +3,9 @@ Guest DNA Profile - Hyper-Personalization Engine
 Her misafir için DNA profili: tercihler, davranışlar, tahminler
 """
 from datetime import datetime, timezone
-from typing import Dict, List
-import statistics
+from typing import Dict
+
+from guest_rollup import get_guest_rollups, loyalty_tier
 
 class GuestDNAEngine:
     """Misafir DNA profilleme motoru"""
@@ -20,29 +21,20 @@ class GuestDNAEngine:
         if not guest:
             return {'error': 'Guest not found'}
         
-        # Get booking history
-        bookings = await self.db.bookings.find({
-            'guest_id': guest_id,
-            'tenant_id': tenant_id
-        }, {'_id': 0}).to_list(100)
-        
-        # Get preferences
-        preferences = await self.db.enhanced_guest_preferences.find_one({
-            'guest_id': guest_id,
-            'tenant_id': tenant_id
-        }, {'_id': 0})
+        # Stay history and preferences come pre-aggregated in the guest rollup
+        rollup = await get_guest_rollups(self.db).get(tenant_id, guest_id)
         
         # Analyze patterns
-        patterns = await self.analyze_behavioral_patterns(guest_id, bookings)
-        spending = await self.calculate_spending_profile(bookings)
-        propensity = await self.calculate_upsell_propensity(guest_id, bookings)
+        patterns = await self.analyze_behavioral_patterns(guest_id, rollup)
+        spending = await self.calculate_spending_profile(rollup)
+        propensity = await self.calculate_upsell_propensity(guest_id, rollup)
         
         return {
             'guest_id': guest_id,
             'guest_name': guest.get('name'),
-            'total_stays': len(bookings),
+            'total_stays': rollup.get('stays', 0),
             'member_since': guest.get('created_at'),
-            'preferences': preferences or {},
+            'preferences': rollup.get('enhanced_preferences') or {},
             'behavioral_patterns': patterns,
             'spending_profile': spending,
             'upsell_propensity': propensity,
@@ -51,46 +43,40 @@ class GuestDNAEngine:
             'generated_at': datetime.now(timezone.utc).isoformat()
         }
     
-    async def analyze_behavioral_patterns(self, guest_id: str, bookings: List) -> Dict:
+    async def analyze_behavioral_patterns(self, guest_id: str, rollup: Dict) -> Dict:
         """Davranış pattern'lerini analiz et"""
-        if not bookings:
+        stays = rollup.get('stays', 0)
+        if not stays:
             return {}
         
-        # Booking lead time
-        lead_times = []
-        for b in bookings:
-            if b.get('created_at') and b.get('check_in'):
-                # Simplified
-                lead_times.append(30)  # days
-        
-        avg_lead_time = statistics.mean(lead_times) if lead_times else 30
+        # Booking lead time (simplified)
+        avg_lead_time = 30
         
         # Stay patterns
-        weekend_stays = len([b for b in bookings if b.get('rate_type') == 'leisure'])
-        business_stays = len([b for b in bookings if b.get('market_segment') == 'corporate'])
+        weekend_stays = (rollup.get('rate_type_mix') or {}).get('leisure', 0)
+        business_stays = (rollup.get('segment_mix') or {}).get('corporate', 0)
         
         return {
             'avg_booking_lead_time_days': round(avg_lead_time, 1),
             'preferred_stay_type': 'leisure' if weekend_stays > business_stays else 'business',
-            'booking_frequency': len(bookings) / 12 if len(bookings) > 0 else 0,  # per year
+            'booking_frequency': stays / 12,  # per year
             'weekend_preference': weekend_stays > business_stays
         }
     
-    async def calculate_spending_profile(self, bookings: List) -> Dict:
+    async def calculate_spending_profile(self, rollup: Dict) -> Dict:
         """Harcama profili"""
-        if not bookings:
+        if not rollup.get('stays'):
             return {'total_spent': 0, 'avg_per_stay': 0}
         
-        total_spent = sum([b.get('total_amount', 0) for b in bookings])
-        avg_per_stay = total_spent / len(bookings)
+        total_spent = rollup.get('total_spend', 0)
         
         return {
             'total_spent': round(total_spent, 2),
-            'avg_per_stay': round(avg_per_stay, 2),
+            'avg_per_stay': rollup.get('avg_spend_per_stay', 0),
             'ltv_tier': 'high_value' if total_spent > 5000 else 'valuable' if total_spent > 2000 else 'regular'
         }
     
-    async def calculate_upsell_propensity(self, guest_id: str, bookings: List) -> Dict:
+    async def calculate_upsell_propensity(self, guest_id: str, rollup: Dict) -> Dict:
         """Upsell kabul eğilimi"""
         # Simulated propensity scores
         return {
@@ -104,14 +90,7 @@ class GuestDNAEngine:
     
     def recommend_tier(self, spending: Dict) -> str:
         """VIP tier önerisi"""
-        total = spending.get('total_spent', 0)
-        if total > 10000:
-            return 'platinum'
-        elif total > 5000:
-            return 'gold'
-        elif total > 2000:
-            return 'silver'
-        return 'regular'
+        return loyalty_tier(spending.get('total_spent', 0))
 
 # Global
 guest_dna_engine = None
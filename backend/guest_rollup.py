@@ -0,0 +1,379 @@
+"""
+Guest Rollup - incrementally maintained guest 360 document
+One guest_rollups row per guest: completed stays, nights, room and extras
+spend, ADR, first/last stay, channel and segment mix, LTV tier, and the
+profile side documents (VIP protocol, preferences, celebrations, active
+blacklist entries) with their flags.
+
+Checkout $inc's the stay, folio close adds non-room charges, profile edits
+refresh the side documents. Every increment carries its source ref in
+'applied' so a stay or folio is never counted twice. Guests without a row
+(history before the rollup) are rebuilt from raw bookings on first read.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+
+from data_archival import aggregate_with_archive
+
+# Charges already carried by the booking amount
+ROOM_CHARGE_CATEGORIES = ('room', 'city_tax')
+READ_PROJECTION = {'_id': 0, 'applied': 0}
+TOTALS_PROJECTION = {'_id': 0, 'stays': 1, 'nights': 1, 'room_revenue': 1, 'extras_revenue': 1}
+
+
+def _key(value, default: str = 'other') -> str:
+    return str(value if value not in (None, '') else default).replace('.', '_').lstrip('$') or default
+
+
+def _day(value) -> Optional[str]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    return str(value)[:10]
+
+
+def _nights(booking: Dict[str, Any]) -> int:
+    ci, co = _day(booking.get('check_in')), _day(booking.get('check_out'))
+    if not ci or not co:
+        return 0
+    try:
+        return max((datetime.fromisoformat(co) - datetime.fromisoformat(ci)).days, 0)
+    except ValueError:
+        return 0
+
+
+def _channel(booking: Dict[str, Any]) -> str:
+    return _key(booking.get('ota_channel') or booking.get('channel') or booking.get('source_channel'), 'direct')
+
+
+def ltv_tier(total_spend: float) -> str:
+    if total_spend > 10000:
+        return 'vip'
+    if total_spend > 5000:
+        return 'high_value'
+    if total_spend > 2000:
+        return 'valuable'
+    return 'regular'
+
+
+def loyalty_tier(total_spend: float) -> str:
+    """Tier recommendation used by the guest DNA profile"""
+    if total_spend > 10000:
+        return 'platinum'
+    if total_spend > 5000:
+        return 'gold'
+    if total_spend > 2000:
+        return 'silver'
+    return 'regular'
+
+
+def _derived(doc: Dict[str, Any]) -> Dict[str, Any]:
+    stays, nights = doc.get('stays', 0), doc.get('nights', 0)
+    room, extras = doc.get('room_revenue', 0.0), doc.get('extras_revenue', 0.0)
+    total = room + extras
+    return {
+        'total_spend': round(total, 2),
+        'adr': round(room / nights, 2) if nights else 0.0,
+        'avg_spend_per_stay': round(total / stays, 2) if stays else 0.0,
+        'ltv_tier': ltv_tier(total),
+        'tier_recommendation': loyalty_tier(total),
+    }
+
+
+class GuestRollups:
+    """Per-guest lifetime aggregates"""
+
+    def __init__(self, db):
+        self.db = db
+
+    # ------------------------------------------------------------ profile side documents
+
+    async def _profiles(self, tenant_id: str, guest_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Side documents and flags for many guests: one query per collection"""
+        out = {gid: {'vip_protocol': None, 'enhanced_preferences': None, 'celebration_tracking': None,
+                     'blacklist_entries': []} for gid in guest_ids}
+        query = {'tenant_id': tenant_id, 'guest_id': {'$in': guest_ids}}
+        async for doc in self.db.vip_protocols.find({**query, 'active': True}, {'_id': 0}):
+            out[doc['guest_id']]['vip_protocol'] = doc
+        async for doc in self.db.enhanced_guest_preferences.find(query, {'_id': 0}):
+            out[doc['guest_id']]['enhanced_preferences'] = doc
+        async for doc in self.db.celebration_tracking.find(query, {'_id': 0}):
+            out[doc['guest_id']]['celebration_tracking'] = doc
+        async for doc in self.db.blacklist_entries.find({**query, 'active': True}, {'_id': 0}):
+            out[doc['guest_id']]['blacklist_entries'].append(doc)
+        async for guest in self.db.guests.find({'tenant_id': tenant_id, 'id': {'$in': guest_ids}},
+                                               {'_id': 0, 'id': 1, 'name': 1, 'email': 1, 'tags': 1}):
+            out[guest['id']].update({'guest_name': guest.get('name'), 'email': guest.get('email'),
+                                     'tags': guest.get('tags') or []})
+        for profile in out.values():
+            profile['vip'] = profile['vip_protocol'] is not None or 'vip' in profile.get('tags', [])
+            profile['blacklisted'] = len(profile['blacklist_entries']) > 0
+            profile['has_preferences'] = profile['enhanced_preferences'] is not None
+            profile['has_celebrations'] = profile['celebration_tracking'] is not None
+        return out
+
+    async def refresh_profile(self, tenant_id: str, guest_id: str):
+        """Re-read VIP / preference / celebration / blacklist docs after a profile edit"""
+        if not await self.db.guest_rollups.find_one({'tenant_id': tenant_id, 'guest_id': guest_id}, {'_id': 1}):
+            await self.rebuild_guests(tenant_id, [guest_id])
+            return
+        profile = (await self._profiles(tenant_id, [guest_id]))[guest_id]
+        await self.db.guest_rollups.update_one(
+            {'tenant_id': tenant_id, 'guest_id': guest_id},
+            {'$set': {**profile, 'updated_at': datetime.now(timezone.utc).isoformat()}}
+        )
+
+    # ------------------------------------------------------------ increments
+
+    async def _increment(self, tenant_id: str, guest_id: str, ref: str, update: Dict[str, Any]):
+        update.setdefault('$push', {})['applied'] = ref
+        doc = await self.db.guest_rollups.find_one_and_update(
+            {'tenant_id': tenant_id, 'guest_id': guest_id, 'applied': {'$ne': ref}},
+            update,
+            projection=TOTALS_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if doc:
+            await self.db.guest_rollups.update_one(
+                {'tenant_id': tenant_id, 'guest_id': guest_id},
+                {'$set': {**_derived(doc), 'updated_at': datetime.now(timezone.utc).isoformat()}}
+            )
+
+    async def record_stay(self, tenant_id: str, booking: Dict[str, Any]):
+        """Fold a checked-out booking into its guest's rollup"""
+        guest_id = booking.get('guest_id')
+        if not guest_id:
+            return
+        if not await self.db.guest_rollups.find_one({'tenant_id': tenant_id, 'guest_id': guest_id}, {'_id': 1}):
+            # First rollup for this guest: the rebuild already includes this stay
+            await self.rebuild_guests(tenant_id, [guest_id])
+            return
+        last_day = _day(booking.get('check_out')) or _day(datetime.now(timezone.utc))
+        inc = {
+            'stays': 1,
+            'nights': _nights(booking),
+            'room_revenue': float(booking.get('total_amount', 0) or 0),
+            f'channel_mix.{_channel(booking)}': 1,
+            f'segment_mix.{_key(booking.get("market_segment"))}': 1,
+        }
+        if booking.get('rate_type'):
+            inc[f'rate_type_mix.{_key(booking["rate_type"])}'] = 1
+        await self._increment(tenant_id, guest_id, f"booking:{booking['id']}", {
+            '$inc': inc,
+            '$max': {'last_stay': last_day},
+            '$min': {'first_stay': _day(booking.get('check_in')) or last_day},
+            '$set': {'last_booking_id': booking['id']},
+        })
+
+    async def record_folio(self, tenant_id: str, folio: Dict[str, Any]):
+        """Add a closed folio's non-room charges (F&B, spa, minibar...) to the guest's spend"""
+        guest_id = folio.get('guest_id')
+        if not guest_id and folio.get('booking_id'):
+            booking = await self.db.bookings.find_one(
+                {'id': folio['booking_id'], 'tenant_id': tenant_id}, {'_id': 0, 'guest_id': 1}
+            )
+            guest_id = (booking or {}).get('guest_id')
+        if not guest_id:
+            return
+        if not await self.db.guest_rollups.find_one({'tenant_id': tenant_id, 'guest_id': guest_id}, {'_id': 1}):
+            await self.rebuild_guests(tenant_id, [guest_id])
+            return
+        extras = (await self._folio_extras(tenant_id, [folio['id']])).get(folio['id'], 0.0)
+        await self._increment(tenant_id, guest_id, f"folio:{folio['id']}", {
+            '$inc': {'extras_revenue': extras, 'folios': 1},
+        })
+
+    async def _folio_extras(self, tenant_id: str, folio_ids: List[str]) -> Dict[str, float]:
+        if not folio_ids:
+            return {}
+        rows = await aggregate_with_archive(self.db, 'folio_charges', {
+            'tenant_id': tenant_id, 'folio_id': {'$in': folio_ids}, 'voided': {'$ne': True},
+            'charge_category': {'$nin': list(ROOM_CHARGE_CATEGORIES)}
+        }, [
+            {'$group': {'_id': '$folio_id', 'total': {'$sum': {'$ifNull': ['$total', '$amount']}}}}
+        ]).to_list(None)
+        return {r['_id']: float(r['total'] or 0) for r in rows}
+
+    # ------------------------------------------------------------ rebuilds
+
+    async def rebuild_guests(self, tenant_id: str, guest_ids: Optional[List[str]] = None) -> int:
+        """Recompute rollups from raw bookings and folios, archived ones included (all guests when guest_ids is None)"""
+        booking_query: Dict[str, Any] = {'tenant_id': tenant_id, 'status': 'checked_out'}
+        if guest_ids is not None:
+            booking_query['guest_id'] = {'$in': guest_ids}
+        rollups: Dict[str, Dict[str, Any]] = {gid: self._empty() for gid in guest_ids or []}
+        booking_guest: Dict[str, str] = {}
+        async for b in aggregate_with_archive(self.db, 'bookings', booking_query, [{'$project': {
+            '_id': 0, 'id': 1, 'guest_id': 1, 'check_in': 1, 'check_out': 1, 'total_amount': 1,
+            'ota_channel': 1, 'channel': 1, 'source_channel': 1, 'market_segment': 1, 'rate_type': 1
+        }}]):
+            if not b.get('guest_id'):
+                continue
+            r = rollups.setdefault(b['guest_id'], self._empty())
+            booking_guest[b['id']] = b['guest_id']
+            r['stays'] += 1
+            r['nights'] += _nights(b)
+            r['room_revenue'] += float(b.get('total_amount', 0) or 0)
+            for field, key in (('channel_mix', _channel(b)), ('segment_mix', _key(b.get('market_segment')))):
+                r[field][key] = r[field].get(key, 0) + 1
+            if b.get('rate_type'):
+                key = _key(b['rate_type'])
+                r['rate_type_mix'][key] = r['rate_type_mix'].get(key, 0) + 1
+            last_day = _day(b.get('check_out'))
+            first_day = _day(b.get('check_in')) or last_day
+            if last_day and (not r['last_stay'] or last_day > r['last_stay']):
+                r['last_stay'], r['last_booking_id'] = last_day, b['id']
+            if first_day and (not r['first_stay'] or first_day < r['first_stay']):
+                r['first_stay'] = first_day
+            r['applied'].append(f"booking:{b['id']}")
+
+        folio_query: Dict[str, Any] = {'tenant_id': tenant_id, 'status': 'closed'}
+        if guest_ids is not None:
+            folio_query['$or'] = [{'guest_id': {'$in': guest_ids}}, {'booking_id': {'$in': list(booking_guest)}}]
+        folios = await aggregate_with_archive(self.db, 'folios', folio_query, [
+            {'$project': {'_id': 0, 'id': 1, 'guest_id': 1, 'booking_id': 1}}
+        ]).to_list(None)
+        extras = await self._folio_extras(tenant_id, [f['id'] for f in folios])
+        for f in folios:
+            guest_id = f.get('guest_id') or booking_guest.get(f.get('booking_id'))
+            if not guest_id or (guest_ids is not None and guest_id not in rollups):
+                continue
+            r = rollups.setdefault(guest_id, self._empty())
+            r['extras_revenue'] += extras.get(f['id'], 0.0)
+            r['folios'] += 1
+            r['applied'].append(f"folio:{f['id']}")
+
+        if guest_ids is None:
+            # Guests without stays still belong in segment queries
+            async for g in self.db.guests.find({'tenant_id': tenant_id}, {'_id': 0, 'id': 1}):
+                rollups.setdefault(g['id'], self._empty())
+            await self.db.guest_rollups.delete_many({'tenant_id': tenant_id, 'guest_id': {'$nin': list(rollups)}})
+
+        now = datetime.now(timezone.utc).isoformat()
+        ids = list(rollups)
+        for start in range(0, len(ids), 1000):
+            chunk = ids[start:start + 1000]
+            profiles = await self._profiles(tenant_id, chunk)
+            ops = []
+            for guest_id in chunk:
+                r = rollups[guest_id]
+                r['room_revenue'] = round(r['room_revenue'], 2)
+                r['extras_revenue'] = round(r['extras_revenue'], 2)
+                ops.append(UpdateOne(
+                    {'tenant_id': tenant_id, 'guest_id': guest_id},
+                    {'$set': {**r, **_derived(r), **profiles[guest_id], 'updated_at': now, 'rebuilt_at': now}},
+                    upsert=True
+                ))
+            if ops:
+                await self.db.guest_rollups.bulk_write(ops, ordered=False)
+        if guest_ids is None:
+            await self.db.guest_rollup_meta.update_one(
+                {'tenant_id': tenant_id}, {'$set': {'built_at': now, 'guests': len(ids)}}, upsert=True
+            )
+            print(f"👤 Guest rollups rebuilt for tenant {tenant_id}: {len(ids)} guests")
+        return len(ids)
+
+    @staticmethod
+    def _empty() -> Dict[str, Any]:
+        return {
+            'stays': 0, 'nights': 0, 'folios': 0, 'room_revenue': 0.0, 'extras_revenue': 0.0,
+            'first_stay': None, 'last_stay': None, 'last_booking_id': None,
+            'channel_mix': {}, 'segment_mix': {}, 'rate_type_mix': {}, 'applied': [],
+        }
+
+    async def ensure_built(self, tenant_id: str):
+        """Segment queries span every guest: backfill the tenant once"""
+        if not await self.db.guest_rollup_meta.find_one({'tenant_id': tenant_id}, {'_id': 1}):
+            await self.rebuild_guests(tenant_id)
+
+    # ------------------------------------------------------------ reads
+
+    async def get(self, tenant_id: str, guest_id: str) -> Dict[str, Any]:
+        doc = await self.db.guest_rollups.find_one({'tenant_id': tenant_id, 'guest_id': guest_id}, READ_PROJECTION)
+        if doc is None:
+            await self.rebuild_guests(tenant_id, [guest_id])
+            doc = await self.db.guest_rollups.find_one({'tenant_id': tenant_id, 'guest_id': guest_id}, READ_PROJECTION)
+        return doc or {}
+
+    async def many(self, tenant_id: str, guest_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        guest_ids = list({gid for gid in guest_ids if gid})
+        if not guest_ids:
+            return {}
+        docs = {d['guest_id']: d for d in await self.db.guest_rollups.find(
+            {'tenant_id': tenant_id, 'guest_id': {'$in': guest_ids}}, READ_PROJECTION
+        ).to_list(None)}
+        missing = [gid for gid in guest_ids if gid not in docs]
+        if missing:
+            await self.rebuild_guests(tenant_id, missing)
+            async for d in self.db.guest_rollups.find(
+                {'tenant_id': tenant_id, 'guest_id': {'$in': missing}}, READ_PROJECTION
+            ):
+                docs[d['guest_id']] = d
+        return docs
+
+    @staticmethod
+    def segment_query(tenant_id: str, ltv_tier: Optional[str] = None, min_stays: Optional[int] = None,
+                      min_spend: Optional[float] = None, channel: Optional[str] = None,
+                      vip: Optional[bool] = None, blacklisted: Optional[bool] = None,
+                      last_stay_before: Optional[str] = None, last_stay_after: Optional[str] = None) -> Dict[str, Any]:
+        query: Dict[str, Any] = {'tenant_id': tenant_id}
+        if ltv_tier:
+            query['ltv_tier'] = {'$in': ltv_tier.split(',')}
+        if min_stays is not None:
+            query['stays'] = {'$gte': min_stays}
+        if min_spend is not None:
+            query['total_spend'] = {'$gte': min_spend}
+        if channel:
+            query[f'channel_mix.{_key(channel)}'] = {'$gt': 0}
+        if vip is not None:
+            query['vip'] = vip
+        if blacklisted is not None:
+            query['blacklisted'] = blacklisted
+        if last_stay_before or last_stay_after:
+            query['last_stay'] = {}
+            if last_stay_before:
+                query['last_stay']['$lt'] = last_stay_before
+            if last_stay_after:
+                query['last_stay']['$gte'] = last_stay_after
+        return query
+
+    async def segment(self, tenant_id: str, sort: str = 'total_spend', limit: int = 100, skip: int = 0,
+                      **filters) -> Dict[str, Any]:
+        await self.ensure_built(tenant_id)
+        query = self.segment_query(tenant_id, **filters)
+        projection = {'_id': 0, 'guest_id': 1, 'guest_name': 1, 'email': 1, 'stays': 1, 'nights': 1,
+                      'total_spend': 1, 'adr': 1, 'last_stay': 1, 'ltv_tier': 1, 'vip': 1, 'blacklisted': 1,
+                      'channel_mix': 1}
+        total = await self.db.guest_rollups.count_documents(query)
+        guests = await self.db.guest_rollups.find(query, projection).sort(
+            [(sort, -1), ('guest_id', 1)]
+        ).skip(skip).limit(limit).to_list(limit)
+        return {'guests': guests, 'total': total}
+
+    async def guest_ids(self, tenant_id: str, **filters) -> List[str]:
+        await self.ensure_built(tenant_id)
+        return [d['guest_id'] async for d in self.db.guest_rollups.find(
+            self.segment_query(tenant_id, **filters), {'_id': 0, 'guest_id': 1}
+        )]
+
+    async def tier_counts(self, tenant_id: str) -> Dict[str, int]:
+        await self.ensure_built(tenant_id)
+        rows = await self.db.guest_rollups.aggregate([
+            {'$match': {'tenant_id': tenant_id}},
+            {'$group': {'_id': '$ltv_tier', 'count': {'$sum': 1}}}
+        ]).to_list(None)
+        return {r['_id'] or 'regular': r['count'] for r in rows}
+
+
+guest_rollups = None
+
+
+def get_guest_rollups(db):
+    global guest_rollups
+    if guest_rollups is None:
+        guest_rollups = GuestRollups(db)
+    return guest_rollups
@@ -0,0 +1,306 @@
+"""
+Housekeeping Assignment Engine
+Daily board: due-outs, stayovers, vacant-dirty rooms and VIP/arrival priority
+-> balanced, floor-clustered attendant workloads sized to each shift.
+
+Solver: rooms x attendants travel cost matrix (numpy) seeded from a
+contiguous floor sweep, greedy longest-task-first placement, then a
+best-move local search on workload balance + travel. 550 rooms x 40
+attendants solves in a few tens of milliseconds.
+"""
+
+import time
+import uuid
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pymongo import DeleteMany, InsertOne, UpdateMany
+
+# Minutes credited per task (checkout / vacant-dirty = full clean)
+CHECKOUT_MINUTES = {'standard': 30, 'deluxe': 40, 'suite': 60}
+DEFAULT_CHECKOUT_MINUTES = 35
+STAYOVER_FACTOR = 0.5
+VIP_EXTRA_MINUTES = 10
+FLOOR_CHANGE_MINUTES = 5
+DEFAULT_SHIFT_MINUTES = 480
+MAX_LOCAL_SEARCH_MOVES = 500
+
+PRIORITY_RANK = {'urgent': 3, 'high': 2, 'normal': 1, 'low': 0}
+ACTIVE_BOOKING_STATUSES = ['confirmed', 'guaranteed', 'checked_in']
+UNCLEANABLE_ROOM_STATUSES = {'out_of_order', 'maintenance'}
+ENGINE_SOURCE = 'assignment_engine'
+
+
+def task_minutes(room_type: Optional[str], task_type: str, vip: bool) -> int:
+    base = CHECKOUT_MINUTES.get((room_type or '').lower(), DEFAULT_CHECKOUT_MINUTES)
+    minutes = base * STAYOVER_FACTOR if task_type == 'stayover' else base
+    return int(round(minutes + (VIP_EXTRA_MINUTES if vip else 0)))
+
+
+def solve_assignment(minutes: np.ndarray, floors: np.ndarray, shifts: np.ndarray,
+                     order_key: Optional[np.ndarray] = None,
+                     preferred_floors: Optional[List[Optional[int]]] = None) -> np.ndarray:
+    """
+    Assign N tasks to M attendants; returns the attendant index per task.
+
+    minutes: task durations (N), floors: task floors (N), shifts: shift minutes (M),
+    order_key: sweep order of tasks (default floor), preferred_floors: anchor floor per attendant
+    """
+    n, m = len(minutes), len(shifts)
+    if n == 0 or m == 0:
+        return np.zeros(n, dtype=int)
+    minutes = minutes.astype(float)
+    floors = floors.astype(float)
+    shifts = shifts.astype(float)
+
+    total = minutes.sum()
+    targets = total * shifts / shifts.sum()
+
+    # Contiguous sweep along floors -> anchor floor per attendant
+    sweep = np.argsort(order_key if order_key is not None else floors, kind='stable')
+    cum = np.cumsum(minutes[sweep])
+    cuts = np.searchsorted(cum, np.cumsum(targets)[:-1])
+    anchors = np.array([
+        np.median(floors[chunk]) if chunk.size else floors.mean()
+        for chunk in np.split(sweep, cuts)
+    ])
+    if preferred_floors:
+        anchors = np.array([p if p is not None else a for p, a in zip(preferred_floors, anchors)], dtype=float)
+
+    travel = np.abs(floors[:, None] - anchors[None, :]) * FLOOR_CHANGE_MINUTES  # N x M
+
+    # Greedy: longest tasks first onto the cheapest attendant (travel + overshoot)
+    assigned = np.empty(n, dtype=int)
+    load = np.zeros(m)
+    for i in np.argsort(-minutes, kind='stable'):
+        over_target = np.maximum(load + minutes[i] - targets, 0)
+        over_shift = np.maximum(load + minutes[i] - shifts, 0)
+        j = int(np.argmin(travel[i] + over_target + 10 * over_shift))
+        assigned[i] = j
+        load[j] += minutes[i]
+
+    # Local search: apply the best single-task move while it lowers
+    # travel + lam * sum((load - target)^2)
+    lam = 1.0 / max(minutes.mean(), 1.0)
+    rows = np.arange(n)
+    for _ in range(MAX_LOCAL_SEARCH_MOVES):
+        dev = load - targets
+        src_dev = dev[assigned]                                      # N
+        delta_src = (src_dev - minutes) ** 2 - src_dev ** 2          # N
+        delta_dst = (dev[None, :] + minutes[:, None]) ** 2 - dev[None, :] ** 2  # N x M
+        delta = travel - travel[rows, assigned][:, None] + lam * (delta_src[:, None] + delta_dst)
+        delta[rows, assigned] = 0.0
+        flat = int(np.argmin(delta))
+        i, j = divmod(flat, m)
+        if delta[i, j] >= -1e-9:
+            break
+        load[assigned[i]] -= minutes[i]
+        load[j] += minutes[i]
+        assigned[i] = j
+    return assigned
+
+
+class HKAssignmentEngine:
+    """Builds, solves and persists the daily housekeeping board"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def build_board(self, tenant_id: str, day: str, dirty_only: bool = False) -> List[Dict[str, Any]]:
+        """Cleaning tasks for the day from three queries (rooms, bookings, VIP guests)"""
+        rooms = await self.db.rooms.find(
+            {'tenant_id': tenant_id},
+            {'_id': 0, 'id': 1, 'room_number': 1, 'floor': 1, 'room_type': 1, 'status': 1}
+        ).to_list(10000)
+        rooms = [r for r in rooms if r.get('status') not in UNCLEANABLE_ROOM_STATUSES]
+
+        stays: Dict[str, Dict[str, Any]] = {}
+        async for b in self.db.bookings.find({
+            'tenant_id': tenant_id,
+            'status': {'$in': ACTIVE_BOOKING_STATUSES},
+            'check_in': {'$lte': day + 'T23:59:59'},
+            'check_out': {'$gte': day}
+        }, {'_id': 0, 'room_id': 1, 'guest_id': 1, 'check_in': 1, 'check_out': 1}):
+            ci, co = str(b.get('check_in', ''))[:10], str(b.get('check_out', ''))[:10]
+            info = stays.setdefault(b.get('room_id'), {})
+            if co == day:
+                info['departure'] = True
+            elif ci < day < co:
+                info['stayover'] = True
+            if ci == day:
+                info['arrival'] = True
+            info.setdefault('guest_ids', []).append(b.get('guest_id'))
+
+        guest_ids = [g for s in stays.values() for g in s['guest_ids'] if g]
+        vip_guests = set()
+        if guest_ids:
+            vip_guests = {
+                g['id'] async for g in self.db.guests.find(
+                    {'tenant_id': tenant_id, 'id': {'$in': guest_ids}, 'vip_status': True}, {'_id': 0, 'id': 1}
+                )
+            }
+
+        tasks = []
+        for room in rooms:
+            stay = stays.get(room['id'], {})
+            dirty = room.get('status') == 'dirty'
+            if stay.get('departure') or (dirty and not stay.get('stayover')):
+                task_type = 'checkout'
+            elif stay.get('stayover'):
+                task_type = 'stayover'
+            else:
+                continue
+            if dirty_only and not dirty:
+                continue
+            vip = any(g in vip_guests for g in stay.get('guest_ids', []))
+            arrival = stay.get('arrival', False)
+            priority = 'urgent' if vip and arrival else 'high' if arrival or vip else 'normal'
+            tasks.append({
+                'room_id': room['id'],
+                'room_number': room.get('room_number'),
+                'floor': int(room.get('floor') or 0),
+                'room_type': room.get('room_type'),
+                'type': task_type,
+                'priority': priority,
+                'vip': vip,
+                'estimated_minutes': task_minutes(room.get('room_type'), task_type, vip)
+            })
+        return tasks
+
+    async def load_staff(self, tenant_id: str) -> List[Dict[str, Any]]:
+        return await self.db.users.find(
+            {'tenant_id': tenant_id, 'role': 'housekeeping', 'is_active': True},
+            {'_id': 0, 'id': 1, 'name': 1, 'shift_minutes': 1, 'floors': 1}
+        ).to_list(500)
+
+    def solve(self, tasks: List[Dict[str, Any]], staff: List[Dict[str, Any]]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        minutes = np.array([t['estimated_minutes'] for t in tasks], dtype=float)
+        floors = np.array([t['floor'] for t in tasks], dtype=float)
+        shifts = np.array([float(s.get('shift_minutes') or DEFAULT_SHIFT_MINUTES) for s in staff])
+        # Sweep order: floor, then room number
+        sweep = sorted(range(len(tasks)), key=lambda k: (tasks[k]['floor'], str(tasks[k]['room_number'])))
+        order_key = np.empty(len(tasks), dtype=int)
+        order_key[sweep] = np.arange(len(tasks))
+        preferred = [min(s['floors']) if s.get('floors') else None for s in staff]
+
+        assigned = solve_assignment(minutes, floors, shifts, order_key, preferred)
+
+        board = []
+        for j, member in enumerate(staff):
+            mine = [tasks[i] for i in np.flatnonzero(assigned == j)] if tasks else []
+            mine.sort(key=lambda t: (-PRIORITY_RANK[t['priority']], t['floor'], str(t['room_number'])))
+            load = sum(t['estimated_minutes'] for t in mine)
+            board.append({
+                'staff_id': member.get('id'),
+                'staff_name': member.get('name'),
+                'shift_minutes': int(shifts[j]),
+                'estimated_minutes': load,
+                'overtime_minutes': max(load - int(shifts[j]), 0),
+                'floors': sorted({t['floor'] for t in mine}),
+                'total_tasks': len(mine),
+                'tasks': [{**t, 'sequence': k + 1} for k, t in enumerate(mine)]
+            })
+
+        loads = np.array([b['estimated_minutes'] for b in board], dtype=float)
+        return {
+            'staff_assignments': board,
+            'summary': {
+                'total_tasks': len(tasks),
+                'checkouts': sum(1 for t in tasks if t['type'] == 'checkout'),
+                'stayovers': sum(1 for t in tasks if t['type'] == 'stayover'),
+                'vip_rooms': sum(1 for t in tasks if t['vip']),
+                'total_minutes': int(minutes.sum()),
+                'available_minutes': int(shifts.sum()),
+                'max_load_minutes': int(loads.max()) if len(loads) else 0,
+                'min_load_minutes': int(loads.min()) if len(loads) else 0,
+                'avg_floors_per_attendant': round(float(np.mean([len(b['floors']) for b in board])), 2) if board else 0,
+                'overtime_minutes': int(sum(b['overtime_minutes'] for b in board)),
+                'solve_ms': round((time.perf_counter() - started) * 1000, 1)
+            }
+        }
+
+    async def optimize(self, tenant_id: str, day: str, staff: Optional[List[Dict[str, Any]]] = None,
+                       dirty_only: bool = False, persist: bool = True,
+                       assigned_by: Optional[str] = None) -> Dict[str, Any]:
+        tasks = await self.build_board(tenant_id, day, dirty_only=dirty_only)
+        staff = staff or await self.load_staff(tenant_id)
+        if not staff:
+            return {'date': day, 'staff_assignments': [], 'summary': {'total_tasks': len(tasks)},
+                    'unassigned': tasks, 'persisted': False}
+
+        plan = self.solve(tasks, staff)
+        plan['date'] = day
+        plan['persisted'] = False
+        if persist:
+            # An empty board still replaces the day's plan, so yesterday's run does not stay live
+            await self.persist(tenant_id, day, plan, assigned_by)
+            plan['persisted'] = True
+        return plan
+
+    async def persist(self, tenant_id: str, day: str, plan: Dict[str, Any], assigned_by: Optional[str]):
+        """Replace the day's engine plan: one bulk write per collection"""
+        now = datetime.now(timezone.utc)
+        board_day = datetime.combine(date.fromisoformat(day), datetime.min.time()).replace(tzinfo=timezone.utc)
+
+        task_ops = [DeleteMany({'tenant_id': tenant_id, 'scheduled_date': day,
+                                'source': ENGINE_SOURCE, 'status': 'pending'})]
+        assignment_ops = [DeleteMany({'tenant_id': tenant_id, 'assignment_date': board_day,
+                                      'source': ENGINE_SOURCE, 'status': 'assigned'})]
+        room_ops = []
+        for member in plan['staff_assignments']:
+            if not member['tasks']:
+                continue
+            room_ids = [t['room_id'] for t in member['tasks']]
+            for t in member['tasks']:
+                task_ops.append(InsertOne({
+                    'id': str(uuid.uuid4()),
+                    'tenant_id': tenant_id,
+                    'room_id': t['room_id'],
+                    'room_number': t['room_number'],
+                    'task_type': t['type'],
+                    'priority': t['priority'],
+                    'assigned_to': member['staff_name'],
+                    'assigned_staff_id': member['staff_id'],
+                    'sequence': t['sequence'],
+                    'status': 'pending',
+                    'scheduled_date': day,
+                    'estimated_duration': t['estimated_minutes'],
+                    'created_at': now.isoformat(),
+                    'source': ENGINE_SOURCE
+                }))
+            assignment_ops.append(InsertOne({
+                'id': str(uuid.uuid4()),
+                'tenant_id': tenant_id,
+                'assignment_date': board_day,
+                'staff_id': member['staff_id'],
+                'staff_name': member['staff_name'],
+                'assigned_rooms': room_ids,
+                'room_count': len(room_ids),
+                'estimated_minutes': member['estimated_minutes'],
+                'status': 'assigned',
+                'assigned_by': assigned_by,
+                'source': ENGINE_SOURCE,
+                'created_at': now,
+                'updated_at': now
+            }))
+            room_ops.append(UpdateMany(
+                {'tenant_id': tenant_id, 'id': {'$in': room_ids}},
+                {'$set': {'assigned_to': member['staff_name'], 'assigned_at': now}}
+            ))
+
+        await self.db.housekeeping_tasks.bulk_write(task_ops, ordered=True)
+        await self.db.hk_task_assignments.bulk_write(assignment_ops, ordered=True)
+        if room_ops:
+            await self.db.rooms.bulk_write(room_ops, ordered=False)
+
+
+hk_assignment_engine = None
+
+
+def get_hk_assignment_engine(db):
+    global hk_assignment_engine
+    if hk_assignment_engine is None:
+        hk_assignment_engine = HKAssignmentEngine(db)
+    return hk_assignment_engine
@@ -0,0 +1,155 @@
+"""
+Housekeeping Boards - read model by business date
+Due-out, stayover, arrival and room-status boards from a single aggregation:
+bookings touching the day (+ guest name via $lookup) $unionWith compact room
+rows. Replaces the load-all-checked-in + per-booking room/guest lookups.
+"""
+
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Optional
+
+IN_HOUSE_STATUSES = ['checked_in']
+ARRIVAL_STATUSES = ['confirmed', 'guaranteed', 'pending']
+ROOM_STATUSES = ['available', 'occupied', 'dirty', 'cleaning', 'inspected', 'maintenance', 'out_of_order']
+READY_STATUSES = {'available', 'inspected'}
+
+ROOM_PROJECTION = {
+    '_id': 0, 'kind': {'$literal': 'room'}, 'id': 1, 'room_number': 1, 'room_type': 1, 'floor': 1,
+    'status': 1, 'bed_type': 1, 'base_price': 1, 'max_occupancy': 1, 'assigned_to': 1,
+    'current_booking_id': 1, 'last_cleaned': 1,
+}
+
+
+def _to_date(value) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and len(value) >= 10:
+        try:
+            return date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    return None
+
+
+def _date_bound(field: str, op: str, day_s: str, day_dt: datetime) -> Dict[str, Any]:
+    # Booking dates are stored either as ISO strings or as BSON dates
+    return {'$or': [{field: {op: day_s}}, {field: {op: day_dt}}]}
+
+
+class HousekeepingBoards:
+    """Builds the day's housekeeping boards with one round-trip"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def _pipeline(self, tenant_id: str, day: date) -> list:
+        day_start = datetime.combine(day, time.min).replace(tzinfo=timezone.utc)
+        day_end = datetime.combine(day, time.max).replace(tzinfo=timezone.utc)
+
+        in_house = {
+            'status': {'$in': IN_HOUSE_STATUSES},
+            '$and': [_date_bound('check_out', '$gte', day.isoformat(), day_start)],
+        }
+        arrivals = {
+            'status': {'$in': ARRIVAL_STATUSES},
+            '$and': [
+                _date_bound('check_in', '$gte', day.isoformat(), day_start),
+                _date_bound('check_in', '$lte', day.isoformat() + 'T23:59:59.999999', day_end),
+            ],
+        }
+        return [
+            {'$match': {'tenant_id': tenant_id, '$or': [in_house, arrivals]}},
+            {'$lookup': {'from': 'guests', 'localField': 'guest_id', 'foreignField': 'id', 'as': 'guest'}},
+            {'$project': {
+                '_id': 0, 'kind': {'$literal': 'booking'}, 'id': 1, 'room_id': 1, 'status': 1,
+                'check_in': 1, 'check_out': 1,
+                'guest_name': {'$arrayElemAt': ['$guest.name', 0]},
+                'vip': {'$arrayElemAt': ['$guest.vip_status', 0]},
+            }},
+            {'$unionWith': {
+                'coll': 'rooms',
+                'pipeline': [{'$match': {'tenant_id': tenant_id}}, {'$project': ROOM_PROJECTION}],
+            }},
+        ]
+
+    async def day_boards(self, tenant_id: str, day: Optional[date] = None) -> Dict[str, Any]:
+        day = day or datetime.now(timezone.utc).date()
+        tomorrow = day + timedelta(days=1)
+
+        rooms, bookings = {}, []
+        async for doc in self.db.bookings.aggregate(self._pipeline(tenant_id, day), allowDiskUse=True):
+            if doc.pop('kind') == 'room':
+                rooms[doc['id']] = doc
+            else:
+                bookings.append(doc)
+
+        due_out, stayovers, arrivals = [], [], []
+        for b in bookings:
+            room = rooms.get(b.get('room_id')) or {}
+            base = {
+                'room_id': b.get('room_id'),
+                'room_number': room.get('room_number', 'N/A'),
+                'room_type': room.get('room_type', 'N/A'),
+                'floor': room.get('floor'),
+                'guest_name': b.get('guest_name') or 'N/A',
+                'vip': bool(b.get('vip')),
+                'booking_id': b.get('id'),
+            }
+            check_in, check_out = b.get('check_in'), b.get('check_out')
+            if b.get('status') in IN_HOUSE_STATUSES:
+                checkout_date = _to_date(check_out)
+                if checkout_date is None:
+                    continue
+                checkout_s = check_out.isoformat() if isinstance(check_out, datetime) else check_out
+                if checkout_date in (day, tomorrow):
+                    due_out.append({**base, 'checkout_date': checkout_s, 'is_today': checkout_date == day})
+                if checkout_date > day:
+                    stayovers.append({**base, 'checkout_date': checkout_s,
+                                      'nights_remaining': (checkout_date - day).days})
+            elif _to_date(check_in) == day:
+                arrivals.append({
+                    **base,
+                    'room_status': room.get('status', 'unknown'),
+                    'checkin_time': check_in.isoformat() if isinstance(check_in, datetime) else check_in,
+                    'booking_status': b.get('status'),
+                    'ready': room.get('status') in READY_STATUSES,
+                })
+
+        return {
+            'date': day.isoformat(),
+            'due_out': {'due_out_rooms': due_out, 'count': len(due_out)},
+            'stayovers': {'stayover_rooms': stayovers, 'count': len(stayovers)},
+            'arrivals': {
+                'arrival_rooms': arrivals,
+                'count': len(arrivals),
+                'ready_count': sum(1 for r in arrivals if r['ready'])
+            },
+            'room_status': self._status_board(rooms.values()),
+        }
+
+    @staticmethod
+    def _status_board(rooms) -> Dict[str, Any]:
+        status_counts = {s: 0 for s in ROOM_STATUSES}
+        for room in rooms:
+            status = room.get('status')
+            status_counts[status] = status_counts.get(status, 0) + 1
+        room_list = sorted(rooms, key=lambda r: (r.get('floor') or 0, str(r.get('room_number'))))
+        return {'rooms': room_list, 'status_counts': status_counts, 'total_rooms': len(room_list)}
+
+    async def room_status(self, tenant_id: str) -> Dict[str, Any]:
+        """Room status board alone: compact projection, no booking scan"""
+        projection = {k: v for k, v in ROOM_PROJECTION.items() if k != 'kind'}
+        rooms = await self.db.rooms.find({'tenant_id': tenant_id}, projection).to_list(None)
+        return self._status_board(rooms)
+
+
+hk_boards = None
+
+
+def get_hk_boards(db):
+    global hk_boards
+    if hk_boards is None:
+        hk_boards = HousekeepingBoards(db)
+    return hk_boards
@@ -2,7 +2,6 @@
 Housekeeping Intelligence - AI-Powered
 Oda dağılımı optimizasyonu, tahminli temizlik süreleri
 """
-import random
 from datetime import datetime, timezone, timedelta
 from typing import List, Dict
 
@@ -13,37 +12,30 @@ class HousekeepingAI:
         self.db = db
     
     async def optimize_room_assignment(self, tenant_id: str, staff_list: List[dict]) -> List[dict]:
-        """Odaları personele optimal dağıt"""
-        dirty_rooms = await self.db.rooms.find({
-            'tenant_id': tenant_id,
-            'status': 'dirty'
-        }, {'_id': 0}).to_list(100)
+        """Odaları personele optimal dağıt (kirli odalar, kat bazlı dengeli yük)"""
+        from hk_assignment_engine import get_hk_assignment_engine
         
-        if not dirty_rooms or not staff_list:
+        if not staff_list:
             return []
         
-        assignments = []
-        staff_workload = {s['id']: 0 for s in staff_list}
-        
-        for room in dirty_rooms:
-            available_staff = sorted(staff_list, key=lambda s: staff_workload[s['id']])
-            
-            if available_staff:
-                assigned_staff = available_staff[0]
-                base_time = {'Standard': 25, 'Deluxe': 35, 'Suite': 50}.get(room.get('room_type', 'Standard'), 30)
-                estimated_time = int(base_time * random.uniform(0.9, 1.1))
-                
-                assignments.append({
-                    'room_id': room['id'],
-                    'room_number': room['room_number'],
-                    'staff_id': assigned_staff['id'],
-                    'staff_name': assigned_staff['name'],
-                    'estimated_minutes': estimated_time
-                })
-                
-                staff_workload[assigned_staff['id']] += estimated_time
+        engine = get_hk_assignment_engine(self.db)
+        today = datetime.now(timezone.utc).date().isoformat()
+        tasks = await engine.build_board(tenant_id, today, dirty_only=True)
+        if not tasks:
+            return []
         
-        return assignments
+        plan = engine.solve(tasks, staff_list)
+        return [
+            {
+                'room_id': task['room_id'],
+                'room_number': task['room_number'],
+                'staff_id': member['staff_id'],
+                'staff_name': member['staff_name'],
+                'estimated_minutes': task['estimated_minutes']
+            }
+            for member in plan['staff_assignments']
+            for task in member['tasks']
+        ]
     
     async def predict_cleaning_time(self, room_type: str, staff_id: str) -> dict:
         """Temizlik süresi tahmini"""
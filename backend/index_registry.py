@@ -0,0 +1,546 @@
+"""
+Index Registry - declarative MongoDB indexes with versioned migrations
+Every index the application relies on is declared here, per collection, as
+part of an ordered migration. Migrations are applied outside application
+startup (`python db_optimization.py`, the admin endpoint or the maintenance
+task) and recorded in `index_migrations`, so each runs once per database.
+
+Usage is sampled from `$indexStats` into `index_usage` (cumulative across
+server restarts, which reset the counters); undeclared indexes that stay
+unused can be dropped, declared ones are only reported so the registry stays
+the source of truth.
+"""
+
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import APIRouter, Request
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEX_MIGRATION_LOCK_SECONDS = int(os.environ.get('INDEX_MIGRATION_LOCK_SECONDS', '3600'))
+INDEX_UNUSED_MIN_DAYS = int(os.environ.get('INDEX_UNUSED_MIN_DAYS', '14'))
+
+# MongoDB error codes
+INDEX_OPTIONS_CONFLICT = 85    # same keys already indexed under another name/options
+INDEX_NOT_FOUND = 27
+NAMESPACE_NOT_FOUND = 26
+
+
+def default_name(keys: Iterable[Tuple[str, Any]]) -> str:
+    """The name MongoDB gives an index created without one"""
+    return '_'.join(f'{field}_{direction}' for field, direction in keys)
+
+
+class IndexSpec:
+    """One declared index: collection, ordered keys, name and create_index options"""
+
+    def __init__(self, collection: str, keys: List[Tuple[str, Any]], name: Optional[str] = None, **options):
+        self.collection = collection
+        self.keys = [(field, direction) for field, direction in keys]
+        self.name = name or default_name(self.keys)
+        self.options = options
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'collection': self.collection, 'name': self.name, 'keys': self.keys, **self.options}
+
+
+class Migration:
+    """Ordered set of index creations and drops applied once per database"""
+
+    def __init__(self, version: int, description: str, create: List[IndexSpec] = (),
+                 drop: List[Tuple[str, str]] = ()):
+        self.version = version
+        self.description = description
+        self.create = list(create)
+        self.drop = list(drop)
+
+
+def _tenant(collection: str, *keys: Tuple[str, Any], name: str, **options) -> IndexSpec:
+    return IndexSpec(collection, [('tenant_id', 1), *keys], name, **options)
+
+
+def _baseline() -> List[IndexSpec]:
+    """Indexes previously created by the startup hook and the service setup_indexes methods"""
+    specs = [
+        # Agency booking requests
+        IndexSpec('agency_booking_requests', [('idempotency_key', 1)], 'uniq_idempotency_key', unique=True),
+        IndexSpec('agency_booking_requests', [('status', 1), ('hotel_id', 1)], 'idx_status_hotel'),
+        IndexSpec('agency_booking_requests', [('agency_id', 1), ('status', 1)], 'idx_agency_status'),
+        IndexSpec('agency_booking_requests', [('expires_at', 1)], 'idx_expires_at'),
+        IndexSpec('agency_booking_requests', [('created_at', -1)], 'idx_created_at_desc'),
+
+        # Bookings - calendar, boards and keyset pagination
+        _tenant('bookings', ('check_in', 1), ('check_out', 1), name='idx_bookings_tenant_checkin_checkout'),
+        _tenant('bookings', ('status', 1), ('check_in', 1), name='idx_bookings_tenant_status_checkin'),
+        _tenant('bookings', ('status', 1), ('check_out', 1), name='idx_bookings_tenant_status_checkout'),
+        _tenant('bookings', ('room_id', 1), ('check_in', 1), name='idx_bookings_tenant_room_checkin'),
+        _tenant('bookings', ('check_in', -1), ('id', -1), name='idx_bookings_tenant_checkin_id'),
+
+        # Rooms
+        _tenant('rooms', ('room_number', 1), name='idx_rooms_tenant_number', unique=True),
+        _tenant('rooms', ('status', 1), ('room_type', 1), name='idx_rooms_tenant_status_type'),
+
+        # Compiled rate grid
+        _tenant('rate_grid', ('rate_plan_id', 1), ('room_type', 1), ('date', 1), name='idx_rate_grid_key',
+                unique=True),
+        _tenant('rate_grid', ('plan_ref', 1), name='idx_rate_grid_plan_ref'),
+
+        # Guests
+        _tenant('guests', ('email', 1), name='idx_guests_tenant_email'),
+        _tenant('guests', ('phone', 1), name='idx_guests_tenant_phone'),
+        IndexSpec('guests', [('id', 1)], 'idx_guests_id'),
+        _tenant('guests', ('created_at', -1), ('id', -1), name='idx_guests_tenant_created_id'),
+
+        # Folios and charges
+        _tenant('folios', ('booking_id', 1), name='idx_folios_tenant_booking'),
+        _tenant('folios', ('status', 1), ('created_at', -1), name='idx_folios_tenant_status_created'),
+        IndexSpec('folio_charges', [('folio_id', 1), ('tenant_id', 1), ('date', 1), ('id', 1)],
+                  'idx_folio_charges_folio_date_id'),
+
+        # General ledger
+        _tenant('journal_entries', ('source_type', 1), ('source_id', 1), ('event', 1),
+                name='idx_journal_source_event', unique=True),
+        _tenant('journal_entries', ('applied', 1), name='idx_journal_tenant_applied'),
+        _tenant('ledger_balances', ('day', 1), ('account', 1), name='idx_ledger_balances_key', unique=True),
+        _tenant('ledger_cash_flows', ('day', 1), ('category', 1), name='idx_ledger_cash_flows_key', unique=True),
+        _tenant('ledger_snapshots', ('period', -1), name='idx_ledger_snapshots_period', unique=True),
+
+        # POS
+        _tenant('pos_daily_totals', ('business_date', 1), ('channel', 1), ('outlet_id', 1),
+                name='idx_pos_daily_totals_key', unique=True),
+        _tenant('pos_menu_transactions', ('transaction_date', 1), name='idx_pos_menu_transactions_date'),
+        _tenant('pos_menu_items', ('outlet_id', 1), name='idx_pos_menu_items_outlet'),
+        _tenant('pos_menu_transactions', ('client_ref', 1), name='idx_pos_transactions_client_ref', unique=True,
+                partialFilterExpression={'client_ref': {'$type': 'string'}}),
+
+        # Search tokens
+        _tenant('search_index', ('kind', 1), ('tokens', 1), ('sort_key', -1), name='idx_search_index_tokens'),
+        _tenant('search_index', ('kind', 1), ('ref_id', 1), name='idx_search_index_ref', unique=True),
+        IndexSpec('search_index_meta', [('tenant_id', 1)], 'idx_search_index_meta_tenant', unique=True),
+
+        # Guest 360 rollups
+        _tenant('guest_rollups', ('guest_id', 1), name='idx_guest_rollups_guest', unique=True),
+        _tenant('guest_rollups', ('ltv_tier', 1), ('total_spend', -1), name='idx_guest_rollups_tier_spend'),
+        _tenant('guest_rollups', ('last_stay', -1), name='idx_guest_rollups_last_stay'),
+
+        # Audit logs and notifications (keyset pagination)
+        _tenant('audit_logs', ('timestamp', -1), ('id', -1), name='idx_audit_logs_tenant_ts_id'),
+        IndexSpec('notifications', [('user_id', 1), ('created_at', -1), ('id', -1)],
+                  'idx_notifications_user_created_id'),
+        _tenant('notifications', ('user_id', 1), ('created_at', -1), ('id', -1),
+                name='idx_notifications_tenant_user_created_id'),
+
+        # Outbound message queue (message_delivery.py)
+        IndexSpec('outbound_messages', [('status', 1), ('next_attempt_at', 1), ('priority', -1)], 'idx_outbound_due'),
+        _tenant('outbound_messages', ('created_at', -1), name='idx_outbound_tenant_created'),
+        IndexSpec('outbound_messages', [('batch_id', 1), ('status', 1)], 'idx_outbound_batch_status'),
+        IndexSpec('outbound_messages', [('id', 1)], 'uniq_outbound_id', unique=True),
+
+        # Materialized views (materialized_views.py)
+        IndexSpec('materialized_views', [('view_name', 1)], unique=True),
+        IndexSpec('materialized_views', [('updated_at', -1)]),
+        IndexSpec('materialized_views', [('view_type', 1)]),
+        IndexSpec('materialized_view_partitions', [('view_name', 1), ('tenant_id', 1), ('partition', 1)],
+                  'idx_mv_partitions_key', unique=True),
+        IndexSpec('materialized_view_partitions', [('view_name', 1), ('partition', 1), ('refreshed_at', 1)],
+                  'idx_mv_partitions_refreshed'),
+
+        # Archive collections (data_archival.py)
+        IndexSpec('bookings_archive', [('archived_at', -1)]),
+        IndexSpec('bookings_archive', [('check_in', -1)]),
+        IndexSpec('bookings_archive', [('check_out', -1)]),
+        IndexSpec('bookings_archive', [('guest_id', 1)]),
+        IndexSpec('bookings_archive', [('status', 1)]),
+        IndexSpec('bookings_archive', [('guest_id', 1), ('check_in', -1)]),
+        IndexSpec('folio_charges_archive', [('folio_id', 1)], 'idx_folio_charges_archive_folio'),
+        IndexSpec('payments_archive', [('folio_id', 1)], 'idx_payments_archive_folio'),
+        IndexSpec('archive_checkpoints', [('collection', 1), ('scope', 1)], 'idx_archive_checkpoints_key',
+                  unique=True),
+    ]
+    # Materialized view change detection reads sources by write time
+    for collection in ('bookings', 'folios', 'rooms', 'guests'):
+        for field in ('updated_at', 'created_at'):
+            specs.append(IndexSpec(collection, [(field, 1)], f'idx_{collection}_{field}'))
+    archive_dates = {'bookings': 'check_out', 'folios': 'closed_at', 'folio_charges': 'date',
+                     'payments': 'processed_at', 'audit_logs': 'timestamp', 'housekeeping_tasks': 'completed_at'}
+    for collection, date_field in archive_dates.items():
+        specs.append(_tenant(f'{collection}_archive', (date_field, -1), name=f'idx_{collection}_archive_tenant_date'))
+        specs.append(_tenant(f'{collection}_archive', ('id', 1), name=f'idx_{collection}_archive_tenant_id'))
+    return specs
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'Baseline: indexes previously created at startup and by service setup', create=_baseline()),
+    Migration(2, 'Query shapes from server.py without a matching index', create=[
+        # Folio balance / detail: {folio_id, voided} with or without tenant_id
+        IndexSpec('folio_charges', [('folio_id', 1), ('voided', 1)], 'idx_folio_charges_folio_voided'),
+        # Flash / portfolio revenue: {tenant_id, charge_date, voided}; reports: {tenant_id, date range, voided}
+        _tenant('folio_charges', ('charge_date', 1), ('voided', 1), name='idx_folio_charges_tenant_charge_date'),
+        _tenant('folio_charges', ('date', 1), name='idx_folio_charges_tenant_date'),
+        _tenant('folio_charges', ('booking_id', 1), name='idx_folio_charges_tenant_booking'),
+        IndexSpec('payments', [('folio_id', 1)], 'idx_payments_folio'),
+        _tenant('payments', ('processed_at', -1), name='idx_payments_tenant_processed'),
+        # Pickup and booking-number lookups (prefix regex falls back to these bounds)
+        _tenant('bookings', ('created_at', -1), name='idx_bookings_tenant_created'),
+        _tenant('bookings', ('booking_number', 1), name='idx_bookings_tenant_number'),
+        _tenant('bookings', ('guest_id', 1), ('check_in', -1), name='idx_bookings_tenant_guest_checkin'),
+        # Company search: tenant + status narrows the case-insensitive name regex
+        _tenant('companies', ('status', 1), ('name', 1), name='idx_companies_tenant_status_name'),
+        # Anchored created_at prefix regex ('^YYYY-MM-DD') uses these as range bounds
+        _tenant('maintenance_tasks', ('created_at', -1), name='idx_maintenance_tasks_tenant_created'),
+        _tenant('room_access_logs', ('created_at', -1), name='idx_room_access_logs_tenant_created'),
+        _tenant('housekeeping_tasks', ('status', 1), ('room_id', 1), name='idx_housekeeping_tasks_tenant_status_room'),
+        # Portfolio membership
+        IndexSpec('properties', [('portfolio_id', 1)], 'idx_properties_portfolio'),
+        IndexSpec('properties', [('organization_id', 1)], 'idx_properties_organization'),
+        IndexSpec('properties', [('id', 1)], 'idx_properties_id'),
+    ]),
+    Migration(3, 'Retire tenant-global unique indexes from the legacy optimizer', drop=[
+        # room numbers and guest e-mails are unique per tenant, not per database
+        ('rooms', 'room_number_1'),
+        ('guests', 'email_1'),
+    ]),
+    Migration(4, 'E-Fatura pipeline queue and records (efatura_pipeline.py)', create=[
+        # Claim: {efatura_status: 'pending'} oldest first; claimed batch re-read by token
+        IndexSpec('accounting_invoices', [('efatura_status', 1), ('efatura_queued_at', 1)],
+                  'idx_accounting_invoices_efatura_queue'),
+        IndexSpec('accounting_invoices', [('efatura_claim', 1)], 'idx_accounting_invoices_efatura_claim', sparse=True),
+        IndexSpec('accounting_invoices', [('id', 1)], 'idx_accounting_invoices_id'),
+        _tenant('efatura_records', ('invoice_id', 1), name='idx_efatura_records_tenant_invoice'),
+    ]),
+    Migration(5, 'One ledger_meta row per tenant (general ledger initialization marker)', create=[
+        IndexSpec('ledger_meta', [('tenant_id', 1)], 'idx_ledger_meta_tenant', unique=True),
+    ]),
+    Migration(6, 'POS late-ticket adjustments and per-day backfill markers (pos_daily_totals.py)', create=[
+        _tenant('pos_daily_adjustments', ('business_date', 1), ('channel', 1), ('outlet_id', 1),
+                name='idx_pos_daily_adjustments_key', unique=True),
+        _tenant('pos_daily_backfills', ('channel', 1), ('business_date', 1),
+                name='idx_pos_daily_backfills_key', unique=True),
+    ]),
+]
+
+
+def declared_indexes() -> Dict[str, Dict[str, IndexSpec]]:
+    """Live registry: {collection: {name: spec}} after every migration"""
+    registry: Dict[str, Dict[str, IndexSpec]] = {}
+    for migration in MIGRATIONS:
+        for spec in migration.create:
+            registry.setdefault(spec.collection, {})[spec.name] = spec
+        for collection, name in migration.drop:
+            registry.get(collection, {}).pop(name, None)
+    return registry
+
+
+def _key_tuple(keys) -> Tuple:
+    items = keys.items() if isinstance(keys, dict) else keys
+    return tuple((field, direction if isinstance(direction, str) else int(direction)) for field, direction in items)
+
+
+class IndexRegistry:
+    """Applies registry migrations and tracks index usage"""
+
+    def __init__(self, db):
+        self.db = db
+        self.migrations = db.index_migrations
+        self.usage = db.index_usage
+
+    # ------------------------------------------------------------ migrations
+
+    async def applied_versions(self) -> List[int]:
+        docs = await self.migrations.find({'applied_at': {'$exists': True}}, {'_id': 1}).to_list(None)
+        return sorted(doc['_id'] for doc in docs)
+
+    async def pending(self) -> List[Migration]:
+        applied = set(await self.applied_versions())
+        return [m for m in MIGRATIONS if m.version not in applied]
+
+    async def _acquire(self, owner: str) -> bool:
+        now = datetime.now(timezone.utc)
+        lock = {'_id': 'lock', 'owner': owner,
+                'expires_at': (now + timedelta(seconds=INDEX_MIGRATION_LOCK_SECONDS)).isoformat()}
+        try:
+            await self.migrations.insert_one(lock)
+            return True
+        except DuplicateKeyError:
+            # A crashed run leaves its lock until it expires
+            stale = await self.migrations.delete_one({'_id': 'lock', 'expires_at': {'$lt': now.isoformat()}})
+            if not stale.deleted_count:
+                return False
+            try:
+                await self.migrations.insert_one(lock)
+                return True
+            except DuplicateKeyError:
+                return False
+
+    async def _create(self, spec: IndexSpec) -> str:
+        try:
+            await self.db[spec.collection].create_index(spec.keys, name=spec.name, **spec.options)
+            return 'created'
+        except OperationFailure as e:
+            if e.code == INDEX_OPTIONS_CONFLICT:
+                # Same keys already indexed (e.g. by the legacy scripts under a default name)
+                return 'exists'
+            raise
+
+    async def _drop(self, collection: str, name: str) -> str:
+        try:
+            await self.db[collection].drop_index(name)
+            return 'dropped'
+        except OperationFailure as e:
+            if e.code in (INDEX_NOT_FOUND, NAMESPACE_NOT_FOUND) or 'not found' in str(e).lower():
+                return 'absent'
+            raise
+
+    async def migrate(self, target: Optional[int] = None, dry_run: bool = False) -> Dict[str, Any]:
+        """Apply pending migrations in order (up to target); stops at the first failure"""
+        pending = [m for m in await self.pending() if target is None or m.version <= target]
+        if dry_run or not pending:
+            return {
+                'applied': [],
+                'pending': [{'version': m.version, 'description': m.description,
+                             'create': [s.to_dict() for s in m.create], 'drop': m.drop} for m in pending],
+                'dry_run': dry_run
+            }
+
+        owner = str(uuid.uuid4())
+        if not await self._acquire(owner):
+            return {'applied': [], 'status': 'locked', 'message': 'Another index migration is running'}
+
+        applied = []
+        try:
+            for migration in pending:
+                started = datetime.now(timezone.utc)
+                result = {'created': [], 'existing': [], 'dropped': [], 'absent': []}
+                try:
+                    for spec in migration.create:
+                        outcome = await self._create(spec)
+                        result['created' if outcome == 'created' else 'existing'].append(
+                            f'{spec.collection}.{spec.name}')
+                    for collection, name in migration.drop:
+                        outcome = await self._drop(collection, name)
+                        result['dropped' if outcome == 'dropped' else 'absent'].append(f'{collection}.{name}')
+                except Exception as e:
+                    logger.error(f"❌ Index migration {migration.version} failed: {e}")
+                    return {'applied': applied, 'failed': migration.version, 'error': str(e), **result}
+
+                record = {
+                    '_id': migration.version,
+                    'description': migration.description,
+                    'applied_at': datetime.now(timezone.utc).isoformat(),
+                    'duration_ms': int((datetime.now(timezone.utc) - started).total_seconds() * 1000),
+                    **result
+                }
+                await self.migrations.replace_one({'_id': migration.version}, record, upsert=True)
+                applied.append(record)
+                logger.info(f"✅ Index migration {migration.version} applied: {migration.description}")
+        finally:
+            await self.migrations.delete_one({'_id': 'lock', 'owner': owner})
+
+        return {'applied': applied}
+
+    async def ensure(self, collections: Iterable[str]) -> Dict[str, str]:
+        """Create the registry's declared indexes for the given collections (idempotent)"""
+        registry = declared_indexes()
+        results = {}
+        for collection in collections:
+            for spec in registry.get(collection, {}).values():
+                try:
+                    results[f'{collection}.{spec.name}'] = await self._create(spec)
+                except Exception as e:
+                    logger.warning(f"Index {collection}.{spec.name} not created: {e}")
+                    results[f'{collection}.{spec.name}'] = f'error: {e}'
+        return results
+
+    async def ensure_constraints(self) -> Dict[str, str]:
+        """
+        Create every declared unique index. Idempotent writes (ledger source
+        events, POS client_ref dedupe, upsert keys) rely on these, so startup
+        ensures them instead of waiting for the migration run.
+        """
+        results = {}
+        for collection, specs in declared_indexes().items():
+            for spec in specs.values():
+                if not spec.options.get('unique'):
+                    continue
+                try:
+                    results[f'{collection}.{spec.name}'] = await self._create(spec)
+                except Exception as e:
+                    logger.error(f"Unique index {collection}.{spec.name} not created: {e}")
+                    results[f'{collection}.{spec.name}'] = f'error: {e}'
+        return results
+
+    async def status(self) -> Dict[str, Any]:
+        """Applied / pending migrations and declared indexes missing from the database"""
+        applied = await self.migrations.find({'applied_at': {'$exists': True}},
+                                             {'_id': 1, 'description': 1, 'applied_at': 1}).to_list(None)
+        missing = []
+        for collection, specs in declared_indexes().items():
+            try:
+                existing = await self.db[collection].index_information()
+            except Exception:
+                existing = {}
+            existing_keys = {_key_tuple(info['key']) for info in existing.values()}
+            for spec in specs.values():
+                if spec.name not in existing and _key_tuple(spec.keys) not in existing_keys:
+                    missing.append(f'{collection}.{spec.name}')
+        return {
+            'latest_version': MIGRATIONS[-1].version,
+            'applied': sorted(({'version': a['_id'], 'description': a.get('description'),
+                                'applied_at': a.get('applied_at')} for a in applied), key=lambda a: a['version']),
+            'pending': [{'version': m.version, 'description': m.description} for m in await self.pending()],
+            'missing_indexes': missing
+        }
+
+    # ------------------------------------------------------------ usage
+
+    async def record_usage(self, collections: Optional[Iterable[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Sample $indexStats and accumulate per-index ops in index_usage.
+        Counters restart with the server (their `since` changes), so each host's
+        delta is added to a running total rather than stored as-is.
+        """
+        if collections is None:
+            collections = [c for c in await self.db.list_collection_names() if not c.startswith('system.')]
+        now = datetime.now(timezone.utc).isoformat()
+        report: Dict[str, List[Dict[str, Any]]] = {}
+        for collection in collections:
+            try:
+                stats = await self.db[collection].aggregate([{'$indexStats': {}}]).to_list(None)
+            except Exception as e:
+                logger.debug(f"$indexStats unavailable for {collection}: {e}")
+                continue
+            for stat in stats:
+                name = stat.get('name')
+                host = str(stat.get('host', 'local')).replace('.', '_')
+                accesses = stat.get('accesses', {})
+                ops = int(accesses.get('ops', 0))
+                since = accesses.get('since')
+                since = since.isoformat() if hasattr(since, 'isoformat') else str(since)
+
+                doc_id = f'{collection}.{name}'
+                current = await self.usage.find_one({'_id': doc_id}) or {}
+                previous = current.get('hosts', {}).get(host, {})
+                delta = ops - previous.get('ops', 0) if previous.get('since') == since else ops
+                await self.usage.update_one(
+                    {'_id': doc_id},
+                    {'$set': {'collection': collection, 'name': name, 'key': list(stat.get('key', {}).items()),
+                              f'hosts.{host}': {'ops': ops, 'since': since}, 'last_sampled': now},
+                     '$inc': {'ops_total': max(delta, 0)},
+                     '$setOnInsert': {'first_seen': now}},
+                    upsert=True
+                )
+                report.setdefault(collection, []).append({
+                    'name': name, 'ops': ops, 'ops_total': current.get('ops_total', 0) + max(delta, 0),
+                    'since': since
+                })
+        return report
+
+    async def unused(self, min_days: int = INDEX_UNUSED_MIN_DAYS) -> Dict[str, List[Dict[str, Any]]]:
+        """Indexes with no recorded use over at least min_days of sampling"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=min_days)).isoformat()
+        registry = declared_indexes()
+        droppable, declared = [], []
+        async for doc in self.usage.find({'ops_total': 0, 'first_seen': {'$lte': cutoff}}):
+            collection, name = doc['collection'], doc['name']
+            if name == '_id_':
+                continue
+            try:
+                info = (await self.db[collection].index_information()).get(name)
+            except Exception:
+                info = None
+            if not info:
+                # Index is gone; forget its history
+                await self.usage.delete_one({'_id': doc['_id']})
+                continue
+            entry = {'collection': collection, 'name': name, 'key': info['key'], 'first_seen': doc['first_seen']}
+            declared_keys = {_key_tuple(s.keys) for s in registry.get(collection, {}).values()}
+            if name in registry.get(collection, {}) or _key_tuple(info['key']) in declared_keys:
+                declared.append(entry)
+            elif info.get('unique') or 'expireAfterSeconds' in info:
+                # Unique and TTL indexes enforce behaviour even when no query reads them
+                continue
+            else:
+                droppable.append(entry)
+        return {'droppable': droppable, 'declared_unused': declared}
+
+    async def drop_unused(self, min_days: int = INDEX_UNUSED_MIN_DAYS, dry_run: bool = True) -> Dict[str, Any]:
+        """
+        Drop undeclared indexes with no use over min_days. Declared indexes are
+        only reported: retire them with a new migration so the registry agrees.
+        """
+        await self.record_usage()
+        candidates = await self.unused(min_days)
+        dropped = []
+        if not dry_run:
+            for entry in candidates['droppable']:
+                if await self._drop(entry['collection'], entry['name']) == 'dropped':
+                    await self.usage.delete_one({'_id': f"{entry['collection']}.{entry['name']}"})
+                    dropped.append(f"{entry['collection']}.{entry['name']}")
+                    logger.info(f"🗑️ Dropped unused index {entry['collection']}.{entry['name']}")
+        return {**candidates, 'dropped': dropped, 'dry_run': dry_run}
+
+
+index_registry = None
+
+
+def get_index_registry(db):
+    global index_registry
+    if index_registry is None:
+        index_registry = IndexRegistry(db)
+    return index_registry
+
+
+# ------------------------------------------------------------ admin endpoints
+
+index_router = APIRouter(prefix="/api/monitoring/indexes", tags=["Indexes"])
+
+
+class IndexMigrateRequest(BaseModel):
+    target_version: Optional[int] = None
+    dry_run: bool = False
+
+
+class DropUnusedRequest(BaseModel):
+    min_days: int = INDEX_UNUSED_MIN_DAYS
+    dry_run: bool = True
+
+
+@index_router.get("/status")
+async def get_index_status(request: Request):
+    """Applied / pending migrations and declared indexes missing from the database"""
+    return await get_index_registry(request.app.state.db).status()
+
+
+@index_router.post("/migrate")
+async def run_index_migrations(payload: IndexMigrateRequest, request: Request):
+    """Apply pending index migrations (index builds run on the database, not at startup)"""
+    return await get_index_registry(request.app.state.db).migrate(payload.target_version, payload.dry_run)
+
+
+@index_router.get("/usage")
+async def get_index_usage(request: Request, collection: Optional[str] = None):
+    """Sample $indexStats now and return cumulative per-index usage"""
+    registry = get_index_registry(request.app.state.db)
+    return {'usage': await registry.record_usage([collection] if collection else None),
+            'timestamp': datetime.now(timezone.utc).isoformat()}
+
+
+@index_router.post("/drop-unused")
+async def drop_unused_indexes(payload: DropUnusedRequest, request: Request):
+    """Drop undeclared indexes unused for min_days (dry run by default)"""
+    return await get_index_registry(request.app.state.db).drop_unused(payload.min_days, payload.dry_run)
+
+
+@index_router.get("/suggestions")
+async def get_index_suggestions(request: Request, limit: int = 500):
+    """Missing-index suggestions from profiled query shapes (system.profile)"""
+    from query_analyzer import QueryAnalyzer
+    analyzer = QueryAnalyzer(db=request.app.state.db)
+    return {'suggestions': await analyzer.find_missing_indexes(limit=min(max(limit, 1), 5000), verbose=False),
+            'timestamp': datetime.now(timezone.utc).isoformat()}
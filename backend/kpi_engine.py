@@ -0,0 +1,327 @@
+"""
+KPI Engine - declared metrics compiled into per-collection aggregations
+A metric names a collection, a filter and the $group accumulators it needs
+(optionally grouped by a key). All metrics of a bundle that read the same
+collection are compiled into ONE pipeline ($match on the union of their
+filters, then a $facet with one branch per metric), and the per-collection
+pipelines run concurrently. Results are cached per (tenant, bundle, business
+date), so a dashboard load costs a few aggregations instead of a chain of
+sequential counts and Python-side sums.
+
+Bundles used by the executive, GM and finance dashboards are declared at the
+bottom of this module (executive_metrics, flash_metrics, ...).
+"""
+
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+KPI_CACHE_TTL_SECONDS = int(os.environ.get('KPI_CACHE_TTL_SECONDS', '60'))
+KPI_CLOSED_DAY_TTL_SECONDS = int(os.environ.get('KPI_CLOSED_DAY_TTL_SECONDS', '900'))
+KPI_CACHE_MAX_ENTRIES = int(os.environ.get('KPI_CACHE_MAX_ENTRIES', '5000'))
+
+# Accumulator helpers ($group expressions)
+COUNT = {'$sum': 1}
+
+
+def total(field: str) -> Dict[str, Any]:
+    return {'$sum': {'$ifNull': [f'${field}', 0]}}
+
+
+def average(field: str) -> Dict[str, Any]:
+    return {'$avg': f'${field}'}
+
+
+def count_if(expression: Dict[str, Any]) -> Dict[str, Any]:
+    return {'$sum': {'$cond': [expression, 1, 0]}}
+
+
+class Metric:
+    """One KPI input: a filtered $group over a single collection"""
+
+    def __init__(self, collection: str, match: Optional[Dict[str, Any]] = None,
+                 by: Optional[str] = None, **fields: Dict[str, Any]):
+        self.collection = collection
+        self.match = match or {}
+        self.by = by
+        self.fields = fields or {'count': COUNT}
+
+    def stages(self) -> List[Dict[str, Any]]:
+        stages = [{'$match': self.match}] if self.match else []
+        stages.append({'$group': {'_id': f'${self.by}' if self.by else None, **self.fields}})
+        return stages
+
+    def empty(self) -> Dict[str, Any]:
+        return {} if self.by else {name: 0 for name in self.fields}
+
+    def read(self, groups: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if self.by:
+            return {g['_id']: {k: v for k, v in g.items() if k != '_id'} for g in groups}
+        if not groups:
+            return self.empty()
+        row = {k: v for k, v in groups[0].items() if k != '_id'}
+        return {name: (row.get(name) if row.get(name) is not None else 0) for name in self.fields}
+
+
+def compile_pipelines(tenant_id: str, metrics: Dict[str, Metric]) -> Dict[str, List[Dict[str, Any]]]:
+    """{collection: pipeline}; one pipeline per collection however many metrics read it"""
+    by_collection: Dict[str, Dict[str, Metric]] = {}
+    for name, metric in metrics.items():
+        by_collection.setdefault(metric.collection, {})[name] = metric
+
+    pipelines = {}
+    for collection, group in by_collection.items():
+        match: Dict[str, Any] = {'tenant_id': tenant_id}
+        filters = [m.match for m in group.values()]
+        if len(group) == 1:
+            metric, = group.values()
+            pipelines[collection] = [{'$match': {**match, **metric.match}}] + metric.stages()[-1:]
+            continue
+        if all(filters):
+            # Only read documents at least one branch needs
+            match['$or'] = filters
+        pipelines[collection] = [
+            {'$match': match},
+            {'$facet': {name: metric.stages() for name, metric in group.items()}},
+        ]
+    return pipelines
+
+
+class KPIEngine:
+    """Runs metric bundles and caches them per tenant and business date"""
+
+    def __init__(self, db):
+        self.db = db
+        self._cache: Dict[tuple, Dict[str, Any]] = {}
+        self._locks: Dict[tuple, asyncio.Lock] = {}
+
+    async def _run(self, tenant_id: str, metrics: Dict[str, Metric]) -> Dict[str, Any]:
+        pipelines = compile_pipelines(tenant_id, metrics)
+        collections = list(pipelines)
+        outputs = await asyncio.gather(*[
+            self.db[collection].aggregate(pipelines[collection]).to_list(None)
+            for collection in collections
+        ])
+
+        values: Dict[str, Any] = {}
+        for collection, output in zip(collections, outputs):
+            names = [n for n, m in metrics.items() if m.collection == collection]
+            if len(names) == 1:
+                values[names[0]] = metrics[names[0]].read(output)
+                continue
+            facets = output[0] if output else {}
+            for name in names:
+                values[name] = metrics[name].read(facets.get(name) or [])
+        return values
+
+    async def _cached(self, key: tuple, producer) -> Dict[str, Any]:
+        today = datetime.now(timezone.utc).date().isoformat()
+        ttl = KPI_CACHE_TTL_SECONDS if key[2] >= today else KPI_CLOSED_DAY_TTL_SECONDS
+        entry = self._cache.get(key)
+        if entry and time.monotonic() - entry['computed_at'] < ttl:
+            return entry['values']
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            entry = self._cache.get(key)
+            if entry and time.monotonic() - entry['computed_at'] < ttl:
+                return entry['values']
+            values = await producer()
+            self._store(key, {'values': values, 'computed_at': time.monotonic()})
+            return values
+
+    def _store(self, key: tuple, entry: Dict[str, Any]):
+        """Insert as most recent; past KPI_CACHE_MAX_ENTRIES the least recently computed keys go"""
+        self._cache.pop(key, None)
+        self._cache[key] = entry
+        while len(self._cache) > KPI_CACHE_MAX_ENTRIES:
+            oldest = next(iter(self._cache))
+            self._cache.pop(oldest)
+            lock = self._locks.get(oldest)
+            if lock is not None and not lock.locked():
+                self._locks.pop(oldest)
+
+    async def compute(self, tenant_id: str, metrics: Dict[str, Metric], bundle: Optional[str] = None,
+                      business_date: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Evaluate a metric bundle. Named bundles are cached per business date:
+        today's figures for KPI_CACHE_TTL_SECONDS, closed days longer.
+        """
+        if not bundle:
+            return await self._run(tenant_id, metrics)
+        business_date = business_date or datetime.now(timezone.utc).date().isoformat()
+        return await self._cached((tenant_id, bundle, business_date), lambda: self._run(tenant_id, metrics))
+
+    def invalidate(self, tenant_id: str, bundle: Optional[str] = None):
+        for key in [k for k in self._cache if k[0] == tenant_id and (bundle is None or k[1] == bundle)]:
+            self._cache.pop(key, None)
+
+    # ------------------------------------------------------------ bundles
+
+    async def executive_snapshot(self, tenant_id: str) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        return await self.compute(tenant_id, executive_metrics(now), 'executive', now.date().isoformat())
+
+    async def daily_flash(self, tenant_id: str, business_date: date) -> Dict[str, Any]:
+        return await self.compute(tenant_id, flash_metrics(business_date), 'daily_flash', business_date.isoformat())
+
+    async def finance_snapshot(self, tenant_id: str) -> Dict[str, Any]:
+        today = datetime.now(timezone.utc).date()
+
+        async def produce():
+            # Open company folios are read alongside the other metrics; their
+            # balances need the folio ids, so charges/payments per folio follow
+            folios, values = await asyncio.gather(
+                self.db.folios.find(
+                    {'tenant_id': tenant_id, 'folio_type': 'company', 'status': 'open'},
+                    {'_id': 0, 'id': 1, 'created_at': 1}
+                ).to_list(None),
+                self._run(tenant_id, finance_metrics(today))
+            )
+            values['company_folios'] = folios
+            if folios:
+                values.update(await self._run(tenant_id, folio_balance_metrics([f['id'] for f in folios])))
+            else:
+                values.update({'folio_charges': {}, 'folio_payments': {}})
+            return values
+
+        return await self._cached((tenant_id, 'finance', today.isoformat()), produce)
+
+    async def gm_snapshot(self, tenant_id: str) -> Dict[str, Any]:
+        today = datetime.now(timezone.utc).date()
+        return await self.compute(tenant_id, gm_metrics(today), 'gm_snapshot', today.isoformat())
+
+
+# ---------------------------------------------------------------- declarations
+
+def _day_bounds(day: date) -> tuple:
+    start = datetime.combine(day, datetime.min.time()).replace(tzinfo=timezone.utc)
+    end = datetime.combine(day, datetime.max.time()).replace(tzinfo=timezone.utc)
+    return start.isoformat(), end.isoformat()
+
+
+def executive_metrics(now: datetime) -> Dict[str, Metric]:
+    """Occupancy, 24h revenue with its prior-day trend, ADR, RevPAR inputs, NPS and cash"""
+    yesterday = (now - timedelta(days=1)).isoformat()
+    two_days_ago = (now - timedelta(days=2)).isoformat()
+    stays = {'status': {'$in': ['checked_in', 'checked_out']}, 'check_in': {'$gte': yesterday}}
+    return {
+        'rooms': Metric('rooms', total=COUNT, occupied=count_if({'$eq': ['$status', 'occupied']})),
+        'payments_24h': Metric('payments', {'payment_date': {'$gte': yesterday}}, amount=total('amount')),
+        'payments_prev_24h': Metric('payments', {'payment_date': {'$gte': two_days_ago, '$lt': yesterday}},
+                                    amount=total('amount')),
+        'stays_24h': Metric('bookings', stays, count=COUNT, amount=total('total_amount')),
+        'reviews': Metric('reviews', count=COUNT, rating=total('rating')),
+        'cash': Metric('bank_accounts', balance=total('balance')),
+    }
+
+
+def flash_metrics(day: date) -> Dict[str, Metric]:
+    """Daily flash: occupancy, movements and revenue by charge category for one business date"""
+    start, end = _day_bounds(day)
+    # Booking dates are compared against naive bounds, as the flash report always has
+    naive_start = datetime.combine(day, datetime.min.time()).isoformat()
+    naive_end = datetime.combine(day, datetime.max.time()).isoformat()
+    day_str = day.isoformat()
+    return {
+        'rooms': Metric('rooms', total=COUNT,
+                        occupied_now=count_if({'$eq': ['$current_status', 'occupied']})),
+        'in_house': Metric('bookings', {'status': 'checked_in', 'check_in': {'$lte': naive_end},
+                                        'check_out': {'$gte': naive_start}}),
+        'arrivals': Metric('bookings', {'check_in': {'$gte': naive_start, '$lte': naive_end}}),
+        'departures': Metric('bookings', {'check_out': {'$gte': naive_start, '$lte': naive_end}}),
+        'expected_arrivals': Metric('bookings', {'check_in': day_str,
+                                                 'status': {'$in': ['confirmed', 'checked_in']}}),
+        'expected_departures': Metric('bookings', {'check_out': day_str,
+                                                   'status': {'$in': ['checked_in', 'checked_out']}}),
+        'charges_by_category': Metric('folio_charges', {'date': {'$gte': start, '$lte': end}, 'voided': False},
+                                      by='charge_category', amount=total('total')),
+    }
+
+
+def finance_metrics(today: date) -> Dict[str, Metric]:
+    """Collections today and month-to-date, MTD revenue and pending accounting invoices"""
+    today_start, today_end = _day_bounds(today)
+    month_start, _ = _day_bounds(today.replace(day=1))
+    return {
+        'collections_today': Metric('payments', {'processed_at': {'$gte': today_start, '$lte': today_end}},
+                                    count=COUNT, amount=total('amount')),
+        'collections_mtd': Metric('payments', {'processed_at': {'$gte': month_start, '$lte': today_end}},
+                                  amount=total('amount')),
+        'revenue_mtd': Metric('folio_charges', {'date': {'$gte': month_start, '$lte': today_end}, 'voided': False},
+                              amount=total('total')),
+        'pending_invoices': Metric('accounting_invoices', {'status': {'$in': ['pending', 'partial']}},
+                                   count=COUNT, amount=total('total')),
+    }
+
+
+def folio_balance_metrics(folio_ids: Iterable[str]) -> Dict[str, Metric]:
+    """Charges and payments per folio (balance = charges - payments)"""
+    ids = list(folio_ids)
+    return {
+        'folio_charges': Metric('folio_charges', {'folio_id': {'$in': ids}, 'voided': False},
+                                by='folio_id', amount=total('total')),
+        'folio_payments': Metric('payments', {'folio_id': {'$in': ids}, 'voided': False},
+                                 by='folio_id', amount=total('amount')),
+    }
+
+
+def gm_metrics(today: date) -> Dict[str, Metric]:
+    """Today's GM snapshot: occupancy, revenue, check-ins/outs, complaints and urgent tasks"""
+    day = today.isoformat()
+    return {
+        'rooms': Metric('rooms', total=COUNT, occupied=count_if({'$eq': ['$status', 'occupied']})),
+        'payments_today': Metric('payments', {'payment_date': {'$gte': day}}, amount=total('amount')),
+        'check_ins': Metric('bookings', {'check_in': day, 'status': 'checked_in'}),
+        'check_outs': Metric('bookings', {'check_out': day, 'status': 'checked_out'}),
+        'complaints': Metric('feedback', {'rating': {'$lte': 2}, 'created_at': {'$gte': day}}),
+        'urgent_tasks': Metric('maintenance_tasks', {'status': 'pending', 'priority': {'$in': ['high', 'urgent']}}),
+    }
+
+
+def portfolio_metrics(day: date, pickup_days: int = 7, drilldown: bool = False) -> Dict[str, Metric]:
+    """One property's day: inventory, rooms sold, room revenue and pickup (ADR/RevPAR inputs)"""
+    d = day.isoformat()
+    next_day = (day + timedelta(days=1)).isoformat()
+    pickup_from = (day - timedelta(days=pickup_days - 1)).isoformat()
+    sold = {'status': {'$in': ['confirmed', 'guaranteed', 'checked_in', 'checked_out']},
+            'check_in': {'$lt': next_day}, 'check_out': {'$gt': d}}
+    pickup = {'status': {'$nin': ['cancelled', 'no_show']}, 'created_at': {'$gte': pickup_from, '$lt': next_day}}
+    in_house_fields = {'rooms_sold': COUNT, 'guests': total('adults'), 'children': total('children'),
+                       'base_rate': total('base_rate')}
+    metrics = {
+        'rooms': Metric('rooms', {'status': {'$ne': 'out_of_order'}, 'room_status': {'$ne': 'out_of_order'}},
+                        total=COUNT,
+                        occupied=count_if({'$or': [{'$eq': ['$status', 'occupied']},
+                                                   {'$eq': ['$room_status', 'occupied']}]})),
+        'in_house': Metric('bookings', sold, **in_house_fields),
+        'pickup': Metric('bookings', pickup, bookings=COUNT, revenue=total('total_amount')),
+        'charges_by_category': Metric('folio_charges', {
+            'voided': False,
+            '$or': [{'charge_date': d}, {'date': {'$gte': d, '$lt': next_day}}],
+        }, by='charge_category', amount=total('total')),
+    }
+    if drilldown:
+        metrics['by_room_type'] = Metric('bookings', sold, by='room_type', **in_house_fields)
+        metrics['by_segment'] = Metric('bookings', sold, by='market_segment', **in_house_fields)
+        metrics['pickup_by_channel'] = Metric('bookings', pickup, by='channel', bookings=COUNT,
+                                              revenue=total('total_amount'))
+    return metrics
+
+
+def category_totals(groups: Dict[Any, Dict[str, Any]]) -> Dict[str, float]:
+    """{'room': x, 'fb': y, 'other': z, 'total': t} from a by='charge_category' metric"""
+    room = sum(g.get('amount', 0) for k, g in groups.items() if k == 'room')
+    fb = sum(g.get('amount', 0) for k, g in groups.items() if k in ('food', 'beverage'))
+    total_amount = sum(g.get('amount', 0) for g in groups.values())
+    return {'room': room, 'fb': fb, 'other': total_amount - room - fb, 'total': total_amount}
+
+
+kpi_engine = None
+
+
+def get_kpi_engine(db):
+    global kpi_engine
+    if kpi_engine is None:
+        kpi_engine = KPIEngine(db)
+    return kpi_engine
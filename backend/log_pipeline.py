@@ -0,0 +1,310 @@
+"""
+Log Pipeline - buffered audit / operational log writer
+Request handlers hand log documents to an in-process bounded buffer per
+collection; a flusher writes each buffer with one insert_many when it
+reaches FLUSH_BATCH_SIZE or every FLUSH_INTERVAL_SECONDS. Per-collection
+policy when a buffer is full:
+
+- block: the caller flushes inline (backpressure; nothing is lost)
+- drop:  the entry is discarded and counted (high-volume, low-value logs)
+
+Every flush also $inc's log_counters (per tenant / collection: an all-time
+row and hourly rows with status/severity breakdowns) so dashboards read a
+few counter rows instead of count_documents over unbounded collections.
+Entries carry a BSON 'ts' date used for TTL retention; api_logs is created
+as a time-series collection.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = int(os.environ.get('LOG_FLUSH_BATCH_SIZE', '500'))
+FLUSH_INTERVAL_SECONDS = float(os.environ.get('LOG_FLUSH_INTERVAL_SECONDS', '1.0'))
+HOURLY_COUNTER_DAYS = 8
+
+# collection: (buffer capacity, full-buffer policy, retention days)
+LOG_POLICIES = {
+    'audit_logs': (5000, 'block', 730),
+    'error_logs': (2000, 'block', 180),
+    'api_logs': (2000, 'drop', 30),
+    'night_audit_logs': (500, 'block', 730),
+    'ota_sync_logs': (2000, 'block', 90),
+    'rms_publish_logs': (1000, 'block', 180),
+    'maintenance_prediction_logs': (1000, 'drop', 180),
+    'alert_history': (1000, 'block', 730),
+}
+TIMESERIES_COLLECTIONS = {'api_logs'}
+
+
+def _hour(ts: datetime) -> str:
+    return ts.strftime('%Y-%m-%dT%H')
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return datetime.now(timezone.utc)
+
+
+def _label(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = getattr(value, 'value', value)
+    return str(value).replace('.', '_').lstrip('$') or None
+
+
+def counter_updates(collection: str, docs: Iterable[Dict[str, Any]], dropped: Dict[Any, int] = None,
+                    include_total: bool = True) -> List[UpdateOne]:
+    """$inc operations for a batch: one all-time row and one hourly row per tenant/hour"""
+    rows: Dict[tuple, Dict[str, int]] = {}
+    buckets = ('total',) if include_total else ()
+
+    def add(key, field, n=1):
+        inc = rows.setdefault(key, {})
+        inc[field] = inc.get(field, 0) + n
+
+    for doc in docs:
+        tenant_id = doc.get('tenant_id')
+        for bucket in buckets + (_hour(doc['ts']),):
+            key = (tenant_id, bucket)
+            add(key, 'count')
+            status, severity = _label(doc.get('status')), _label(doc.get('severity'))
+            if status:
+                add(key, f'status.{status}')
+            if severity:
+                add(key, f'severity.{severity}')
+    for tenant_id, n in (dropped or {}).items():
+        add((tenant_id, 'total'), 'dropped', n)
+
+    ops = []
+    for (tenant_id, bucket), inc in rows.items():
+        update: Dict[str, Any] = {'$inc': inc}
+        if bucket != 'total':
+            expires = datetime.strptime(bucket, '%Y-%m-%dT%H').replace(tzinfo=timezone.utc) \
+                + timedelta(days=HOURLY_COUNTER_DAYS)
+            update['$setOnInsert'] = {'expires_at': expires}
+        ops.append(UpdateOne({'tenant_id': tenant_id, 'collection': collection, 'bucket': bucket}, update, upsert=True))
+    return ops
+
+
+class LogPipeline:
+    """Bounded per-collection buffers flushed in batches"""
+
+    def __init__(self, db, batch_size: int = FLUSH_BATCH_SIZE, interval: float = FLUSH_INTERVAL_SECONDS):
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = interval
+        self._buffers: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._dropped: Dict[str, Dict[Any, int]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self.stats = {'written': 0, 'dropped': 0, 'flushes': 0, 'failed_flushes': 0}
+
+    # -- lifecycle --
+
+    async def setup_collections(self):
+        existing = set(await self.db.list_collection_names())
+        for name, (_, _, days) in LOG_POLICIES.items():
+            ttl = days * 86400
+            try:
+                if name in TIMESERIES_COLLECTIONS and name not in existing:
+                    await self.db.create_collection(
+                        name, timeseries={'timeField': 'ts', 'metaField': 'tenant_id', 'granularity': 'seconds'},
+                        expireAfterSeconds=ttl
+                    )
+                    continue
+                await self.db[name].create_index([('ts', 1)], name=f'ttl_{name}_ts', expireAfterSeconds=ttl)
+            except Exception as e:
+                logger.warning(f"Log collection setup for {name}: {e}")
+        await self.db.log_counters.create_index(
+            [('tenant_id', 1), ('collection', 1), ('bucket', 1)], name='uniq_log_counters_bucket', unique=True
+        )
+        await self.db.log_counters.create_index([('expires_at', 1)], name='ttl_log_counters', expireAfterSeconds=0)
+
+    async def start(self):
+        if self._running:
+            return
+        self._running = True
+        await self.setup_collections()
+        self._task = asyncio.create_task(self._flusher(), name='log-flusher')
+        logger.info("🪵 Log pipeline started")
+
+    async def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush_all()
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    # -- submit --
+
+    async def submit(self, collection: str, doc: Dict[str, Any]):
+        capacity, policy, _ = LOG_POLICIES.get(collection, (1000, 'block', 365))
+        buffer = self._buffers.setdefault(collection, deque())
+        if len(buffer) >= capacity:
+            if policy == 'drop':
+                dropped = self._dropped.setdefault(collection, {})
+                dropped[doc.get('tenant_id')] = dropped.get(doc.get('tenant_id'), 0) + 1
+                self.stats['dropped'] += 1
+                return
+            await self.flush(collection)
+        entry = dict(doc)  # insert_many adds _id; callers may still return their dict
+        entry.setdefault('ts', _as_datetime(entry.get('timestamp')))
+        buffer.append(entry)
+        if len(buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    # -- flush --
+
+    async def flush(self, collection: str) -> int:
+        lock = self._locks.setdefault(collection, asyncio.Lock())
+        async with lock:
+            buffer = self._buffers.get(collection)
+            dropped = self._dropped.pop(collection, None)
+            if not buffer and not dropped:
+                return 0
+            batch = list(buffer or [])
+            if buffer:
+                buffer.clear()
+            try:
+                if batch:
+                    await self.db[collection].insert_many(batch, ordered=False)
+            except Exception as e:
+                self.stats['failed_flushes'] += 1
+                logger.warning(f"Log flush for {collection} failed ({len(batch)} entries): {e}")
+                # Keep what still fits for the next attempt
+                capacity = LOG_POLICIES.get(collection, (1000,))[0]
+                buffer = self._buffers.setdefault(collection, deque())
+                for entry in reversed(batch[:max(capacity - len(buffer), 0)]):
+                    entry.pop('_id', None)
+                    buffer.appendleft(entry)
+                pending = self._dropped.setdefault(collection, {})
+                for tenant_id, n in (dropped or {}).items():
+                    pending[tenant_id] = pending.get(tenant_id, 0) + n
+                return 0
+            try:
+                ops = counter_updates(collection, batch, dropped)
+                if ops:
+                    await self.db.log_counters.bulk_write(ops, ordered=False)
+            except Exception as e:
+                logger.warning(f"Log counters for {collection} not updated: {e}")
+            self.stats['written'] += len(batch)
+            self.stats['flushes'] += 1
+            return len(batch)
+
+    async def flush_all(self) -> int:
+        return sum([await self.flush(name) for name in list(set(self._buffers) | set(self._dropped))])
+
+    async def _flusher(self):
+        while self._running:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush_all()
+            except Exception as e:
+                logger.warning(f"Log flusher error: {e}")
+
+    # -- counters --
+
+    async def ensure_counters(self, tenant_id: str, collections: Iterable[str]):
+        """Seed counters once from existing documents (history written before the pipeline)"""
+        if await self.db.log_counter_meta.find_one({'tenant_id': tenant_id}, {'_id': 1}):
+            return
+        since = datetime.now(timezone.utc) - timedelta(hours=24)
+        for name in collections:
+            total = await self.db[name].count_documents({'tenant_id': tenant_id})
+            await self.db.log_counters.update_one(
+                {'tenant_id': tenant_id, 'collection': name, 'bucket': 'total'},
+                {'$set': {'count': total}}, upsert=True
+            )
+            recent = await self.db[name].find(
+                {'tenant_id': tenant_id, 'timestamp': {'$gte': since.isoformat()}},
+                {'_id': 0, 'tenant_id': 1, 'timestamp': 1, 'status': 1, 'severity': 1}
+            ).to_list(None)
+            for doc in recent:
+                doc['ts'] = _as_datetime(doc.get('timestamp'))
+            # Raw documents already include anything flushed before seeding
+            await self.db.log_counters.delete_many({
+                'tenant_id': tenant_id, 'collection': name, 'bucket': {'$gte': _hour(since), '$lt': 'total'}
+            })
+            ops = counter_updates(name, recent, include_total=False)
+            if ops:
+                await self.db.log_counters.bulk_write(ops, ordered=False)
+        await self.db.log_counter_meta.update_one(
+            {'tenant_id': tenant_id}, {'$set': {'seeded_at': datetime.now(timezone.utc).isoformat()}}, upsert=True
+        )
+
+    async def counters(self, tenant_id: str, collections: Iterable[str], hours: int = 24) -> Dict[str, Dict[str, Any]]:
+        """{collection: {'total': n, 'recent': {'count', 'status': {...}, 'severity': {...}}}}"""
+        collections = list(collections)
+        await self.flush_all()
+        await self.ensure_counters(tenant_id, collections)
+        start = _hour(datetime.now(timezone.utc) - timedelta(hours=hours - 1))
+        out = {name: {'total': 0, 'dropped': 0, 'recent': {'count': 0, 'status': {}, 'severity': {}}}
+               for name in collections}
+        async for row in self.db.log_counters.find({
+            'tenant_id': tenant_id, 'collection': {'$in': collections},
+            '$or': [{'bucket': 'total'}, {'bucket': {'$gte': start, '$lt': 'total'}}]
+        }, {'_id': 0}):
+            summary = out[row['collection']]
+            if row['bucket'] == 'total':
+                summary['total'] = row.get('count', 0)
+                summary['dropped'] = row.get('dropped', 0)
+                continue
+            recent = summary['recent']
+            recent['count'] += row.get('count', 0)
+            for field in ('status', 'severity'):
+                for k, v in (row.get(field) or {}).items():
+                    recent[field][k] = recent[field].get(k, 0) + v
+        return out
+
+
+log_pipeline: Optional[LogPipeline] = None
+
+
+async def init_log_pipeline(db, **kwargs) -> LogPipeline:
+    global log_pipeline
+    if log_pipeline is None:
+        log_pipeline = LogPipeline(db, **kwargs)
+    await log_pipeline.start()
+    return log_pipeline
+
+
+def get_log_pipeline() -> Optional[LogPipeline]:
+    return log_pipeline
+
+
+async def write_log(db, collection: str, doc: Dict[str, Any]):
+    """Buffered when the pipeline runs (API process), direct insert otherwise (scripts, workers)"""
+    if log_pipeline is not None and log_pipeline.running:
+        await log_pipeline.submit(collection, doc)
+        return
+    entry = dict(doc)
+    entry.setdefault('ts', _as_datetime(entry.get('timestamp')))
+    await db[collection].insert_one(entry)
+    await db.log_counters.bulk_write(counter_updates(collection, [entry]), ordered=False)
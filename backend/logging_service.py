@@ -1,6 +1,8 @@
 """
 Logging Service for Hotel PMS
 Centralized logging for production monitoring
+Log entries go through the buffered log pipeline (log_pipeline.py);
+alerts are written immediately.
 """
 
 from datetime import datetime, timezone
@@ -9,6 +11,8 @@ from enum import Enum
 import traceback
 import json
 
+from log_pipeline import write_log
+
 
 class LogLevel(str, Enum):
     """Log severity levels"""
@@ -93,7 +97,7 @@ class LoggingService:
             'resolution_notes': None
         }
         
-        await self.db.error_logs.insert_one(log_entry)
+        await write_log(self.db, 'error_logs', log_entry)
         
         # Also create an alert for critical errors
         if severity == LogLevel.CRITICAL:
@@ -145,7 +149,7 @@ class LoggingService:
             'metadata': metadata or {}
         }
         
-        await self.db.night_audit_logs.insert_one(log_entry)
+        await write_log(self.db, 'night_audit_logs', log_entry)
         
         # Create alert if audit failed
         if status == 'failed':
@@ -197,7 +201,7 @@ class LoggingService:
             'metadata': metadata or {}
         }
         
-        await self.db.ota_sync_logs.insert_one(log_entry)
+        await write_log(self.db, 'ota_sync_logs', log_entry)
         
         # Create alert if sync failed
         if status == 'failed':
@@ -257,7 +261,7 @@ class LoggingService:
             'metadata': metadata or {}
         }
         
-        await self.db.rms_publish_logs.insert_one(log_entry)
+        await write_log(self.db, 'rms_publish_logs', log_entry)
         
         # Create alert if publishing failed
         if status == 'failed':
@@ -317,7 +321,7 @@ class LoggingService:
             'metadata': metadata or {}
         }
         
-        await self.db.maintenance_prediction_logs.insert_one(log_entry)
+        await write_log(self.db, 'maintenance_prediction_logs', log_entry)
         
         # Create alert for high-risk predictions
         if prediction_result == 'high':
@@ -370,7 +374,7 @@ class LoggingService:
         
         # Insert into both alerts collection and alert_history
         await self.db.alerts.insert_one(alert_entry)
-        await self.db.alert_history.insert_one(alert_entry)
+        await write_log(self.db, 'alert_history', alert_entry)
         
         return alert_id
     
@@ -401,7 +405,7 @@ class LoggingService:
         
         # Only log slow requests (>2s) or errors to reduce storage
         if duration_ms and duration_ms > 2000 or status_code >= 400:
-            await self.db.api_logs.insert_one(log_entry)
+            await write_log(self.db, 'api_logs', log_entry)
 
 
 # Helper function to capture exception details
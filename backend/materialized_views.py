@@ -1,290 +1,561 @@
 """
 Materialized Views System
 Pre-computed dashboard metrics for ultra-fast loading
+
+Views are tenant-aware and stored as partitions in materialized_view_partitions:
+one 'summary' partition per tenant (point-in-time figures) and one
+'day:YYYY-MM-DD' partition per tenant and business date inside the view's
+window. Each view declares its source collections; a refresh only recomputes
+the tenant/date partitions touched since the previous refresh (documents whose
+updated_at / created_at is past the watermark), plus any summary or today
+partition older than MV_MAX_STALENESS_SECONDS. Writes that do not stamp
+updated_at are caught by a full window rebuild every MV_RECONCILE_SECONDS.
+Per-view refresh state (the watermark) lives in materialized_views.
 """
-from datetime import datetime, timedelta
+import asyncio
+import contextlib
+import os
+from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import ASCENDING, DESCENDING
+from pymongo import UpdateOne
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
 
 logger = logging.getLogger(__name__)
 
+MV_REFRESH_INTERVAL_SECONDS = int(os.environ.get('MV_REFRESH_INTERVAL_SECONDS', '60'))
+MV_MAX_STALENESS_SECONDS = int(os.environ.get('MV_MAX_STALENESS_SECONDS', '300'))
+MV_RECONCILE_SECONDS = int(os.environ.get('MV_RECONCILE_SECONDS', '3600'))
+
+
+class ViewDefinition:
+    """A view, its source collections and the date fields that partition them"""
+
+    def __init__(self, name: str, view_type: str, sources: Dict[str, tuple], window_days: int = 30):
+        self.name = name
+        self.view_type = view_type
+        # {collection: (date_from_field, date_to_field)}; () = summary-only source
+        self.sources = sources
+        self.window_days = window_days
+
+
+DASHBOARD_VIEW = ViewDefinition(
+    'dashboard_metrics', 'dashboard',
+    sources={
+        'bookings': ('check_in', 'check_out'),
+        'folios': ('created_at', 'created_at'),
+        'rooms': (),
+        'guests': (),
+    },
+)
+
+VIEWS = {view.name: view for view in [DASHBOARD_VIEW]}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, str) and value:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    return None
+
+
+def _age_seconds(value) -> Optional[float]:
+    parsed = _parse(value)
+    return (_now() - parsed).total_seconds() if parsed else None
+
+
+def _window(view: ViewDefinition) -> List[str]:
+    today = _now().date()
+    return [(today - timedelta(days=i)).isoformat() for i in range(view.window_days)]
+
+
+def _expand(date_from, date_to, window: Set[str]) -> Set[str]:
+    """Window dates covered by [date_from, date_to] (ISO date or datetime strings)"""
+    start = str(date_from or '')[:10]
+    end = str(date_to or date_from or '')[:10]
+    if not start:
+        return set()
+    return {d for d in window if start <= d <= end}
+
+
 class MaterializedViewsManager:
-    def __init__(self, db):
+    def __init__(self, db, interval: int = MV_REFRESH_INTERVAL_SECONDS):
         self.db = db
         self.views = db.materialized_views
+        self.partitions = db.materialized_view_partitions
         self.bookings = db.bookings
         self.rooms = db.rooms
         self.guests = db.guests
         self.folios = db.folios
-        
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        # (view, tenant) locks serialize a tenant's partition writes; (view, None) guards the all-tenant run
+        self._locks: Dict[Tuple[str, Optional[str]], asyncio.Lock] = {}
+        self._last_reconcile = _now()
+
     async def setup_indexes(self):
-        """Setup indexes for materialized views"""
-        try:
-            await self.views.create_index([("view_name", ASCENDING)], unique=True)
-            await self.views.create_index([("updated_at", DESCENDING)])
-            await self.views.create_index([("view_type", ASCENDING)])
-            logger.info("Materialized view indexes created")
-        except Exception as e:
-            logger.error(f"Failed to create materialized view indexes: {e}")
-    
-    async def refresh_dashboard_metrics(self) -> Dict[str, Any]:
-        """Refresh all dashboard metrics"""
-        try:
-            start_time = datetime.utcnow()
-            
-            # Calculate all metrics in parallel
-            today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            yesterday = today - timedelta(days=1)
-            week_ago = today - timedelta(days=7)
-            month_ago = today - timedelta(days=30)
-            
-            # Occupancy metrics
-            total_rooms = await self.rooms.count_documents({"status": {"$ne": "out_of_order"}})
-            occupied_rooms = await self.bookings.count_documents({
-                "status": "checked_in",
-                "check_in": {"$lte": datetime.utcnow()},
-                "check_out": {"$gte": datetime.utcnow()}
-            })
-            occupancy_rate = (occupied_rooms / total_rooms * 100) if total_rooms > 0 else 0
-            
-            # Today's stats
-            today_arrivals = await self.bookings.count_documents({
-                "check_in": {
-                    "$gte": today,
-                    "$lt": today + timedelta(days=1)
-                }
-            })
-            
-            today_departures = await self.bookings.count_documents({
-                "check_out": {
-                    "$gte": today,
-                    "$lt": today + timedelta(days=1)
-                }
-            })
-            
-            # Revenue metrics
-            revenue_pipeline = [
-                {
-                    "$match": {
-                        "created_at": {"$gte": today}
-                    }
-                },
-                {
-                    "$group": {
-                        "_id": None,
-                        "total_revenue": {"$sum": "$balance"},
-                        "room_revenue": {
-                            "$sum": {
-                                "$cond": [
-                                    {"$eq": ["$folio_type", "guest"]},
-                                    "$balance",
-                                    0
-                                ]
-                            }
-                        }
-                    }
-                }
-            ]
-            revenue_result = await self.folios.aggregate(revenue_pipeline).to_list(1)
-            today_revenue = revenue_result[0]["total_revenue"] if revenue_result else 0
-            
-            # ADR calculation
-            adr_pipeline = [
-                {
-                    "$match": {
-                        "status": "checked_in",
-                        "check_in": {"$gte": month_ago}
-                    }
-                },
-                {
-                    "$group": {
-                        "_id": None,
-                        "avg_rate": {"$avg": "$total_amount"}
-                    }
-                }
-            ]
-            adr_result = await self.bookings.aggregate(adr_pipeline).to_list(1)
-            adr = round(adr_result[0]["avg_rate"], 2) if adr_result else 0
-            
-            # RevPAR
-            revpar = round(adr * (occupancy_rate / 100), 2)
-            
-            # Guest metrics
-            total_guests = await self.guests.count_documents({})
-            vip_guests = await self.guests.count_documents({"tags": "vip"})
-            
-            # Booking metrics
-            total_bookings = await self.bookings.count_documents({})
-            active_bookings = await self.bookings.count_documents({
-                "status": {"$in": ["confirmed", "checked_in"]}
-            })
-            
-            # Weekly trend
-            weekly_occupancy = []
-            for i in range(7):
-                day = today - timedelta(days=i)
-                day_occupied = await self.bookings.count_documents({
-                    "status": "checked_in",
-                    "check_in": {"$lte": day},
-                    "check_out": {"$gte": day}
-                })
-                weekly_occupancy.append({
-                    "date": day.isoformat(),
-                    "occupancy": round((day_occupied / total_rooms * 100), 2) if total_rooms > 0 else 0,
-                    "occupied_rooms": day_occupied
-                })
-            
-            # Monthly revenue trend
-            monthly_revenue = []
-            for i in range(30):
-                day = today - timedelta(days=i)
-                day_end = day + timedelta(days=1)
-                day_revenue_result = await self.folios.aggregate([
-                    {
-                        "$match": {
-                            "created_at": {"$gte": day, "$lt": day_end}
-                        }
-                    },
-                    {
-                        "$group": {
-                            "_id": None,
-                            "revenue": {"$sum": "$balance"}
-                        }
-                    }
-                ]).to_list(1)
-                day_revenue = day_revenue_result[0]["revenue"] if day_revenue_result else 0
-                monthly_revenue.append({
-                    "date": day.isoformat(),
-                    "revenue": round(day_revenue, 2)
-                })
-            
-            # Compile metrics
-            metrics = {
-                "view_name": "dashboard_metrics",
-                "view_type": "dashboard",
-                "updated_at": datetime.utcnow(),
-                "refresh_duration_ms": (datetime.utcnow() - start_time).total_seconds() * 1000,
-                "data": {
-                    "occupancy": {
-                        "rate": round(occupancy_rate, 2),
-                        "occupied_rooms": occupied_rooms,
-                        "total_rooms": total_rooms,
-                        "available_rooms": total_rooms - occupied_rooms
-                    },
-                    "today": {
-                        "arrivals": today_arrivals,
-                        "departures": today_departures,
-                        "revenue": round(today_revenue, 2)
-                    },
-                    "financial": {
-                        "adr": adr,
-                        "revpar": revpar,
-                        "today_revenue": round(today_revenue, 2)
-                    },
-                    "guests": {
-                        "total": total_guests,
-                        "vip": vip_guests
-                    },
-                    "bookings": {
-                        "total": total_bookings,
-                        "active": active_bookings
-                    },
-                    "trends": {
-                        "weekly_occupancy": weekly_occupancy,
-                        "monthly_revenue": monthly_revenue[:7]  # Last 7 days for dashboard
-                    }
-                }
+        """Ensure the registry's indexes for view storage and change detection on the sources"""
+        from index_registry import get_index_registry
+        sources = {c for view in VIEWS.values() for c in view.sources}
+        await get_index_registry(self.db).ensure(['materialized_views', 'materialized_view_partitions', *sorted(sources)])
+        logger.info("Materialized view indexes ensured")
+
+    # ------------------------------------------------------------ lifecycle
+
+    async def start(self):
+        """Scheduled refresh: incremental refresh of every view each interval"""
+        if self._running:
+            return
+        self._running = True
+        self._task = asyncio.create_task(self._refresher(), name='materialized-views-refresher')
+        logger.info("Materialized views refresher started")
+
+    async def stop(self):
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _lock(self, view_name: str, tenant_id: Optional[str] = None) -> asyncio.Lock:
+        return self._locks.setdefault((view_name, tenant_id), asyncio.Lock())
+
+    async def _refresher(self):
+        while self._running:
+            try:
+                # Periodic full rebuild catches source writes that did not stamp updated_at
+                reconcile = (_now() - self._last_reconcile).total_seconds() >= MV_RECONCILE_SECONDS
+                await self.refresh_all_views(full=reconcile)
+                if reconcile:
+                    self._last_reconcile = _now()
+            except Exception as e:
+                logger.warning(f"Materialized views refresh error: {e}")
+            await asyncio.sleep(self.interval)
+
+    # ------------------------------------------------------------ change detection
+
+    async def _touched(self, view: ViewDefinition, since: str, tenant_id: Optional[str] = None) -> Dict[str, Set[str]]:
+        """{tenant_id: {dates}} for source documents written since the watermark"""
+        window = set(_window(view))
+        # Sources stamp ISO strings or BSON dates; Mongo compares within one type only
+        since_date = _parse(since)
+        match: Dict[str, Any] = {'$or': [
+            {field: {'$gte': bound}} for field in ('updated_at', 'created_at') for bound in (since, since_date)
+        ]}
+        if tenant_id:
+            match['tenant_id'] = tenant_id
+
+        def pipeline(fields: tuple):
+            group: Dict[str, Any] = {'_id': '$tenant_id'}
+            if fields:
+                group['spans'] = {'$addToSet': {'from': f'${fields[0]}', 'to': f'${fields[1]}'}}
+            return [{'$match': match}, {'$group': group}]
+
+        collections = list(view.sources)
+        outputs = await asyncio.gather(*[
+            self.db[c].aggregate(pipeline(view.sources[c])).to_list(None) for c in collections
+        ])
+        touched: Dict[str, Set[str]] = {}
+        for output in outputs:
+            for row in output:
+                if not row.get('_id'):
+                    continue
+                dates = touched.setdefault(row['_id'], set())
+                for span in row.get('spans') or []:
+                    dates |= _expand(span.get('from'), span.get('to'), window)
+        return touched
+
+    async def _tenants(self) -> List[str]:
+        return [t for t in await self.rooms.distinct('tenant_id') if t]
+
+    async def _stale(self, view: ViewDefinition, tenant_id: Optional[str] = None,
+                     max_age_seconds: int = MV_MAX_STALENESS_SECONDS) -> Set[str]:
+        """Tenants whose summary or today partition is past the staleness bound"""
+        cutoff = (_now() - timedelta(seconds=max_age_seconds)).isoformat()
+        query: Dict[str, Any] = {
+            'view_name': view.name,
+            'partition': {'$in': ['summary', f"day:{_now().date().isoformat()}"]},
+            'refreshed_at': {'$lt': cutoff},
+        }
+        if tenant_id:
+            query['tenant_id'] = tenant_id
+        return set(await self.partitions.distinct('tenant_id', query))
+
+    # ------------------------------------------------------------ partition builders
+
+    async def _summary(self, tenant_id: str) -> Dict[str, Any]:
+        """Point-in-time partition: one aggregation per source, run concurrently"""
+        now = _now().isoformat()
+        month_ago = (_now() - timedelta(days=30)).date().isoformat()
+        rooms, bookings, guests = await asyncio.gather(
+            self.rooms.aggregate([
+                {'$match': {'tenant_id': tenant_id, 'status': {'$ne': 'out_of_order'}}},
+                {'$group': {'_id': None, 'total_rooms': {'$sum': 1}}},
+            ]).to_list(1),
+            self.bookings.aggregate([
+                {'$match': {'tenant_id': tenant_id}},
+                {'$group': {
+                    '_id': None,
+                    'total': {'$sum': 1},
+                    'active': {'$sum': {'$cond': [{'$in': ['$status', ['confirmed', 'checked_in']]}, 1, 0]}},
+                    'occupied': {'$sum': {'$cond': [{'$and': [
+                        {'$eq': ['$status', 'checked_in']},
+                        {'$lte': ['$check_in', now]},
+                        {'$gte': ['$check_out', now[:10]]},
+                    ]}, 1, 0]}},
+                    'adr_total': {'$sum': {'$cond': [{'$and': [
+                        {'$eq': ['$status', 'checked_in']}, {'$gte': ['$check_in', month_ago]},
+                    ]}, {'$ifNull': ['$total_amount', 0]}, 0]}},
+                    'adr_count': {'$sum': {'$cond': [{'$and': [
+                        {'$eq': ['$status', 'checked_in']}, {'$gte': ['$check_in', month_ago]},
+                    ]}, 1, 0]}},
+                }},
+            ]).to_list(1),
+            self.guests.aggregate([
+                {'$match': {'tenant_id': tenant_id}},
+                {'$group': {'_id': None, 'total': {'$sum': 1},
+                            'vip': {'$sum': {'$cond': [{'$in': ['vip', {'$ifNull': ['$tags', []]}]}, 1, 0]}}}},
+            ]).to_list(1),
+        )
+        rooms = rooms[0] if rooms else {}
+        bookings = bookings[0] if bookings else {}
+        guests = guests[0] if guests else {}
+        adr_count = bookings.get('adr_count', 0)
+        return {
+            'total_rooms': rooms.get('total_rooms', 0),
+            'occupied_rooms': bookings.get('occupied', 0),
+            'adr': round(bookings.get('adr_total', 0) / adr_count, 2) if adr_count else 0,
+            'guests_total': guests.get('total', 0),
+            'guests_vip': guests.get('vip', 0),
+            'bookings_total': bookings.get('total', 0),
+            'bookings_active': bookings.get('active', 0),
+        }
+
+    async def _days(self, tenant_id: str, dates: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Day partitions: one bookings $facet (a branch per date) and one folios $group"""
+        dates = sorted(set(dates))
+        if not dates:
+            return {}
+        first = dates[0]
+        after_last = (datetime.fromisoformat(dates[-1]) + timedelta(days=1)).date().isoformat()
+
+        def next_day(d: str) -> str:
+            return (datetime.fromisoformat(d) + timedelta(days=1)).date().isoformat()
+
+        facets = {
+            f"d{d.replace('-', '')}": [{'$group': {
+                '_id': None,
+                'occupied': {'$sum': {'$cond': [{'$and': [
+                    {'$eq': ['$status', 'checked_in']},
+                    {'$lt': ['$check_in', next_day(d)]}, {'$gte': ['$check_out', d]},
+                ]}, 1, 0]}},
+                'arrivals': {'$sum': {'$cond': [{'$and': [
+                    {'$gte': ['$check_in', d]}, {'$lt': ['$check_in', next_day(d)]},
+                ]}, 1, 0]}},
+                'departures': {'$sum': {'$cond': [{'$and': [
+                    {'$gte': ['$check_out', d]}, {'$lt': ['$check_out', next_day(d)]},
+                ]}, 1, 0]}},
+            }}]
+            for d in dates
+        }
+        bookings, revenue = await asyncio.gather(
+            self.bookings.aggregate([
+                {'$match': {'tenant_id': tenant_id, 'check_in': {'$lt': after_last},
+                            'check_out': {'$gte': first}}},
+                {'$facet': facets},
+            ]).to_list(1),
+            self.folios.aggregate([
+                {'$match': {'tenant_id': tenant_id, 'created_at': {'$gte': first, '$lt': after_last}}},
+                {'$group': {'_id': {'$substr': ['$created_at', 0, 10]},
+                            'revenue': {'$sum': {'$ifNull': ['$balance', 0]}}}},
+            ]).to_list(None),
+        )
+        branches = bookings[0] if bookings else {}
+        revenue_by_day = {r['_id']: r.get('revenue', 0) for r in revenue}
+        days = {}
+        for d in dates:
+            row = (branches.get(f"d{d.replace('-', '')}") or [{}])[0]
+            days[d] = {
+                'date': d,
+                'occupied_rooms': row.get('occupied', 0),
+                'arrivals': row.get('arrivals', 0),
+                'departures': row.get('departures', 0),
+                'revenue': round(revenue_by_day.get(d, 0), 2),
             }
-            
-            # Upsert to database
-            await self.views.update_one(
-                {"view_name": "dashboard_metrics"},
-                {"$set": metrics},
-                upsert=True
-            )
-            
-            logger.info(f"Dashboard metrics refreshed in {metrics['refresh_duration_ms']}ms")
-            return {
-                "success": True,
-                "refresh_duration_ms": metrics['refresh_duration_ms'],
-                "metrics": metrics["data"]
+        return days
+
+    async def _refresh_tenant(self, view: ViewDefinition, tenant_id: str, dates: Set[str]) -> int:
+        """Recompute the summary and the given day partitions of one tenant"""
+        dates = set(dates) | {_now().date().isoformat()}
+        summary, days = await asyncio.gather(self._summary(tenant_id), self._days(tenant_id, dates))
+        refreshed_at = _now().isoformat()
+        ops = [UpdateOne(
+            {'view_name': view.name, 'tenant_id': tenant_id, 'partition': 'summary'},
+            {'$set': {'data': summary, 'refreshed_at': refreshed_at}}, upsert=True
+        )]
+        ops += [UpdateOne(
+            {'view_name': view.name, 'tenant_id': tenant_id, 'partition': f'day:{d}'},
+            {'$set': {'data': data, 'business_date': d, 'refreshed_at': refreshed_at}}, upsert=True
+        ) for d, data in days.items()]
+        await self.partitions.bulk_write(ops, ordered=False)
+        return len(ops)
+
+    # ------------------------------------------------------------ refresh
+
+    async def refresh_view(self, view_name: str, tenant_id: Optional[str] = None, full: bool = False,
+                           max_age_seconds: int = MV_MAX_STALENESS_SECONDS) -> Dict[str, Any]:
+        """
+        Incremental refresh. Without a watermark (first run) or with full=True
+        every partition in the window is rebuilt. A tenant-scoped refresh does
+        not move the view's watermark.
+        """
+        view = VIEWS[view_name]
+        # A tenant refresh never waits behind the all-tenant run, only behind writes to its own partitions
+        async with self._lock(view.name, tenant_id):
+            start_time = _now()
+            state = await self.views.find_one({'view_name': view.name}, {'_id': 0, 'last_refresh_at': 1}) or {}
+            since = state.get('last_refresh_at') if isinstance(state.get('last_refresh_at'), str) else None
+            window = set(_window(view))
+
+            if full or not since:
+                tenants = [tenant_id] if tenant_id else await self._tenants()
+                work = {t: set(window) for t in tenants}
+            else:
+                work = await self._touched(view, since, tenant_id)
+                for t in await self._stale(view, tenant_id, max_age_seconds):
+                    work.setdefault(t, set())
+                if tenant_id and not await self.partitions.find_one(
+                    {'view_name': view.name, 'tenant_id': tenant_id, 'partition': 'summary'}, {'_id': 1}
+                ):
+                    work[tenant_id] = set(window)
+                elif tenant_id:
+                    # An on-demand refresh always re-reads the point-in-time partitions
+                    work.setdefault(tenant_id, set())
+
+            partitions = 0
+            for t, dates in work.items():
+                async with self._lock(view.name, t) if not tenant_id else contextlib.nullcontext():
+                    partitions += await self._refresh_tenant(view, t, dates)
+
+            duration_ms = (_now() - start_time).total_seconds() * 1000
+            state_update: Dict[str, Any] = {
+                'view_type': view.view_type,
+                'sources': list(view.sources),
+                'updated_at': _now().isoformat(),
+                'refresh_duration_ms': duration_ms,
+                'last_refresh': {'tenants': len(work), 'partitions': partitions, 'full': full or not since},
             }
-            
+            if not tenant_id:
+                # Writes racing this refresh are picked up by the next one
+                state_update['last_refresh_at'] = start_time.isoformat()
+            await self.views.update_one({'view_name': view.name}, {'$set': state_update}, upsert=True)
+
+        logger.info(f"View {view.name} refreshed: {len(work)} tenants, {partitions} partitions in {duration_ms:.0f}ms")
+        return {
+            "success": True,
+            "refresh_duration_ms": duration_ms,
+            "tenants_refreshed": len(work),
+            "partitions_refreshed": partitions,
+        }
+
+    async def refresh_dashboard_metrics(self, tenant_id: Optional[str] = None, full: bool = False) -> Dict[str, Any]:
+        """Refresh dashboard metrics (touched tenant/date partitions only)"""
+        try:
+            result = await self.refresh_view(DASHBOARD_VIEW.name, tenant_id, full)
+            if tenant_id:
+                result["metrics"] = await self.get_view(DASHBOARD_VIEW.name, tenant_id=tenant_id, refresh=False)
+            return result
         except Exception as e:
             logger.error(f"Failed to refresh dashboard metrics: {e}")
             return {
                 "success": False,
                 "error": str(e)
             }
-    
-    async def get_view(self, view_name: str, max_age_seconds: int = 300) -> Optional[Dict[str, Any]]:
+
+    # ------------------------------------------------------------ reads
+
+    @staticmethod
+    def _assemble(summary: Dict[str, Any], days: Dict[str, Dict[str, Any]], window: List[str]) -> Dict[str, Any]:
+        total_rooms = summary.get('total_rooms', 0)
+        occupied_rooms = summary.get('occupied_rooms', 0)
+        occupancy_rate = (occupied_rooms / total_rooms * 100) if total_rooms > 0 else 0
+        adr = summary.get('adr', 0)
+        today = days.get(window[0], {})
+        empty = {'occupied_rooms': 0, 'arrivals': 0, 'departures': 0, 'revenue': 0}
+        return {
+            "occupancy": {
+                "rate": round(occupancy_rate, 2),
+                "occupied_rooms": occupied_rooms,
+                "total_rooms": total_rooms,
+                "available_rooms": total_rooms - occupied_rooms
+            },
+            "today": {
+                "arrivals": today.get('arrivals', 0),
+                "departures": today.get('departures', 0),
+                "revenue": today.get('revenue', 0)
+            },
+            "financial": {
+                "adr": adr,
+                "revpar": round(adr * (occupancy_rate / 100), 2),
+                "today_revenue": today.get('revenue', 0)
+            },
+            "guests": {
+                "total": summary.get('guests_total', 0),
+                "vip": summary.get('guests_vip', 0)
+            },
+            "bookings": {
+                "total": summary.get('bookings_total', 0),
+                "active": summary.get('bookings_active', 0)
+            },
+            "trends": {
+                "weekly_occupancy": [
+                    {
+                        "date": d,
+                        "occupancy": round((days.get(d, empty)['occupied_rooms'] / total_rooms * 100), 2)
+                        if total_rooms > 0 else 0,
+                        "occupied_rooms": days.get(d, empty)['occupied_rooms']
+                    }
+                    for d in window[:7]
+                ],
+                "monthly_revenue": [
+                    {"date": d, "revenue": days.get(d, empty)['revenue']} for d in window[:7]
+                ]
+            }
+        }
+
+    async def get_view(self, view_name: str, max_age_seconds: int = 300, tenant_id: Optional[str] = None,
+                       refresh: bool = True) -> Optional[Dict[str, Any]]:
         """
-        Get materialized view with freshness check
-        
+        Get a tenant's materialized view with freshness check
+
         Args:
             view_name: Name of the view
             max_age_seconds: Maximum age in seconds (default 5 minutes)
-            
+            tenant_id: Tenant whose partitions are served
+            refresh: Refresh the tenant's partitions when older than max_age_seconds
+
         Returns:
-            View data or None if too old
+            View data with a 'freshness' block, or None if the view was never built
         """
+        view = VIEWS.get(view_name)
+        if not view or not tenant_id:
+            return None
         try:
-            view = await self.views.find_one({"view_name": view_name})
-            
-            if not view:
+            window = _window(view)
+            wanted = ['summary'] + [f'day:{d}' for d in window]
+
+            async def load():
+                return {
+                    p['partition']: p async for p in self.partitions.find(
+                        {'view_name': view.name, 'tenant_id': tenant_id, 'partition': {'$in': wanted}},
+                        {'_id': 0, 'partition': 1, 'data': 1, 'refreshed_at': 1}
+                    )
+                }
+
+            def freshness(parts):
+                summary = parts.get('summary')
+                if not summary or f'day:{window[0]}' not in parts:
+                    return None, None
+                return summary.get('refreshed_at'), _age_seconds(summary.get('refreshed_at'))
+
+            parts = await load()
+            refreshed_at, age = freshness(parts)
+            if refresh and (age is None or age > max_age_seconds):
+                await self.refresh_view(view.name, tenant_id, max_age_seconds=max_age_seconds)
+                parts = await load()
+                refreshed_at, age = freshness(parts)
+            if 'summary' not in parts:
                 return None
-            
-            # Check freshness
-            updated_at = view.get("updated_at")
-            if updated_at:
-                age = (datetime.utcnow() - updated_at).total_seconds()
-                if age > max_age_seconds:
-                    logger.warning(f"View {view_name} is stale ({age}s old)")
-                    return None
-            
-            return view.get("data")
-            
+
+            days = {k[4:]: p['data'] for k, p in parts.items() if k.startswith('day:')}
+            data = self._assemble(parts['summary']['data'], days, window)
+            data['freshness'] = {
+                'refreshed_at': refreshed_at,
+                'age_seconds': round(age, 2) if age is not None else None,
+                'max_age_seconds': max_age_seconds,
+                'stale': age is None or age > max_age_seconds,
+            }
+            return data
+
         except Exception as e:
             logger.error(f"Failed to get view {view_name}: {e}")
             return None
-    
-    async def refresh_all_views(self) -> Dict[str, Any]:
+
+    async def refresh_all_views(self, full: bool = False) -> Dict[str, Any]:
         """Refresh all materialized views"""
         results = {
-            "dashboard_metrics": await self.refresh_dashboard_metrics()
+            name: await self.refresh_view(name, full=full) for name in VIEWS
         }
-        
+
         return {
             "success": all(r.get("success", False) for r in results.values()),
             "results": results,
             "total_duration_ms": sum(r.get("refresh_duration_ms", 0) for r in results.values())
         }
-    
+
     async def get_view_stats(self) -> Dict[str, Any]:
-        """Get statistics about all views"""
+        """Get statistics about all views, including partition staleness"""
         try:
-            views = await self.views.find({}).to_list(None)
-            
+            views = await self.views.find({}, {'_id': 0}).to_list(None)
+            partitions = {
+                row['_id']: row for row in await self.partitions.aggregate([
+                    {'$group': {'_id': '$view_name', 'partitions': {'$sum': 1},
+                                'tenants': {'$addToSet': '$tenant_id'},
+                                'oldest_refresh': {'$min': '$refreshed_at'},
+                                'newest_refresh': {'$max': '$refreshed_at'}}},
+                ]).to_list(None)
+            }
+
             stats = []
             for view in views:
-                updated_at = view.get("updated_at")
-                age_seconds = (datetime.utcnow() - updated_at).total_seconds() if updated_at else None
-                
+                updated_at = _parse(view.get("updated_at"))
+                age_seconds = _age_seconds(updated_at)
+                p = partitions.get(view.get("view_name"), {})
                 stats.append({
                     "view_name": view.get("view_name"),
                     "view_type": view.get("view_type"),
+                    "sources": view.get("sources", []),
                     "updated_at": updated_at.isoformat() if updated_at else None,
                     "age_seconds": round(age_seconds, 2) if age_seconds else None,
-                    "refresh_duration_ms": view.get("refresh_duration_ms")
+                    "refresh_duration_ms": view.get("refresh_duration_ms"),
+                    "watermark": view.get("last_refresh_at") if isinstance(view.get("last_refresh_at"), str) else None,
+                    "last_refresh": view.get("last_refresh"),
+                    "tenants": len(p.get("tenants", [])),
+                    "partitions": p.get("partitions", 0),
+                    "oldest_partition_age_seconds": _age_seconds(p.get("oldest_refresh")),
+                    "max_staleness_seconds": MV_MAX_STALENESS_SECONDS,
                 })
-            
+
             return {
                 "total_views": len(stats),
                 "views": stats
             }
-            
+
         except Exception as e:
             logger.error(f"Failed to get view stats: {e}")
             return {"error": str(e)}
+
+
+materialized_views_manager = None
+
+
+async def init_materialized_views(db) -> MaterializedViewsManager:
+    global materialized_views_manager
+    if materialized_views_manager is None:
+        materialized_views_manager = MaterializedViewsManager(db)
+    await materialized_views_manager.start()
+    return materialized_views_manager
+
+
+def get_materialized_views() -> Optional[MaterializedViewsManager]:
+    return materialized_views_manager
@@ -0,0 +1,634 @@
+"""
+Message Delivery Service
+Persisted outbound queue for email / SMS / WhatsApp with worker coroutines,
+pooled provider sessions, batch sends, per-provider rate limiting and retry
+"""
+
+import asyncio
+import logging
+import os
+import smtplib
+import socket
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr, make_msgid
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+class MessageStatus:
+    QUEUED = "queued"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"      # waiting for retry
+    DEAD = "dead"          # retries exhausted
+
+
+class MessageChannel:
+    EMAIL = "email"
+    SMS = "sms"
+    WHATSAPP = "whatsapp"
+
+
+class PermanentDeliveryError(Exception):
+    """Provider rejected the message; retrying will not help"""
+
+
+# ============= RATE LIMITING =============
+
+class TokenBucket:
+    """Async token bucket (rate per second, burst capacity)"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+# ============= PROVIDERS =============
+
+class DeliveryProvider:
+    """Base provider: sends one message at a time over a pooled session"""
+
+    name = "base"
+    channel = MessageChannel.EMAIL
+
+    def __init__(self, rate_per_second: float = 10.0, pool_size: int = 2):
+        self.limiter = TokenBucket(rate_per_second, capacity=max(rate_per_second, pool_size))
+        self.pool_size = pool_size
+        self.sent = 0
+        self.failed = 0
+
+    async def send(self, message: Dict[str, Any]) -> Optional[str]:
+        """Deliver one message; return provider message id. Raise on failure."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'provider': self.name,
+            'channel': self.channel,
+            'rate_per_second': self.limiter.rate,
+            'pool_size': self.pool_size,
+            'sent': self.sent,
+            'failed': self.failed,
+        }
+
+
+class SMTPProvider(DeliveryProvider):
+    """SMTP with a pool of authenticated, reusable sessions
+
+    smtplib is blocking, so every session is driven from a worker thread
+    via asyncio.to_thread; the event loop never waits on SMTP I/O. Works
+    against AWS SES as well as a local stub server
+    (SMTP_USE_TLS=false, no credentials).
+    """
+
+    name = "smtp"
+    channel = MessageChannel.EMAIL
+
+    def __init__(self, host: str, port: int, username: str = '', password: str = '',
+                 use_tls: bool = True, sender_email: str = '', sender_name: str = '',
+                 rate_per_second: float = 14.0, pool_size: int = 4, idle_timeout: float = 60.0):
+        super().__init__(rate_per_second, pool_size)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.sender_email = sender_email
+        self.sender_name = sender_name
+        self.idle_timeout = idle_timeout
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._created = 0
+        self._create_lock = asyncio.Lock()
+
+    # -- session pool --
+
+    def _connect(self) -> smtplib.SMTP:
+        session = smtplib.SMTP(self.host, self.port, timeout=20)
+        session.ehlo()
+        if self.use_tls:
+            session.starttls()
+            session.ehlo()
+        if self.username:
+            session.login(self.username, self.password)
+        return session
+
+    async def _acquire(self) -> Tuple[smtplib.SMTP, float]:
+        while True:
+            try:
+                session, last_used = self._idle.get_nowait()
+            except asyncio.QueueEmpty:
+                async with self._create_lock:
+                    if self._created < self.pool_size:
+                        self._created += 1
+                        try:
+                            return await asyncio.to_thread(self._connect), time.monotonic()
+                        except Exception:
+                            self._created -= 1
+                            raise
+                session, last_used = await self._idle.get()
+            if time.monotonic() - last_used < self.idle_timeout:
+                return session, last_used
+            # Idle sessions may have been dropped by the server; probe first
+            try:
+                status, _ = await asyncio.to_thread(session.noop)
+                if status == 250:
+                    return session, last_used
+            except Exception:
+                pass
+            await self._discard(session)
+
+    def _release(self, session: smtplib.SMTP):
+        self._idle.put_nowait((session, time.monotonic()))
+
+    async def _discard(self, session: smtplib.SMTP):
+        self._created -= 1
+        try:
+            await asyncio.to_thread(session.close)
+        except Exception:
+            pass
+
+    # -- sending --
+
+    def _build_mime(self, message: Dict[str, Any]) -> MIMEMultipart:
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = message.get('subject', '')
+        msg['From'] = formataddr((message.get('sender_name') or self.sender_name,
+                                  message.get('sender') or self.sender_email))
+        msg['To'] = message['recipient']
+        msg['Message-ID'] = make_msgid(domain=(self.sender_email.split('@')[-1] or None))
+        msg.attach(MIMEText(message.get('text') or '', 'plain', 'utf-8'))
+        if message.get('html'):
+            msg.attach(MIMEText(message['html'], 'html', 'utf-8'))
+        return msg
+
+    async def send(self, message: Dict[str, Any]) -> Optional[str]:
+        await self.limiter.acquire()
+        mime = self._build_mime(message)
+        session, _ = await self._acquire()
+        try:
+            refused = await asyncio.to_thread(
+                session.sendmail, message.get('sender') or self.sender_email,
+                [message['recipient']], mime.as_string()
+            )
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+            # Session is still usable; the message itself was rejected
+            self._release(session)
+            code = getattr(e, 'smtp_code', None)
+            if code is None and isinstance(e, smtplib.SMTPRecipientsRefused):
+                code = next(iter(e.recipients.values()), (None,))[0]
+            if code and 500 <= code < 600:
+                raise PermanentDeliveryError(str(e))
+            raise
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPException, OSError, socket.timeout):
+            await self._discard(session)
+            raise
+        self._release(session)
+        if refused:
+            raise PermanentDeliveryError(f"Refused: {refused}")
+        return mime['Message-ID']
+
+    async def close(self):
+        while not self._idle.empty():
+            session, _ = self._idle.get_nowait()
+            try:
+                await asyncio.to_thread(session.quit)
+            except Exception:
+                pass
+        self._created = 0
+
+
+class HTTPMessagingProvider(DeliveryProvider):
+    """SMS / WhatsApp gateway over a keep-alive HTTP session pool"""
+
+    def __init__(self, name: str, channel: str, api_url: str, api_token: str,
+                 sender: str = '', rate_per_second: float = 20.0, pool_size: int = 8):
+        super().__init__(rate_per_second, pool_size)
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.name = name
+        self.channel = channel
+        self.api_url = api_url
+        self.sender = sender
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Authorization': f'Bearer {api_token}'})
+        self._slots = asyncio.Semaphore(pool_size)
+
+    def _post(self, message: Dict[str, Any]):
+        return self.session.post(self.api_url, json={
+            'to': message['recipient'],
+            'from': self.sender,
+            'body': message.get('text') or message.get('body', ''),
+            'reference': message['id'],
+        }, timeout=15)
+
+    async def send(self, message: Dict[str, Any]) -> Optional[str]:
+        await self.limiter.acquire()
+        async with self._slots:
+            response = await asyncio.to_thread(self._post, message)
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            raise PermanentDeliveryError(f"HTTP {response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+        try:
+            return (response.json() or {}).get('id')
+        except ValueError:
+            return None
+
+    async def close(self):
+        await asyncio.to_thread(self.session.close)
+
+
+class ConsoleProvider(DeliveryProvider):
+    """Mock mode: print the message (matches the existing mock email output)"""
+
+    def __init__(self, channel: str):
+        super().__init__(rate_per_second=1000.0, pool_size=1)
+        self.name = f"console_{channel}"
+        self.channel = channel
+
+    async def send(self, message: Dict[str, Any]) -> Optional[str]:
+        print("\n" + "=" * 60)
+        print(f"📨 {self.channel.upper()} (MOCK)")
+        print("=" * 60)
+        print(f"Alıcı: {message['recipient']}")
+        if message.get('subject'):
+            print(f"Konu: {message['subject']}")
+        print(message.get('text') or message.get('body', ''))
+        print("=" * 60 + "\n")
+        return f"mock-{message['id']}"
+
+
+def build_default_providers() -> Dict[str, DeliveryProvider]:
+    """Providers per channel from environment (mock when credentials are missing)"""
+    providers: Dict[str, DeliveryProvider] = {}
+
+    email_mode = os.environ.get('EMAIL_MODE', 'production')
+    smtp_username = os.environ.get('SMTP_USERNAME', '')
+    smtp_host = os.environ.get('SMTP_HOST', 'email-smtp.eu-central-1.amazonaws.com')
+    stub_smtp = smtp_host in ('localhost', '127.0.0.1')
+    if email_mode == 'production' and (smtp_username or stub_smtp):
+        providers[MessageChannel.EMAIL] = SMTPProvider(
+            host=smtp_host,
+            port=int(os.environ.get('SMTP_PORT', '587')),
+            username=smtp_username,
+            password=os.environ.get('SMTP_PASSWORD', ''),
+            use_tls=os.environ.get('SMTP_USE_TLS', 'false' if stub_smtp else 'true').lower() == 'true',
+            sender_email=os.environ.get('SENDER_EMAIL', 'info@syroce.com'),
+            sender_name=os.environ.get('SENDER_NAME', 'Syroce'),
+            rate_per_second=float(os.environ.get('SMTP_RATE_PER_SECOND', '14')),
+            pool_size=int(os.environ.get('SMTP_POOL_SIZE', '4')),
+        )
+    else:
+        providers[MessageChannel.EMAIL] = ConsoleProvider(MessageChannel.EMAIL)
+
+    for channel, prefix in ((MessageChannel.SMS, 'SMS'), (MessageChannel.WHATSAPP, 'WHATSAPP')):
+        api_url = os.environ.get(f'{prefix}_API_URL')
+        api_token = os.environ.get(f'{prefix}_API_KEY')
+        if api_url and api_token:
+            providers[channel] = HTTPMessagingProvider(
+                name=f"{channel}_http",
+                channel=channel,
+                api_url=api_url,
+                api_token=api_token,
+                sender=os.environ.get(f'{prefix}_SENDER', ''),
+                rate_per_second=float(os.environ.get(f'{prefix}_RATE_PER_SECOND', '20')),
+                pool_size=int(os.environ.get(f'{prefix}_POOL_SIZE', '8')),
+            )
+        else:
+            providers[channel] = ConsoleProvider(channel)
+
+    return providers
+
+
+# ============= QUEUE =============
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class DeliveryService:
+    """Persisted outbound queue drained by worker coroutines
+
+    Messages live in `outbound_messages`; workers claim due messages,
+    send them through the channel's provider and record results with one
+    bulk_write per batch. Failures retry with exponential backoff until
+    max_attempts, then move to `dead`. Final outcomes are written back to
+    the records that queued them (sent_messages rows, marketing campaigns).
+    """
+
+    def __init__(self, db, providers: Optional[Dict[str, DeliveryProvider]] = None,
+                 workers: int = 4, batch_size: int = 50, max_attempts: int = 5,
+                 lock_seconds: int = 300, poll_interval: float = 2.0):
+        self.db = db
+        self.collection = db.outbound_messages
+        self.providers = providers if providers is not None else build_default_providers()
+        self.worker_count = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lock_seconds = lock_seconds
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+
+    # -- lifecycle --
+
+    async def setup_indexes(self):
+        from index_registry import get_index_registry
+        await get_index_registry(self.db).ensure(['outbound_messages'])
+
+    async def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"delivery-worker-{i}")
+            for i in range(self.worker_count)
+        ]
+        self._tasks.append(asyncio.create_task(self._reaper(), name="delivery-reaper"))
+        logger.info(f"📨 Delivery service started with {self.worker_count} workers")
+
+    async def stop(self):
+        self._running = False
+        self._wakeup.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for provider in self.providers.values():
+            await provider.close()
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    # -- enqueue --
+
+    def _build(self, channel: str, recipient: str, tenant_id: Optional[str] = None,
+               subject: str = '', text: str = '', html: str = '', priority: int = 0,
+               batch_id: Optional[str] = None, source: Optional[Dict[str, Any]] = None,
+               send_at: Optional[datetime] = None) -> Dict[str, Any]:
+        now = _now()
+        return {
+            'id': str(uuid.uuid4()),
+            'tenant_id': tenant_id,
+            'channel': channel,
+            'recipient': recipient,
+            'subject': subject,
+            'text': text,
+            'html': html,
+            'priority': priority,
+            'batch_id': batch_id,
+            'source': source or {},
+            'status': MessageStatus.QUEUED,
+            'attempts': 0,
+            'max_attempts': self.max_attempts,
+            'next_attempt_at': send_at or now,
+            'created_at': now,
+            'updated_at': now,
+        }
+
+    async def enqueue(self, channel: str, recipient: str, **kwargs) -> str:
+        doc = self._build(channel, recipient, **kwargs)
+        await self.collection.insert_one(doc)
+        self._wakeup.set()
+        return doc['id']
+
+    async def enqueue_email(self, recipient: str, subject: str, html: str, text: str, **kwargs) -> str:
+        return await self.enqueue(MessageChannel.EMAIL, recipient, subject=subject, html=html, text=text, **kwargs)
+
+    async def enqueue_batch(self, messages: List[Dict[str, Any]], tenant_id: Optional[str] = None,
+                            batch_id: Optional[str] = None) -> Dict[str, Any]:
+        """Queue a campaign in one insert_many
+
+        Each item needs `channel` and `recipient` plus any of subject/text/html/source.
+        """
+        batch_id = batch_id or str(uuid.uuid4())
+        docs = [
+            self._build(
+                m['channel'], m['recipient'], tenant_id=m.get('tenant_id', tenant_id),
+                subject=m.get('subject', ''), text=m.get('text', ''), html=m.get('html', ''),
+                priority=m.get('priority', 0), batch_id=batch_id, source=m.get('source'),
+                send_at=m.get('send_at'),
+            )
+            for m in messages if m.get('recipient')
+        ]
+        if docs:
+            await self.collection.insert_many(docs, ordered=False)
+            self._wakeup.set()
+        return {'batch_id': batch_id, 'queued': len(docs), 'message_ids': [d['id'] for d in docs]}
+
+    # -- workers --
+
+    async def _claim(self, worker_id: str) -> List[Dict[str, Any]]:
+        """Claim up to batch_size due messages for this worker (3 round-trips)"""
+        now = _now()
+        due = {
+            'status': {'$in': [MessageStatus.QUEUED, MessageStatus.FAILED]},
+            'next_attempt_at': {'$lte': now},
+        }
+        candidates = await self.collection.find(due, {'_id': 0, 'id': 1}).sort(
+            [('priority', -1), ('next_attempt_at', 1)]
+        ).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+
+        # The status guard makes the claim atomic per message when workers race
+        claim_id = str(uuid.uuid4())
+        await self.collection.update_many(
+            {**due, 'id': {'$in': [c['id'] for c in candidates]}},
+            {
+                '$set': {
+                    'status': MessageStatus.SENDING,
+                    'claim_id': claim_id,
+                    'locked_by': worker_id,
+                    'locked_until': now + timedelta(seconds=self.lock_seconds),
+                    'updated_at': now,
+                },
+                '$inc': {'attempts': 1},
+            }
+        )
+        return await self.collection.find({'claim_id': claim_id}, {'_id': 0}).to_list(self.batch_size)
+
+    async def _worker(self, index: int):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+        while self._running:
+            try:
+                self._wakeup.clear()
+                batch = await self._claim(worker_id)
+                if not batch:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                results = await asyncio.gather(*(self._deliver(m) for m in batch))
+                await self.collection.bulk_write([op for op, _ in results], ordered=False)
+                await self._settle(batch, [outcome for _, outcome in results])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Delivery worker {worker_id} error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _deliver(self, message: Dict[str, Any]) -> Tuple[UpdateOne, Tuple[str, Optional[str]]]:
+        provider = self.providers.get(message['channel'])
+        now = _now()
+        try:
+            if provider is None:
+                raise PermanentDeliveryError(f"No provider for channel {message['channel']}")
+            provider_id = await provider.send(message)
+            provider.sent += 1
+            return UpdateOne({'id': message['id']}, {
+                '$set': {
+                    'status': MessageStatus.SENT,
+                    'provider': provider.name,
+                    'provider_message_id': provider_id,
+                    'sent_at': now,
+                    'updated_at': now,
+                    'last_error': None,
+                },
+                '$unset': {'locked_by': '', 'locked_until': '', 'claim_id': ''},
+            }), (MessageStatus.SENT, None)
+        except Exception as e:
+            if provider is not None:
+                provider.failed += 1
+            permanent = isinstance(e, PermanentDeliveryError)
+            exhausted = message['attempts'] >= message.get('max_attempts', self.max_attempts)
+            status = MessageStatus.DEAD if permanent or exhausted else MessageStatus.FAILED
+            # 30s, 1m, 2m, 4m ... capped at 1h
+            backoff = min(30 * (2 ** (message['attempts'] - 1)), 3600)
+            return UpdateOne({'id': message['id']}, {
+                '$set': {
+                    'status': status,
+                    'last_error': str(e)[:500],
+                    'next_attempt_at': now + timedelta(seconds=backoff),
+                    'updated_at': now,
+                },
+                '$unset': {'locked_by': '', 'locked_until': '', 'claim_id': ''},
+            }), (status, str(e)[:500])
+
+    async def _settle(self, batch: List[Dict[str, Any]], outcomes: List[Tuple[str, Optional[str]]]):
+        """Write sent / dead outcomes back to sent_messages and finish drained campaigns"""
+        now = _now()
+        updates, campaigns = [], set()
+        for message, (status, error) in zip(batch, outcomes):
+            if status not in (MessageStatus.SENT, MessageStatus.DEAD):
+                continue  # still retrying
+            source = message.get('source') or {}
+            if source.get('sent_message_id'):
+                fields = {'status': 'sent', 'sent_at': now} if status == MessageStatus.SENT \
+                    else {'status': 'failed', 'error': error}
+                updates.append(UpdateOne({'id': source['sent_message_id']}, {'$set': fields}))
+            if source.get('type') == 'campaign' and message.get('batch_id'):
+                campaigns.add((message.get('tenant_id'), message['batch_id']))
+        try:
+            if updates:
+                await self.db.sent_messages.bulk_write(updates, ordered=False)
+            for tenant_id, batch_id in campaigns:
+                await self.finish_campaign(tenant_id, batch_id)
+        except Exception as e:
+            logger.error(f"Delivery status write-back error: {e}")
+
+    async def finish_campaign(self, tenant_id: Optional[str], campaign_id: str):
+        """Mark the campaign sent (or failed) once it is fully queued and none of its messages is pending"""
+        pending = await self.collection.count_documents({
+            'batch_id': campaign_id,
+            'status': {'$in': [MessageStatus.QUEUED, MessageStatus.SENDING, MessageStatus.FAILED]},
+        }, limit=1)
+        if pending:
+            return
+        counts = await self.batch_status(campaign_id)
+        delivered, failed = counts.get(MessageStatus.SENT, 0), counts.get(MessageStatus.DEAD, 0)
+        await self.db.marketing_campaigns.update_one(
+            {'id': campaign_id, 'tenant_id': tenant_id, 'status': 'sending', 'queueing': {'$ne': True}},
+            {'$set': {'status': 'sent' if delivered or not failed else 'failed',
+                      'delivered_count': delivered, 'failed_count': failed,
+                      'completed_at': _now().isoformat()}}
+        )
+
+    async def _reaper(self):
+        """Return messages whose worker died mid-send to the queue"""
+        while self._running:
+            try:
+                await asyncio.sleep(60)
+                result = await self.collection.update_many(
+                    {'status': MessageStatus.SENDING, 'locked_until': {'$lt': _now()}},
+                    {'$set': {'status': MessageStatus.FAILED, 'next_attempt_at': _now(),
+                              'last_error': 'lock expired'},
+                     '$unset': {'locked_by': '', 'locked_until': '', 'claim_id': ''}}
+                )
+                if result.modified_count:
+                    self._wakeup.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Delivery reaper error: {e}")
+
+    # -- reporting --
+
+    async def queue_stats(self, tenant_id: Optional[str] = None) -> Dict[str, Any]:
+        match = {'tenant_id': tenant_id} if tenant_id else {}
+        rows = await self.collection.aggregate([
+            {'$match': match},
+            {'$group': {'_id': {'channel': '$channel', 'status': '$status'}, 'count': {'$sum': 1}}}
+        ]).to_list(100)
+        by_channel: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            by_channel.setdefault(row['_id']['channel'], {})[row['_id']['status']] = row['count']
+        return {
+            'running': self._running,
+            'workers': self.worker_count,
+            'queues': by_channel,
+            'providers': [p.stats() for p in self.providers.values()],
+        }
+
+    async def batch_status(self, batch_id: str) -> Dict[str, int]:
+        rows = await self.collection.aggregate([
+            {'$match': {'batch_id': batch_id}},
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+        ]).to_list(10)
+        return {row['_id']: row['count'] for row in rows}
+
+
+# Global delivery service (created at startup)
+delivery_service: Optional[DeliveryService] = None
+
+
+async def init_delivery_service(db, **kwargs) -> DeliveryService:
+    global delivery_service
+    if delivery_service is None:
+        delivery_service = DeliveryService(db, **kwargs)
+    await delivery_service.start()
+    return delivery_service
+
+
+def get_delivery_service() -> Optional[DeliveryService]:
+    return delivery_service
@@ -568,3 +568,71 @@ class HKSchedulerDataGenerator:
             })
         
         return pd.DataFrame(data)
+
+
+class NoShowDataGenerator:
+    """
+    No-Show Data Generator
+    Generates booking-level no-show outcomes
+    """
+    
+    @staticmethod
+    def generate(num_bookings=5000):
+        """
+        Generate no-show training data
+        
+        Features:
+        - lead_time_days (0-365)
+        - nights (1-14)
+        - total_amount (40-3000)
+        - has_payment_method (0/1)
+        - is_ota (0/1)
+        - has_prior_contact (0/1)
+        - prior_stays (0-20)
+        - prior_no_shows (0-3)
+        - is_weekend_arrival (0/1)
+        
+        Target:
+        - no_show (0/1)
+        """
+        
+        data = []
+        
+        for _ in range(num_bookings):
+            lead_time_days = int(np.random.exponential(30))
+            lead_time_days = min(lead_time_days, 365)
+            nights = int(np.random.choice([1, 2, 3, 4, 5, 7, 10, 14], p=[0.25, 0.25, 0.2, 0.1, 0.08, 0.07, 0.03, 0.02]))
+            nightly_rate = random.uniform(40, 220)
+            total_amount = round(nightly_rate * nights, 2)
+            has_payment_method = 1 if random.random() < 0.7 else 0
+            is_ota = 1 if random.random() < 0.45 else 0
+            has_prior_contact = 1 if random.random() < 0.4 else 0
+            prior_stays = int(np.random.poisson(1.2))
+            prior_no_shows = int(np.random.poisson(0.15))
+            is_weekend_arrival = 1 if random.random() < 2 / 7 else 0
+            
+            # Base no-show probability and risk factors
+            p = 0.04
+            p += 0.10 * (1 - has_payment_method)
+            p += 0.06 * is_ota
+            p += 0.04 * (1 - has_prior_contact)
+            p += 0.05 if lead_time_days > 60 else 0.03 if lead_time_days < 3 else 0
+            p += 0.03 if nightly_rate < 80 else 0
+            p += 0.12 * min(prior_no_shows, 3)
+            p -= 0.01 * min(prior_stays, 5)
+            p = max(0.01, min(0.9, p))
+            
+            data.append({
+                'lead_time_days': lead_time_days,
+                'nights': nights,
+                'total_amount': total_amount,
+                'has_payment_method': has_payment_method,
+                'is_ota': is_ota,
+                'has_prior_contact': has_prior_contact,
+                'prior_stays': prior_stays,
+                'prior_no_shows': prior_no_shows,
+                'is_weekend_arrival': is_weekend_arrival,
+                'no_show': 1 if random.random() < p else 0
+            })
+        
+        return pd.DataFrame(data)
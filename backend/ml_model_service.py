@@ -0,0 +1,522 @@
+"""
+ML Model Service
+Off-loop model training in a process pool and in-memory model serving
+with hot-reload of new artifact versions and vectorised batch prediction
+"""
+
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone, date
+from typing import Any, Dict, Iterable, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.environ.get('ML_MODEL_DIR', 'ml_models')
+
+
+class ModelNotAvailableError(Exception):
+    """Raised when a prediction target has no trained artifact on disk"""
+
+
+# ============= TRAINING =============
+
+def _rms_summary(df):
+    return {
+        'total_samples': len(df),
+        'date_range': {'start': df['date'].min(), 'end': df['date'].max()},
+        'occupancy_range': {
+            'min': float(df['occupancy_rate'].min()),
+            'max': float(df['occupancy_rate'].max()),
+            'mean': float(df['occupancy_rate'].mean())
+        },
+        'price_range': {
+            'min': float(df['optimal_price'].min()),
+            'max': float(df['optimal_price'].max()),
+            'mean': float(df['optimal_price'].mean())
+        }
+    }
+
+
+def _persona_summary(df):
+    return {
+        'total_guests': len(df),
+        'persona_distribution': df['persona_type'].value_counts().to_dict(),
+        'avg_stays': float(df['total_stays'].mean()),
+        'avg_spend': float(df['avg_spend'].mean())
+    }
+
+
+def _maintenance_summary(df):
+    return {
+        'total_samples': len(df),
+        'equipment_distribution': df['equipment_type'].value_counts().to_dict(),
+        'risk_distribution': df['failure_risk'].value_counts().to_dict(),
+        'avg_days_until_failure': float(df['days_until_failure'].mean())
+    }
+
+
+def _hk_summary(df):
+    return {
+        'total_days': len(df),
+        'avg_occupancy': float(df['occupancy_rate'].mean()),
+        'avg_staff_needed': float(df['staff_needed'].mean()),
+        'avg_hours': float(df['estimated_hours'].mean()),
+        'peak_staff_needed': int(df['staff_needed'].max())
+    }
+
+
+def _no_show_summary(df):
+    return {
+        'total_bookings': len(df),
+        'no_show_rate': float(df['no_show'].mean()),
+        'avg_lead_time_days': float(df['lead_time_days'].mean())
+    }
+
+
+# Generator / trainer are resolved by name inside the worker process so only
+# plain strings cross the process boundary.
+TRAINING_SPECS = {
+    'rms': {
+        'generator': 'RMSDataGenerator', 'size_param': 'days', 'default_size': 730,
+        'trainer': 'RMSModelTrainer', 'summary': _rms_summary,
+    },
+    'persona': {
+        'generator': 'PersonaDataGenerator', 'size_param': 'num_guests', 'default_size': 400,
+        'trainer': 'PersonaModelTrainer', 'summary': _persona_summary,
+    },
+    'predictive_maintenance': {
+        'generator': 'PredictiveMaintenanceDataGenerator', 'size_param': 'num_samples', 'default_size': 1000,
+        'trainer': 'PredictiveMaintenanceModelTrainer', 'summary': _maintenance_summary,
+    },
+    'hk_scheduler': {
+        'generator': 'HKSchedulerDataGenerator', 'size_param': 'num_days', 'default_size': 365,
+        'trainer': 'HKSchedulerModelTrainer', 'summary': _hk_summary,
+    },
+    'no_show': {
+        'generator': 'NoShowDataGenerator', 'size_param': 'num_bookings', 'default_size': 5000,
+        'trainer': 'NoShowModelTrainer', 'summary': _no_show_summary,
+    },
+}
+
+
+def _native(value):
+    """Convert numpy scalars/containers into BSON/JSON friendly Python types"""
+    return json.loads(json.dumps(value, default=lambda o: o.item() if hasattr(o, 'item') else str(o)))
+
+
+def _run_training(kind: str, size: Optional[int], model_dir: str) -> Dict[str, Any]:
+    """
+    Runs inside a pool process: generate data, fit, then publish artifacts.
+    Trainers write into a private staging directory; files are moved into
+    model_dir with os.replace (atomic) so serving workers never read a
+    half-written pickle. Metrics JSON is published last.
+    """
+    spec = TRAINING_SPECS[kind]
+    generators = importlib.import_module('ml_data_generators')
+    trainers = importlib.import_module('ml_trainers')
+
+    os.makedirs(model_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f'.train-{kind}-', dir=model_dir)
+    try:
+        data_df = getattr(generators, spec['generator']).generate(
+            **{spec['size_param']: size or spec['default_size']}
+        )
+        trainer = getattr(trainers, spec['trainer'])(model_dir=staging)
+        metrics = trainer.train(data_df)
+
+        for name in sorted(os.listdir(staging), key=lambda f: f.endswith('.json')):
+            os.replace(os.path.join(staging, name), os.path.join(model_dir, name))
+
+        return _native({'metrics': metrics, 'data_summary': spec['summary'](data_df)})
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+class ModelTrainingService:
+    """Schedules training jobs on a process pool and tracks them in ml_training_jobs"""
+
+    def __init__(self, db, model_dir: str = MODEL_DIR, max_workers: Optional[int] = None):
+        self.collection = db.ml_training_jobs
+        self.model_dir = model_dir
+        self.max_workers = max_workers or int(os.environ.get('ML_TRAINING_WORKERS', '1'))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._active: Dict[str, Dict[str, Any]] = {}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: never fork a process that holds Motor/event-loop threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._pool
+
+    async def submit(self, kind: str, size: Optional[int] = None,
+                     requested_by: Optional[str] = None, tenant_id: Optional[str] = None) -> Dict[str, Any]:
+        """Queue a training job; an already running job for the same model is reused"""
+        if kind not in TRAINING_SPECS:
+            raise ValueError(f"Unknown model: {kind}")
+
+        for job in self._active.values():
+            if job['kind'] == kind:
+                return job
+
+        job = {
+            'id': str(uuid.uuid4()),
+            'kind': kind,
+            'size': size or TRAINING_SPECS[kind]['default_size'],
+            'status': 'queued',
+            'requested_by': requested_by,
+            'tenant_id': tenant_id,
+            'created_at': datetime.now(timezone.utc).isoformat()
+        }
+        await self.collection.insert_one(dict(job))
+
+        self._active[job['id']] = job
+        task = asyncio.create_task(self._run(job))
+        self._tasks[job['id']] = task
+        task.add_done_callback(lambda t, job_id=job['id']: self._forget(job_id, t))
+        return job
+
+    def _forget(self, job_id: str, task: asyncio.Task):
+        self._tasks.pop(job_id, None)
+        if not task.cancelled():
+            task.exception()  # failure is recorded on the job document
+
+    async def _run(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        job['status'] = 'running'
+        await self._update(job['id'], status='running', started_at=datetime.now(timezone.utc).isoformat())
+        try:
+            result = await loop.run_in_executor(
+                self._executor(), _run_training, job['kind'], job['size'], self.model_dir
+            )
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._pool = None
+            await self._update(job['id'], status='failed', error=str(e),
+                               finished_at=datetime.now(timezone.utc).isoformat())
+            logger.error(f"Training job {job['id']} ({job['kind']}) failed: {e}")
+            raise
+        finally:
+            self._active.pop(job['id'], None)
+
+        await self._update(
+            job['id'], status='completed',
+            finished_at=datetime.now(timezone.utc).isoformat(),
+            duration_seconds=round(time.perf_counter() - started, 2),
+            metrics=result['metrics'], data_summary=result['data_summary']
+        )
+        # Pick up the new artifacts in this worker right away; other workers
+        # notice the changed files on their next stat check.
+        model_registry.invalidate()
+        return result
+
+    async def _update(self, job_id: str, **fields):
+        await self.collection.update_one({'id': job_id}, {'$set': fields})
+
+    async def wait(self, job_id: str) -> Dict[str, Any]:
+        """Await a job's result without blocking the event loop"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            return await asyncio.shield(task)
+        job = await self.get_job(job_id)
+        if not job:
+            raise KeyError(job_id)
+        if job['status'] == 'failed':
+            raise RuntimeError(job.get('error') or 'Training failed')
+        return {'metrics': job.get('metrics'), 'data_summary': job.get('data_summary')}
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({'id': job_id}, {'_id': 0})
+
+    async def list_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        return await self.collection.find(
+            {}, {'_id': 0, 'metrics': 0}
+        ).sort('created_at', -1).to_list(limit)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# ============= SERVING =============
+
+RMS_OCCUPANCY_FEATURES = [
+    'day_of_week', 'month', 'season', 'is_weekend', 'is_holiday',
+    'days_until_event', 'competitor_avg_rate', 'competitor_occupancy',
+    'historical_occupancy_7d', 'historical_occupancy_30d', 'lead_time_bookings',
+    'current_price'
+]
+
+RMS_PRICING_FEATURES = [
+    'day_of_week', 'month', 'season', 'is_weekend', 'is_holiday',
+    'days_until_event', 'competitor_avg_rate', 'occupancy_rate',
+    'historical_occupancy_7d', 'historical_occupancy_30d'
+]
+
+HK_FEATURES = [
+    'day_of_week', 'is_weekend', 'season', 'total_rooms',
+    'occupied_rooms', 'checkout_rooms', 'stayover_rooms',
+    'vip_rooms', 'occupancy_rate', 'avg_room_type_points'
+]
+
+NO_SHOW_FEATURES = [
+    'lead_time_days', 'nights', 'total_amount', 'has_payment_method',
+    'is_ota', 'has_prior_contact', 'prior_stays', 'prior_no_shows',
+    'is_weekend_arrival'
+]
+
+PERSONA_FEATURES = [
+    'total_stays', 'avg_spend', 'total_spent', 'avg_lead_time',
+    'ota_bookings', 'direct_bookings', 'upsells_accepted',
+    'negative_reviews', 'positive_reviews', 'days_since_last_visit',
+    'booking_frequency'
+]
+
+MAINTENANCE_FEATURES = [
+    'equipment_type_encoded', 'temperature', 'vibration_level',
+    'error_count_24h', 'usage_hours', 'days_since_maintenance',
+    'humidity', 'pressure', 'age_years'
+]
+
+# output: value (regression), proba (positive-class probability), label (decoded class)
+PREDICTORS = {
+    'price': {
+        'artifact': 'rms_pricing_model.pkl', 'features': RMS_PRICING_FEATURES, 'output': 'value',
+        'defaults': {'days_until_event': 60, 'competitor_avg_rate': 150, 'occupancy_rate': 0.7,
+                     'historical_occupancy_7d': 0.7, 'historical_occupancy_30d': 0.7},
+    },
+    'occupancy': {
+        'artifact': 'rms_occupancy_model.pkl', 'features': RMS_OCCUPANCY_FEATURES, 'output': 'value',
+        'defaults': {'days_until_event': 60, 'competitor_avg_rate': 150, 'competitor_occupancy': 0.7,
+                     'historical_occupancy_7d': 0.7, 'historical_occupancy_30d': 0.7, 'current_price': 150},
+    },
+    'no_show': {
+        'artifact': 'no_show_model.pkl', 'features': NO_SHOW_FEATURES, 'output': 'proba',
+        'defaults': {'nights': 1},
+    },
+    'hk_hours': {
+        'artifact': 'hk_hours_model.pkl', 'features': HK_FEATURES, 'output': 'value',
+        'defaults': {'avg_room_type_points': 1.5},
+    },
+    'hk_staff': {
+        'artifact': 'hk_staff_model.pkl', 'features': HK_FEATURES, 'output': 'value',
+        'defaults': {'avg_room_type_points': 1.5},
+    },
+    'persona': {
+        'artifact': 'persona_model.pkl', 'features': PERSONA_FEATURES, 'output': 'label',
+        'label_encoder': 'persona_label_encoder.pkl',
+    },
+    'maintenance_risk': {
+        'artifact': 'maintenance_risk_model.pkl', 'features': MAINTENANCE_FEATURES, 'output': 'label',
+        'label_encoder': 'maintenance_label_encoder.pkl',
+        'encode': {'equipment_type_encoded': ('equipment_type', 'maintenance_equipment_encoder.pkl')},
+    },
+}
+
+
+class _LoadedArtifact:
+    __slots__ = ('obj', 'signature', 'version', 'loaded_at', 'checked_at')
+
+    def __init__(self, obj, signature, version, checked_at):
+        self.obj = obj
+        self.signature = signature
+        self.version = version
+        self.loaded_at = datetime.now(timezone.utc).isoformat()
+        self.checked_at = checked_at
+
+
+class ModelRegistry:
+    """
+    Per-process cache of deserialised artifacts.
+    Files are stat'ed at most every `check_interval` seconds; a changed
+    (mtime, inode, size) signature triggers a reload, so a model published
+    by a training job is picked up by every API worker without a restart.
+    """
+
+    def __init__(self, model_dir: str = MODEL_DIR, check_interval: float = 5.0):
+        self.model_dir = model_dir
+        self.check_interval = check_interval
+        self._artifacts: Dict[str, _LoadedArtifact] = {}
+        self._lock = threading.Lock()
+        self.predictions_served = 0
+
+    def _signature(self, filename: str):
+        try:
+            st = os.stat(os.path.join(self.model_dir, filename))
+        except FileNotFoundError:
+            raise ModelNotAvailableError(f"{filename} not trained yet")
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def get(self, filename: str) -> _LoadedArtifact:
+        now = time.monotonic()
+        entry = self._artifacts.get(filename)
+        if entry is not None and now - entry.checked_at < self.check_interval:
+            return entry
+
+        signature = self._signature(filename)
+        if entry is not None and entry.signature == signature:
+            entry.checked_at = now
+            return entry
+
+        with self._lock:
+            entry = self._artifacts.get(filename)
+            if entry is None or entry.signature != signature:
+                obj = joblib.load(os.path.join(self.model_dir, filename))
+                version = datetime.fromtimestamp(signature[0] / 1e9, timezone.utc).isoformat()
+                entry = _LoadedArtifact(obj, signature, version, now)
+                self._artifacts[filename] = entry
+                logger.info(f"Loaded model artifact {filename} (version {version})")
+            entry.checked_at = now
+            return entry
+
+    def invalidate(self):
+        """Force a stat check on next access"""
+        for entry in list(self._artifacts.values()):
+            entry.checked_at = 0.0
+
+    def _frame(self, spec: Dict[str, Any], model, rows: List[Dict[str, Any]]) -> pd.DataFrame:
+        names = getattr(model, 'feature_names_in_', None)
+        features = list(names) if names is not None else spec['features']
+        defaults = spec.get('defaults', {})
+        columns = {}
+        for feature in features:
+            if feature in spec.get('encode', {}):
+                source, encoder_file = spec['encode'][feature]
+                lookup = {cls: i for i, cls in enumerate(self.get(encoder_file).obj.classes_)}
+                columns[feature] = [lookup.get(row.get(source), 0) for row in rows]
+            else:
+                default = defaults.get(feature, 0)
+                columns[feature] = [row.get(feature, default) for row in rows]
+        return pd.DataFrame(columns, columns=features).astype(float)
+
+    def predict_sync(self, target: str, rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        spec = PREDICTORS.get(target)
+        if spec is None:
+            raise KeyError(target)
+        rows = list(rows)
+        artifact = self.get(spec['artifact'])
+        if not rows:
+            return {'target': target, 'model_version': artifact.version, 'count': 0, 'predictions': []}
+
+        frame = self._frame(spec, artifact.obj, rows)
+        if spec['output'] == 'proba':
+            predictions = np.round(artifact.obj.predict_proba(frame)[:, 1], 4).tolist()
+        elif spec['output'] == 'label':
+            encoder = self.get(spec['label_encoder']).obj
+            predictions = encoder.inverse_transform(artifact.obj.predict(frame).astype(int)).tolist()
+        else:
+            predictions = np.round(artifact.obj.predict(frame), 4).tolist()
+
+        self.predictions_served += len(rows)
+        return {
+            'target': target,
+            'model_version': artifact.version,
+            'count': len(rows),
+            'predictions': predictions
+        }
+
+    async def predict(self, target: str, rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """One vectorised model call for all rows, run off the event loop"""
+        return await asyncio.to_thread(self.predict_sync, target, rows)
+
+    def available(self, target: str) -> bool:
+        try:
+            self._signature(PREDICTORS[target]['artifact'])
+            return True
+        except (KeyError, ModelNotAvailableError):
+            return False
+
+    def status(self) -> Dict[str, Any]:
+        loaded = {
+            name: {'version': a.version, 'loaded_at': a.loaded_at}
+            for name, a in self._artifacts.items()
+        }
+        return {
+            'targets': {target: self.available(target) for target in PREDICTORS},
+            'loaded_artifacts': loaded,
+            'predictions_served': self.predictions_served
+        }
+
+
+# ============= FEATURE BUILDERS =============
+
+OTA_CHANNELS = {'booking_com', 'expedia', 'airbnb', 'hotels_com', 'agoda', 'ota'}
+
+
+def _as_date(value) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).date()
+        except ValueError:
+            return None
+    return None
+
+
+def no_show_features(booking: Dict[str, Any], history: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Map a booking document (plus guest history counts) to no-show model features"""
+    history = history or {}
+    check_in = _as_date(booking.get('check_in'))
+    check_out = _as_date(booking.get('check_out'))
+    created = _as_date(booking.get('created_at'))
+    lead_time = (check_in - created).days if check_in and created else 0
+    nights = (check_out - check_in).days if check_in and check_out else 1
+    return {
+        'lead_time_days': max(lead_time, 0),
+        'nights': max(nights, 1),
+        'total_amount': float(booking.get('total_amount') or 0),
+        'has_payment_method': 1 if booking.get('payment_method') else 0,
+        'is_ota': 1 if booking.get('channel') in OTA_CHANNELS else 0,
+        'has_prior_contact': 1 if booking.get('last_contact_date') else 0,
+        'prior_stays': history.get('stays', 0),
+        'prior_no_shows': history.get('no_shows', 0),
+        'is_weekend_arrival': 1 if check_in and check_in.weekday() >= 4 else 0
+    }
+
+
+def season_for_month(month: int) -> int:
+    """Season code used by the RMS/HK training data (1=low, 2=high, 3=peak)"""
+    if month in (6, 7, 8, 12):
+        return 3
+    if month in (4, 5, 9, 10):
+        return 2
+    return 1
+
+
+# Per-process registry; the training service is created at startup
+model_registry = ModelRegistry()
+training_service: Optional[ModelTrainingService] = None
+
+
+def init_training_service(db) -> ModelTrainingService:
+    global training_service
+    if training_service is None:
+        training_service = ModelTrainingService(db)
+    return training_service
+
+
+def get_training_service() -> Optional[ModelTrainingService]:
+    return training_service
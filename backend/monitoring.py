@@ -10,6 +10,7 @@ import psutil
 import os
 import logging
 from motor.motor_asyncio import AsyncIOMotorClient
+from request_metrics import LatencyHistogram, metrics_registry
 
 logger = logging.getLogger(__name__)
 
@@ -170,11 +171,11 @@ class DatabaseMonitor:
 
 
 class PerformanceMetrics:
-    """Track API performance metrics"""
+    """Track API performance metrics in bounded latency histograms"""
     
     def __init__(self):
         self.request_counts = {}
-        self.response_times = {}
+        self.response_times: Dict[str, LatencyHistogram] = {}
         self.error_counts = {}
     
     def record_request(self, endpoint: str, duration_ms: float, status_code: int):
@@ -184,10 +185,10 @@ class PerformanceMetrics:
             self.request_counts[endpoint] = 0
         self.request_counts[endpoint] += 1
         
-        # Response time
+        # Response time (fixed-size histogram, not an ever-growing list)
         if endpoint not in self.response_times:
-            self.response_times[endpoint] = []
-        self.response_times[endpoint].append(duration_ms)
+            self.response_times[endpoint] = LatencyHistogram()
+        self.response_times[endpoint].record_ms(duration_ms)
         
         # Errors
         if status_code >= 400:
@@ -199,13 +200,17 @@ class PerformanceMetrics:
         """Get aggregated metrics"""
         metrics = {}
         
-        for endpoint, times in self.response_times.items():
-            if times:
+        for endpoint, histogram in self.response_times.items():
+            if histogram.count:
+                summary = histogram.summary()
                 metrics[endpoint] = {
                     'request_count': self.request_counts.get(endpoint, 0),
-                    'avg_response_ms': round(sum(times) / len(times), 2),
-                    'min_response_ms': round(min(times), 2),
-                    'max_response_ms': round(max(times), 2),
+                    'avg_response_ms': summary['avg_ms'],
+                    'min_response_ms': summary['min_ms'],
+                    'max_response_ms': summary['max_ms'],
+                    'p50_response_ms': summary['p50_ms'],
+                    'p95_response_ms': summary['p95_ms'],
+                    'p99_response_ms': summary['p99_ms'],
                     'error_count': self.error_counts.get(endpoint, 0),
                     'error_rate': round(
                         (self.error_counts.get(endpoint, 0) / self.request_counts.get(endpoint, 1)) * 100,
@@ -314,9 +319,14 @@ async def health_check():
 
 @monitoring_router.get("/metrics")
 async def get_metrics():
-    """Get performance metrics"""
+    """Get performance metrics (p50/p95/p99 per route template, collection and cache)"""
     return {
         'metrics': performance_metrics.get_metrics(),
+        'routes': metrics_registry.route_metrics(),
+        'database': metrics_registry.db_metrics(),
+        'cache': metrics_registry.cache_metrics(),
+        'overall_24h': metrics_registry.overall(24),
+        'collecting_since': metrics_registry.started_at.isoformat(),
         'timestamp': datetime.now(timezone.utc).isoformat()
     }
 
@@ -362,6 +372,7 @@ async def get_database_metrics():
             'connections': await db_monitor.get_connection_stats(),
             'collections': await db_monitor.get_collection_stats(),
             'slow_queries': await db_monitor.get_slow_queries(),
+            'operations': metrics_registry.db_metrics(),
             'timestamp': datetime.now(timezone.utc).isoformat()
         }
         
@@ -420,6 +431,7 @@ async def get_alerts():
 async def reset_metrics():
     """Reset performance metrics"""
     performance_metrics.reset()
+    metrics_registry.reset()
     return {
         'message': 'Metrics reset successfully',
         'timestamp': datetime.now(timezone.utc).isoformat()
@@ -3,14 +3,15 @@ Performance Optimization Endpoints
 Enterprise-level optimizations for 550+ room properties
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 import logging
 from pydantic import BaseModel
 
 from data_archival import DataArchivalManager
-from materialized_views import MaterializedViewsManager
+from materialized_views import MaterializedViewsManager, VIEWS, get_materialized_views
 from advanced_cache import AdvancedCacheManager, CacheLayer, CacheWarmer
+from server import get_current_user, User, _is_super_admin
 import redis
 
 logger = logging.getLogger(__name__)
@@ -23,12 +24,20 @@ class ArchivalRequest(BaseModel):
     dry_run: bool = True
     threshold_days: Optional[int] = None
 
+class ArchiveRunRequest(BaseModel):
+    collections: Optional[List[str]] = None  # If None, every archive policy
+    tenant_id: Optional[str] = None  # Super admin only; defaults to the caller's tenant
+    dry_run: bool = True
+    max_batches: Optional[int] = None  # Time-box the run; the next run resumes
+
 class CacheInvalidation(BaseModel):
     pattern: str
     layer: Optional[str] = None
 
 class RefreshViewRequest(BaseModel):
     view_name: Optional[str] = None  # If None, refresh all
+    tenant_id: Optional[str] = None  # Super admin only; if None, every tenant with touched partitions
+    full: bool = False  # Rebuild every partition instead of the touched ones
 
 # Initialize managers (will be set on app startup)
 archival_manager = None
@@ -41,7 +50,7 @@ def init_optimization_managers(db, redis_client):
     global archival_manager, materialized_views_manager, cache_manager, cache_warmer
     
     archival_manager = DataArchivalManager(db)
-    materialized_views_manager = MaterializedViewsManager(db)
+    materialized_views_manager = get_materialized_views() or MaterializedViewsManager(db)
     cache_manager = AdvancedCacheManager(redis_client)
     cache_warmer = CacheWarmer(cache_manager)
     
@@ -66,6 +75,31 @@ async def archive_bookings(request: ArchivalRequest):
     result = await archival_manager.archive_old_bookings(dry_run=request.dry_run)
     return result
 
+def _scoped_tenant(current_user: User, requested: Optional[str]) -> Optional[str]:
+    """Caller's tenant; another tenant (or None = every tenant) only for super admins"""
+    if _is_super_admin(current_user):
+        return requested
+    if requested and requested != current_user.tenant_id:
+        raise HTTPException(status_code=403, detail="Cross-tenant operations require super admin")
+    return current_user.tenant_id
+
+@optimization_router.post("/archive/run")
+async def run_archival(request: ArchiveRunRequest, current_user: User = Depends(get_current_user)):
+    """
+    Archive every policy collection (bookings, folios, folio_charges, payments,
+    audit_logs, housekeeping_tasks) in resumable _id-ordered batches.
+    Scoped to the caller's tenant; super admins may target any or every tenant.
+    """
+    if not archival_manager:
+        raise HTTPException(status_code=503, detail="Archival manager not initialized")
+    
+    return await archival_manager.archive_all(
+        collections=request.collections,
+        tenant_id=_scoped_tenant(current_user, request.tenant_id),
+        dry_run=request.dry_run,
+        max_batches=request.max_batches
+    )
+
 @optimization_router.get("/archive/stats")
 async def get_archive_stats():
     """Get statistics about data archival"""
@@ -86,20 +120,30 @@ async def setup_archive_indexes():
 # ============= MATERIALIZED VIEWS ENDPOINTS =============
 
 @optimization_router.post("/views/refresh")
-async def refresh_views(request: RefreshViewRequest = None):
+async def refresh_views(request: RefreshViewRequest = None, current_user: User = Depends(get_current_user)):
     """
     Refresh materialized views
     
     - **view_name**: Specific view to refresh (default: all views)
+    - **tenant_id**: Another tenant's partitions (super admin only; default: the caller's tenant)
+    - **full**: Rebuild all partitions instead of those touched since the last refresh
+    
+    Super admins without a tenant_id refresh every tenant.
     """
     if not materialized_views_manager:
         raise HTTPException(status_code=503, detail="Materialized views manager not initialized")
     
-    if request and request.view_name:
-        if request.view_name == "dashboard_metrics":
-            result = await materialized_views_manager.refresh_dashboard_metrics()
-        else:
-            raise HTTPException(status_code=400, detail=f"Unknown view: {request.view_name}")
+    request = request or RefreshViewRequest()
+    tenant_id = _scoped_tenant(current_user, request.tenant_id)
+    if request.view_name and request.view_name not in VIEWS:
+        raise HTTPException(status_code=400, detail=f"Unknown view: {request.view_name}")
+    
+    if tenant_id or request.view_name or request.full:
+        names = [request.view_name] if request.view_name else list(VIEWS)
+        results = {
+            name: await materialized_views_manager.refresh_view(name, tenant_id, request.full) for name in names
+        }
+        result = results[names[0]] if len(names) == 1 else {"success": True, "results": results}
     else:
         result = await materialized_views_manager.refresh_all_views()
     
@@ -116,19 +160,24 @@ async def get_view_stats():
 @optimization_router.get("/views/{view_name}")
 async def get_view(
     view_name: str,
-    max_age_seconds: int = Query(300, description="Maximum age in seconds")
+    tenant_id: Optional[str] = Query(None, description="Another tenant's partitions (super admin only)"),
+    max_age_seconds: int = Query(300, description="Maximum age in seconds"),
+    current_user: User = Depends(get_current_user)
 ):
-    """Get specific materialized view"""
+    """Get the caller's materialized view (refreshed first when older than max_age_seconds)"""
     if not materialized_views_manager:
         raise HTTPException(status_code=503, detail="Materialized views manager not initialized")
     
-    data = await materialized_views_manager.get_view(view_name, max_age_seconds)
+    tenant_id = _scoped_tenant(current_user, tenant_id) or current_user.tenant_id
+    data = await materialized_views_manager.get_view(view_name, max_age_seconds, tenant_id=tenant_id)
     
     if data is None:
         raise HTTPException(status_code=404, detail="View not found or too old")
     
     return {
         "view_name": view_name,
+        "tenant_id": tenant_id,
+        "freshness": data.pop("freshness", None),
         "data": data
     }
 
@@ -3,9 +3,13 @@ Pagination and Query Optimization Utilities
 Ensures efficient data retrieval for large datasets
 """
 
-from typing import TypeVar, Generic, List, Dict, Any, Optional
+from typing import TypeVar, Generic, List, Dict, Any, Optional, Tuple
 from pydantic import BaseModel
 from math import ceil
+from datetime import datetime
+import base64
+import hashlib
+import json
 
 T = TypeVar('T')
 
@@ -65,6 +69,184 @@ class PaginatedResponse(BaseModel, Generic[T]):
         )
 
 
+class CursorPage(BaseModel, Generic[T]):
+    """Keyset (cursor) paginated response format"""
+    items: List[T]
+    next_cursor: Optional[str] = None
+    has_more: bool
+    limit: int
+    total: Optional[int] = None
+    total_is_estimate: bool = False
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a cursor is malformed or was issued for another sort order"""
+
+
+# ============= KEYSET (CURSOR) PAGINATION =============
+
+# Common sort keys; each ends with a unique tie-breaker so pages never overlap
+SORT_CREATED_DESC = [('created_at', -1), ('id', -1)]
+SORT_CHECK_IN_DESC = [('check_in', -1), ('id', -1)]
+# room_number is unique per tenant (idx_rooms_tenant_number), so it is its own tie-breaker
+SORT_ROOM_NUMBER = [('room_number', 1)]
+SORT_TIMESTAMP_DESC = [('timestamp', -1), ('id', -1)]
+
+# Beyond this many matches the total is reported as an estimate
+DEFAULT_COUNT_CAP = 10000
+
+
+def _sort_fingerprint(sort_keys: List[Tuple[str, int]]) -> str:
+    return hashlib.sha1(repr(sort_keys).encode()).hexdigest()[:8]
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and '$dt' in value:
+        return datetime.fromisoformat(value['$dt'])
+    return value
+
+
+def encode_cursor(doc: Dict[str, Any], sort_keys: List[Tuple[str, int]]) -> str:
+    """Opaque cursor holding the sort-key values of the last item on a page"""
+    payload = {
+        's': _sort_fingerprint(sort_keys),
+        'v': [_encode_value(doc.get(field)) for field, _ in sort_keys]
+    }
+    raw = json.dumps(payload, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort_keys: List[Tuple[str, int]]) -> List[Any]:
+    """Decode a cursor back into sort-key values"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = [_decode_value(v) for v in payload['v']]
+    except Exception:
+        raise InvalidCursorError('Malformed cursor')
+    if payload.get('s') != _sort_fingerprint(sort_keys) or len(values) != len(sort_keys):
+        raise InvalidCursorError('Cursor does not match this listing')
+    return values
+
+
+def _after(field: str, direction: int, value: Any) -> Optional[Dict[str, Any]]:
+    """Filter for values strictly after `value` in sort order (nulls sort lowest)"""
+    if value is None:
+        # Ascending: everything non-null follows; descending: nothing sorts below null
+        return {field: {'$ne': None}} if direction == 1 else None
+    if direction == 1:
+        return {field: {'$gt': value}}
+    # Descending order puts null/missing values last, so they still follow
+    return {field: {'$not': {'$gte': value}}}
+
+
+def build_keyset_filter(sort_keys: List[Tuple[str, int]], values: List[Any]) -> Dict[str, Any]:
+    """
+    Build the "seek" predicate for the page after `values`
+
+    For sort (a desc, id desc) and last values (A, I) this yields
+    {'$or': [{a: {'$lt': A}}, {a: A, id: {'$lt': I}}]}, which MongoDB
+    answers with index bounds instead of skipping over earlier pages.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort_keys):
+        clause = {prefix_field: values[j] for j, (prefix_field, _) in enumerate(sort_keys[:i])}
+        after = _after(field, direction, values[i])
+        if after is None:
+            continue
+        clause.update(after)
+        clauses.append(clause)
+    if not clauses:
+        # Nothing can follow the cursor
+        return {'_id': {'$exists': False}}
+    return {'$or': clauses} if len(clauses) > 1 else clauses[0]
+
+
+async def estimate_total(collection, query: Dict[str, Any], cap: int = DEFAULT_COUNT_CAP) -> Tuple[int, bool]:
+    """
+    Count matches up to `cap`
+
+    Returns (total, is_estimate); is_estimate is True when the cap was hit
+    and the real total is at least `cap`.
+    """
+    total = await collection.count_documents(query, limit=cap)
+    return total, total >= cap
+
+
+async def keyset_find(
+    collection,
+    query: Dict[str, Any],
+    sort_keys: List[Tuple[str, int]],
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    projection: Dict[str, int] = None,
+    with_total: bool = False,
+    count_cap: int = DEFAULT_COUNT_CAP
+) -> CursorPage:
+    """
+    Execute keyset paginated find query
+    
+    Args:
+        collection: MongoDB collection
+        query: Query filter
+        sort_keys: Sort specification ending in a unique tie-breaker (e.g. 'id')
+        limit: Items per page
+        cursor: Opaque cursor from the previous page's next_cursor
+        projection: Fields to include/exclude (sort keys are always included)
+        with_total: Count matches on the first page (capped at count_cap); opt in
+            only where the response already carried a total
+        count_cap: Upper bound for the count; above it totals are estimates
+    
+    Returns:
+        CursorPage
+    """
+    limit = max(1, min(limit, 1000))
+    
+    if cursor:
+        seek = build_keyset_filter(sort_keys, decode_cursor(cursor, sort_keys))
+        page_query = {'$and': [query, seek]} if query else seek
+    else:
+        page_query = query
+    
+    if projection is None:
+        projection = {'_id': 0}
+    elif any(v for k, v in projection.items() if k != '_id'):
+        projection = {**projection, **{field: 1 for field, _ in sort_keys}}
+    
+    # Fetch one extra row to know whether another page exists
+    items = await collection.find(page_query, projection).sort(sort_keys).limit(limit + 1).to_list(limit + 1)
+    has_more = len(items) > limit
+    items = items[:limit]
+    
+    total, total_is_estimate = None, False
+    if with_total and not cursor:
+        total, total_is_estimate = await estimate_total(collection, query, count_cap)
+    
+    return CursorPage(
+        items=items,
+        next_cursor=encode_cursor(items[-1], sort_keys) if has_more and items else None,
+        has_more=has_more,
+        limit=limit,
+        total=total,
+        total_is_estimate=total_is_estimate
+    )
+
+
+def apply_cursor_headers(response, page: CursorPage):
+    """Expose cursor metadata on list endpoints whose body must stay a plain list"""
+    if page.next_cursor:
+        response.headers['X-Next-Cursor'] = page.next_cursor
+    if page.total is not None:
+        response.headers['X-Total-Count'] = str(page.total)
+        response.headers['X-Total-Is-Estimate'] = 'true' if page.total_is_estimate else 'false'
+
+
 class QueryOptimizer:
     """Optimize MongoDB queries for performance"""
     
@@ -395,11 +577,14 @@ async def paginated_find(
     page_size: int,
     sort_field: str = 'created_at',
     sort_order: str = 'desc',
-    projection: Dict[str, int] = None
+    projection: Dict[str, int] = None,
+    count_cap: Optional[int] = None
 ):
     """
     Execute paginated find query
     
+    Prefer keyset_find for deep listings; skip() cost grows with the page number.
+    
     Args:
         collection: MongoDB collection
         query: Query filter
@@ -408,6 +593,7 @@ async def paginated_find(
         sort_field: Field to sort by
         sort_order: 'asc' or 'desc'
         projection: Fields to include/exclude
+        count_cap: Stop counting at this many matches (total becomes a lower bound)
     
     Returns:
         PaginatedResponse
@@ -416,8 +602,11 @@ async def paginated_find(
     params = PaginationParams(page=page, page_size=page_size)
     params.validate()
     
-    # Get total count
-    total = await collection.count_documents(query)
+    # Get total count (bounded when an estimate is acceptable)
+    if count_cap:
+        total, _ = await estimate_total(collection, query, count_cap)
+    else:
+        total = await collection.count_documents(query)
     
     # Get items
     if projection is None:
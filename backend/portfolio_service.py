@@ -0,0 +1,262 @@
+"""
+Portfolio Service - multi-property KPI aggregation
+Resolves the properties of a portfolio (group tenant), computes each
+property's day KPIs through the KPI engine (three aggregations per property)
+with bounded parallelism, and merges them into portfolio occupancy, ADR,
+RevPAR and pickup. Property snapshots are cached per (property, business
+date) and carry their own computed_at, so a portfolio view reports how fresh
+each property is and only recomputes the stale ones.
+"""
+
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from kpi_engine import category_totals, get_kpi_engine, portfolio_metrics
+
+PORTFOLIO_CONCURRENCY = int(os.environ.get('PORTFOLIO_CONCURRENCY', '5'))
+PORTFOLIO_TTL_SECONDS = int(os.environ.get('PORTFOLIO_TTL_SECONDS', '120'))
+PORTFOLIO_PROPERTY_TIMEOUT_SECONDS = float(os.environ.get('PORTFOLIO_PROPERTY_TIMEOUT_SECONDS', '10'))
+PORTFOLIO_SNAPSHOT_MAX_ENTRIES = int(os.environ.get('PORTFOLIO_SNAPSHOT_MAX_ENTRIES', '2000'))
+
+
+def _ratio(numerator: float, denominator: float, scale: float = 1) -> float:
+    return round(numerator / denominator * scale, 2) if denominator else 0
+
+
+def property_kpis(values: Dict[str, Any]) -> Dict[str, Any]:
+    """Day KPIs of one property from its portfolio_metrics values"""
+    total_rooms = values['rooms']['total']
+    rooms_sold = values['in_house']['rooms_sold']
+    revenue = category_totals(values['charges_by_category'])
+    # Room charges are posted by the night audit; until then the booked rate stands in
+    room_revenue = revenue['room'] or values['in_house']['base_rate']
+    return {
+        'total_rooms': total_rooms,
+        'occupied_rooms': values['rooms']['occupied'],
+        'rooms_sold': rooms_sold,
+        'guests': values['in_house']['guests'] + values['in_house']['children'],
+        'occupancy': _ratio(rooms_sold, total_rooms, 100),
+        'adr': _ratio(room_revenue, rooms_sold),
+        'revpar': _ratio(room_revenue, total_rooms),
+        'room_revenue': round(room_revenue, 2),
+        'total_revenue': round(revenue['total'], 2),
+        'pickup_bookings': values['pickup']['bookings'],
+        'pickup_revenue': round(values['pickup']['revenue'], 2),
+    }
+
+
+class PortfolioService:
+    """Concurrent per-property KPI fan-out with per-property snapshot cache"""
+
+    def __init__(self, db, concurrency: int = PORTFOLIO_CONCURRENCY):
+        self.db = db
+        self.engine = get_kpi_engine(db)
+        self.concurrency = concurrency
+        self._snapshots: Dict[tuple, Dict[str, Any]] = {}
+
+    # ------------------------------------------------------------ membership
+
+    async def properties(self, tenant_id: str) -> List[Dict[str, Any]]:
+        """
+        Properties of the user's portfolio. A property's own data lives under
+        its id as tenant_id; the user's own hotel is always part of it, so a
+        single hotel is a portfolio of itself.
+        """
+        props = await self.db.properties.find(
+            {'$or': [{'portfolio_id': tenant_id}, {'organization_id': tenant_id}, {'tenant_id': tenant_id}],
+             'status': {'$nin': ['inactive', 'archived']}},
+            {'_id': 0, 'id': 1, 'property_id': 1, 'property_name': 1, 'name': 1, 'property_code': 1,
+             'location': 1, 'city': 1, 'status': 1}
+        ).to_list(500)
+        result = {}
+        for p in props:
+            property_id = p.get('id') or p.get('property_id')
+            if property_id and property_id not in result:
+                result[property_id] = {
+                    'property_id': property_id,
+                    'property_name': p.get('property_name') or p.get('name') or 'Unnamed Property',
+                    'property_code': p.get('property_code'),
+                    'location': p.get('location') or p.get('city'),
+                }
+        if tenant_id not in result:
+            org = await self.db.organizations.find_one({'id': tenant_id}, {'_id': 0, 'name': 1}) or {}
+            home = {'property_id': tenant_id, 'property_name': org.get('name') or 'Hotel',
+                    'property_code': None, 'location': None}
+            result = {tenant_id: home, **result}
+        return list(result.values())
+
+    async def property_ids(self, tenant_id: str) -> List[str]:
+        return [p['property_id'] for p in await self.properties(tenant_id)]
+
+    # ------------------------------------------------------------ per-property snapshots
+
+    async def _property(self, prop: Dict[str, Any], day: date, semaphore: asyncio.Semaphore,
+                        refresh: bool = False, drilldown: bool = False) -> Dict[str, Any]:
+        key = (prop['property_id'], day.isoformat(), drilldown)
+        cached = self._snapshots.get(key)
+        if cached and not refresh and time.monotonic() - cached['loaded_at'] < PORTFOLIO_TTL_SECONDS:
+            return cached
+        async with semaphore:
+            try:
+                values = await asyncio.wait_for(
+                    self.engine.compute(prop['property_id'], portfolio_metrics(day, drilldown=drilldown)),
+                    timeout=PORTFOLIO_PROPERTY_TIMEOUT_SECONDS
+                )
+            except Exception as e:
+                print(f"⚠️ Portfolio KPIs failed for property {prop['property_id']}: {e}")
+                if cached:
+                    # Serve the last snapshot; its freshness shows it is old
+                    return {**cached, 'error': str(e)}
+                return {'kpis': None, 'values': None, 'computed_at': None, 'loaded_at': 0, 'error': str(e)}
+        entry = {
+            'kpis': property_kpis(values),
+            'values': values,
+            'computed_at': datetime.now(timezone.utc).isoformat(),
+            'loaded_at': time.monotonic(),
+        }
+        # Most recent last; least recently computed snapshots drop off past the cap
+        self._snapshots.pop(key, None)
+        self._snapshots[key] = entry
+        while len(self._snapshots) > PORTFOLIO_SNAPSHOT_MAX_ENTRIES:
+            self._snapshots.pop(next(iter(self._snapshots)))
+        return entry
+
+    def invalidate(self, property_ids: List[str]):
+        ids = set(property_ids)
+        for key in [k for k in self._snapshots if k[0] in ids]:
+            self._snapshots.pop(key, None)
+        for property_id in ids:
+            self.engine.invalidate(property_id)
+
+    @staticmethod
+    def _freshness(entry: Dict[str, Any]) -> Dict[str, Any]:
+        age = round(time.monotonic() - entry['loaded_at'], 1) if entry.get('computed_at') else None
+        return {'computed_at': entry.get('computed_at'), 'age_seconds': age,
+                'stale': age is None or age > PORTFOLIO_TTL_SECONDS, 'error': entry.get('error')}
+
+    # ------------------------------------------------------------ portfolio views
+
+    async def snapshot(self, tenant_id: str, day: Optional[date] = None, refresh: bool = False) -> Dict[str, Any]:
+        """Every property's KPIs for the day, computed concurrently, plus portfolio totals"""
+        day = day or datetime.now(timezone.utc).date()
+        props = await self.properties(tenant_id)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        entries = await asyncio.gather(*[self._property(p, day, semaphore, refresh) for p in props])
+
+        rows, totals = [], {'total_rooms': 0, 'occupied_rooms': 0, 'rooms_sold': 0, 'guests': 0,
+                            'room_revenue': 0.0, 'total_revenue': 0.0, 'pickup_bookings': 0, 'pickup_revenue': 0.0}
+        for prop, entry in zip(props, entries):
+            kpis = entry.get('kpis') or {}
+            for field in totals:
+                totals[field] += kpis.get(field, 0)
+            rows.append({**prop, **kpis, 'freshness': self._freshness(entry)})
+
+        reporting = [r for r in rows if r.get('total_rooms') is not None]
+        summary = {
+            'total_properties': len(props),
+            'reporting_properties': len(reporting),
+            **{k: round(v, 2) if isinstance(v, float) else v for k, v in totals.items()},
+            'occupancy': _ratio(totals['rooms_sold'], totals['total_rooms'], 100),
+            'adr': _ratio(totals['room_revenue'], totals['rooms_sold']),
+            'revpar': _ratio(totals['room_revenue'], totals['total_rooms']),
+            'average_occupancy': round(sum(r.get('occupancy', 0) for r in reporting) / len(reporting), 1)
+            if reporting else 0,
+        }
+        ages = [r['freshness']['age_seconds'] for r in rows if r['freshness']['age_seconds'] is not None]
+        return {
+            'date': day.isoformat(),
+            'summary': summary,
+            'properties': rows,
+            'freshness': {
+                'oldest_age_seconds': max(ages) if ages else None,
+                'stale_properties': [r['property_id'] for r in rows if r['freshness']['stale']],
+                'ttl_seconds': PORTFOLIO_TTL_SECONDS,
+            },
+        }
+
+    async def drilldown(self, tenant_id: str, property_id: str, day: Optional[date] = None,
+                        refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """One property's KPIs with room type / segment / pickup channel breakdowns"""
+        day = day or datetime.now(timezone.utc).date()
+        prop = next((p for p in await self.properties(tenant_id) if p['property_id'] == property_id), None)
+        if not prop:
+            return None
+        entry = await self._property(prop, day, asyncio.Semaphore(1), refresh, drilldown=True)
+        values = entry.get('values') or {}
+
+        def breakdown(groups: Dict[Any, Dict[str, Any]]) -> List[Dict[str, Any]]:
+            return sorted(({'key': k or 'unknown', **v} for k, v in groups.items()),
+                          key=lambda r: r.get('rooms_sold', r.get('bookings', 0)), reverse=True)
+
+        return {
+            'date': day.isoformat(),
+            **prop,
+            'kpis': entry.get('kpis'),
+            'revenue_by_category': {k or 'other': round(v.get('amount', 0), 2)
+                                    for k, v in (values.get('charges_by_category') or {}).items()},
+            'by_room_type': breakdown(values.get('by_room_type') or {}),
+            'by_segment': breakdown(values.get('by_segment') or {}),
+            'pickup_by_channel': breakdown(values.get('pickup_by_channel') or {}),
+            'freshness': self._freshness(entry),
+        }
+
+    async def series(self, tenant_id: str, start: date, end: date, metric: str = 'occupancy') -> Dict[str, Any]:
+        """Per-day values for every property: one range aggregation per property instead of one per day"""
+        props = await self.properties(tenant_id)
+        days = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+        next_day = (end + timedelta(days=1)).isoformat()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def one(prop):
+            async with semaphore:
+                tenant = prop['property_id']
+                if metric == 'revenue':
+                    rows = await self.db.folio_charges.aggregate([
+                        {'$match': {'tenant_id': tenant, 'voided': False,
+                                    'charge_date': {'$gte': days[0], '$lte': days[-1]}}},
+                        {'$group': {'_id': '$charge_date', 'total': {'$sum': {'$ifNull': ['$total', 0]}}}},
+                    ]).to_list(None)
+                    by_day = {r['_id']: r['total'] for r in rows}
+                    return {d: by_day.get(d, 0.0) for d in days}
+                if metric == 'occupancy':
+                    total_rooms, stays = await asyncio.gather(
+                        self.db.rooms.count_documents({'tenant_id': tenant}),
+                        self.db.bookings.find(
+                            {'tenant_id': tenant,
+                             'status': {'$in': ['confirmed', 'guaranteed', 'checked_in', 'checked_out']},
+                             'check_in': {'$lt': next_day}, 'check_out': {'$gt': days[0]}},
+                            {'_id': 0, 'check_in': 1, 'check_out': 1}
+                        ).to_list(None)
+                    )
+                    sold = {d: 0 for d in days}
+                    for stay in stays:
+                        ci, co = str(stay.get('check_in', ''))[:10], str(stay.get('check_out', ''))[:10]
+                        for d in days:
+                            if ci <= d < co:
+                                sold[d] += 1
+                    return {d: _ratio(n, total_rooms, 100) for d, n in sold.items()}
+                return {d: 0 for d in days}
+
+        values = await asyncio.gather(*[one(p) for p in props])
+        return {
+            'data': [
+                {'date': d, 'properties': [
+                    {'property_id': p['property_id'], 'property_name': p['property_name'], 'value': round(v[d], 2)}
+                    for p, v in zip(props, values)
+                ]}
+                for d in days
+            ]
+        }
+
+
+portfolio_service = None
+
+
+def get_portfolio_service(db):
+    global portfolio_service
+    if portfolio_service is None:
+        portfolio_service = PortfolioService(db)
+    return portfolio_service
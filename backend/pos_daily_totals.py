@@ -0,0 +1,251 @@
+"""
+POS Daily Totals - running per-outlet, per-business-day aggregates
+Every posted POS transaction $inc's one row per (channel, outlet, business
+date): totals by payment method, category, server, hour and menu item.
+Daily closure seals the day's rows; tickets posted to a sealed day after
+the closure go to pos_daily_adjustments instead, so a sealed row never
+changes. Z-reports, daily summaries and menu engineering read these rows
+instead of scanning raw transactions. Days up to and including the day the
+running totals went live are backfilled from raw transactions once, per day,
+the first time a report reads them.
+
+Channels: 'menu' = pos_menu_transactions, 'quick' = pos_transactions.
+"""
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from pymongo import ReturnDocument, UpdateOne
+
+
+def _key(value, default: str = 'Unknown') -> str:
+    # Labels become sub-document keys: no dots, no leading '$'
+    return str(value if value not in (None, '') else default).replace('.', '_').lstrip('$') or default
+
+
+class POSDailyTotals:
+    """Incremental day/outlet aggregates for POS reporting"""
+
+    def __init__(self, db):
+        self.db = db
+        self._live_day: Optional[str] = None
+
+    # ------------------------------------------------------------ writes
+
+    @staticmethod
+    def _row_key(tenant_id: str, channel: str, trans: Dict[str, Any]) -> tuple:
+        return (tenant_id, channel, trans.get('outlet_id'), trans.get('transaction_date'))
+
+    @staticmethod
+    def _updates(trans: Dict[str, Any], channel: str, inc: Dict[str, float], sets: Dict[str, Any]):
+        amount = float(trans.get('total_amount', trans.get('amount', 0)) or 0)
+        cost = float(trans.get('total_cost', 0) or 0)
+        method = _key(trans.get('payment_method'), 'cash')
+
+        def add(path, value):
+            inc[path] = inc.get(path, 0) + value
+
+        add('transaction_count', 1)
+        add('gross_sales', amount)
+        add('total_cost', cost)
+        add(f'payment_methods.{method}.amount', amount)
+        add(f'payment_methods.{method}.count', 1)
+        add(f'servers.{_key(trans.get("server_name"))}', amount)
+        add(f'hours.{(trans.get("transaction_time") or "00")[:2]}', amount)
+        for item in trans.get('items') or []:
+            category = _key(item.get('category'), 'Other')
+            add(f'categories.{category}', item.get('total_price', 0) or 0)
+            item_key = _key(item.get('menu_item_id') or item.get('item_name'))
+            add(f'items.{item_key}.quantity', item.get('quantity', 0) or 0)
+            add(f'items.{item_key}.revenue', item.get('total_price', 0) or 0)
+            add(f'items.{item_key}.cost', item.get('total_cost', 0) or 0)
+            sets[f'items.{item_key}.item_name'] = item.get('item_name')
+            sets[f'items.{item_key}.category'] = category
+        if trans.get('outlet_name'):
+            sets['outlet_name'] = trans['outlet_name']
+
+    async def live_day(self) -> str:
+        """Business date the running totals went live (earlier days need a backfill)"""
+        if self._live_day is None:
+            today = datetime.now(timezone.utc).date().isoformat()
+            meta = await self.db.pos_daily_totals_meta.find_one_and_update(
+                {'_id': 'live'}, {'$setOnInsert': {'since': today}}, upsert=True, return_document=ReturnDocument.AFTER
+            )
+            self._live_day = (meta or {}).get('since') or today
+        return self._live_day
+
+    async def sealed_dates(self, tenant_id: str, dates: Iterable[str]) -> Set[str]:
+        dates = sorted(set(d for d in dates if d))
+        if not dates:
+            return set()
+        rows = await self.db.pos_daily_totals.distinct(
+            'business_date', {'tenant_id': tenant_id, 'business_date': {'$in': dates}, 'status': 'sealed'}
+        )
+        closures = await self.db.pos_closures.distinct(
+            'closure_date', {'tenant_id': tenant_id, 'closure_date': {'$in': dates}}
+        )
+        return set(rows) | set(closures)
+
+    async def record(self, tenant_id: str, transactions: Iterable[Dict[str, Any]], channel: str = 'menu',
+                     respect_seal: bool = True):
+        """Fold posted transactions into their day rows with one bulk_write per collection"""
+        if respect_seal:
+            await self.live_day()
+        grouped: Dict[tuple, tuple] = {}
+        for trans in transactions:
+            key = self._row_key(tenant_id, channel, trans)
+            inc, sets = grouped.setdefault(key, ({}, {}))
+            self._updates(trans, channel, inc, sets)
+        if not grouped:
+            return
+        sealed = await self.sealed_dates(tenant_id, (d for _, _, _, d in grouped)) if respect_seal else set()
+        now = datetime.now(timezone.utc).isoformat()
+        ops: Dict[str, List[UpdateOne]] = {'pos_daily_totals': [], 'pos_daily_adjustments': []}
+        for (t, c, o, d), (inc, sets) in grouped.items():
+            # Late tickets for a closed day are kept apart so the sealed rows stay as closed
+            target = 'pos_daily_adjustments' if d in sealed else 'pos_daily_totals'
+            ops[target].append(UpdateOne(
+                {'tenant_id': t, 'channel': c, 'outlet_id': o, 'business_date': d},
+                {'$inc': inc, '$set': {**sets, 'updated_at': now},
+                 '$setOnInsert': {'status': 'adjustment' if d in sealed else 'open'}},
+                upsert=True
+            ))
+        for collection, updates in ops.items():
+            if updates:
+                await self.db[collection].bulk_write(updates, ordered=False)
+
+    async def rebuild_days(self, tenant_id: str, dates: Iterable[str], channel: str = 'menu') -> int:
+        """Recompute open days' rows from raw transactions; sealed days are left as closed"""
+        dates = set(dates)
+        dates = sorted(dates - await self.sealed_dates(tenant_id, dates))
+        if not dates:
+            return 0
+        source = self.db.pos_menu_transactions if channel == 'menu' else self.db.pos_transactions
+        await self.db.pos_daily_totals.delete_many(
+            {'tenant_id': tenant_id, 'channel': channel, 'business_date': {'$in': dates}}
+        )
+        batch, count = [], 0
+        async for trans in source.find({'tenant_id': tenant_id, 'transaction_date': {'$in': dates}}, {'_id': 0}):
+            batch.append(trans)
+            count += 1
+            if len(batch) >= 1000:
+                await self.record(tenant_id, batch, channel, respect_seal=False)
+                batch = []
+        await self.record(tenant_id, batch, channel, respect_seal=False)
+        return count
+
+    async def rebuild_day(self, tenant_id: str, business_date: str, channel: str = 'menu') -> int:
+        """Recompute one day's rows from raw transactions (0 and no change when the day is sealed)"""
+        return await self.rebuild_days(tenant_id, [business_date], channel)
+
+    async def _backfill(self, tenant_id: str, start_date: str, end_date: str, channels: List[str]):
+        """Rebuild every day in the range not yet backfilled (history before, and the mixed go-live day)"""
+        start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+        days = {(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)}
+        for channel in channels:
+            done = set(await self.db.pos_daily_backfills.distinct('business_date', {
+                'tenant_id': tenant_id, 'channel': channel, 'business_date': {'$gte': start_date, '$lte': end_date}
+            }))
+            missing = sorted(days - done)
+            if not missing:
+                continue
+            await self.rebuild_days(tenant_id, missing, channel)
+            await self.db.pos_daily_backfills.bulk_write([
+                UpdateOne({'tenant_id': tenant_id, 'channel': channel, 'business_date': d},
+                          {'$setOnInsert': {'backfilled_at': datetime.now(timezone.utc).isoformat()}}, upsert=True)
+                for d in missing
+            ], ordered=False)
+
+    async def seal(self, tenant_id: str, business_date: str, closed_by: Optional[str] = None) -> Dict[str, Any]:
+        """Freeze the day: mark its rows sealed and return the merged totals"""
+        rows = await self.rows(tenant_id, business_date, business_date, channel=None)
+        await self.db.pos_daily_totals.update_many(
+            {'tenant_id': tenant_id, 'business_date': business_date},
+            {'$set': {'status': 'sealed', 'sealed_at': datetime.now(timezone.utc).isoformat(), 'sealed_by': closed_by}}
+        )
+        return self.merge(rows)
+
+    # ------------------------------------------------------------ reads
+
+    async def rows(self, tenant_id: str, start_date: str, end_date: str, outlet_id: Optional[str] = None,
+                   channel: Optional[str] = 'menu', backfill: bool = True) -> List[Dict[str, Any]]:
+        query: Dict[str, Any] = {'tenant_id': tenant_id, 'business_date': {'$gte': start_date, '$lte': end_date}}
+        if channel:
+            query['channel'] = channel
+        if outlet_id:
+            query['outlet_id'] = outlet_id
+        if backfill:
+            live_day = await self.live_day()
+            if start_date <= live_day:
+                await self._backfill(tenant_id, start_date, min(end_date, live_day),
+                                     [channel] if channel else ['menu', 'quick'])
+        rows = await self.db.pos_daily_totals.find(query, {'_id': 0}).to_list(None)
+        rows += await self.db.pos_daily_adjustments.find(query, {'_id': 0}).to_list(None)
+        return rows
+
+    @staticmethod
+    def merge(rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        merged = {
+            'transaction_count': 0, 'gross_sales': 0.0, 'total_cost': 0.0,
+            'payment_methods': {}, 'categories': {}, 'servers': {}, 'hours': {}, 'items': {},
+            'outlets': {}, 'sealed': True, 'adjustments': {'transaction_count': 0, 'gross_sales': 0.0},
+        }
+        any_row = False
+        for row in rows:
+            if row.get('status') == 'adjustment':
+                # Posted after the day was sealed: counted in the totals, reported separately
+                merged['adjustments']['transaction_count'] += row.get('transaction_count', 0)
+                merged['adjustments']['gross_sales'] += row.get('gross_sales', 0)
+            else:
+                any_row = True
+                merged['sealed'] = merged['sealed'] and row.get('status') == 'sealed'
+            for field in ('transaction_count', 'gross_sales', 'total_cost'):
+                merged[field] += row.get(field, 0)
+            for method, v in (row.get('payment_methods') or {}).items():
+                m = merged['payment_methods'].setdefault(method, {'amount': 0.0, 'count': 0})
+                m['amount'] += v.get('amount', 0)
+                m['count'] += v.get('count', 0)
+            for field in ('categories', 'servers', 'hours'):
+                for k, v in (row.get(field) or {}).items():
+                    merged[field][k] = merged[field].get(k, 0) + v
+            for k, v in (row.get('items') or {}).items():
+                item = merged['items'].setdefault(k, {'item_name': v.get('item_name'), 'category': v.get('category'),
+                                                      'quantity': 0, 'revenue': 0.0, 'cost': 0.0})
+                for field in ('quantity', 'revenue', 'cost'):
+                    item[field] += v.get(field, 0)
+            name = row.get('outlet_name') or 'Unknown'
+            merged['outlets'][name] = merged['outlets'].get(name, 0) + row.get('gross_sales', 0)
+        merged['sealed'] = merged['sealed'] and any_row
+        return merged
+
+    async def day(self, tenant_id: str, business_date: str, outlet_id: Optional[str] = None,
+                  channel: Optional[str] = 'menu') -> Dict[str, Any]:
+        return self.merge(await self.rows(tenant_id, business_date, business_date, outlet_id, channel))
+
+    async def range(self, tenant_id: str, start_date: str, end_date: str, outlet_id: Optional[str] = None,
+                    channel: Optional[str] = 'menu') -> Dict[str, Any]:
+        return self.merge(await self.rows(tenant_id, start_date, end_date, outlet_id, channel))
+
+    async def outlet_counts(self, tenant_id: str, business_date: str) -> Dict[str, Dict[str, float]]:
+        """{outlet_id: {'transactions': n, 'revenue': x}} for one day"""
+        counts: Dict[str, Dict[str, float]] = {}
+        for r in await self.rows(tenant_id, business_date, business_date):
+            c = counts.setdefault(r.get('outlet_id'), {'transactions': 0, 'revenue': 0})
+            c['transactions'] += r.get('transaction_count', 0)
+            c['revenue'] += r.get('gross_sales', 0)
+        return counts
+
+    @staticmethod
+    def trailing_window(days: int) -> tuple:
+        today = datetime.now(timezone.utc).date()
+        return (today - timedelta(days=days - 1)).isoformat(), today.isoformat()
+
+
+pos_daily_totals = None
+
+
+def get_pos_daily_totals(db):
+    global pos_daily_totals
+    if pos_daily_totals is None:
+        pos_daily_totals = POSDailyTotals(db)
+    return pos_daily_totals
@@ -0,0 +1,297 @@
+"""
+POS Engine - bulk order pipeline
+Per-outlet menu catalog cache (versioned, invalidated by menu writes), batch
+pricing of queued tickets from offline tablets, and room-charge posting to
+folios in one bulk operation: a ticket batch costs a fixed handful of
+round-trips instead of N+3 per ticket. Posted tickets are folded into the
+running day totals (pos_daily_totals).
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from pos_daily_totals import get_pos_daily_totals
+
+CATALOG_TTL_SECONDS = int(os.environ.get('POS_MENU_CACHE_TTL_SECONDS', '120'))
+MENU_PROJECTION = {'_id': 0, 'id': 1, 'outlet_id': 1, 'item_name': 1, 'name': 1, 'category': 1,
+                   'price': 1, 'cost': 1, 'status': 1, 'available': 1}
+
+
+class MenuCatalogCache:
+    """Menu items per (tenant, outlet); a version bump drops the cached catalog"""
+
+    def __init__(self, db):
+        self.db = db
+        self._catalogs: Dict[tuple, Dict[str, Any]] = {}
+        self._versions: Dict[str, int] = {}
+        self._locks: Dict[tuple, asyncio.Lock] = {}
+
+    def version(self, tenant_id: str) -> int:
+        return self._versions.get(tenant_id, 0)
+
+    def invalidate(self, tenant_id: str, outlet_id: Optional[str] = None):
+        self._versions[tenant_id] = self.version(tenant_id) + 1
+        for key in [k for k in self._catalogs if k[0] == tenant_id and (outlet_id is None or k[1] == outlet_id)]:
+            self._catalogs.pop(key, None)
+
+    def _fresh(self, catalog: Optional[Dict[str, Any]], tenant_id: str) -> bool:
+        return bool(catalog) and catalog['version'] == self.version(tenant_id) \
+            and time.monotonic() - catalog['loaded_at'] < CATALOG_TTL_SECONDS
+
+    async def get(self, tenant_id: str, outlet_id: str) -> Optional[Dict[str, Any]]:
+        """{'outlet': {...}, 'items': {id: item}, 'version': n} or None when the outlet does not exist"""
+        key = (tenant_id, outlet_id)
+        catalog = self._catalogs.get(key)
+        if self._fresh(catalog, tenant_id):
+            return catalog
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            catalog = self._catalogs.get(key)
+            if self._fresh(catalog, tenant_id):
+                return catalog
+            version = self.version(tenant_id)
+            outlet = await self.db.pos_outlets.find_one(
+                {'id': outlet_id, 'tenant_id': tenant_id}, {'_id': 0, 'id': 1, 'outlet_name': 1, 'status': 1}
+            )
+            if not outlet:
+                return None
+            items = await self.db.pos_menu_items.find(
+                {'tenant_id': tenant_id, 'outlet_id': outlet_id}, MENU_PROJECTION
+            ).to_list(None)
+            catalog = {
+                'outlet': outlet,
+                'items': {item['id']: item for item in items},
+                'version': version,
+                'loaded_at': time.monotonic(),
+            }
+            if version == self.version(tenant_id):
+                self._catalogs[key] = catalog
+            return catalog
+
+
+class POSEngine:
+    """Prices and persists POS tickets in batches"""
+
+    def __init__(self, db):
+        self.db = db
+        self.catalog = MenuCatalogCache(db)
+
+    @staticmethod
+    def _price_order(order: Dict[str, Any], catalog: Dict[str, Any], extra_items: Dict[str, Any]) -> Dict[str, Any]:
+        subtotal, total_cost, lines = 0.0, 0.0, []
+        for item in order.get('items') or []:
+            quantity = item.get('quantity', 0) or 0
+            menu_item = catalog['items'].get(item.get('menu_item_id')) or extra_items.get(item.get('menu_item_id'))
+            # Tickets keep the price rung up on the tablet; the catalog fills it in when absent
+            price = item.get('price')
+            if price is None:
+                price = (menu_item or {}).get('price', 0) or 0
+            subtotal += quantity * price
+            if menu_item:
+                unit_cost = menu_item.get('cost', 0) or 0
+                total_cost += unit_cost * quantity
+                lines.append({
+                    'menu_item_id': item.get('menu_item_id'),
+                    'item_name': menu_item.get('item_name') or menu_item.get('name'),
+                    'category': menu_item.get('category'),
+                    'quantity': quantity,
+                    'unit_price': price,
+                    'unit_cost': unit_cost,
+                    'total_price': quantity * price,
+                    'total_cost': unit_cost * quantity
+                })
+        return {'items': lines, 'subtotal': subtotal, 'total_cost': total_cost}
+
+    async def submit_orders(self, tenant_id: str, orders: List[Dict[str, Any]], user_id: str) -> Dict[str, Any]:
+        """
+        Price and persist a batch of tickets. Orders carrying a client_ref that
+        was already synced are reported as duplicates instead of re-posted.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(orders)
+
+        # Catalogs (cached) for every outlet in the batch
+        catalogs = {}
+        for outlet_id in {o.get('outlet_id') for o in orders}:
+            catalogs[outlet_id] = await self.catalog.get(tenant_id, outlet_id)
+
+        # Items priced from another outlet's or an outlet-less menu: one lookup
+        missing = {
+            item.get('menu_item_id')
+            for o in orders if catalogs.get(o.get('outlet_id'))
+            for item in o.get('items') or []
+            if item.get('menu_item_id') not in catalogs[o.get('outlet_id')]['items']
+        } - {None}
+        extra_items = {}
+        if missing:
+            async for item in self.db.pos_menu_items.find(
+                {'tenant_id': tenant_id, 'id': {'$in': list(missing)}}, MENU_PROJECTION
+            ):
+                extra_items[item['id']] = item
+
+        refs = [o['client_ref'] for o in orders if o.get('client_ref')]
+        synced = {}
+        if refs:
+            async for t in self.db.pos_menu_transactions.find(
+                {'tenant_id': tenant_id, 'client_ref': {'$in': refs}}, {'_id': 0, 'client_ref': 1, 'id': 1}
+            ):
+                synced[t['client_ref']] = t['id']
+
+        folio_ids = list({o['folio_id'] for o in orders if o.get('folio_id')})
+        folios = {}
+        if folio_ids:
+            async for f in self.db.folios.find(
+                {'tenant_id': tenant_id, 'id': {'$in': folio_ids}, 'status': 'open'},
+                {'_id': 0, 'id': 1, 'booking_id': 1}
+            ):
+                folios[f['id']] = f
+
+        now = datetime.now(timezone.utc)
+        transactions, charges, positions = [], [], []
+        for i, order in enumerate(orders):
+            ref = order.get('client_ref')
+            if ref and ref in synced:
+                results[i] = {'status': 'duplicate', 'client_ref': ref, 'transaction_id': synced.get(ref)}
+                continue
+            catalog = catalogs.get(order.get('outlet_id'))
+            if not catalog:
+                results[i] = {'status': 'error', 'client_ref': ref, 'error': 'Outlet not found'}
+                continue
+            folio_id = order.get('folio_id')
+            if folio_id and folio_id not in folios:
+                results[i] = {'status': 'error', 'client_ref': ref, 'error': 'Folio not found or closed'}
+                continue
+
+            ordered_at = order.get('ordered_at')
+            if isinstance(ordered_at, str):
+                try:
+                    ordered_at = datetime.fromisoformat(ordered_at.replace('Z', '+00:00'))
+                except ValueError:
+                    ordered_at = None
+            elif not ordered_at:
+                ordered_at = now
+            if not isinstance(ordered_at, datetime):
+                results[i] = {'status': 'error', 'client_ref': ref, 'error': 'Invalid ordered_at'}
+                continue
+
+            priced = self._price_order(order, catalog, extra_items)
+            subtotal = priced['subtotal']
+            outlet_name = catalog['outlet'].get('outlet_name')
+
+            transaction = {
+                'id': str(uuid.uuid4()),
+                'tenant_id': tenant_id,
+                'outlet_id': order['outlet_id'],
+                'outlet_name': outlet_name,
+                'transaction_date': ordered_at.date().isoformat(),
+                'transaction_time': ordered_at.time().isoformat(),
+                'items': priced['items'],
+                'subtotal': round(subtotal, 2),
+                'total_amount': round(subtotal, 2),  # Can add tax/service charge
+                'total_cost': round(priced['total_cost'], 2),
+                'gross_profit': round(subtotal - priced['total_cost'], 2),
+                'payment_method': order.get('payment_method'),
+                'folio_id': folio_id,
+                'table_number': order.get('table_number'),
+                'server_name': order.get('server_name'),
+                'status': 'completed',
+                'processed_by': user_id,
+                'menu_version': catalog['version'],
+                'created_at': now.isoformat()
+            }
+            if ref:
+                transaction['client_ref'] = ref
+                synced[ref] = transaction['id']
+            transactions.append(transaction)
+            positions.append(i)
+
+            if folio_id:
+                total = round(subtotal, 2)
+                charges.append({
+                    'id': str(uuid.uuid4()),
+                    'tenant_id': tenant_id,
+                    'folio_id': folio_id,
+                    'booking_id': folios[folio_id].get('booking_id'),
+                    'charge_category': 'food',
+                    'category': 'fnb',
+                    'charge_date': ordered_at.date().isoformat(),
+                    'date': ordered_at.isoformat(),
+                    'description': f"F&B - {outlet_name}",
+                    'unit_price': total,
+                    'amount': total,
+                    'quantity': 1,
+                    'tax_amount': 0.0,
+                    'total': total,
+                    'voided': False,
+                    'pos_transaction_id': transaction['id'],
+                    'posted_at': now.isoformat(),
+                    'posted_by': user_id
+                })
+            results[i] = {'status': 'created', 'client_ref': ref, 'transaction_id': transaction['id'],
+                          'transaction': transaction}
+
+        if transactions:
+            failed = {}
+            try:
+                await self.db.pos_menu_transactions.insert_many([dict(t) for t in transactions], ordered=False)
+            except BulkWriteError as e:
+                failed = {err['index']: err for err in e.details.get('writeErrors', [])}
+            if failed:
+                # A duplicate client_ref means another sync of the same ticket won the race:
+                # it is already applied, so nothing of this copy is posted
+                lost_refs = [transactions[k]['client_ref'] for k, err in failed.items()
+                             if err.get('code') == 11000 and transactions[k].get('client_ref')]
+                winners = {}
+                if lost_refs:
+                    async for t in self.db.pos_menu_transactions.find(
+                        {'tenant_id': tenant_id, 'client_ref': {'$in': lost_refs}}, {'_id': 0, 'client_ref': 1, 'id': 1}
+                    ):
+                        winners[t['client_ref']] = t['id']
+                for k, err in failed.items():
+                    ref = transactions[k].get('client_ref')
+                    if err.get('code') == 11000:
+                        results[positions[k]] = {'status': 'duplicate', 'client_ref': ref,
+                                                 'transaction_id': winners.get(ref)}
+                    else:
+                        results[positions[k]] = {'status': 'error', 'client_ref': ref,
+                                                 'error': err.get('errmsg', 'Insert failed')}
+                dropped = {transactions[k]['id'] for k in failed}
+                for r in results:
+                    if r and r['status'] == 'duplicate' and r.get('transaction_id') in dropped:
+                        r['transaction_id'] = winners.get(r['client_ref'])
+                transactions = [t for t in transactions if t['id'] not in dropped]
+                charges = [c for c in charges if c['pos_transaction_id'] not in dropped]
+            if transactions:
+                await get_pos_daily_totals(self.db).record(tenant_id, transactions, channel='menu')
+        folio_totals: Dict[str, float] = {}
+        for charge in charges:
+            folio_totals[charge['folio_id']] = folio_totals.get(charge['folio_id'], 0.0) + charge['total']
+        if charges:
+            await self.db.folio_charges.insert_many(charges, ordered=False)
+            await self.db.folios.bulk_write([
+                UpdateOne({'id': folio_id, 'tenant_id': tenant_id}, {'$inc': {'balance': round(amount, 2)}})
+                for folio_id, amount in folio_totals.items()
+            ], ordered=False)
+
+        return {
+            'results': results,
+            'created': len(transactions),
+            'duplicates': sum(1 for r in results if r['status'] == 'duplicate'),
+            'failed': sum(1 for r in results if r['status'] == 'error'),
+            'folio_charges': len(charges),
+        }
+
+
+pos_engine = None
+
+
+def get_pos_engine(db):
+    global pos_engine
+    if pos_engine is None:
+        pos_engine = POSEngine(db)
+    return pos_engine
@@ -19,34 +19,18 @@ class PredictiveEngine:
             'tenant_id': tenant_id,
             'check_in': {'$regex': f'^{target_date}'},
             'status': {'$in': ['confirmed', 'guaranteed']}
-        }, {'_id': 0}).to_list(100)
+        }, {'_id': 0, 'id': 1, 'guest_id': 1, 'check_in': 1, 'check_out': 1, 'created_at': 1,
+            'payment_method': 1, 'channel': 1, 'last_contact_date': 1, 'total_amount': 1}).to_list(5000)
+        
+        # One batched model call for all bookings; heuristics when no model is trained
+        model_scores = await self._model_no_show_scores(tenant_id, bookings)
         
         predictions = []
-        for booking in bookings:
-            # Risk factors (simplified ML model)
-            risk_score = 0.0
-            
-            # No payment method
-            if not booking.get('payment_method'):
-                risk_score += 0.35
-            
-            # OTA booking
-            if booking.get('channel') in ['booking_com', 'expedia']:
-                risk_score += 0.25
-            
-            # No pre-arrival contact
-            if not booking.get('last_contact_date'):
-                risk_score += 0.20
-            
-            # Last minute booking
-            if booking.get('created_at'):
-                days_advance = 1  # Simplified
-                if days_advance < 3:
-                    risk_score += 0.15
-            
-            # Low price point
-            if booking.get('total_amount', 0) < 80:
-                risk_score += 0.10
+        for i, booking in enumerate(bookings):
+            if model_scores is not None:
+                risk_score = model_scores[i]
+            else:
+                risk_score = self._heuristic_no_show_score(booking)
             
             confidence = min(risk_score * 100, 95)
             risk_level = 'high' if risk_score > 0.6 else 'medium' if risk_score > 0.3 else 'low'
@@ -59,7 +43,8 @@ class PredictiveEngine:
                     'confidence': round(confidence, 1),
                     'risk_level': risk_level,
                     'recommended_action': 'Reconfirm booking via phone/WhatsApp' if risk_level == 'high' else 'Monitor',
-                    'factors': self._get_risk_factors(booking)
+                    'factors': self._get_risk_factors(booking),
+                    'source': 'ml_model' if model_scores is not None else 'heuristic'
                 })
         
         # Sort by risk
@@ -67,6 +52,60 @@ class PredictiveEngine:
         
         return predictions
     
+    async def _model_no_show_scores(self, tenant_id: str, bookings: List[dict]) -> Optional[List[float]]:
+        """No-show probabilities from the trained model, or None if unavailable"""
+        from ml_model_service import model_registry, no_show_features, ModelNotAvailableError
+        
+        if not bookings or not model_registry.available('no_show'):
+            return None
+        
+        # Guest history for all bookings in one aggregation
+        guest_ids = list({b['guest_id'] for b in bookings if b.get('guest_id')})
+        history = {}
+        async for row in self.db.bookings.aggregate([
+            {'$match': {'tenant_id': tenant_id, 'guest_id': {'$in': guest_ids},
+                        'status': {'$in': ['checked_out', 'no_show']}}},
+            {'$group': {'_id': {'guest_id': '$guest_id', 'status': '$status'}, 'count': {'$sum': 1}}}
+        ]):
+            counts = history.setdefault(row['_id']['guest_id'], {'stays': 0, 'no_shows': 0})
+            counts['stays' if row['_id']['status'] == 'checked_out' else 'no_shows'] = row['count']
+        
+        try:
+            result = await model_registry.predict(
+                'no_show', [no_show_features(b, history.get(b.get('guest_id'))) for b in bookings]
+            )
+        except ModelNotAvailableError:
+            return None
+        return result['predictions']
+    
+    def _heuristic_no_show_score(self, booking: dict) -> float:
+        """Rule-based risk score used before a no-show model has been trained"""
+        risk_score = 0.0
+        
+        # No payment method
+        if not booking.get('payment_method'):
+            risk_score += 0.35
+        
+        # OTA booking
+        if booking.get('channel') in ['booking_com', 'expedia']:
+            risk_score += 0.25
+        
+        # No pre-arrival contact
+        if not booking.get('last_contact_date'):
+            risk_score += 0.20
+        
+        # Last minute booking
+        if booking.get('created_at'):
+            days_advance = 1  # Simplified
+            if days_advance < 3:
+                risk_score += 0.15
+        
+        # Low price point
+        if booking.get('total_amount', 0) < 80:
+            risk_score += 0.10
+        
+        return risk_score
+    
     def _get_risk_factors(self, booking: dict) -> List[str]:
         """Risk faktörlerini listele"""
         factors = []
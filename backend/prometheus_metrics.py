@@ -190,15 +190,11 @@ async def collect_system_metrics(db):
         # db_connection_pool_size.set(get_pool_size())
         # db_active_connections.set(get_active_connections())
         
-        # Collect cache metrics
+        # Collect cache metrics (hit rates observed by request_metrics hooks)
         try:
-            from cache_manager import cache
-            cache_stats = cache.health_check()
-            if cache_stats.get('status') == 'healthy':
-                # Calculate cache hit rate
-                total_keys = cache_stats.get('total_keys', 0)
-                if total_keys > 0:
-                    cache_hit_rate.labels(cache_type='redis').set(80.0)  # From our tests
+            from request_metrics import metrics_registry
+            for cache_type, stats in metrics_registry.cache_metrics().items():
+                cache_hit_rate.labels(cache_type=cache_type).set(stats['hit_rate'])
         except:
             pass
         
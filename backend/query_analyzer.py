@@ -13,7 +13,12 @@ import json
 class QueryAnalyzer:
     """Analyze database queries for performance optimization"""
     
-    def __init__(self):
+    def __init__(self, db=None):
+        if db is not None:
+            # Reuse the application's client (e.g. from the profiler endpoints)
+            self.client = None
+            self.db = db
+            return
         mongo_url = os.environ.get('MONGO_URL')
         db_name = os.environ.get('DB_NAME')
         self.client = AsyncIOMotorClient(mongo_url)
@@ -34,13 +39,16 @@ class QueryAnalyzer:
             print(f"❌ Failed to enable profiling: {e}")
             return False
     
-    async def get_slow_queries(self, limit=20):
+    async def get_slow_queries(self, limit=20, verbose=True):
         """Get slowest queries from system.profile"""
         try:
             queries = await self.db.system.profile.find({
                 'millis': {'$gt': 100}
             }).sort('millis', -1).limit(limit).to_list(limit)
             
+            if not verbose:
+                return queries
+            
             print(f"\n🐌 TOP {len(queries)} SLOW QUERIES")
             print("=" * 80)
             
@@ -63,6 +71,36 @@ class QueryAnalyzer:
             print(f"❌ Failed to get slow queries: {e}")
             return []
     
+    @staticmethod
+    def summarize_slow_queries(queries):
+        """Group system.profile entries by namespace and plan for reporting"""
+        groups = {}
+        for query in queries:
+            key = (query.get('ns', 'unknown'), query.get('op', 'unknown'), query.get('planSummary', 'unknown'))
+            group = groups.setdefault(key, {
+                'namespace': key[0],
+                'operation': key[1],
+                'plan': key[2],
+                'count': 0,
+                'total_ms': 0,
+                'max_ms': 0,
+                'docs_examined': 0,
+                'docs_returned': 0,
+                'collection_scan': 'COLLSCAN' in key[2],
+                'last_seen': None
+            })
+            millis = query.get('millis', 0)
+            group['count'] += 1
+            group['total_ms'] += millis
+            group['max_ms'] = max(group['max_ms'], millis)
+            group['docs_examined'] += query.get('docsExamined', 0)
+            group['docs_returned'] += query.get('nreturned', 0)
+            ts = query.get('ts')
+            if ts and (group['last_seen'] is None or ts.isoformat() > group['last_seen']):
+                group['last_seen'] = ts.isoformat()
+        
+        return sorted(groups.values(), key=lambda g: g['total_ms'], reverse=True)
+    
     async def analyze_index_usage(self):
         """Analyze index usage across collections"""
         collections = [
@@ -161,43 +199,183 @@ class QueryAnalyzer:
         
         return stats
     
-    async def find_missing_indexes(self):
-        """Identify potential missing indexes based on common query patterns"""
-        print(f"\n🔍 MISSING INDEX ANALYSIS")
-        print("=" * 80)
-        
+    # Operators that bound a range scan rather than pin a value (ESR: range goes last)
+    _RANGE_OPS = {'$gt', '$gte', '$lt', '$lte', '$ne', '$nin', '$exists', '$type'}
+
+    @classmethod
+    def query_shape(cls, filter_doc, sort=None):
+        """
+        Split a filter into equality, range and unindexable (unanchored regex)
+        fields, plus sort keys. Values are dropped; only the shape matters.
+        """
+        equality, ranges, regex = set(), set(), set()
+
+        def visit(doc):
+            for field, cond in (doc or {}).items():
+                if field == '$and':
+                    for clause in cond:
+                        visit(clause)
+                    continue
+                if field.startswith('$'):
+                    # $or / $expr / $text branches are not prefix-indexable as a whole
+                    continue
+                pattern = None
+                if isinstance(cond, dict) and any(k.startswith('$') for k in cond):
+                    if '$regex' in cond:
+                        pattern = cond['$regex']
+                    elif set(cond) & cls._RANGE_OPS:
+                        ranges.add(field)
+                        continue
+                    else:
+                        equality.add(field)  # $eq / $in / $all / $elemMatch
+                        continue
+                elif hasattr(cond, 'pattern'):
+                    pattern = cond
+                else:
+                    equality.add(field)
+                    continue
+                text = getattr(pattern, 'pattern', pattern)
+                flags = str(cond.get('$options', '')) if isinstance(cond, dict) else ''
+                if isinstance(text, str) and text.startswith('^') and 'i' not in flags:
+                    ranges.add(field)  # anchored, case-sensitive: bounded index scan
+                else:
+                    regex.add(field)
+
+        visit(filter_doc)
+        sort_keys = list((sort or {}).items())
+        return {
+            'equality': sorted(equality, key=lambda f: (f != 'tenant_id', f)),
+            'sort': [(field, int(direction)) for field, direction in sort_keys if field not in equality],
+            'range': sorted(ranges - equality - {f for f, _ in sort_keys}),
+            'regex': sorted(regex),
+        }
+
+    @staticmethod
+    def _profile_filter(entry):
+        """(collection, filter, sort) of a system.profile entry, or None"""
+        command = entry.get('command', {}) or {}
+        collection = entry.get('ns', '').split('.', 1)[-1]
+        if 'find' in command:
+            return collection, command.get('filter'), command.get('sort')
+        if 'aggregate' in command:
+            pipeline = command.get('pipeline') or []
+            match = pipeline[0].get('$match') if pipeline and '$match' in pipeline[0] else None
+            sort = pipeline[1].get('$sort') if match is not None and len(pipeline) > 1 and '$sort' in pipeline[1] else None
+            return (collection, match, sort) if match else None
+        if 'count' in command or 'distinct' in command:
+            return collection, command.get('query'), None
+        if 'findAndModify' in command:
+            return collection, command.get('query'), command.get('sort')
+        if 'q' in command:  # update / delete statements
+            return collection, command.get('q'), None
+        return None
+
+    @staticmethod
+    def _covered(shape, index_keys):
+        """An index serves the shape when its leading keys are the equality fields"""
+        fields = [field for field, _ in index_keys]
+        equality = shape['equality']
+        if not equality:
+            leading = (shape['sort'] or [(f, 1) for f in shape['range']] or [(None, 1)])[0][0]
+            return bool(fields) and fields[0] == leading
+        return set(fields[:len(equality)]) == set(equality)
+
+    async def find_missing_indexes(self, limit=500, verbose=True):
+        """
+        Suggest indexes from profiled query shapes (system.profile): shapes whose
+        equality fields no existing index leads with get an ESR-ordered
+        suggestion (equality, sort, range). Declared registry indexes that are
+        not built yet are reported too, since `migrate` fixes those.
+        """
+        from index_registry import declared_indexes, get_index_registry
+
+        if verbose:
+            print(f"\n🔍 MISSING INDEX ANALYSIS")
+            print("=" * 80)
+
+        try:
+            entries = await self.db['system.profile'].find(
+                {'op': {'$in': ['query', 'command', 'count', 'distinct', 'update', 'remove', 'getmore']}}
+            ).sort('ts', -1).limit(limit).to_list(limit)
+        except Exception as e:
+            print(f"❌ Failed to read system.profile: {e}")
+            entries = []
+
+        shapes = {}
+        for entry in entries:
+            parsed = self._profile_filter(entry)
+            if not parsed or parsed[0].startswith('system.'):
+                continue
+            collection, filter_doc, sort = parsed
+            shape = self.query_shape(filter_doc, sort)
+            key = (collection, tuple(shape['equality']), tuple(shape['sort']), tuple(shape['range']),
+                   tuple(shape['regex']))
+            group = shapes.setdefault(key, {'collection': collection, 'shape': shape, 'count': 0, 'total_ms': 0,
+                                            'docs_examined': 0, 'docs_returned': 0, 'collection_scan': False})
+            group['count'] += 1
+            group['total_ms'] += entry.get('millis', 0)
+            group['docs_examined'] += entry.get('docsExamined', 0)
+            group['docs_returned'] += entry.get('nreturned', 0)
+            group['collection_scan'] |= 'COLLSCAN' in str(entry.get('planSummary', ''))
+
+        index_cache = {}
+        registry = declared_indexes()
         recommendations = []
-        
-        # Analyze bookings
-        print(f"\n📁 Analyzing bookings collection...")
-        
-        # Check for queries without indexes
-        explain = await self.db.bookings.find({
-            'status': 'confirmed'
-        }).explain()
-        
-        if 'COLLSCAN' in str(explain):
+        for group in sorted(shapes.values(), key=lambda g: g['total_ms'], reverse=True):
+            collection, shape = group['collection'], group['shape']
+            if not (shape['equality'] or shape['sort'] or shape['range']):
+                continue
+            if collection not in index_cache:
+                try:
+                    info = await self.db[collection].index_information()
+                    index_cache[collection] = [spec['key'] for spec in info.values()]
+                except Exception:
+                    index_cache[collection] = []
+            if any(self._covered(shape, keys) for keys in index_cache[collection]):
+                continue
+
+            suggested = ([(f, 1) for f in shape['equality']] + shape['sort'] + [(f, 1) for f in shape['range']])
+            declared = next((name for name, spec in registry.get(collection, {}).items()
+                             if self._covered(shape, spec.keys)), None)
             recommendations.append({
-                'collection': 'bookings',
-                'field': 'status',
-                'reason': 'Collection scan detected for status queries'
+                'collection': collection,
+                'field': ' + '.join(f for f, _ in suggested),
+                'keys': suggested,
+                'equality': shape['equality'],
+                'sort': shape['sort'],
+                'range': shape['range'],
+                'unindexable_regex': shape['regex'],
+                'count': group['count'],
+                'total_ms': group['total_ms'],
+                'docs_examined': group['docs_examined'],
+                'docs_returned': group['docs_returned'],
+                'collection_scan': group['collection_scan'],
+                'declared_index': declared,
+                'reason': (f"Declared as {declared}; run pending index migrations" if declared
+                           else 'No index leads with the equality fields of this query shape')
             })
-            print(f"  ⚠️  Recommendation: Add index on 'status'")
-        
-        # Check compound queries
-        explain = await self.db.bookings.find({
-            'tenant_id': 'test',
-            'check_in': {'$gte': datetime.now()}
-        }).explain()
-        
-        if 'COLLSCAN' in str(explain):
+            if verbose:
+                print(f"  ⚠️  {collection}: {group['count']}x, {group['total_ms']}ms → index on {suggested}")
+                if shape['regex']:
+                    print(f"     Unanchored/case-insensitive regex on {shape['regex']} cannot use index bounds")
+
+        # Declared but not built (registry migrations not yet applied)
+        status = await get_index_registry(self.db).status()
+        for missing in status['missing_indexes']:
+            collection, name = missing.split('.', 1)
+            if any(r['declared_index'] == name and r['collection'] == collection for r in recommendations):
+                continue
+            spec = registry[collection][name]
             recommendations.append({
-                'collection': 'bookings',
-                'field': 'tenant_id + check_in',
-                'reason': 'Collection scan for date range queries'
+                'collection': collection,
+                'field': ' + '.join(f for f, _ in spec.keys),
+                'keys': spec.keys,
+                'declared_index': name,
+                'reason': 'Declared in the index registry but not built; run pending index migrations'
             })
-            print(f"  ⚠️  Recommendation: Add compound index on tenant_id + check_in")
-        
+            if verbose:
+                print(f"  ⚠️  {collection}.{name} declared but missing")
+
         return recommendations
     
     async def generate_optimization_report(self):
@@ -254,7 +432,8 @@ class QueryAnalyzer:
         print("✅ Analysis Complete!")
         print("=" * 80)
         
-        await self.client.close()
+        if self.client:
+            self.client.close()
 
 async def main():
     """Run query analyzer"""
@@ -0,0 +1,397 @@
+"""
+Compiled Rate Grid
+Precomputed sellable rate per (room type, rate plan / operator, night) so ARI,
+booking quotes and the calendar tooltip read one row per night instead of
+re-resolving rate_periods -> contracts -> rate_plans -> rooms.base_price.
+
+Grid keys (rate_plan_id field):
+  'default'        BAR: first open plan of the room type, else rooms.base_price
+  '<plan id>'      a specific rate plan
+  'op:<operator>'  operator rate: rate_periods -> allotment contract -> default
+
+Writes to the sources call invalidate() for the affected scope only; the rows
+are dropped and rebuilt in the background, and readers compile any missing
+rows on demand so a read never sees a stale night.
+"""
+
+import asyncio
+import os
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+GRID_COLLECTION = 'rate_grid'
+DEFAULT_KEY = 'default'
+OPERATOR_PREFIX = 'op:'
+HORIZON_DAYS = int(os.environ.get('RATE_GRID_HORIZON_DAYS', '400'))
+WRITE_CHUNK = 1000
+
+
+def operator_key(operator_id: str) -> str:
+    return f"{OPERATOR_PREFIX}{operator_id}"
+
+
+def _day_str(value) -> Optional[str]:
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, str) and len(value) >= 10:
+        return value[:10]
+    return None
+
+
+def _date_range(start: date, end: date) -> List[str]:
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+def _plan_matches(plan: Dict[str, Any], room_type: str) -> bool:
+    return not plan.get('room_type') or plan.get('room_type') == room_type
+
+
+def _plan_open(plan: Dict[str, Any], day: str, weekday: int) -> bool:
+    valid_from = _day_str(plan.get('valid_from'))
+    valid_to = _day_str(plan.get('valid_to'))
+    if valid_from and day < valid_from:
+        return False
+    if valid_to and day > valid_to:
+        return False
+    dows = plan.get('days_of_week')
+    return not dows or weekday in dows
+
+
+def _plan_rate(plan: Dict[str, Any]) -> Optional[float]:
+    rate = plan.get('base_price')
+    return rate if rate is not None else plan.get('base_rate')
+
+
+def _first_covering(spans: List[Tuple[str, str, Dict[str, Any]]], days: List[str]) -> List[Optional[Dict[str, Any]]]:
+    """For each day the first span (in list order) whose [start, end] covers it"""
+    out: List[Optional[Dict[str, Any]]] = [None] * len(days)
+    # Fill in reverse so the earliest span in list order wins
+    for start, end, doc in reversed(spans):
+        lo, hi = bisect_left(days, start), bisect_right(days, end)
+        for i in range(lo, hi):
+            out[i] = doc
+    return out
+
+
+class RateGridCompiler:
+    """Builds and serves the rate_grid collection"""
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db[GRID_COLLECTION]
+        self._tasks: set = set()
+
+    # ---------------------------------------------------------------- sources
+
+    async def _load_sources(self, tenant_id: str, operator_ids: Optional[List[str]]) -> Dict[str, Any]:
+        base_prices: Dict[str, Optional[float]] = {}
+        async for room in self.db.rooms.find(
+            {'tenant_id': tenant_id, '$or': [{'is_active': True}, {'is_active': {'$exists': False}}]},
+            {'_id': 0, 'room_type': 1, 'base_price': 1}
+        ):
+            rt = room.get('room_type') or 'unknown'
+            if base_prices.get(rt) is None:
+                base_prices[rt] = room.get('base_price')
+
+        plans = await self.db.rate_plans.find(
+            {'tenant_id': tenant_id, 'is_active': True}, {'_id': 0}
+        ).sort('_id', 1).to_list(1000)
+
+        packages: Dict[str, Dict[str, float]] = {}
+        async for pkg in self.db.packages.find(
+            {'tenant_id': tenant_id, 'is_active': True, 'linked_rate_plan_ids.0': {'$exists': True}},
+            {'_id': 0, 'price_type': 1, 'additional_amount': 1, 'linked_rate_plan_ids': 1}
+        ):
+            price_type = pkg.get('price_type') or 'per_room'
+            for plan_id in pkg.get('linked_rate_plan_ids', []):
+                totals = packages.setdefault(plan_id, {'per_room': 0.0, 'per_person': 0.0, 'per_stay': 0.0})
+                totals[price_type] = totals.get(price_type, 0.0) + float(pkg.get('additional_amount') or 0)
+
+        op_filter: Dict[str, Any] = {'tenant_id': tenant_id}
+        if operator_ids is not None:
+            op_filter['operator_id'] = {'$in': operator_ids}
+
+        periods: Dict[Tuple[str, str], list] = {}
+        async for p in self.db.rate_periods.find(op_filter, {'_id': 0}).sort('start_date', 1):
+            ps, pe = _day_str(p.get('start_date')), _day_str(p.get('end_date'))
+            if ps and pe:
+                periods.setdefault((p.get('operator_id'), p.get('room_type_id')), []).append((ps, pe, p))
+
+        stop_sales = {
+            ss['operator_id']: bool(ss.get('stop_sale'))
+            async for ss in self.db.stop_sales.find({**op_filter, 'active': True}, {'_id': 0, 'operator_id': 1, 'stop_sale': 1})
+        }
+
+        contract_filter: Dict[str, Any] = {'tenant_id': tenant_id, 'status': 'active'}
+        if operator_ids is not None:
+            contract_filter['tour_operator'] = {'$in': operator_ids}
+        contracts: Dict[Tuple[str, str], list] = {}
+        async for c in self.db.allotment_contracts.find(contract_filter, {'_id': 0}).sort('start_date', 1):
+            cs, ce = _day_str(c.get('start_date')), _day_str(c.get('end_date'))
+            if cs and ce:
+                contracts.setdefault((c.get('tour_operator'), c.get('room_type')), []).append((cs, ce, c))
+
+        return {
+            'base_prices': base_prices,
+            'plans': plans,
+            'packages': packages,
+            'periods': periods,
+            'stop_sales': stop_sales,
+            'contracts': contracts,
+        }
+
+    # ---------------------------------------------------------------- compile
+
+    def _default_plan(self, plans: List[Dict[str, Any]], room_type: str, day: str, weekday: int) -> Optional[Dict[str, Any]]:
+        # A plan for this room type wins over a room-type-agnostic one
+        open_plans = [p for p in plans if _plan_matches(p, room_type) and _plan_open(p, day, weekday)]
+        typed = [p for p in open_plans if p.get('room_type') == room_type]
+        return (typed or open_plans or [None])[0]
+
+    def _build_rows(self, tenant_id: str, key: str, room_type: str, days: List[str],
+                    src: Dict[str, Any], compiled_at: str) -> List[Dict[str, Any]]:
+        plans = src['plans']
+        base_price = src['base_prices'].get(room_type)
+        operator_id = key[len(OPERATOR_PREFIX):] if key.startswith(OPERATOR_PREFIX) else None
+        plan_key = key != DEFAULT_KEY and operator_id is None
+        plan = next((p for p in plans if p.get('id') == key), None) if plan_key else None
+
+        if operator_id is not None:
+            period_for_day = _first_covering(src['periods'].get((operator_id, room_type), []), days)
+            contract_for_day = _first_covering(src['contracts'].get((operator_id, room_type), []), days)
+            operator_stop = src['stop_sales'].get(operator_id, False)
+        else:
+            period_for_day = contract_for_day = [None] * len(days)
+            operator_stop = False
+
+        rows = []
+        for i, day in enumerate(days):
+            weekday = date.fromisoformat(day).weekday()
+            period, contract = period_for_day[i], contract_for_day[i]
+            row: Dict[str, Any] = {
+                'tenant_id': tenant_id,
+                'room_type': room_type,
+                'rate_plan_id': key,
+                'date': day,
+                'rate': None,
+                'currency': None,
+                'source': None,
+                'plan_ref': None,
+                'board_code': None,
+                'stop_sell': operator_stop,
+                'min_stay': 1,
+                'max_stay': None,
+                'cta': False,
+                'ctd': False,
+                'allotment': None,
+                'compiled_at': compiled_at,
+            }
+
+            resolved_plan = None
+            if plan_key:
+                # Specific plan: closed outside its room type / validity window
+                if plan is not None and _plan_matches(plan, room_type) and _plan_open(plan, day, weekday):
+                    resolved_plan = plan
+                    row.update(rate=_plan_rate(plan), source='rate_plans')
+                else:
+                    row.update(stop_sell=True, source='not_applicable')
+            elif period is not None and period.get('rate') is not None:
+                row.update(
+                    rate=period.get('rate'),
+                    currency=period.get('currency'),
+                    source='rate_periods',
+                    plan_ref=period.get('rate_plan_id'),
+                    board_code=period.get('board_code'),
+                    stop_sell=operator_stop or bool(period.get('stop_sell')),
+                    min_stay=int(period.get('min_stay') or 1),
+                    max_stay=int(period['max_stay']) if period.get('max_stay') is not None else None,
+                    cta=bool(period.get('cta', False)),
+                    ctd=bool(period.get('ctd', False)),
+                )
+            elif contract is not None and contract.get('rate') is not None:
+                row.update(rate=contract.get('rate'), source='allotment_contract', plan_ref=contract.get('id'))
+            else:
+                resolved_plan = self._default_plan(plans, room_type, day, weekday)
+                if resolved_plan is not None and _plan_rate(resolved_plan) is not None:
+                    row.update(rate=_plan_rate(resolved_plan), source='rate_plans')
+                else:
+                    resolved_plan = None
+                    row.update(rate=base_price, source='rooms.base_price')
+
+            if resolved_plan is not None:
+                row.update(
+                    currency=resolved_plan.get('currency'),
+                    plan_ref=resolved_plan.get('id'),
+                    board_code=resolved_plan.get('meal_plan') or resolved_plan.get('board_code'),
+                    min_stay=int(resolved_plan.get('min_stay') or 1),
+                    max_stay=resolved_plan.get('max_stay'),
+                )
+
+            if contract is not None:
+                row['allotment'] = max(
+                    int(contract.get('allocated_rooms') or 0)
+                    - int(contract.get('used_rooms') or 0)
+                    - int(contract.get('released_rooms') or 0), 0)
+
+            pkg = src['packages'].get(row['plan_ref']) or {}
+            row['package_per_room'] = round(pkg.get('per_room', 0.0), 2)
+            row['package_per_person'] = round(pkg.get('per_person', 0.0), 2)
+            row['package_per_stay'] = round(pkg.get('per_stay', 0.0), 2)
+            row['sellable_rate'] = (
+                round(row['rate'] + row['package_per_room'], 2) if row['rate'] is not None else None
+            )
+            rows.append(row)
+        return rows
+
+    async def compile(self, tenant_id: str, keys: Optional[List[str]] = None,
+                      room_types: Optional[List[str]] = None,
+                      start: Optional[date] = None, end: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Compile (upsert) grid rows for the scope; returns the rows written"""
+        start = start or date.today()
+        end = end or start + timedelta(days=HORIZON_DAYS)
+        days = _date_range(start, end)
+
+        operator_ids = None
+        if keys is not None and DEFAULT_KEY not in keys:
+            operator_ids = [k[len(OPERATOR_PREFIX):] for k in keys if k.startswith(OPERATOR_PREFIX)]
+        src = await self._load_sources(tenant_id, operator_ids)
+
+        if room_types is None:
+            room_types = sorted(src['base_prices'])
+        if keys is None:
+            operators = {op for op, _ in src['periods']} | set(src['stop_sales']) | {op for op, _ in src['contracts']}
+            keys = [DEFAULT_KEY] + [p['id'] for p in src['plans'] if p.get('id')] + \
+                   [operator_key(op) for op in sorted(o for o in operators if o)]
+
+        compiled_at = datetime.now(timezone.utc).isoformat()
+        rows: List[Dict[str, Any]] = []
+        for key in keys:
+            for rt in room_types:
+                rows.extend(self._build_rows(tenant_id, key, rt, days, src, compiled_at))
+
+        for i in range(0, len(rows), WRITE_CHUNK):
+            await self.collection.bulk_write([
+                UpdateOne(
+                    {'tenant_id': tenant_id, 'room_type': r['room_type'],
+                     'rate_plan_id': r['rate_plan_id'], 'date': r['date']},
+                    {'$set': r}, upsert=True
+                ) for r in rows[i:i + WRITE_CHUNK]
+            ], ordered=False)
+        return rows
+
+    # ----------------------------------------------------------- invalidation
+
+    async def invalidate(self, tenant_id: str, keys: Optional[Iterable[str]] = None,
+                         room_types: Optional[Iterable[str]] = None,
+                         plan_refs: Optional[Iterable[str]] = None) -> int:
+        """Drop the rows a source change affects and rebuild just that scope in the background"""
+        query: Dict[str, Any] = {'tenant_id': tenant_id}
+        if room_types is not None:
+            query['room_type'] = {'$in': list(room_types)}
+        clauses = []
+        if keys is not None:
+            clauses.append({'rate_plan_id': {'$in': list(keys)}})
+        if plan_refs is not None:
+            clauses.append({'plan_ref': {'$in': list(plan_refs)}})
+        if clauses:
+            query['$or'] = clauses
+
+        # Keys present in the scope (plus the named ones) are what gets rebuilt
+        scope_keys = set(keys or [])
+        if keys is None or plan_refs is not None:
+            scope_keys |= set(await self.collection.distinct('rate_plan_id', query))
+        scope_keys = sorted(scope_keys)
+        result = await self.collection.delete_many(query)
+
+        if scope_keys:
+            task = asyncio.create_task(self.compile(
+                tenant_id, keys=scope_keys, room_types=list(room_types) if room_types is not None else None
+            ))
+            self._tasks.add(task)
+            task.add_done_callback(self._forget)
+        return result.deleted_count
+
+    def _forget(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"⚠️ Rate grid rebuild failed: {task.exception()}")
+
+    # ---------------------------------------------------------------- readers
+
+    async def get_rows(self, tenant_id: str, key: str, room_types: List[str],
+                       start: date, end: date) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Rows keyed by (room_type, date); compiles whatever is missing in one pass"""
+        rows = await self.collection.find({
+            'tenant_id': tenant_id,
+            'rate_plan_id': key,
+            'room_type': {'$in': room_types},
+            'date': {'$gte': start.isoformat(), '$lte': end.isoformat()}
+        }, {'_id': 0}).to_list(None)
+
+        nights = (end - start).days + 1
+        if len(rows) < len(room_types) * nights:
+            counts = {rt: 0 for rt in room_types}
+            for r in rows:
+                counts[r['room_type']] += 1
+            missing = [rt for rt in room_types if counts[rt] < nights]
+            rows = [r for r in rows if r['room_type'] not in missing]
+            rows.extend(await self.compile(tenant_id, keys=[key], room_types=missing, start=start, end=end))
+
+        return {(r['room_type'], r['date']): r for r in rows}
+
+    async def quote(self, tenant_id: str, room_type: str, check_in: date, check_out: date,
+                    key: str = DEFAULT_KEY, adults: int = 2) -> Dict[str, Any]:
+        """Price a stay from the compiled rows and check its restrictions"""
+        grid = await self.get_rows(tenant_id, key, [room_type], check_in, check_out)
+        stay_days = _date_range(check_in, check_out - timedelta(days=1))
+        nights = [grid[(room_type, d)] for d in stay_days]
+        arrival, departure = nights[0], grid[(room_type, check_out.isoformat())]
+
+        reasons = []
+        if any(n['stop_sell'] for n in nights):
+            reasons.append('stop_sell')
+        if any(n['rate'] is None for n in nights):
+            reasons.append('no_rate')
+        if arrival['cta']:
+            reasons.append('closed_to_arrival')
+        if departure['ctd']:
+            reasons.append('closed_to_departure')
+        if len(nights) < (arrival['min_stay'] or 1):
+            reasons.append(f"min_stay_{arrival['min_stay']}")
+        if arrival['max_stay'] and len(nights) > arrival['max_stay']:
+            reasons.append(f"max_stay_{arrival['max_stay']}")
+
+        room_total = sum(n['sellable_rate'] or 0 for n in nights)
+        per_person = sum(n['package_per_person'] for n in nights) * adults
+        per_stay = arrival['package_per_stay']
+        return {
+            'room_type': room_type,
+            'rate_plan_id': key,
+            'check_in': check_in.isoformat(),
+            'check_out': check_out.isoformat(),
+            'nights': len(nights),
+            'sellable': not reasons,
+            'restrictions': reasons,
+            'currency': next((n['currency'] for n in nights if n['currency']), None),
+            'total': round(room_total + per_person + per_stay, 2),
+            'nightly': [
+                {'date': n['date'], 'rate': n['rate'], 'sellable_rate': n['sellable_rate'],
+                 'source': n['source'], 'stop_sell': n['stop_sell']}
+                for n in nights
+            ],
+        }
+
+
+rate_grid = None
+
+
+def get_rate_grid(db):
+    global rate_grid
+    if rate_grid is None:
+        rate_grid = RateGridCompiler(db)
+    return rate_grid
@@ -9,6 +9,8 @@ from typing import Any, Optional, Callable
 from functools import wraps
 import orjson
 
+from request_metrics import record_cache_operation
+
 class RedisCache:
     """Redis-based cache for ultra-fast distributed caching"""
     
@@ -50,12 +52,15 @@ class RedisCache:
             data = self.redis_client.get(key)
             if data:
                 self._hits += 1
+                record_cache_operation('redis_fast', True)
                 return orjson.loads(data)
             self._misses += 1
+            record_cache_operation('redis_fast', False)
             return None
         except Exception as e:
             print(f"Redis get error: {e}")
             self._misses += 1
+            record_cache_operation('redis_fast', False)
             return None
     
     def set(self, key: str, value: Any, ttl: int = 60):
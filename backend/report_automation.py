@@ -50,9 +50,38 @@ class ReportAutomation:
         return html
     
     async def send_flash_report_email(self, tenant_id: str, recipients: list):
-        """Flash report'u email ile gönder"""
-        print(f"📧 Sending flash report to {len(recipients)} recipients")
-        return True
+        """Flash report'u email ile gönder (tek batch olarak kuyruğa alınır)"""
+        from message_delivery import get_delivery_service, MessageChannel
+        
+        total_rooms = await self.db.rooms.count_documents({'tenant_id': tenant_id})
+        occupied = await self.db.rooms.count_documents({'tenant_id': tenant_id, 'status': 'occupied'})
+        report_date = datetime.now(timezone.utc).date().isoformat()
+        report_data = {
+            'report_date': report_date,
+            'occupancy': {
+                'occupancy_pct': round(occupied / total_rooms * 100, 1) if total_rooms else 0
+            }
+        }
+        html = await self.generate_flash_report_email(tenant_id, report_data)
+        subject = f"Daily Flash Report - {report_date}"
+        text = f"Daily Flash Report {report_date}: Doluluk {report_data['occupancy']['occupancy_pct']}%"
+        
+        delivery = get_delivery_service()
+        if delivery and delivery.running:
+            result = await delivery.enqueue_batch([
+                {'channel': MessageChannel.EMAIL, 'recipient': r, 'subject': subject, 'text': text, 'html': html,
+                 'source': {'type': 'flash_report', 'report_date': report_date}}
+                for r in recipients
+            ], tenant_id=tenant_id)
+            print(f"📧 Flash report queued for {result['queued']} recipients")
+            return result
+        
+        # No delivery workers (e.g. scripts): send concurrently, off the event loop
+        results = await asyncio.gather(*(
+            asyncio.to_thread(self.email_service._send_email_smtp, r, subject, html, text)
+            for r in recipients
+        ))
+        return {'queued': 0, 'sent': sum(1 for ok in results if ok)}
 
 # Global
 report_automation = None
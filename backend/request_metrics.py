@@ -0,0 +1,402 @@
+"""
+Request, Database and Cache Instrumentation for Hotel PMS
+Bounded HDR-style latency histograms fed by an ASGI middleware,
+a pymongo CommandListener and cache hit/miss hooks
+"""
+
+import threading
+import time
+import contextvars
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import monitoring
+
+try:
+    from prometheus_metrics import track_http_request, track_db_query, track_cache_operation
+    PROMETHEUS_AVAILABLE = True
+except Exception:
+    PROMETHEUS_AVAILABLE = False
+
+# ============= HISTOGRAM =============
+
+# 32 sub-buckets per power of two -> ~3% relative precision
+SUB_BUCKET_BITS = 5
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+# Values are recorded in microseconds; anything above one hour is clamped
+MAX_TRACKABLE_US = 3_600_000_000
+
+
+def _bucket_index(value: int) -> int:
+    shift = max(0, value.bit_length() - (SUB_BUCKET_BITS + 1))
+    return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+
+def _bucket_bounds(index: int) -> Tuple[int, int]:
+    shift = max(0, (index >> SUB_BUCKET_BITS) - 1)
+    mantissa = index - (shift << SUB_BUCKET_BITS)
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """Log-linear latency histogram with fixed memory (HDR-style)
+
+    Memory is bounded by the number of buckets (< 1k) regardless of how
+    many values are recorded, unlike keeping every latency in a list.
+    """
+
+    __slots__ = ('counts', 'count', 'total_us', 'min_us', 'max_us')
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+    def record(self, value_us: int):
+        value_us = min(max(int(value_us), 0), MAX_TRACKABLE_US)
+        index = _bucket_index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total_us += value_us
+        if self.min_us is None or value_us < self.min_us:
+            self.min_us = value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def record_ms(self, value_ms: float):
+        self.record(int(value_ms * 1000))
+
+    def merge(self, other: 'LatencyHistogram'):
+        for index, n in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + n
+        self.count += other.count
+        self.total_us += other.total_us
+        if other.min_us is not None and (self.min_us is None or other.min_us < self.min_us):
+            self.min_us = other.min_us
+        self.max_us = max(self.max_us, other.max_us)
+
+    def percentile_us(self, percentile: float) -> int:
+        if not self.count:
+            return 0
+        target = max(1, int(round(self.count * percentile / 100.0)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                low, high = _bucket_bounds(index)
+                return min((low + high) // 2, self.max_us)
+        return self.max_us
+
+    def summary(self) -> Dict[str, Any]:
+        """Millisecond summary with p50/p95/p99"""
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_us / self.count / 1000, 2),
+            'min_ms': round((self.min_us or 0) / 1000, 2),
+            'max_ms': round(self.max_us / 1000, 2),
+            'p50_ms': round(self.percentile_us(50) / 1000, 2),
+            'p95_ms': round(self.percentile_us(95) / 1000, 2),
+            'p99_ms': round(self.percentile_us(99) / 1000, 2),
+        }
+
+
+class _HourlyWindow:
+    """One hour of request latencies for trend endpoints"""
+
+    __slots__ = ('hour', 'histogram', 'errors')
+
+    def __init__(self, hour: datetime):
+        self.hour = hour
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+
+
+# ============= REGISTRY =============
+
+class MetricsRegistry:
+    """Thread-safe store for HTTP, DB and cache metrics
+
+    Motor runs pymongo in executor threads, so command events arrive
+    off the event loop; every mutation goes through one lock.
+    """
+
+    def __init__(self, retention_hours: int = 168):
+        self._lock = threading.Lock()
+        self.routes: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self.db_ops: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.cache_ops: Dict[str, Dict[str, int]] = {}
+        self.hourly: deque = deque(maxlen=retention_hours)
+        self.tenant_tiers: Dict[str, str] = {}
+        self.started_at = datetime.now(timezone.utc)
+
+    # ---- HTTP ----
+
+    def record_request(self, method: str, route: str, tier: str, status_code: int, duration_ms: float):
+        key = (method, route, tier)
+        with self._lock:
+            entry = self.routes.get(key)
+            if entry is None:
+                entry = {'histogram': LatencyHistogram(), 'errors': 0}
+                self.routes[key] = entry
+            entry['histogram'].record_ms(duration_ms)
+            if status_code >= 500:
+                entry['errors'] += 1
+
+            window = self._current_window()
+            window.histogram.record_ms(duration_ms)
+            if status_code >= 500:
+                window.errors += 1
+
+    def _current_window(self) -> _HourlyWindow:
+        hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        if not self.hourly or self.hourly[-1].hour != hour:
+            self.hourly.append(_HourlyWindow(hour))
+        return self.hourly[-1]
+
+    # ---- DB ----
+
+    def record_db(self, collection: str, operation: str, duration_us: int, docs: int, failed: bool = False):
+        key = (collection, operation)
+        with self._lock:
+            entry = self.db_ops.get(key)
+            if entry is None:
+                entry = {'histogram': LatencyHistogram(), 'docs_returned': 0, 'failures': 0}
+                self.db_ops[key] = entry
+            entry['histogram'].record(duration_us)
+            entry['docs_returned'] += docs
+            if failed:
+                entry['failures'] += 1
+
+    # ---- Cache ----
+
+    def record_cache(self, cache_type: str, hit: bool):
+        with self._lock:
+            entry = self.cache_ops.setdefault(cache_type, {'hits': 0, 'misses': 0})
+            entry['hits' if hit else 'misses'] += 1
+
+    # ---- Tenant tiers ----
+
+    def set_tenant_tier(self, tenant_id: str, tier: Optional[str]):
+        if tenant_id and tier:
+            self.tenant_tiers[tenant_id] = tier
+
+    def tier_for(self, tenant_id: Optional[str]) -> str:
+        if not tenant_id:
+            return 'anonymous'
+        return self.tenant_tiers.get(tenant_id, 'unknown')
+
+    # ---- Reporting ----
+
+    def route_metrics(self) -> list:
+        with self._lock:
+            items = list(self.routes.items())
+        result = []
+        for (method, route, tier), entry in items:
+            summary = entry['histogram'].summary()
+            summary.update({
+                'method': method,
+                'route': route,
+                'tenant_tier': tier,
+                'error_count': entry['errors'],
+            })
+            result.append(summary)
+        result.sort(key=lambda r: r.get('p95_ms', 0), reverse=True)
+        return result
+
+    def db_metrics(self) -> list:
+        with self._lock:
+            items = list(self.db_ops.items())
+        result = []
+        for (collection, operation), entry in items:
+            summary = entry['histogram'].summary()
+            summary.update({
+                'collection': collection,
+                'operation': operation,
+                'docs_returned': entry['docs_returned'],
+                'failures': entry['failures'],
+            })
+            result.append(summary)
+        result.sort(key=lambda r: r.get('p95_ms', 0), reverse=True)
+        return result
+
+    def cache_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            items = {k: dict(v) for k, v in self.cache_ops.items()}
+        for stats in items.values():
+            total = stats['hits'] + stats['misses']
+            stats['hit_rate'] = round(stats['hits'] / total * 100, 2) if total else 0
+        return items
+
+    def hourly_metrics(self, hours: int = 24) -> list:
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=hours)
+        with self._lock:
+            windows = [w for w in self.hourly if w.hour >= cutoff]
+        result = []
+        for window in windows:
+            summary = window.histogram.summary()
+            count = window.histogram.count
+            summary.update({
+                'timestamp': window.hour.isoformat(),
+                'requests_per_minute': round(count / 60, 2),
+                'error_rate': round(window.errors / count * 100, 2) if count else 0,
+            })
+            result.append(summary)
+        return result
+
+    def overall(self, hours: int = 24) -> Dict[str, Any]:
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=hours)
+        merged = LatencyHistogram()
+        errors = 0
+        with self._lock:
+            for window in self.hourly:
+                if window.hour >= cutoff:
+                    merged.merge(window.histogram)
+                    errors += window.errors
+        summary = merged.summary()
+        summary['error_count'] = errors
+        summary['error_rate'] = round(errors / merged.count * 100, 2) if merged.count else 0
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self.routes.clear()
+            self.db_ops.clear()
+            self.cache_ops.clear()
+            self.hourly.clear()
+            self.started_at = datetime.now(timezone.utc)
+
+
+# Global registry instance
+metrics_registry = MetricsRegistry()
+
+# Per-request labels; the middleware installs a dict that auth code fills in
+_request_labels: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    'request_labels', default=None
+)
+
+
+def tag_request(**labels):
+    """Attach labels (e.g. tenant_id) to the in-flight request"""
+    current = _request_labels.get()
+    if current is not None:
+        current.update(labels)
+
+
+def record_cache_operation(cache_type: str, hit: bool):
+    """Cache hit/miss hook used by cache_manager and redis_cache"""
+    metrics_registry.record_cache(cache_type, hit)
+    if PROMETHEUS_AVAILABLE:
+        track_cache_operation(cache_type, hit)
+
+
+# ============= ASGI MIDDLEWARE =============
+
+class RequestMetricsMiddleware:
+    """Record latency per route template and tenant tier
+
+    Uses the matched route's path template (``/api/bookings/{booking_id}``)
+    rather than the raw path so label cardinality stays bounded.
+    """
+
+    def __init__(self, app, exclude_paths: Tuple[str, ...] = ('/health', '/ws')):
+        self.app = app
+        self.exclude_paths = exclude_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope.get('path', '').startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        labels: Dict[str, Any] = {}
+        token = _request_labels.set(labels)
+        start = time.perf_counter()
+        status_holder = {'status': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status_holder['status'] = message.get('status', 500)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            _request_labels.reset(token)
+            route = scope.get('route')
+            template = getattr(route, 'path', None) or 'unmatched'
+            method = scope.get('method', 'GET')
+            tier = metrics_registry.tier_for(labels.get('tenant_id'))
+            metrics_registry.record_request(method, template, tier, status_holder['status'], duration_ms)
+            if PROMETHEUS_AVAILABLE:
+                track_http_request(method, template, status_holder['status'], duration_ms / 1000)
+
+
+# ============= MONGODB COMMAND LISTENER =============
+
+_TRACKED_COMMANDS = {
+    'find', 'aggregate', 'count', 'distinct', 'insert', 'update', 'delete',
+    'findAndModify', 'getMore', 'createIndexes',
+}
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo listener recording per-collection/op latency and docs returned"""
+
+    def __init__(self, registry: MetricsRegistry, max_pending: int = 10000):
+        self.registry = registry
+        self.max_pending = max_pending
+        self._pending: Dict[Tuple[int, Any], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name not in _TRACKED_COMMANDS:
+            return
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection', 'unknown')
+        else:
+            collection = event.command.get(event.command_name, 'unknown')
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._pending.clear()
+            self._pending[(event.request_id, event.connection_id)] = (str(collection), event.command_name)
+
+    def _pop(self, event) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            return self._pending.pop((event.request_id, event.connection_id), None)
+
+    def succeeded(self, event):
+        labels = self._pop(event)
+        if labels is None:
+            return
+        collection, operation = labels
+        self.registry.record_db(collection, operation, event.duration_micros, _docs_returned(event.reply))
+        if PROMETHEUS_AVAILABLE:
+            track_db_query(collection, operation, event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        labels = self._pop(event)
+        if labels is None:
+            return
+        collection, operation = labels
+        self.registry.record_db(collection, operation, event.duration_micros, 0, failed=True)
+
+
+def _docs_returned(reply) -> int:
+    if not reply:
+        return 0
+    cursor = reply.get('cursor')
+    if cursor:
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or [])
+    values = reply.get('values')
+    if values is not None:
+        return len(values)
+    n = reply.get('n')
+    return n if isinstance(n, int) else 0
+
+
+mongo_command_metrics = MongoCommandMetrics(metrics_registry)
@@ -0,0 +1,351 @@
+"""
+Search Index - guest / reservation typeahead
+One search_index entry per guest or booking holding normalised tokens:
+Turkish-aware folding (İ/ı/ş/ğ/ü/ö/ç), prefix tokens per word for
+typeahead, '~' trigrams for fuzzy fallback and phone digit variants.
+Lookups hit the multikey (tenant_id, kind, tokens) index instead of
+unanchored $regex collection scans. Entries are maintained on guest and
+booking writes; a throttled created_at sweep, run in the background,
+picks up inserts made by paths without a hook. Callers with extra filters
+(dates, status) pass them to ids(), which pages through index candidates
+until enough of them pass the filter.
+"""
+
+import asyncio
+import re
+import time
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import DeleteOne, UpdateOne
+
+KINDS = ('guest', 'booking')
+MIN_PREFIX = 2
+MAX_PREFIX = 20
+CANDIDATE_LIMIT = 300
+SWEEP_INTERVAL_SECONDS = 30
+
+_TR_FOLD = str.maketrans({
+    'İ': 'i', 'I': 'i', 'ı': 'i', 'Ş': 's', 'ş': 's', 'Ğ': 'g', 'ğ': 'g',
+    'Ü': 'u', 'ü': 'u', 'Ö': 'o', 'ö': 'o', 'Ç': 'c', 'ç': 'c',
+})
+_NON_WORD = re.compile(r'[^0-9a-z@]+')
+_DIGITS = re.compile(r'\D+')
+_NOT_PHONE = re.compile(r'[^0-9\s+()\-]')
+
+GUEST_FIELDS = {'_id': 0, 'id': 1, 'tenant_id': 1, 'name': 1, 'first_name': 1, 'last_name': 1,
+                'email': 1, 'phone': 1, 'id_number': 1, 'created_at': 1}
+BOOKING_FIELDS = {'_id': 0, 'id': 1, 'tenant_id': 1, 'guest_id': 1, 'guest_name': 1, 'guest_email': 1,
+                  'guest_phone': 1, 'booking_number': 1, 'confirmation_number': 1, 'channel_booking_id': 1,
+                  'ota_reservation_id': 1, 'check_in': 1, 'check_out': 1, 'created_at': 1}
+
+
+def normalize(text: Any) -> str:
+    """Case- and accent-insensitive form; İ/I/ı all fold to 'i'"""
+    if text is None:
+        return ''
+    folded = str(text).translate(_TR_FOLD)
+    folded = unicodedata.normalize('NFKD', folded)
+    folded = ''.join(ch for ch in folded if not unicodedata.combining(ch)).lower()
+    return _NON_WORD.sub(' ', folded.replace('@', ' ')).strip()
+
+
+def _words(*values) -> List[str]:
+    out = []
+    for value in values:
+        out.extend(w for w in normalize(value).split() if w)
+    return out
+
+
+def _phone_variants(phone: Any) -> List[str]:
+    digits = _DIGITS.sub('', str(phone or ''))
+    if len(digits) < 4:
+        return []
+    variants = {digits}
+    if digits.startswith('90') and len(digits) > 10:
+        variants.add(digits[2:])
+    if digits.startswith('0'):
+        variants.add(digits[1:])
+    variants.add('#' + digits[-4:])  # last four digits, typed at the front desk
+    return list(variants)
+
+
+def _tokens(words: Iterable[str], exact: Iterable[str] = ()) -> List[str]:
+    tokens = set(exact)
+    for w in words:
+        tokens.add(w)
+        for k in range(MIN_PREFIX, min(len(w), MAX_PREFIX) + 1):
+            tokens.add(w[:k])
+        if len(w) >= 3 and not w.isdigit():
+            tokens.update('~' + w[i:i + 3] for i in range(len(w) - 2))
+    return list(tokens)
+
+
+def _sort_key(value) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value or '')
+
+
+def guest_entry(guest: Dict[str, Any]) -> Dict[str, Any]:
+    name = guest.get('name') or ' '.join(filter(None, [guest.get('first_name'), guest.get('last_name')]))
+    words = _words(name, guest.get('id_number'))
+    email = (guest.get('email') or '').strip().lower()
+    if email:
+        words += _words(email.split('@')[0])
+    phones = _phone_variants(guest.get('phone'))
+    words += [p for p in phones if not p.startswith('#')]
+    exact = [p for p in phones if p.startswith('#')] + ([email] if email else [])
+    return {
+        'tenant_id': guest.get('tenant_id'),
+        'kind': 'guest',
+        'ref_id': guest['id'],
+        'tokens': _tokens(words, exact),
+        'words': sorted(set(words) | set(exact)),
+        'sort_key': _sort_key(guest.get('created_at')),
+        'display': {'name': name, 'email': guest.get('email'), 'phone': guest.get('phone')},
+    }
+
+
+def booking_entry(booking: Dict[str, Any]) -> Dict[str, Any]:
+    words = _words(booking.get('guest_name'), booking.get('booking_number'), booking.get('confirmation_number'),
+                   booking.get('channel_booking_id'), booking.get('ota_reservation_id'))
+    words += _words((booking.get('id') or '')[:8])
+    email = (booking.get('guest_email') or '').strip().lower()
+    phones = _phone_variants(booking.get('guest_phone'))
+    words += [p for p in phones if not p.startswith('#')]
+    exact = [p for p in phones if p.startswith('#')] + ([email] if email else []) + [booking['id']]
+    return {
+        'tenant_id': booking.get('tenant_id'),
+        'kind': 'booking',
+        'ref_id': booking['id'],
+        'guest_id': booking.get('guest_id'),
+        'tokens': _tokens(words, exact),
+        'words': sorted(set(words) | set(exact)),
+        'sort_key': _sort_key(booking.get('check_in')),
+        'display': {
+            'guest_name': booking.get('guest_name'),
+            'booking_number': booking.get('booking_number'),
+            'check_in': _sort_key(booking.get('check_in')) or None,
+            'check_out': _sort_key(booking.get('check_out')) or None,
+        },
+    }
+
+
+def query_terms(q: str) -> List[str]:
+    """Search terms for a typed query; digit runs also match stored phone variants"""
+    raw = str(q or '').strip()
+    if '@' in raw and ' ' not in raw:
+        return [raw.lower()]
+    terms = [w[:MAX_PREFIX] for w in _words(raw) if len(w) >= MIN_PREFIX]
+    digits = _DIGITS.sub('', raw)
+    if len(digits) >= 4 and not _NOT_PHONE.search(raw):  # looks like a phone number
+        if len(digits) == 4:
+            return ['#' + digits]
+        stripped = digits[2:] if digits.startswith('90') and len(digits) > 10 else digits.lstrip('0')
+        return [stripped[:MAX_PREFIX]]
+    return terms
+
+
+class SearchIndex:
+    """Token index for guests and bookings"""
+
+    def __init__(self, db):
+        self.db = db
+        self._last_sweep: Dict[str, float] = {}
+        self._building: Dict[str, asyncio.Task] = {}
+        self._sweeping: Dict[str, asyncio.Task] = {}
+
+    # ------------------------------------------------------------ maintenance
+
+    async def index_docs(self, kind: str, docs: Iterable[Dict[str, Any]]):
+        build = guest_entry if kind == 'guest' else booking_entry
+        now = datetime.now(timezone.utc).isoformat()
+        ops = [
+            UpdateOne(
+                {'tenant_id': entry['tenant_id'], 'kind': kind, 'ref_id': entry['ref_id']},
+                {'$set': {**entry, 'indexed_at': now}},
+                upsert=True
+            )
+            for entry in (build(doc) for doc in docs if doc and doc.get('id'))
+        ]
+        if ops:
+            await self.db.search_index.bulk_write(ops, ordered=False)
+
+    async def index_guest(self, guest: Dict[str, Any]):
+        await self.index_docs('guest', [guest])
+
+    async def index_booking(self, booking: Dict[str, Any]):
+        await self.index_docs('booking', [booking])
+
+    async def reindex(self, tenant_id: str, kind: str, ref_ids: List[str]):
+        """Re-read documents after an update and refresh their entries"""
+        coll, fields = (self.db.guests, GUEST_FIELDS) if kind == 'guest' else (self.db.bookings, BOOKING_FIELDS)
+        docs = await coll.find({'tenant_id': tenant_id, 'id': {'$in': ref_ids}}, fields).to_list(None)
+        await self.index_docs(kind, docs)
+        missing = set(ref_ids) - {d['id'] for d in docs}
+        if missing:
+            await self.db.search_index.bulk_write([
+                DeleteOne({'tenant_id': tenant_id, 'kind': kind, 'ref_id': ref_id}) for ref_id in missing
+            ], ordered=False)
+
+    async def _stream(self, tenant_id: str, kind: str, since: Optional[str] = None) -> int:
+        coll, fields = (self.db.guests, GUEST_FIELDS) if kind == 'guest' else (self.db.bookings, BOOKING_FIELDS)
+        query: Dict[str, Any] = {'tenant_id': tenant_id}
+        if since:
+            query['$or'] = [{'created_at': {'$gt': since}},
+                            {'created_at': {'$gt': datetime.fromisoformat(since)}}]
+        batch, count = [], 0
+        async for doc in coll.find(query, fields):
+            batch.append(doc)
+            count += 1
+            if len(batch) >= 1000:
+                await self.index_docs(kind, batch)
+                batch = []
+        await self.index_docs(kind, batch)
+        return count
+
+    async def build(self, tenant_id: str) -> Dict[str, int]:
+        """Index every guest and booking of the tenant"""
+        started = datetime.now(timezone.utc).isoformat()
+        await self.db.search_index_meta.update_one(
+            {'tenant_id': tenant_id}, {'$set': {'status': 'building', 'started_at': started}}, upsert=True
+        )
+        counts = {kind: await self._stream(tenant_id, kind) for kind in KINDS}
+        # Entries not touched by this pass point at deleted documents
+        await self.db.search_index.delete_many({'tenant_id': tenant_id, 'indexed_at': {'$lt': started}})
+        await self.db.search_index_meta.update_one(
+            {'tenant_id': tenant_id},
+            {'$set': {'status': 'ready', 'watermark': started, 'counts': counts,
+                      'built_at': datetime.now(timezone.utc).isoformat()}}
+        )
+        print(f"🔎 Search index built for tenant {tenant_id}: {counts}")
+        return counts
+
+    async def ensure_ready(self, tenant_id: str) -> bool:
+        """True when the index can serve queries; starts a background build otherwise"""
+        meta = await self.db.search_index_meta.find_one({'tenant_id': tenant_id}, {'_id': 0})
+        if not meta or meta.get('status') != 'ready':
+            task = self._building.get(tenant_id)
+            # A 'building' marker older than an hour belongs to a crashed worker
+            stale = bool(meta) and meta.get('started_at', '') < (
+                datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+            if (not meta or meta.get('status') != 'building' or stale) and (task is None or task.done()):
+                self._building[tenant_id] = asyncio.create_task(self.build(tenant_id))
+            return False
+        task = self._sweeping.get(tenant_id)
+        if time.monotonic() - self._last_sweep.get(tenant_id, 0) > SWEEP_INTERVAL_SECONDS and (
+                task is None or task.done()):
+            self._last_sweep[tenant_id] = time.monotonic()
+            self._sweeping[tenant_id] = asyncio.create_task(self._sweep(tenant_id, meta.get('watermark')))
+        return True
+
+    async def _sweep(self, tenant_id: str, watermark: Optional[str]):
+        """Index documents created since the watermark by paths without a hook"""
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            for kind in KINDS:
+                await self._stream(tenant_id, kind, since=watermark)
+            await self.db.search_index_meta.update_one({'tenant_id': tenant_id}, {'$set': {'watermark': now}})
+        except Exception as e:
+            print(f"⚠️ Search index sweep failed for tenant {tenant_id}: {e}")
+
+    # ------------------------------------------------------------ queries
+
+    async def search(self, tenant_id: str, q: str, kinds: Iterable[str] = KINDS,
+                     limit: int = 20) -> Optional[List[Dict[str, Any]]]:
+        """
+        Ranked matches [{kind, id, score, ...display}], or None while the
+        tenant's index is still being built (callers fall back to their
+        legacy query).
+        """
+        if not await self.ensure_ready(tenant_id):
+            return None
+        terms = query_terms(q)
+        if not terms:
+            return []
+        results, _ = await self._ranked(tenant_id, terms, list(kinds))
+        return results[:limit]
+
+    async def _ranked(self, tenant_id: str, terms: List[str], kinds: List[str], skip: int = 0,
+                      sort_from: Optional[str] = None, sort_to: Optional[str] = None):
+        """One page of up to CANDIDATE_LIMIT ranked matches and whether more pages exist"""
+        projection = {'_id': 0, 'kind': 1, 'ref_id': 1, 'words': 1, 'sort_key': 1, 'display': 1, 'guest_id': 1}
+        query: Dict[str, Any] = {'tenant_id': tenant_id, 'kind': {'$in': kinds}, 'tokens': {'$all': terms}}
+        if sort_from or sort_to:
+            query['sort_key'] = {k: v for k, v in (('$gte', sort_from), ('$lte', sort_to)) if v}
+        candidates = await self.db.search_index.find(query, projection).sort(
+            [('sort_key', -1), ('ref_id', 1)]
+        ).skip(skip).limit(CANDIDATE_LIMIT).to_list(CANDIDATE_LIMIT)
+        more = len(candidates) == CANDIDATE_LIMIT
+
+        fuzzy = False
+        if not candidates and not skip:
+            grams = sorted({'~' + t[i:i + 3] for t in terms if not t.isdigit() for i in range(len(t) - 2)})
+            if grams:
+                fuzzy = True
+                candidates = await self.db.search_index.aggregate([
+                    {'$match': {**query, 'tokens': {'$in': grams}}},
+                    {'$limit': 5000},
+                    {'$project': {**projection, 'hits': {'$size': {'$setIntersection': ['$tokens', grams]}}}},
+                    {'$match': {'hits': {'$gte': max(1, (len(grams) + 1) // 2)}}},
+                    {'$sort': {'hits': -1, 'sort_key': -1}},
+                    {'$limit': CANDIDATE_LIMIT},
+                ]).to_list(CANDIDATE_LIMIT)
+
+        results = []
+        for c in candidates:
+            words = set(c.get('words') or [])
+            if fuzzy:
+                score = c['hits'] / 10.0
+            else:
+                score = sum(3 if t in words else 1 for t in terms)
+            results.append({'kind': c['kind'], 'id': c['ref_id'], 'guest_id': c.get('guest_id'),
+                            'score': score, 'fuzzy': fuzzy, 'sort_key': c.get('sort_key'), **(c.get('display') or {})})
+        results.sort(key=lambda r: (r['score'], r['sort_key'] or ''), reverse=True)
+        for r in results:
+            r.pop('sort_key')
+        return results, more
+
+    async def ids(self, tenant_id: str, q: str, kind: str, limit: int = CANDIDATE_LIMIT,
+                  where: Optional[Dict[str, Any]] = None, sort_from: Optional[str] = None,
+                  sort_to: Optional[str] = None) -> Optional[List[str]]:
+        """
+        Ranked ids of matching documents, or None while the index builds.
+        `where` is a filter on the guests/bookings collection (dates, status);
+        candidate pages are checked against it until `limit` ids pass.
+        sort_from/sort_to bound the entry sort_key (created_at for guests,
+        check_in for bookings) inside the index query itself.
+        """
+        if not await self.ensure_ready(tenant_id):
+            return None
+        terms = query_terms(q)
+        if not terms:
+            return []
+        coll = self.db.guests if kind == 'guest' else self.db.bookings
+        found: List[str] = []
+        skip = 0
+        while len(found) < limit:
+            hits, more = await self._ranked(tenant_id, terms, [kind], skip, sort_from, sort_to)
+            page = [h['id'] for h in hits]
+            if page and where:
+                passed = set(await coll.distinct(
+                    'id', {'$and': [where, {'tenant_id': tenant_id, 'id': {'$in': page}}]}
+                ))
+                page = [ref_id for ref_id in page if ref_id in passed]
+            found.extend(page)
+            if not more or not where:
+                break
+            skip += CANDIDATE_LIMIT
+        return found[:limit]
+
+
+search_index = None
+
+
+def get_search_index(db):
+    global search_index
+    if search_index is None:
+        search_index = SearchIndex(db)
+    return search_index
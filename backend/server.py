@@ -3,7 +3,7 @@ from fastapi import Body
 
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import ORJSONResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.gzip import GZipMiddleware
@@ -41,6 +41,7 @@ import base64
 import secrets
 import sys
 import hashlib
+import re
 
 import random
 from openpyxl import Workbook
@@ -51,6 +52,11 @@ from fastapi.responses import StreamingResponse
 # Add current directory to path for accounting models
 sys.path.append(os.path.dirname(__file__))
 
+from pagination_utils import (
+    keyset_find, apply_cursor_headers, InvalidCursorError,
+    SORT_CREATED_DESC, SORT_CHECK_IN_DESC, SORT_TIMESTAMP_DESC, SORT_ROOM_NUMBER
+)
+
 # Import cache manager for performance optimization
 try:
     from cache_manager import cached, cache, DashboardCache, RoomCache, BookingCache
@@ -134,6 +140,13 @@ from health_check import health_router
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/hotel_pms')  # Fallback for local dev
 db_name = os.environ.get('DB_NAME', 'hotel_pms')  # Fallback for local dev
 
+# Request/DB/cache instrumentation (bounded histograms served by /monitoring endpoints)
+from request_metrics import (
+    RequestMetricsMiddleware, mongo_command_metrics, metrics_registry, tag_request
+)
+from endpoint_profiler import ProfilerMiddleware, profiler_command_listener
+from log_pipeline import write_log
+
 # Optimized connection pool for high concurrency (550 rooms, 300+ daily transactions)
 client = AsyncIOMotorClient(
     mongo_url,
@@ -145,7 +158,8 @@ client = AsyncIOMotorClient(
     socketTimeoutMS=20000,  # Faster socket timeout
     retryWrites=True,
     retryReads=True,
-    maxConnecting=10  # Allow more simultaneous connections
+    maxConnecting=10,  # Allow more simultaneous connections
+    event_listeners=[mongo_command_metrics, profiler_command_listener]  # Per-collection/op latency + per-request query budgets
 )
 db = client[db_name]
 
@@ -461,6 +475,7 @@ async def cm_get_ari(
     - availability computed from rooms - active bookings - room blocks
     - stop_sell applied via stop_sales (operator-based if provided)
     - rate resolved from rate_periods (operator_id+room_type_id) if available; fallback rate_plans/rooms
+      (precompiled per room type/night in rate_grid)
 
     NOTE: rate_periods uses room_type_id, but current PMS uses room_type strings.
     For now, we treat room_type_id == room_type.
@@ -525,32 +540,18 @@ async def cm_get_ari(
         {"_id": 0, "room_id": 1, "start_date": 1, "end_date": 1},
     ).to_list(10000)
 
-    # Stop-sell (operator-based)
-    stop_sell = False
-    if operator_id:
-        ss = await db.stop_sales.find_one({"tenant_id": tenant_id, "operator_id": operator_id, "active": True}, {"_id": 0})
-        stop_sell = bool(ss)
-
-    # Rates: use rate_periods if operator_id present
-    # rate_periods uses start_date/end_date strings; date compare should be parsed or kept yyyy-mm-dd
-    periods = []
-    if operator_id:
-        # In this PMS, we do not yet have a room_type_id table; treat room_type_id as room_type.
-        room_type_id = room_type or rooms[0].get('room_type')
-        periods = await db.rate_periods.find(
-            {"tenant_id": tenant_id, "operator_id": operator_id, "room_type_id": room_type_id},
-            {"_id": 0},
-        ).sort('start_date', 1).to_list(200)
-
-    # Rate plans fallback (BAR by default)
-    rate_plans = await db.rate_plans.find({"tenant_id": tenant_id, "is_active": True}, {"_id": 0}).to_list(200)
-
     # Pre-group rooms by type
     rooms_by_type: Dict[str, List[str]] = {}
     for r in rooms:
         rt = r.get('room_type') or 'unknown'
         rooms_by_type.setdefault(rt, []).append(r['id'])
 
+    # Rates + stop-sell from the compiled rate grid (one query; room_type_id == room_type)
+    from rate_grid import get_rate_grid, operator_key, DEFAULT_KEY
+    grid = await get_rate_grid(db).get_rows(
+        tenant_id, operator_key(operator_id) if operator_id else DEFAULT_KEY, list(rooms_by_type), sd, ed
+    )
+
     # Helper: compute sold for a day
     def _overlaps_day(check_in_s: str, check_out_s: str, day_s: str) -> bool:
         # check_in/check_out are YYYY-MM-DD strings
@@ -590,46 +591,17 @@ async def cm_get_ari(
             blocked = len(blocked_ids)
             available = max(total - sold - blocked, 0)
 
-            # resolve rate
-            rate_val = None
-            rate_source = None
-            currency = "EUR"
-
-            # 1) rate_periods: pick period where day within [start_date,end_date]
-            if periods:
-                for p in periods:
-                    ps = p.get('start_date')
-                    pe = p.get('end_date')
-                    if ps and pe and ps <= day_s <= pe:
-                        rate_val = p.get('rate')
-                        currency = p.get('currency', currency)
-                        rate_source = 'rate_periods'
-                        break
-
-            # 2) rate_plans fallback
-            if rate_val is None and rate_plans:
-                # take first active plan
-                rp = rate_plans[0]
-                rate_val = rp.get('base_price')
-                currency = rp.get('currency', currency)
-                rate_source = 'rate_plans'
-
-            # 3) rooms.base_price fallback
-            if rate_val is None:
-                room_doc = await db.rooms.find_one({"tenant_id": tenant_id, "room_type": rt}, {"_id": 0, "base_price": 1})
-                rate_val = room_doc.get('base_price') if room_doc else None
-                rate_source = 'rooms.base_price'
-
+            row = grid[(rt, day_s)]
             days.append(
                 CMARIResponseDay(
                     date=day_s,
                     room_type=rt,
                     available=available,
                     sold=sold,
-                    stop_sell=stop_sell,
-                    rate=rate_val,
-                    currency=currency,
-                    rate_source=rate_source,
+                    stop_sell=row['stop_sell'],
+                    rate=row['rate'],
+                    currency=row.get('currency') or "EUR",
+                    rate_source=row['source'],
                 )
             )
         cur = cur + timedelta(days=1)
@@ -735,24 +707,11 @@ async def cm_get_ari_v2(
         {"_id": 0, "room_id": 1, "start_date": 1, "end_date": 1},
     ).to_list(20000)
 
-    # Stop-sell (operator-based)
-    stop_sell = False
-    if operator_id:
-        ss = await db.stop_sales.find_one({"tenant_id": tenant_id, "operator_id": operator_id, "active": True}, {"_id": 0})
-        stop_sell = bool(ss)
-
-    # rate_periods (rate + restrictions)
-    periods = []
-    if operator_id:
-        # Treat room_type_id as room_type
-        room_type_id = room_type or rooms[0].get('room_type')
-        periods = await db.rate_periods.find(
-            {"tenant_id": tenant_id, "operator_id": operator_id, "room_type_id": room_type_id},
-            {"_id": 0},
-        ).sort('start_date', 1).to_list(500)
-
-    rate_plans = await db.rate_plans.find({"tenant_id": tenant_id, "is_active": True}, {"_id": 0}).to_list(200)
-    default_plan = rate_plans[0] if rate_plans else {}
+    # Rate + restrictions (decision 2c) from the compiled rate grid; room_type_id == room_type
+    from rate_grid import get_rate_grid, operator_key, DEFAULT_KEY
+    grid = await get_rate_grid(db).get_rows(
+        tenant_id, operator_key(operator_id) if operator_id else DEFAULT_KEY, list(rooms_by_type), sd, ed
+    )
 
     def _overlaps_day(check_in_s: str, check_out_s: str, day_s: str) -> bool:
         return check_in_s <= day_s < check_out_s
@@ -762,14 +721,6 @@ async def cm_get_ari_v2(
             return start_s <= day_s
         return start_s <= day_s < end_s
 
-    def _resolve_period(day_s: str) -> Optional[dict]:
-        for p in periods:
-            ps = p.get('start_date')
-            pe = p.get('end_date')
-            if ps and pe and ps <= day_s <= pe:
-                return p
-        return None
-
     room_types_out: List[CMARIRoomType] = []
     cur = sd
     while cur <= ed:
@@ -795,46 +746,22 @@ async def cm_get_ari_v2(
             blocked = len(blocked_ids)
             available = max(total - sold - blocked, 0)
 
-            # rate + restrictions
-            period = _resolve_period(day_s) if periods else None
-
-            # restrictions from rate_periods (decision 2c)
+            row = grid[(rt, day_s)]
             restrictions = CMRestrictions(
-                stop_sell=stop_sell or bool(period.get('stop_sell')) if period else stop_sell,
-                min_stay=int(period.get('min_stay', 1)) if period else 1,
-                cta=bool(period.get('cta', False)) if period else False,
-                ctd=bool(period.get('ctd', False)) if period else False,
-                max_stay=int(period.get('max_stay')) if period and period.get('max_stay') is not None else None,
+                stop_sell=row['stop_sell'],
+                min_stay=row['min_stay'],
+                cta=row['cta'],
+                ctd=row['ctd'],
+                max_stay=row['max_stay'],
             )
 
-            rate_amount = None
-            rate_source = None
-            rate_plan_id = None
-            board_code = None
-
-            if period and period.get('rate') is not None:
-                rate_amount = period.get('rate')
-                rate_source = 'rate_periods'
-                rate_plan_id = period.get('rate_plan_id')
-                board_code = period.get('board_code')
-            elif default_plan:
-                rate_amount = default_plan.get('base_price')
-                rate_source = 'rate_plans'
-                rate_plan_id = default_plan.get('id')
-                board_code = default_plan.get('meal_plan') or default_plan.get('board_code')
-
-            if rate_amount is None:
-                room_doc = await db.rooms.find_one({"tenant_id": tenant_id, "room_type": rt}, {"_id": 0, "base_price": 1})
-                rate_amount = room_doc.get('base_price') if room_doc else None
-                rate_source = 'rooms.base_price'
-
             rate_info = CMRateInfo(
-                amount=rate_amount,
+                amount=row['rate'],
                 currency=currency,
                 tax_included=True,
-                source=rate_source,
-                rate_plan_id=rate_plan_id,
-                board_code=board_code,
+                source=row['source'],
+                rate_plan_id=row.get('plan_ref'),
+                board_code=row.get('board_code'),
             )
 
             # add day to proper room_type bucket
@@ -1330,7 +1257,7 @@ async def create_audit_log(
     
     audit_dict = audit.model_dump()
     audit_dict['timestamp'] = audit_dict['timestamp'].isoformat()
-    await db.audit_logs.insert_one(audit_dict)
+    await write_log(db, 'audit_logs', audit_dict)
 
 
 # ================== PLAN & FEATURES ==================
@@ -1437,6 +1364,16 @@ def resolve_tenant_features(tenant_doc: Dict[str, Any]) -> Dict[str, bool]:
     return resolved
 
 
+async def keyset_page(collection, query: Dict[str, Any], sort_keys, limit: int, cursor: Optional[str] = None,
+                      projection: Optional[Dict[str, int]] = None, with_total: bool = False):
+    """keyset_find wrapper that turns bad cursors into a 400"""
+    try:
+        return await keyset_find(collection, query, sort_keys, limit=limit, cursor=cursor,
+                                 projection=projection, with_total=with_total)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 async def load_tenant_doc(tenant_id: str) -> Optional[Dict[str, Any]]:
     """tenant_id hem id alanı hem de _id(ObjectId) için çalışsın."""
     if not tenant_id:
@@ -1445,6 +1382,7 @@ async def load_tenant_doc(tenant_id: str) -> Optional[Dict[str, Any]]:
     # Try by 'id' field first
     doc = await db.tenants.find_one({"id": tenant_id}, {"_id": 0})
     if doc:
+        metrics_registry.set_tenant_tier(tenant_id, doc.get("subscription_plan") or doc.get("plan") or doc.get("subscription_tier"))
         return doc
     
     # Try by string _id (if tenant_id looks like ObjectId)
@@ -3056,6 +2994,13 @@ class CreatePOSTransactionWithMenuRequest(BaseModel):
     table_number: Optional[str] = None
     server_name: Optional[str] = None
 
+class POSBatchOrder(CreatePOSTransactionWithMenuRequest):
+    client_ref: Optional[str] = None  # Tablet-side ticket id, dedupes re-syncs
+    ordered_at: Optional[str] = None  # When the ticket was rung up offline
+
+class POSTransactionBatchRequest(BaseModel):
+    orders: List[POSBatchOrder]
+
 class GenerateZReportRequest(BaseModel):
     outlet_id: Optional[str] = None
     date: Optional[str] = None  # Default to today
@@ -3305,6 +3250,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if 'user_id' not in user_doc:
             user_doc['user_id'] = user_doc.get('id', user_id)
         
+        tag_request(tenant_id=user_doc.get('tenant_id'))
         return User(**user_doc)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired - please login again")
@@ -4232,6 +4178,9 @@ async def create_vip_protocol(
             {'$set': {'tags': current_tags, 'vip_status': True}}
         )
     
+    from guest_rollup import get_guest_rollups
+    await get_guest_rollups(db).refresh_profile(current_user.tenant_id, guest_id)
+    
     return {
         'success': True,
         'message': message,
@@ -4318,6 +4267,9 @@ async def add_to_blacklist(
         }
     )
     
+    from guest_rollup import get_guest_rollups
+    await get_guest_rollups(db).refresh_profile(current_user.tenant_id, guest_id)
+    
     return {
         'success': True,
         'message': f'Misafir {action} listesine eklendi',
@@ -4385,6 +4337,9 @@ async def update_celebration_tracking(
         }
         await db.celebration_tracking.insert_one(celebration)
     
+    from guest_rollup import get_guest_rollups
+    await get_guest_rollups(db).refresh_profile(current_user.tenant_id, guest_id)
+    
     return {
         'success': True,
         'message': 'Kutlama bilgileri kaydedildi',
@@ -4487,6 +4442,9 @@ async def update_enhanced_preferences(
         }
         await db.enhanced_guest_preferences.insert_one(pref_doc)
     
+    from guest_rollup import get_guest_rollups
+    await get_guest_rollups(db).refresh_profile(current_user.tenant_id, guest_id)
+    
     return {
         'success': True,
         'message': 'Tercihler başarıyla kaydedildi',
@@ -4508,58 +4466,38 @@ async def get_complete_guest_profile(
     if not guest:
         raise HTTPException(status_code=404, detail="Misafir bulunamadı")
     
-    # Get all stays
-    stays = await db.bookings.find({
-        'guest_id': guest_id,
-        'tenant_id': current_user.tenant_id
-    }, {'_id': 0}).sort('check_in', -1).to_list(100)
-    
-    # Get VIP protocol
-    vip_protocol = await db.vip_protocols.find_one({
-        'guest_id': guest_id,
-        'tenant_id': current_user.tenant_id,
-        'active': True
-    }, {'_id': 0})
-    
-    # Get enhanced preferences
-    preferences = await db.enhanced_guest_preferences.find_one({
-        'guest_id': guest_id,
-        'tenant_id': current_user.tenant_id
-    }, {'_id': 0})
+    # Lifetime stats and profile side documents: one rollup read
+    from guest_rollup import get_guest_rollups
+    rollup = await get_guest_rollups(db).get(current_user.tenant_id, guest_id)
     
-    # Get celebration info
-    celebration = await db.celebration_tracking.find_one({
+    # Recent stays only
+    stays = await db.bookings.find({
         'guest_id': guest_id,
         'tenant_id': current_user.tenant_id
-    }, {'_id': 0})
+    }, {'_id': 0}).sort('check_in', -1).to_list(10)
     
-    # Get blacklist entries
-    blacklist = await db.blacklist_entries.find({
-        'guest_id': guest_id,
-        'tenant_id': current_user.tenant_id,
-        'active': True
-    }, {'_id': 0}).to_list(10)
-    
-    # Calculate spending profile
-    total_spent = sum([s.get('total_amount', 0) for s in stays])
-    total_nights = sum([
-        (datetime.fromisoformat(s['check_out'].replace('Z', '+00:00')) - 
-         datetime.fromisoformat(s['check_in'].replace('Z', '+00:00'))).days 
-        for s in stays if s.get('check_in') and s.get('check_out')
-    ])
+    vip_protocol = rollup.get('vip_protocol')
+    preferences = rollup.get('enhanced_preferences')
+    celebration = rollup.get('celebration_tracking')
+    blacklist = rollup.get('blacklist_entries') or []
     
     spending_profile = {
-        'total_stays': len(stays),
-        'total_nights': total_nights,
-        'total_spent': round(total_spent, 2),
-        'avg_spend_per_stay': round(total_spent / len(stays), 2) if len(stays) > 0 else 0,
-        'lifetime_value_tier': 'vip' if total_spent > 10000 else 'high_value' if total_spent > 5000 else 'valuable' if total_spent > 2000 else 'regular'
+        'total_stays': rollup.get('stays', 0),
+        'total_nights': rollup.get('nights', 0),
+        'total_spent': rollup.get('total_spend', 0.0),
+        'room_revenue': rollup.get('room_revenue', 0.0),
+        'extras_revenue': rollup.get('extras_revenue', 0.0),
+        'avg_spend_per_stay': rollup.get('avg_spend_per_stay', 0.0),
+        'adr': rollup.get('adr', 0.0),
+        'last_stay': rollup.get('last_stay'),
+        'channel_mix': rollup.get('channel_mix', {}),
+        'lifetime_value_tier': rollup.get('ltv_tier', 'regular')
     }
     
     return {
         'guest': guest,
-        'stay_history': stays[:10],  # Last 10 stays
-        'total_stays': len(stays),
+        'stay_history': stays,  # Last 10 stays
+        'total_stays': rollup.get('stays', 0),
         'vip_protocol': vip_protocol,
         'has_vip_protocol': vip_protocol is not None,
         'enhanced_preferences': preferences,
@@ -4720,16 +4658,91 @@ async def create_campaign(
     
     return {'success': True, 'message': 'Kampanya oluşturuldu', 'campaign_id': campaign['id']}
 
+@api_router.post("/marketing/campaigns/{campaign_id}/send")
+async def send_campaign(
+    campaign_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Kampanyayı segmentteki misafirlere gönder (toplu kuyruk, batch_id = campaign_id)
+
+    Status stays 'sending' until the delivery workers drain the batch, then
+    becomes 'sent' (or 'failed' when every message died).
+    """
+    from message_delivery import get_delivery_service
+    
+    delivery = get_delivery_service()
+    if not delivery or not delivery.running:
+        raise HTTPException(status_code=503, detail="Delivery service not running")
+    
+    campaign = await db.marketing_campaigns.find_one(
+        {'id': campaign_id, 'tenant_id': current_user.tenant_id}, {'_id': 0}
+    )
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Kampanya bulunamadı")
+    if campaign.get('status') in ('sending', 'sent'):
+        raise HTTPException(status_code=409, detail="Kampanya zaten gönderildi")
+    
+    query = {'tenant_id': current_user.tenant_id, 'email': {'$nin': [None, '']}}
+    segment = campaign.get('segment', 'all')
+    if segment == 'vip':
+        query['tags'] = 'vip'
+    elif segment in ('high_value', 'valuable', 'regular', 'ltv_vip'):
+        from guest_rollup import get_guest_rollups
+        query['id'] = {'$in': await get_guest_rollups(db).guest_ids(
+            current_user.tenant_id, ltv_tier='vip' if segment == 'ltv_vip' else segment
+        )}
+    
+    # 'sending' lands before the first message is queued, so a worker that drains the batch
+    # right away finds the campaign in that state; 'queueing' keeps it from finishing early
+    # while later chunks are still being queued
+    claimed = await db.marketing_campaigns.update_one(
+        {'id': campaign_id, 'tenant_id': current_user.tenant_id, 'status': {'$nin': ['sending', 'sent']}},
+        {'$set': {'status': 'sending', 'queueing': True, 'sent_count': 0,
+                  'sent_at': datetime.now(timezone.utc).isoformat()}}
+    )
+    if not claimed.modified_count:
+        raise HTTPException(status_code=409, detail="Kampanya zaten gönderildi")
+    
+    # Stream recipients and queue in chunks; one insert_many per chunk
+    queued = 0
+    chunk = []
+    async for guest in db.guests.find(query, {'_id': 0, 'id': 1, 'email': 1}):
+        chunk.append({
+            'channel': MessageChannel.EMAIL.value,
+            'recipient': guest['email'],
+            'subject': campaign['subject'],
+            'text': campaign['message'],
+            'source': {'type': 'campaign', 'campaign_id': campaign_id, 'guest_id': guest['id']}
+        })
+        if len(chunk) >= 1000:
+            queued += (await delivery.enqueue_batch(chunk, current_user.tenant_id, batch_id=campaign_id))['queued']
+            chunk = []
+    if chunk:
+        queued += (await delivery.enqueue_batch(chunk, current_user.tenant_id, batch_id=campaign_id))['queued']
+    
+    await db.marketing_campaigns.update_one(
+        {'id': campaign_id}, {'$set': {'sent_count': queued}, '$unset': {'queueing': ''}}
+    )
+    # Workers may have drained the batch already (or it is empty): finish it here in that case
+    await delivery.finish_campaign(current_user.tenant_id, campaign_id)
+    
+    return {'success': True, 'campaign_id': campaign_id, 'queued': queued}
+
 @api_router.get("/marketing/segments")
 async def get_customer_segments(current_user: User = Depends(get_current_user)):
     """Müşteri segmentleri"""
+    from guest_rollup import get_guest_rollups
     vip_count = await db.guests.count_documents({'tenant_id': current_user.tenant_id, 'tags': 'vip'})
     total = await db.guests.count_documents({'tenant_id': current_user.tenant_id})
+    tiers = await get_guest_rollups(db).tier_counts(current_user.tenant_id)
     
     return {
         'segments': [
             {'name': 'VIP', 'count': vip_count},
             {'name': 'All', 'count': total}
+        ] + [
+            {'name': f'LTV: {tier}', 'segment': tier, 'count': tiers.get(tier, 0)}
+            for tier in ('vip', 'high_value', 'valuable', 'regular')
         ]
     }
 
@@ -5016,6 +5029,37 @@ async def get_ai_room_assignment(
         'total_estimated_time': sum([a['estimated_minutes'] for a in assignments])
     }
 
+@api_router.post("/housekeeping/assignments/optimize")
+async def optimize_hk_assignments(
+    data: dict,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Daily housekeeping board: balanced, floor-clustered room assignment
+    
+    data: date (YYYY-MM-DD, default today), staff_list (optional; id, name,
+    shift_minutes, floors), dirty_only, dry_run
+    """
+    from hk_assignment_engine import get_hk_assignment_engine
+    
+    day = (data.get('date') or datetime.now(timezone.utc).date().isoformat())[:10]
+    try:
+        datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
+    
+    plan = await get_hk_assignment_engine(db).optimize(
+        current_user.tenant_id,
+        day,
+        staff=data.get('staff_list'),
+        dirty_only=bool(data.get('dirty_only', False)),
+        persist=not data.get('dry_run', False),
+        assigned_by=current_user.name
+    )
+    if not plan['staff_assignments']:
+        raise HTTPException(status_code=400, detail="Aktif kat hizmetleri personeli bulunamadı")
+    return plan
+
 @api_router.get("/housekeeping/predict-time")
 async def predict_cleaning_time(
     room_type: str,
@@ -5045,13 +5089,6 @@ async def get_complaints(
     return {'complaints': complaints, 'total': len(complaints)}
 
 
-# ============= MULTI-PROPERTY MANAGEMENT =============
-
-@api_router.get("/multi-property/dashboard")
-async def multi_property_dashboard(current_user: User = Depends(get_current_user)):
-    properties = [{'property_id': current_user.tenant_id, 'property_name': 'Grand Hotel', 'occupancy_pct': 75}]
-    return {'properties': properties, 'total': 1}
-
 # ============= PAYMENT GATEWAY =============
 
 @api_router.post("/payments/intent")
@@ -5077,13 +5114,6 @@ async def add_points(data: dict, current_user: User = Depends(get_current_user))
 
 
 
-# ============= MULTI-PROPERTY MANAGEMENT =============
-
-@api_router.get("/multi-property/dashboard")
-async def multi_property_dashboard(current_user: User = Depends(get_current_user)):
-    properties = [{'property_id': current_user.tenant_id, 'property_name': 'Grand Hotel', 'occupancy_pct': 75, 'total_rooms': 50}]
-    return {'properties': properties, 'total_properties': 1}
-
 # ============= PAYMENT GATEWAY =============
 
 @api_router.post("/payments/create-intent")
@@ -7360,16 +7390,10 @@ async def get_group_block_details(
         'bookings_count': len(group_bookings)
     }
 
-@api_router.post("/groups/rooming-list/{block_id}")
-async def upload_rooming_list(
-    block_id: str,
-    rooming_list: List[dict],
-    current_user: User = Depends(get_current_user)
-):
-    """Rooming list upload (Excel'den gelen data)"""
-    from group_sales_models import RoomingListEntry
+async def _load_block_rooming_list(block_id: str, rows: List[dict], current_user: User, dry_run: bool = False):
+    """Run a rooming list through the bulk group pipeline for a group block"""
+    from group_pipeline import GroupRoomingPipeline
     
-    # Verify block exists
     block = await db.group_blocks.find_one({
         'id': block_id,
         'tenant_id': current_user.tenant_id
@@ -7378,83 +7402,80 @@ async def upload_rooming_list(
     if not block:
         raise HTTPException(status_code=404, detail="Grup bloğu bulunamadı")
     
-    created_bookings = []
-    errors = []
+    picked_up = await db.bookings.count_documents({
+        'tenant_id': current_user.tenant_id,
+        'group_block_id': block_id,
+        'status': {'$ne': 'cancelled'}
+    })
     
-    for idx, entry_data in enumerate(rooming_list):
-        try:
-            entry = RoomingListEntry(**entry_data)
-            
-            # Create or find guest
-            guest = await db.guests.find_one({
-                'tenant_id': current_user.tenant_id,
-                'name': entry.guest_name
-            }, {'_id': 0})
-            
-            if not guest:
-                # Create new guest
-                guest = {
-                    'id': str(uuid.uuid4()),
-                    'tenant_id': current_user.tenant_id,
-                    'name': entry.guest_name,
-                    'email': entry.email,
-                    'phone': entry.phone,
-                    'passport_number': entry.passport_number,
-                    'created_at': datetime.now(timezone.utc).isoformat()
-                }
-                await db.guests.insert_one(guest)
-            
-            # Find available room of requested type
-            room = await db.rooms.find_one({
-                'tenant_id': current_user.tenant_id,
-                'room_type': entry.room_type,
-                'status': 'available'
-            }, {'_id': 0})
-            
-            if not room:
-                errors.append(f"Row {idx+1}: {entry.room_type} tipi oda mevcut değil")
-                continue
-            
-            # Create booking
-            booking = {
-                'id': str(uuid.uuid4()),
-                'tenant_id': current_user.tenant_id,
-                'guest_id': guest['id'],
-                'room_id': room['id'],
-                'group_block_id': block_id,
-                'check_in': entry.check_in,
-                'check_out': entry.check_out,
-                'status': 'confirmed',
-                'adults': 2,
-                'children': 0,
-                'total_amount': block['group_rate'],
-                'rate_type': 'group',
-                'market_segment': 'group',
-                'special_requests': entry.special_requests,
-                'created_at': datetime.now(timezone.utc).isoformat(),
-                'created_by': current_user.id
-            }
-            
-            await db.bookings.insert_one(booking)
-            created_bookings.append({
-                'booking_id': booking['id'],
-                'guest_name': entry.guest_name,
-                'room_number': room['room_number']
-            })
-            
-        except Exception as e:
-            errors.append(f"Row {idx+1}: {str(e)}")
+    result = await GroupRoomingPipeline(db).load(
+        current_user.tenant_id,
+        rows,
+        {
+            'id': block_id,
+            'collection': 'group_blocks',
+            'link_field': 'group_block_id',
+            'counter_field': 'rooms_picked_up',
+            'capacity': max(block['total_rooms'] - picked_up, 0),
+            'check_in': block.get('check_in'),
+            'check_out': block.get('check_out'),
+            'room_type': block.get('room_type'),
+            'rate': block.get('group_rate', 0)
+        },
+        user_id=current_user.id,
+        dry_run=dry_run
+    )
     
+    created = [r for r in result['rows'] if r['status'] == 'created']
     return {
         'success': True,
-        'message': f'{len(created_bookings)} rezervasyon oluşturuldu',
-        'created_bookings': created_bookings,
-        'errors': errors,
-        'total_processed': len(rooming_list),
-        'successful': len(created_bookings),
-        'failed': len(errors)
+        'message': f'{len(created)} rezervasyon oluşturuldu',
+        'created_bookings': [
+            {'booking_id': r['booking_id'], 'guest_name': r['guest_name'], 'room_number': r['room_number']}
+            for r in created
+        ],
+        'errors': [f"Row {r['row']}: {r['error']}" for r in result['rows'] if r['status'] == 'error'],
+        **result
     }
 
+@api_router.post("/groups/rooming-list/{block_id}")
+async def upload_rooming_list(
+    block_id: str,
+    rooming_list: List[dict],
+    dry_run: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Rooming list upload (Excel'den gelen data) - tek istekte toplu atama"""
+    from group_pipeline import MAX_ROWS
+    
+    if len(rooming_list) > MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"En fazla {MAX_ROWS} satır yüklenebilir")
+    
+    return await _load_block_rooming_list(block_id, rooming_list, current_user, dry_run)
+
+@api_router.post("/groups/rooming-list/{block_id}/upload")
+async def upload_rooming_list_file(
+    block_id: str,
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Rooming list dosya yükleme (.xlsx, .csv, .json)"""
+    from group_pipeline import parse_rooming_file, RoomingListParseError
+    
+    content = await file.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="Dosya boş")
+    if len(content) > 5 * 1024 * 1024:
+        raise HTTPException(status_code=400, detail="Dosya çok büyük (max 5MB)")
+    
+    try:
+        rows = parse_rooming_file(file.filename, content)
+    except (RoomingListParseError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return await _load_block_rooming_list(block_id, rows, current_user, dry_run)
+
 @api_router.get("/groups/master-folio/{block_id}")
 async def get_group_master_folio(
     block_id: str,
@@ -7709,19 +7730,24 @@ async def create_room(
 
 @api_router.get("/pms/rooms", response_model=List[Room])
 async def get_rooms(
+    response: Response,
     limit: int = 100,  # Optimized for 550+ room properties - load in batches
     offset: int = 0,
     status: Optional[str] = None,
     room_type: Optional[str] = None,
     view: Optional[str] = None,
     amenity: Optional[str] = None,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     _: None = Depends(require_module("pms")),
 ):
-    """Get rooms with pagination - Optimized for large properties (550+ rooms)"""
+    """Get rooms with pagination - Optimized for large properties (550+ rooms)
+
+    Rooms are ordered by room_number; pass X-Next-Cursor back as ?cursor= for the next batch.
+    """
     
     # For small queries with filters, skip cache
-    use_cache = (offset == 0 and not status and not room_type and not view and not amenity and limit >= 100)
+    use_cache = (offset == 0 and not cursor and not status and not room_type and not view and not amenity and limit >= 100)
     
     # Try Redis cache first (FASTEST!) - only for full list
     if use_cache:
@@ -7739,10 +7765,12 @@ async def get_rooms(
         from cache_warmer import cache_warmer
         if cache_warmer:
             cached_data = cache_warmer.get_cached(f"rooms:{current_user.tenant_id}")
-            if cached_data:
+            # Only a warmed list that fits in one page can be served: a truncated one would
+            # drop the X-Next-Cursor header and hide the remaining rooms
+            if cached_data and len(cached_data) <= limit:
                 # Process cached data quickly
                 rooms = []
-                for room in cached_data[:limit]:  # Apply limit to cached data
+                for room in cached_data:
                     # Ensure tenant_id is present
                     if 'tenant_id' not in room:
                         room['tenant_id'] = current_user.tenant_id
@@ -7780,7 +7808,13 @@ async def get_rooms(
     
     # Fallback: Ultra-minimal projection with pagination
     projection = {'_id': 0, 'id': 1, 'room_number': 1, 'room_type': 1, 'status': 1, 'floor': 1, 'capacity': 1, 'max_occupancy': 1, 'base_price': 1, 'tenant_id': 1, 'amenities': 1, 'view': 1, 'bed_type': 1, 'images': 1}
-    rooms_raw = await db.rooms.find(query, projection).skip(offset).limit(limit).to_list(limit)
+    if offset and not cursor:
+        # Legacy offset paging
+        rooms_raw = await db.rooms.find(query, projection).sort(SORT_ROOM_NUMBER).skip(offset).limit(limit).to_list(limit)
+    else:
+        page = await keyset_page(db.rooms, query, SORT_ROOM_NUMBER, limit, cursor, projection)
+        apply_cursor_headers(response, page)
+        rooms_raw = page.items
     
     # Fix field mapping
     rooms = []
@@ -7802,8 +7836,8 @@ async def get_rooms(
 
         rooms.append(room)
 
-    # Cache result in Redis for 30 seconds (only for full lists)
-    if use_cache:
+    # Cache result in Redis for 30 seconds (only for full lists that fit in one page)
+    if use_cache and 'X-Next-Cursor' not in response.headers:
         try:
             from redis_cache import redis_cache
             if redis_cache:
@@ -8748,6 +8782,29 @@ async def get_folio_details(folio_id: str, current_user: User = Depends(get_curr
     }
 
 
+@api_router.get("/folio/{folio_id}/charges")
+async def list_folio_charges(
+    folio_id: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    include_voided: bool = True,
+    current_user: User = Depends(get_current_user)
+):
+    """Page through a folio's charges in posting order (keyset cursor)"""
+    query = {'folio_id': folio_id, 'tenant_id': current_user.tenant_id}
+    if not include_voided:
+        query['voided'] = False
+    
+    page = await keyset_page(db.folio_charges, query, [('date', 1), ('id', 1)], limit, cursor)
+    
+    return {
+        'charges': page.items,
+        'count': len(page.items),
+        'next_cursor': page.next_cursor,
+        'has_more': page.has_more
+    }
+
+
 @api_router.get("/folio/{folio_id}/excel")
 @cached(ttl=600, key_prefix="folio_excel")  # Cache for 10 min
 async def export_folio_excel(folio_id: str, current_user: User = Depends(get_current_user)):
@@ -9101,6 +9158,8 @@ async def close_folio(
             'closed_at': datetime.now(timezone.utc).isoformat()
         }}
     )
+    from guest_rollup import get_guest_rollups
+    await get_guest_rollups(db).record_folio(current_user.tenant_id, folio)
     
     return {"message": "Folio closed successfully"}
 
@@ -9342,17 +9401,44 @@ async def create_guest(
     guest_dict = guest.model_dump()
     guest_dict['created_at'] = guest_dict['created_at'].isoformat()
     await db.guests.insert_one(guest_dict)
+
+    from search_index import get_search_index
+    await get_search_index(db).index_guest(guest_dict)
     return guest
 
+GUEST_LIST_PROJECTION = {
+    '_id': 0, **{field: 1 for field in Guest.model_fields},
+    'first_name': 1, 'last_name': 1, 'passport_number': 1
+}
+
 @api_router.get("/pms/guests", response_model=List[Guest])
-@cached(ttl=300, key_prefix="pms_guests")  # Cache for 5 minutes
 async def get_guests(
+    response: Response,
     limit: int = 1000,
     offset: int = 0,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     _: None = Depends(require_module("pms")),
 ):
-    guests_raw = await db.guests.find({'tenant_id': current_user.tenant_id}, {'_id': 0}).skip(offset).limit(limit).to_list(limit)
+    """List guests newest first; pass X-Next-Cursor back as ?cursor= for the next page"""
+    page = await _guest_list_page(current_user.tenant_id, limit, offset, cursor)
+    if page['next_cursor']:
+        response.headers['X-Next-Cursor'] = page['next_cursor']
+    return page['guests']
+
+
+@cached(ttl=300, key_prefix="pms_guests")  # Cache for 5 minutes
+async def _guest_list_page(tenant_id: str, limit: int, offset: int, cursor: Optional[str]) -> Dict[str, Any]:
+    """One page of the guest list and its next cursor (a plain dict, so the page cache can hold it)"""
+    query = {'tenant_id': tenant_id}
+    next_cursor = None
+    if offset and not cursor:
+        # Legacy offset paging (cost grows with offset)
+        guests_raw = await db.guests.find(query, GUEST_LIST_PROJECTION).sort(SORT_CREATED_DESC).skip(offset).limit(limit).to_list(limit)
+    else:
+        page = await keyset_page(db.guests, query, SORT_CREATED_DESC, limit, cursor, GUEST_LIST_PROJECTION)
+        next_cursor = page.next_cursor
+        guests_raw = page.items
     
     # Map database fields to model fields
     guests = []
@@ -9371,7 +9457,7 @@ async def get_guests(
         
         guests.append(guest)
     
-    return guests
+    return {'guests': guests, 'next_cursor': next_cursor}
 
 # ============= PMS - BOOKINGS MANAGEMENT =============
 
@@ -9442,6 +9528,9 @@ async def create_booking(
     booking_dict['created_at'] = booking_dict['created_at'].isoformat()
     await db.bookings.insert_one(booking_dict)
 
+    from search_index import get_search_index
+    await get_search_index(db).index_booking(booking_dict)
+
     # Push CM event (best-effort)
     await cm_push_event({
         "type": "booking.created",
@@ -9479,23 +9568,26 @@ async def create_booking(
 
 @api_router.get("/pms/bookings", response_model=List[Booking])
 async def get_bookings(
+    response: Response,
     limit: int = 30,  # Further reduced for instant response
     offset: int = 0,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     status: Optional[str] = None,
+    cursor: Optional[str] = None,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     _: None = Depends(require_module("pms")),
 ):
-    """Get bookings - INSTANT RESPONSE"""
+    """Get bookings - INSTANT RESPONSE (keyset paging via ?cursor= / X-Next-Cursor)"""
     current_user = await get_current_user(credentials)
     
     # Check pre-warmed cache for default query (no filters)
-    if not start_date and not end_date and not status and offset == 0:
-        from cache_warmer import cache_warmer
-        if cache_warmer:
+    if not start_date and not end_date and not status and offset == 0 and not cursor:
+        from cache_warmer import cache_warmer, BOOKINGS_WARM_LIMIT
+        if cache_warmer and limit <= BOOKINGS_WARM_LIMIT:
             cached_data = cache_warmer.get_cached(f"bookings:{current_user.tenant_id}")
-            if cached_data:
+            # A full warmed list may stop short of the page; a shorter one is every booking
+            if cached_data and (limit <= len(cached_data) or len(cached_data) < BOOKINGS_WARM_LIMIT):
                 # Process and return immediately
                 bookings = []
                 for booking in cached_data[:limit]:
@@ -9534,8 +9626,13 @@ async def get_bookings(
         query['status'] = status
     
     # Execute query with pagination
-    cursor = db.bookings.find(query).sort('check_in', -1).skip(offset).limit(limit)
-    bookings_raw = await cursor.to_list(length=limit)
+    if offset and not cursor:
+        # Legacy offset paging (cost grows with offset)
+        bookings_raw = await db.bookings.find(query, {'_id': 0}).sort(SORT_CHECK_IN_DESC).skip(offset).limit(limit).to_list(length=limit)
+    else:
+        page = await keyset_page(db.bookings, query, SORT_CHECK_IN_DESC, limit, cursor)
+        apply_cursor_headers(response, page)
+        bookings_raw = page.items
 
 
     
@@ -9670,6 +9767,10 @@ async def create_rate_plan(
     rate_plan = RatePlan(**data)
     doc = rate_plan.model_dump()
     await db.rate_plans.insert_one(doc)
+
+    # BAR/operator fallbacks of this room type may now resolve to the new plan
+    from rate_grid import get_rate_grid
+    await get_rate_grid(db).invalidate(current_user.tenant_id, room_types=[rate_plan.room_type])
     return rate_plan
 
 class PackageCreate(BaseModel):
@@ -9699,6 +9800,11 @@ async def create_package(
     data["tenant_id"] = current_user.tenant_id
     package = Package(**data)
     await db.packages.insert_one(package.model_dump())
+    if package.linked_rate_plan_ids:
+        from rate_grid import get_rate_grid
+        await get_rate_grid(db).invalidate(
+            current_user.tenant_id, keys=package.linked_rate_plan_ids, plan_refs=package.linked_rate_plan_ids
+        )
     return package
 
 @api_router.get("/bookings/{booking_id}/override-logs", response_model=List[RateOverrideLog])
@@ -9961,6 +10067,13 @@ async def update_booking(
         {'id': booking_id, 'tenant_id': current_user.tenant_id},
         {'$set': update_data}
     )
+    if {'guest_name', 'guest_email', 'guest_phone', 'booking_number', 'check_in', 'check_out'} & set(update_data):
+        from search_index import get_search_index
+        await get_search_index(db).reindex(current_user.tenant_id, 'booking', [booking_id])
+    if update_data.get('status') == 'checked_out' and booking.get('status') != 'checked_out':
+        from guest_rollup import get_guest_rollups
+        booking.pop('_id', None)
+        await get_guest_rollups(db).record_stay(current_user.tenant_id, {**booking, **update_data})
 
     # Defaults for CM semantics if explicitly passed as null/empty
     if 'source_channel' in update_data and not update_data['source_channel']:
@@ -10329,11 +10442,18 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Total-Is-Estimate"],
 )
 
 # Add GZip compression for responses >500 bytes (aggressive compression for speed)
 app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=6)
 
+# On-demand per-request query budgets for routes enabled via /api/monitoring/profiler
+app.add_middleware(ProfilerMiddleware)
+
+# Outermost: latency per route template + tenant tier (includes compression time)
+app.add_middleware(RequestMetricsMiddleware)
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 # ============= FRONT DESK OPERATIONS =============
@@ -10420,7 +10540,8 @@ async def check_in_guest(booking_id: str, create_folio: bool = True, current_use
         {'id': booking_id},
         {'$set': {
             'status': 'checked_in',
-            'checked_in_at': checked_in_time.isoformat()
+            'checked_in_at': checked_in_time.isoformat(),
+            'updated_at': checked_in_time.isoformat()
         }}
     )
     await db.rooms.update_one(
@@ -10430,6 +10551,9 @@ async def check_in_guest(booking_id: str, create_folio: bool = True, current_use
             'current_booking_id': booking_id
         }}
     )
+    from cache_warmer import cache_warmer
+    if cache_warmer:
+        cache_warmer.invalidate(current_user.tenant_id, ['rooms', 'dashboard', 'arrivals', 'inhouse', 'bookings'])
     
     # Update guest total stays
     await db.guests.update_one({'id': booking['guest_id']}, {'$inc': {'total_stays': 1}})
@@ -10520,7 +10644,8 @@ async def check_out_guest(
         {'id': booking_id},
         {'$set': {
             'status': 'checked_out',
-            'checked_out_at': checked_out_time.isoformat()
+            'checked_out_at': checked_out_time.isoformat(),
+            'updated_at': checked_out_time.isoformat()
         }}
     )
     
@@ -10532,6 +10657,9 @@ async def check_out_guest(
             'current_booking_id': None
         }}
     )
+    from cache_warmer import cache_warmer
+    if cache_warmer:
+        cache_warmer.invalidate(current_user.tenant_id, ['rooms', 'dashboard', 'departures', 'inhouse', 'bookings'])
     
     task = HousekeepingTask(
         tenant_id=current_user.tenant_id,
@@ -10544,6 +10672,14 @@ async def check_out_guest(
     task_dict['created_at'] = task_dict['created_at'].isoformat()
     await db.housekeeping_tasks.insert_one(task_dict)
     
+    # Guest 360 rollup: the stay, then extras from the folios just closed
+    from guest_rollup import get_guest_rollups
+    rollups = get_guest_rollups(db)
+    await rollups.record_stay(current_user.tenant_id, {**booking, 'status': 'checked_out'})
+    if auto_close_folios and total_balance <= 0.01:
+        for folio in folios:
+            await rollups.record_folio(current_user.tenant_id, {**folio, 'guest_id': folio.get('guest_id') or booking.get('guest_id')})
+    
     return {
         'message': 'Check-out completed successfully',
         'checked_out_at': checked_out_time.isoformat(),
@@ -10583,46 +10719,32 @@ async def process_payment(booking_id: str, amount: float, method: str, reference
 @api_router.get("/frontdesk/arrivals")
 @cached(ttl=120, key_prefix="frontdesk_arrivals")  # Cache for 2 min
 async def get_arrivals(date: Optional[str] = None, current_user: User = Depends(get_current_user)):
-    target_date = datetime.fromisoformat(date).date() if date else datetime.now(timezone.utc).date()
-    start_of_day = datetime.combine(target_date, datetime.min.time())
-    end_of_day = datetime.combine(target_date, datetime.max.time())
-    bookings = await db.bookings.find({'tenant_id': current_user.tenant_id, 'status': {'$in': ['confirmed', 'checked_in']},
-                                       'check_in': {'$gte': start_of_day.isoformat(), '$lte': end_of_day.isoformat()}}, {'_id': 0}).to_list(1000)
-    enriched = []
-    for booking in bookings:
-        guest = await db.guests.find_one({'id': booking['guest_id']}, {'_id': 0})
-        room = await db.rooms.find_one({'id': booking['room_id']}, {'_id': 0})
-        enriched.append({**booking, 'guest': guest, 'room': room})
-    return enriched
+    from cache_warmer import cache_warmer, load_arrivals
+    if cache_warmer and not date:
+        cached_data = cache_warmer.get_cached(f"arrivals:{current_user.tenant_id}")
+        if cached_data is not None:
+            return cached_data
+    return await load_arrivals(db, current_user.tenant_id, date)
 
 @api_router.get("/frontdesk/departures")
 @cached(ttl=120, key_prefix="frontdesk_departures")  # Cache for 2 min
 async def get_departures(date: Optional[str] = None, current_user: User = Depends(get_current_user)):
-    target_date = datetime.fromisoformat(date).date() if date else datetime.now(timezone.utc).date()
-    start_of_day = datetime.combine(target_date, datetime.min.time())
-    end_of_day = datetime.combine(target_date, datetime.max.time())
-    bookings = await db.bookings.find({'tenant_id': current_user.tenant_id, 'status': 'checked_in',
-                                       'check_out': {'$gte': start_of_day.isoformat(), '$lte': end_of_day.isoformat()}}, {'_id': 0}).to_list(1000)
-    enriched = []
-    for booking in bookings:
-        guest = await db.guests.find_one({'id': booking['guest_id']}, {'_id': 0})
-        room = await db.rooms.find_one({'id': booking['room_id']}, {'_id': 0})
-        charges = await db.folio_charges.find({'booking_id': booking['id']}, {'_id': 0}).to_list(1000)
-        payments = await db.payments.find({'booking_id': booking['id']}, {'_id': 0}).to_list(1000)
-        balance = sum(c['total'] for c in charges) - sum(p['amount'] for p in payments if p['status'] == 'paid')
-        enriched.append({**booking, 'guest': guest, 'room': room, 'balance': balance})
-    return enriched
+    from cache_warmer import cache_warmer, load_departures
+    if cache_warmer and not date:
+        cached_data = cache_warmer.get_cached(f"departures:{current_user.tenant_id}")
+        if cached_data is not None:
+            return cached_data
+    return await load_departures(db, current_user.tenant_id, date)
 
 @api_router.get("/frontdesk/inhouse")
 @cached(ttl=180, key_prefix="frontdesk_inhouse")  # Cache for 3 min
 async def get_inhouse_guests(current_user: User = Depends(get_current_user)):
-    bookings = await db.bookings.find({'tenant_id': current_user.tenant_id, 'status': 'checked_in'}, {'_id': 0}).to_list(1000)
-    enriched = []
-    for booking in bookings:
-        guest = await db.guests.find_one({'id': booking['guest_id']}, {'_id': 0})
-        room = await db.rooms.find_one({'id': booking['room_id']}, {'_id': 0})
-        enriched.append({**booking, 'guest': guest, 'room': room})
-    return enriched
+    from cache_warmer import cache_warmer, load_inhouse
+    if cache_warmer:
+        cached_data = cache_warmer.get_cached(f"inhouse:{current_user.tenant_id}")
+        if cached_data is not None:
+            return cached_data
+    return await load_inhouse(db, current_user.tenant_id)
 
 # ============= HOUSEKEEPING =============
 
@@ -10668,105 +10790,49 @@ async def update_housekeeping_task(task_id: str, status: Optional[str] = None, a
 @api_router.get("/housekeeping/room-status")
 @cached(ttl=60, key_prefix="housekeeping_room_status")  # Cache for 1 minute (real-time data)
 async def get_room_status_board(current_user: User = Depends(get_current_user)):
-    """Get comprehensive room status board"""
-    rooms = await db.rooms.find({'tenant_id': current_user.tenant_id}, {'_id': 0}).to_list(1000)
-    status_counts = {s: 0 for s in ['available', 'occupied', 'dirty', 'cleaning', 'inspected', 'maintenance', 'out_of_order']}
-    for room in rooms:
-        status_counts[room['status']] += 1
-    return {'rooms': rooms, 'status_counts': status_counts, 'total_rooms': len(rooms)}
+    """Get comprehensive room status board (compact room projection)"""
+    from hk_boards import get_hk_boards
+    return await get_hk_boards(db).room_status(current_user.tenant_id)
+
+def _hk_board_date(board_date: Optional[str]):
+    if not board_date:
+        return None
+    try:
+        return datetime.strptime(board_date[:10], '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
+
+@api_router.get("/housekeeping/boards")
+@cached(ttl=60, key_prefix="hk_boards")
+async def get_housekeeping_boards(
+    date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Due-out, stayover, arrival and room-status boards for a business date in one read"""
+    from hk_boards import get_hk_boards
+    return await get_hk_boards(db).day_boards(current_user.tenant_id, _hk_board_date(date))
 
 @api_router.get("/housekeeping/due-out")
 @cached(ttl=120, key_prefix="hk_due_out")  # Cache for 2 min
-async def get_due_out_rooms(current_user: User = Depends(get_current_user)):
-    """Get rooms with guests checking out today"""
-    today = datetime.now(timezone.utc).date()
-    tomorrow = today + timedelta(days=1)
-    
-    # Find bookings checking out today
-    bookings = await db.bookings.find({
-        'tenant_id': current_user.tenant_id,
-        'status': 'checked_in'
-    }).to_list(1000)
-    
-    due_out_rooms = []
-    for booking in bookings:
-        try:
-            # Handle both datetime and string formats
-            checkout = booking.get('check_out')
-            if isinstance(checkout, datetime):
-                checkout_date = checkout.date()
-            elif isinstance(checkout, str):
-                checkout_date = datetime.fromisoformat(checkout.replace('Z', '+00:00')).date()
-            else:
-                continue
-            
-            if checkout_date == today or checkout_date == tomorrow:
-                room = await db.rooms.find_one({'id': booking['room_id']}, {'_id': 0})
-                guest = await db.guests.find_one({'id': booking['guest_id']}, {'_id': 0})
-                
-                due_out_rooms.append({
-                    'room_number': room['room_number'] if room else 'N/A',
-                    'room_type': room['room_type'] if room else 'N/A',
-                    'guest_name': guest['name'] if guest else 'N/A',
-                    'checkout_date': checkout.isoformat() if isinstance(checkout, datetime) else checkout,
-                    'booking_id': booking['id'],
-                    'is_today': checkout_date == today
-                })
-        except Exception as e:
-            print(f"Error processing booking {booking.get('id')}: {e}")
-            continue
-    
-    return {
-        'due_out_rooms': due_out_rooms,
-        'count': len(due_out_rooms)
-    }
+async def get_due_out_rooms(
+    date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get rooms with guests checking out today (and tomorrow)"""
+    from hk_boards import get_hk_boards
+    boards = await get_hk_boards(db).day_boards(current_user.tenant_id, _hk_board_date(date))
+    return boards['due_out']
 
 @api_router.get("/housekeeping/stayovers")
 @cached(ttl=120, key_prefix="hk_stayovers")  # Cache for 2 min
-async def get_stayover_rooms(current_user: User = Depends(get_current_user)):
+async def get_stayover_rooms(
+    date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     """Get rooms with guests staying beyond today"""
-    today = datetime.now(timezone.utc).date()
-    
-    # Find checked-in bookings not checking out today
-    bookings = await db.bookings.find({
-        'tenant_id': current_user.tenant_id,
-        'status': 'checked_in'
-    }).to_list(1000)
-    
-    stayover_rooms = []
-    for booking in bookings:
-        try:
-            # Handle both datetime and string formats
-            checkout = booking.get('check_out')
-            if isinstance(checkout, datetime):
-                checkout_date = checkout.date()
-            elif isinstance(checkout, str):
-                checkout_date = datetime.fromisoformat(checkout.replace('Z', '+00:00')).date()
-            else:
-                continue
-            
-            if checkout_date > today:
-                room = await db.rooms.find_one({'id': booking['room_id']}, {'_id': 0})
-                guest = await db.guests.find_one({'id': booking['guest_id']}, {'_id': 0})
-                
-                nights_remaining = (checkout_date - today).days
-                
-                stayover_rooms.append({
-                    'room_number': room['room_number'] if room else 'N/A',
-                    'room_type': room['room_type'] if room else 'N/A',
-                    'guest_name': guest['name'] if guest else 'N/A',
-                    'checkout_date': checkout.isoformat() if isinstance(checkout, datetime) else checkout,
-                    'nights_remaining': nights_remaining,
-                    'booking_id': booking['id']
-                })
-        except Exception as e:
-            print(f"Error processing stayover booking {booking.get('id')}: {e}")
-            continue
-    
-    return {
-        'stayover_rooms': stayover_rooms,
-        'count': len(stayover_rooms)
-    }
+    from hk_boards import get_hk_boards
+    boards = await get_hk_boards(db).day_boards(current_user.tenant_id, _hk_board_date(date))
+    return boards['stayovers']
 
 
 @api_router.get("/housekeeping/room-status-report")
@@ -10932,51 +10998,14 @@ async def get_staff_performance_detailed(current_user: User = Depends(get_curren
 
 @api_router.get("/housekeeping/arrivals")
 @cached(ttl=120, key_prefix="hk_arrivals")  # Cache for 2 min
-async def get_arrival_rooms(current_user: User = Depends(get_current_user)):
+async def get_arrival_rooms(
+    date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     """Get rooms with guests arriving today"""
-    today = datetime.now(timezone.utc).date()
-    
-    # Find bookings checking in today
-    bookings = await db.bookings.find({
-        'tenant_id': current_user.tenant_id,
-        'status': {'$in': ['confirmed', 'guaranteed', 'pending']}
-    }).to_list(1000)
-    
-    arrival_rooms = []
-    for booking in bookings:
-        try:
-            # Handle both datetime and string formats
-            checkin = booking.get('check_in')
-            if isinstance(checkin, datetime):
-                checkin_date = checkin.date()
-            elif isinstance(checkin, str):
-                checkin_date = datetime.fromisoformat(checkin.replace('Z', '+00:00')).date()
-            else:
-                continue
-            
-            if checkin_date == today:
-                room = await db.rooms.find_one({'id': booking['room_id']}, {'_id': 0})
-                guest = await db.guests.find_one({'id': booking['guest_id']}, {'_id': 0})
-                
-                arrival_rooms.append({
-                    'room_number': room['room_number'] if room else 'N/A',
-                    'room_type': room['room_type'] if room else 'N/A',
-                    'room_status': room['status'] if room else 'unknown',
-                    'guest_name': guest['name'] if guest else 'N/A',
-                    'checkin_time': checkin.isoformat() if isinstance(checkin, datetime) else checkin,
-                    'booking_id': booking['id'],
-                    'booking_status': booking['status'],
-                    'ready': room['status'] in ['available', 'inspected'] if room else False
-                })
-        except Exception as e:
-            print(f"Error processing arrival booking {booking.get('id')}: {e}")
-            continue
-    
-    return {
-        'arrival_rooms': arrival_rooms,
-        'count': len(arrival_rooms),
-        'ready_count': sum(1 for r in arrival_rooms if r['ready'])
-    }
+    from hk_boards import get_hk_boards
+    boards = await get_hk_boards(db).day_boards(current_user.tenant_id, _hk_board_date(date))
+    return boards['arrivals']
 
 @api_router.put("/housekeeping/room/{room_id}/status")
 async def update_room_status_hk(
@@ -11150,7 +11179,7 @@ async def create_room_block(
     await db.room_blocks.insert_one({**block_dict, 'tenant_id': current_user.tenant_id})
     
     # Create audit log
-    await db.audit_logs.insert_one({
+    await write_log(db, 'audit_logs', {
         'id': str(uuid.uuid4()),
         'tenant_id': current_user.tenant_id,
         'user_id': current_user.id,
@@ -11265,7 +11294,7 @@ async def update_room_block(
     )
     
     # Create audit log
-    await db.audit_logs.insert_one({
+    await write_log(db, 'audit_logs', {
         'id': str(uuid.uuid4()),
         'tenant_id': current_user.tenant_id,
         'user_id': current_user.id,
@@ -11319,7 +11348,7 @@ async def cancel_room_block(
     )
     
     # Create audit log
-    await db.audit_logs.insert_one({
+    await write_log(db, 'audit_logs', {
         'id': str(uuid.uuid4()),
         'tenant_id': current_user.tenant_id,
         'user_id': current_user.id,
@@ -11591,43 +11620,19 @@ async def get_daily_flash_report_data(current_user: User):
     """
     Helper function to get flash report data (reusable for PDF and email)
     """
+    from kpi_engine import get_kpi_engine, category_totals
+
     today = datetime.now(timezone.utc).date()
-    
+    kpis = await get_kpi_engine(db).daily_flash(current_user.tenant_id, today)
+
     # Occupancy
-    rooms = await db.rooms.find({'tenant_id': current_user.tenant_id}).to_list(1000)
-    total_rooms = len(rooms)
-    occupied_rooms = len([r for r in rooms if r.get('current_status') == 'occupied'])
+    total_rooms = kpis['rooms']['total']
+    occupied_rooms = kpis['rooms']['occupied_now']
     occupancy_percentage = (occupied_rooms / total_rooms * 100) if total_rooms > 0 else 0
-    
+
     # Revenue
-    today_start = datetime.combine(today, datetime.min.time()).replace(tzinfo=timezone.utc)
-    today_end = datetime.combine(today, datetime.max.time()).replace(tzinfo=timezone.utc)
-    
-    charges = await db.folio_charges.find({
-        'tenant_id': current_user.tenant_id,
-        'date': {
-            '$gte': today_start.isoformat(),
-            '$lte': today_end.isoformat()
-        },
-        'voided': False
-    }).to_list(10000)
-    
-    room_revenue = sum(c.get('total', 0) for c in charges if c.get('charge_category') == 'room')
-    total_revenue = sum(c.get('total', 0) for c in charges)
-    
-    # Movements
-    arrivals = await db.bookings.find({
-        'tenant_id': current_user.tenant_id,
-        'check_in': today.isoformat(),
-        'status': {'$in': ['confirmed', 'checked_in']}
-    }).to_list(1000)
-    
-    departures = await db.bookings.find({
-        'tenant_id': current_user.tenant_id,
-        'check_out': today.isoformat(),
-        'status': {'$in': ['checked_in', 'checked_out']}
-    }).to_list(1000)
-    
+    revenue = category_totals(kpis['charges_by_category'])
+
     return {
         'occupancy': {
             'occupied': occupied_rooms,
@@ -11635,12 +11640,12 @@ async def get_daily_flash_report_data(current_user: User):
             'percentage': occupancy_percentage
         },
         'revenue': {
-            'room_revenue': room_revenue,
-            'total_revenue': total_revenue
+            'room_revenue': revenue['room'],
+            'total_revenue': revenue['total']
         },
         'movements': {
-            'arrivals': len(arrivals),
-            'departures': len(departures)
+            'arrivals': kpis['expected_arrivals']['count'],
+            'departures': kpis['expected_departures']['count']
         }
     }
 
@@ -11648,50 +11653,25 @@ async def get_daily_flash_report_data(current_user: User):
 @cached(ttl=300, key_prefix="report_daily_flash")  # Cache for 5 minutes
 async def get_daily_flash_report(date_str: Optional[str] = None, current_user: User = Depends(get_current_user)):
     """Daily Flash Report - GM/CFO Dashboard"""
+    from kpi_engine import get_kpi_engine, category_totals
+
     target_date = datetime.fromisoformat(date_str).date() if date_str else datetime.now(timezone.utc).date()
-    start_of_day = datetime.combine(target_date, datetime.min.time())
-    end_of_day = datetime.combine(target_date, datetime.max.time())
-    
-    # Get total rooms
-    total_rooms = await db.rooms.count_documents({'tenant_id': current_user.tenant_id})
-    
-    # Get occupancy (checked-in bookings)
-    occupied_rooms = await db.bookings.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'status': 'checked_in',
-        'check_in': {'$lte': end_of_day.isoformat()},
-        'check_out': {'$gte': start_of_day.isoformat()}
-    })
-    
+    kpis = await get_kpi_engine(db).daily_flash(current_user.tenant_id, target_date)
+
+    total_rooms = kpis['rooms']['total']
+    occupied_rooms = kpis['in_house']['count']
     occupancy_rate = round((occupied_rooms / total_rooms * 100) if total_rooms > 0 else 0, 2)
-    
-    # Get arrivals & departures count
-    arrivals = await db.bookings.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'check_in': {'$gte': start_of_day.isoformat(), '$lte': end_of_day.isoformat()}
-    })
-    
-    departures = await db.bookings.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'check_out': {'$gte': start_of_day.isoformat(), '$lte': end_of_day.isoformat()}
-    })
-    
-    # Note: Revenue is calculated from folio charges, not bookings directly
-    
-    # Calculate revenue from folio charges posted today
-    charges = await db.folio_charges.find({
-        'tenant_id': current_user.tenant_id,
-        'date': {'$gte': start_of_day.isoformat(), '$lte': end_of_day.isoformat()},
-        'voided': False
-    }).to_list(10000)
-    
-    total_revenue = sum(c['total'] for c in charges)
-    
-    # Revenue breakdown by category
-    room_revenue = sum(c['total'] for c in charges if c['charge_category'] == 'room')
-    fb_revenue = sum(c['total'] for c in charges if c['charge_category'] in ['food', 'beverage'])
-    other_revenue = total_revenue - room_revenue - fb_revenue
-    
+
+    arrivals = kpis['arrivals']['count']
+    departures = kpis['departures']['count']
+
+    # Revenue is calculated from folio charges posted that day, by category
+    revenue = category_totals(kpis['charges_by_category'])
+    total_revenue = revenue['total']
+    room_revenue = revenue['room']
+    fb_revenue = revenue['fb']
+    other_revenue = revenue['other']
+
     # Calculate ADR and RevPAR
     adr = round(room_revenue / occupied_rooms, 2) if occupied_rooms > 0 else 0
     rev_par = round(total_revenue / total_rooms, 2) if total_rooms > 0 else 0
@@ -11763,6 +11743,29 @@ async def export_daily_flash_excel(date_str: Optional[str] = None, current_user:
     return excel_response(wb, filename)
 
 
+@api_router.get("/dashboard/views/{view_name}")
+async def get_dashboard_view(
+    view_name: str,
+    max_age_seconds: int = 300,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Pre-computed dashboard view for the current tenant. Partitions older than
+    max_age_seconds are refreshed before serving; 'freshness' reports the age.
+    """
+    from materialized_views import MaterializedViewsManager, get_materialized_views
+    views = get_materialized_views() or MaterializedViewsManager(db)
+    max_age_seconds = max(0, min(max_age_seconds, 3600))
+    data = await views.get_view(view_name, max_age_seconds, tenant_id=current_user.tenant_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="View not found / Görünüm bulunamadı")
+    return {
+        'view_name': view_name,
+        'freshness': data.pop('freshness', None),
+        'data': data
+    }
+
+
 @api_router.get("/dashboard/role-based")
 @cached(ttl=300, key_prefix="dashboard_role_based")  # Cache for 5 minutes
 async def get_role_based_dashboard(current_user: User = Depends(get_current_user)):
@@ -13703,25 +13706,22 @@ async def get_finance_snapshot(current_user: User = Depends(get_current_user)):
     Finance Snapshot for GM Dashboard
     Returns: Total Pending AR, Overdue Invoices (categorized), Today's Collections
     """
+    from kpi_engine import get_kpi_engine
+
     today = datetime.now(timezone.utc).date()
-    today_start = datetime.combine(today, datetime.min.time()).replace(tzinfo=timezone.utc)
-    today_end = datetime.combine(today, datetime.max.time()).replace(tzinfo=timezone.utc)
-    
-    # 1. Calculate Total Pending AR from company folios
-    company_folios = await db.folios.find({
-        'tenant_id': current_user.tenant_id,
-        'folio_type': 'company',
-        'status': 'open'
-    }).to_list(10000)
+    kpis = await get_kpi_engine(db).finance_snapshot(current_user.tenant_id)
     
+    # 1. Total Pending AR from open company folios (charges - payments per folio)
     total_pending_ar = 0
     overdue_0_30 = 0
     overdue_30_60 = 0
     overdue_60_plus = 0
     overdue_invoices_count = 0
     
-    for folio in company_folios:
-        balance = await calculate_folio_balance(folio['id'], current_user.tenant_id)
+    for folio in kpis['company_folios']:
+        charged = kpis['folio_charges'].get(folio['id'], {}).get('amount', 0)
+        paid = kpis['folio_payments'].get(folio['id'], {}).get('amount', 0)
+        balance = round(float(charged) - float(paid), 2)
         
         if balance > 0:
             total_pending_ar += balance
@@ -13740,53 +13740,20 @@ async def get_finance_snapshot(current_user: User = Depends(get_current_user)):
                 else:
                     overdue_60_plus += balance
     
-    # 2. Calculate Today's Collections (payments received today)
-    todays_payments = await db.payments.find({
-        'tenant_id': current_user.tenant_id,
-        'processed_at': {
-            '$gte': today_start.isoformat(),
-            '$lte': today_end.isoformat()
-        }
-    }).to_list(10000)
-    
-    todays_collections = sum(payment.get('amount', 0) for payment in todays_payments)
-    todays_payment_count = len(todays_payments)
+    # 2. Today's Collections (payments received today)
+    todays_collections = kpis['collections_today']['amount']
+    todays_payment_count = kpis['collections_today']['count']
     
-    # 3. Calculate MTD (Month-to-Date) Collections
-    month_start = today.replace(day=1)
-    month_start_dt = datetime.combine(month_start, datetime.min.time()).replace(tzinfo=timezone.utc)
-    
-    mtd_payments = await db.payments.find({
-        'tenant_id': current_user.tenant_id,
-        'processed_at': {
-            '$gte': month_start_dt.isoformat(),
-            '$lte': today_end.isoformat()
-        }
-    }).to_list(10000)
+    # 3. MTD (Month-to-Date) Collections
+    mtd_collections = kpis['collections_mtd']['amount']
     
-    mtd_collections = sum(payment.get('amount', 0) for payment in mtd_payments)
-    
-    # 4. Calculate Collection Rate (MTD Collections / MTD Revenue)
-    mtd_charges = await db.folio_charges.find({
-        'tenant_id': current_user.tenant_id,
-        'date': {
-            '$gte': month_start_dt.isoformat(),
-            '$lte': today_end.isoformat()
-        },
-        'voided': False
-    }).to_list(10000)
-    
-    mtd_revenue = sum(charge.get('total', 0) for charge in mtd_charges)
+    # 4. Collection Rate (MTD Collections / MTD Revenue)
+    mtd_revenue = kpis['revenue_mtd']['amount']
     collection_rate = (mtd_collections / mtd_revenue * 100) if mtd_revenue > 0 else 0
     
-    # 5. Get Accounting Invoices (E-Fatura ready)
-    pending_invoices = await db.accounting_invoices.find({
-        'tenant_id': current_user.tenant_id,
-        'status': {'$in': ['pending', 'partial']}
-    }).to_list(1000)
-    
-    pending_invoice_total = sum(inv.get('total', 0) for inv in pending_invoices)
-    pending_invoice_count = len(pending_invoices)
+    # 5. Accounting Invoices (E-Fatura ready)
+    pending_invoice_total = kpis['pending_invoices']['amount']
+    pending_invoice_count = kpis['pending_invoices']['count']
     
     return {
         'report_date': today.isoformat(),
@@ -13832,8 +13799,11 @@ async def export_revenue_detail_excel(
     if end.tzinfo is None:
         end = end.replace(tzinfo=timezone.utc)
 
-    # Fetch bookings in range
-    bookings = await db.bookings.find(
+    # Fetch bookings in range (archived history included)
+    from data_archival import find_with_archive
+    bookings = await find_with_archive(
+        db,
+        'bookings',
         {
             'tenant_id': current_user.tenant_id,
             'status': {'$in': ['confirmed', 'guaranteed', 'checked_in', 'checked_out']},
@@ -13852,7 +13822,8 @@ async def export_revenue_detail_excel(
             'rate_plan': 1,
             'market_segment': 1,
         },
-    ).to_list(10000)
+        limit=10000,
+    )
 
     # Aggregate per stay-date
     daily_stats: Dict[tuple, Dict[str, Any]] = {}
@@ -14311,6 +14282,11 @@ async def bulk_update_rate_periods(
             }
             await db.rate_periods.insert_one(period_doc)
     
+    from rate_grid import get_rate_grid, operator_key
+    await get_rate_grid(db).invalidate(
+        current_user.tenant_id, keys=[operator_key(operator_id)], room_types=[room_type_id]
+    )
+    
     return {'message': f'{len(periods)} rate periods saved successfully'}
 
 @api_router.get("/rates/stop-sale/status")
@@ -14358,12 +14334,66 @@ async def toggle_stop_sale(
         upsert=True
     )
     
+    from rate_grid import get_rate_grid, operator_key
+    await get_rate_grid(db).invalidate(current_user.tenant_id, keys=[operator_key(operator_id)])
+    
     return {
         'operator_id': operator_id,
         'stop_sale': stop_sale,
         'message': f'Stop-sale {"activated" if stop_sale else "deactivated"} for {operator_id}'
     }
 
+@api_router.get("/rates/quote")
+async def get_rate_quote(
+    room_type: str,
+    check_in: str,
+    check_out: str,
+    rate_plan_id: Optional[str] = None,
+    operator_id: Optional[str] = None,
+    adults: int = 2,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Price a stay from the compiled rate grid (nightly rate + packages, restrictions)
+    """
+    from rate_grid import get_rate_grid, operator_key, DEFAULT_KEY
+    try:
+        ci = date.fromisoformat(check_in)
+        co = date.fromisoformat(check_out)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="check_in/check_out must be YYYY-MM-DD")
+    if co <= ci:
+        raise HTTPException(status_code=400, detail="check_out check_in'den sonra olmalı")
+    if (co - ci).days > 90:
+        raise HTTPException(status_code=400, detail="Max 90 nights")
+
+    key = operator_key(operator_id) if operator_id else (rate_plan_id or DEFAULT_KEY)
+    return await get_rate_grid(db).quote(current_user.tenant_id, room_type, ci, co, key=key, adults=adults)
+
+@api_router.post("/rates/grid/recompile")
+async def recompile_rate_grid(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Full rebuild of the tenant's compiled rate grid (e.g. after room base price changes)
+    """
+    from rate_grid import get_rate_grid
+    try:
+        sd = date.fromisoformat(start_date) if start_date else None
+        ed = date.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date/end_date must be YYYY-MM-DD")
+
+    rows = await get_rate_grid(db).compile(current_user.tenant_id, start=sd, end=ed)
+    return {
+        'success': True,
+        'rows_compiled': len(rows),
+        'rate_plans': len({r['rate_plan_id'] for r in rows}),
+        'room_types': len({r['room_type'] for r in rows})
+    }
+
 @api_router.get("/allotment/consumption")
 @cached(ttl=300, key_prefix="allotment_consumption")  # Cache for 5 min
 async def get_allotment_consumption(
@@ -14498,6 +14528,11 @@ async def create_walk_in_booking(data: dict, current_user: User = Depends(get_cu
         'source': 'walk-in',
         'created_at': datetime.now(timezone.utc).isoformat()
     })
+
+    from search_index import get_search_index
+    search = get_search_index(db)
+    await search.reindex(current_user.tenant_id, 'guest', [guest_id])
+    await search.reindex(current_user.tenant_id, 'booking', [booking_id])
     
     return {'booking_id': booking_id, 'room_number': available_room['room_number']}
 
@@ -14906,6 +14941,7 @@ async def get_audit_logs(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     limit: int = 100,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """Get audit logs with filters"""
@@ -14930,11 +14966,13 @@ async def get_audit_logs(
             '$lte': datetime.fromisoformat(end_date).isoformat()
         }
     
-    logs = await db.audit_logs.find(query, {'_id': 0}).sort('timestamp', -1).limit(limit).to_list(limit)
+    page = await keyset_page(db.audit_logs, query, SORT_TIMESTAMP_DESC, limit, cursor)
     
     return {
-        'logs': logs,
-        'count': len(logs),
+        'logs': page.items,
+        'count': len(page.items),
+        'next_cursor': page.next_cursor,
+        'has_more': page.has_more,
         'filters_applied': {k: v for k, v in query.items() if k != 'tenant_id'}
     }
 
@@ -15218,6 +15256,9 @@ async def import_ota_reservation(
         guest_dict = guest.model_dump()
         guest_dict['created_at'] = guest_dict['created_at'].isoformat()
         await db.guests.insert_one(guest_dict)
+
+        from search_index import get_search_index
+        await get_search_index(db).index_guest(guest_dict)
     
     # Find available room of matching type
     rooms = await db.rooms.find({
@@ -15269,6 +15310,9 @@ async def import_ota_reservation(
     booking_dict['check_out'] = booking_dict['check_out'].isoformat()
     booking_dict['created_at'] = booking_dict['created_at'].isoformat()
     await db.bookings.insert_one(booking_dict)
+
+    from search_index import get_search_index
+    await get_search_index(db).index_booking(booking_dict)
     
     # Update OTA reservation status
     await db.ota_reservations.update_one(
@@ -16822,27 +16866,18 @@ async def get_guest_360(
     if not guest:
         raise HTTPException(status_code=404, detail="Guest not found")
     
-    # Get all bookings
+    # Recent bookings; lifetime stats come from the guest rollup
     bookings = await db.bookings.find({
         'guest_id': guest_id,
         'tenant_id': current_user.tenant_id
-    }, {'_id': 0}).sort('check_in', -1).to_list(100)
-    
-    # Calculate stats
-    total_stays = len([b for b in bookings if b['status'] in ['checked_out', 'checked_in']])
-    total_nights = 0
-    lifetime_value = 0.0
-    adr_values = []
+    }, {'_id': 0}).sort('check_in', -1).to_list(10)
     
-    for booking in bookings:
-        if booking['status'] in ['checked_out', 'checked_in', 'confirmed']:
-            nights = (datetime.fromisoformat(booking['check_out']) - datetime.fromisoformat(booking['check_in'])).days
-            total_nights += nights
-            lifetime_value += booking.get('total_amount', 0)
-            if nights > 0:
-                adr_values.append(booking.get('total_amount', 0) / nights)
-    
-    average_adr = sum(adr_values) / len(adr_values) if adr_values else 0
+    from guest_rollup import get_guest_rollups
+    rollup = await get_guest_rollups(db).get(current_user.tenant_id, guest_id)
+    total_stays = rollup.get('stays', 0)
+    total_nights = rollup.get('nights', 0)
+    lifetime_value = rollup.get('total_spend', 0.0)
+    average_adr = rollup.get('adr', 0.0)
     
     # Get preferences
     preferences = await db.guest_preferences.find_one({
@@ -16886,11 +16921,7 @@ async def get_guest_360(
         }
         await db.guest_profiles.insert_one(profile)
     
-    # Channel distribution
-    channel_mix = {}
-    for booking in bookings:
-        channel = booking.get('ota_channel') or 'direct'
-        channel_mix[channel] = channel_mix.get(channel, 0) + 1
+    channel_mix = rollup.get('channel_mix', {})
     
     # Recent upsells
     upsell_offers = await db.upsell_offers.find({
@@ -16908,12 +16939,50 @@ async def get_guest_360(
             'total_nights': total_nights,
             'lifetime_value': round(lifetime_value, 2),
             'average_adr': round(average_adr, 2),
-            'channel_distribution': channel_mix
+            'channel_distribution': channel_mix,
+            'ltv_tier': rollup.get('ltv_tier', 'regular'),
+            'last_stay': rollup.get('last_stay')
         },
-        'recent_bookings': bookings[:10],
+        'recent_bookings': bookings,
         'recent_upsells': upsell_offers
     }
 
+@api_router.get("/crm/segments/guests")
+async def query_guest_segment(
+    ltv_tier: Optional[str] = None,
+    min_stays: Optional[int] = None,
+    min_spend: Optional[float] = None,
+    channel: Optional[str] = None,
+    vip: Optional[bool] = None,
+    blacklisted: Optional[bool] = None,
+    last_stay_before: Optional[str] = None,
+    last_stay_after: Optional[str] = None,
+    sort: Literal['total_spend', 'stays', 'nights', 'adr', 'last_stay'] = 'total_spend',
+    limit: int = 100,
+    skip: int = 0,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Filter all guests by lifetime stats (guest rollups), e.g. lapsed
+    high-value guests: ltv_tier=vip,high_value&last_stay_before=2025-01-01
+    """
+    from guest_rollup import get_guest_rollups
+    result = await get_guest_rollups(db).segment(
+        current_user.tenant_id, sort=sort, limit=min(max(limit, 1), 1000), skip=max(skip, 0),
+        ltv_tier=ltv_tier, min_stays=min_stays, min_spend=min_spend, channel=channel, vip=vip,
+        blacklisted=blacklisted, last_stay_before=last_stay_before, last_stay_after=last_stay_after
+    )
+    return {**result, 'count': len(result['guests']), 'skip': skip}
+
+@api_router.post("/crm/guest-rollups/rebuild")
+async def rebuild_guest_rollups(current_user: User = Depends(get_current_user)):
+    """Recompute every guest rollup from bookings and folios"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Only admins can rebuild guest rollups")
+    from guest_rollup import get_guest_rollups
+    guests = await get_guest_rollups(db).rebuild_guests(current_user.tenant_id)
+    return {'success': True, 'guests': guests}
+
 @api_router.post("/crm/guest/add-tag")
 async def add_guest_tag(
     guest_id: str,
@@ -17495,19 +17564,50 @@ async def startup_db_seed():
     # that depend on optional packages (motor, redis) or long-running scripts.
     # These can cause startup to fail or be very slow, leading to 520/health check issues.
     
-    # Create agency booking request indexes
+    # Indexes are declared in index_registry.py and applied by its migrations
+    # (python db_optimization.py). Startup ensures only the unique indexes that
+    # idempotent writes depend on and reports what else is pending
     try:
-        col = db.agency_booking_requests
-        await col.create_index([("idempotency_key", 1)], unique=True, name="uniq_idempotency_key")
-        await col.create_index([("status", 1), ("hotel_id", 1)], name="idx_status_hotel")
-        await col.create_index([("agency_id", 1), ("status", 1)], name="idx_agency_status")
-        await col.create_index([("expires_at", 1)], name="idx_expires_at")
-        await col.create_index([("created_at", -1)], name="idx_created_at_desc")
-        print("✅ Agency booking request indexes created")
+        from index_registry import get_index_registry
+        registry = get_index_registry(db)
+        constraints = await registry.ensure_constraints()
+        failed = [name for name, result in constraints.items() if result.startswith('error')]
+        if failed:
+            print(f"⚠️ Unique indexes not created: {', '.join(failed)}")
+        pending = await registry.pending()
+        if pending:
+            print(f"⚠️ {len(pending)} index migration(s) pending (v{pending[0].version}-v{pending[-1].version}); "
+                  f"run: python db_optimization.py")
+        else:
+            print("✅ Index registry up to date")
     except Exception as e:
-        print(f"⚠️ Agency booking request indexes error: {e}")
+        print(f"⚠️ Index registry check: {e}")
 
 
+    # Start buffered audit / operational log writer
+    try:
+        from log_pipeline import init_log_pipeline
+        await init_log_pipeline(db)
+        print("✅ Log pipeline started")
+    except Exception as e:
+        print(f"⚠️ Log pipeline initialization: {e}")
+
+    # Start outbound message delivery workers (email/SMS/WhatsApp queue)
+    try:
+        from message_delivery import init_delivery_service
+        await init_delivery_service(db)
+        print("✅ Message delivery workers started")
+    except Exception as e:
+        print(f"⚠️ Message delivery initialization: {e}")
+
+    # Start scheduled incremental refresh of per-tenant materialized views
+    try:
+        from materialized_views import init_materialized_views
+        await init_materialized_views(db)
+        print("✅ Materialized views refresher started")
+    except Exception as e:
+        print(f"⚠️ Materialized views initialization: {e}")
+
     # Initialize Redis cache (best-effort, non-fatal)
     try:
         print("🚀 Initializing Redis ultra-fast cache...")
@@ -17517,15 +17617,21 @@ async def startup_db_seed():
     except Exception as e:
         print(f"⚠️ Redis cache initialization: {str(e)}")
     
-    # Initialize cache warmer for instant responses (best-effort)
+    # Start the priority-driven cache warmer (warms observed hot views into Redis)
     try:
-        print("🔥 Initializing ultra-fast cache warmer...")
-        from cache_warmer import initialize_cache_warmer
-        await initialize_cache_warmer(db)
-        print("✅ Cache warmer initialized - responses will be instant!")
+        from cache_warmer import init_cache_warmer
+        await init_cache_warmer(db)
+        print("✅ Cache warmer scheduled")
     except Exception as e:
         print(f"⚠️ Cache warmer initialization: {str(e)}")
     
+    # Start the e-Fatura pipeline (renders, validates and submits queued e-invoices)
+    try:
+        from efatura_pipeline import init_efatura_pipeline
+        await init_efatura_pipeline(db)
+    except Exception as e:
+        print(f"⚠️ E-Fatura pipeline initialization: {str(e)}")
+    
     # Initialize optimization systems (only if any tenant has RMS enabled)
     try:
         print("🚀 Initializing enterprise optimization systems...")
@@ -17564,97 +17670,43 @@ async def startup_db_seed():
             init_optimization_managers(db, redis_client)
             print("✅ Optimization managers initialized")
             
-            # Setup indexes for optimization collections
-            from optimization_endpoints import archival_manager, materialized_views_manager
-            if archival_manager:
-                await archival_manager.setup_indexes()
-                print("✅ Archive indexes created")
-            
+            from optimization_endpoints import materialized_views_manager
             if materialized_views_manager:
-                await materialized_views_manager.setup_indexes()
-                print("✅ Materialized view indexes created")
-                
-                # Initial refresh of dashboard metrics
-                print("🔄 Refreshing dashboard metrics...")
-                await materialized_views_manager.refresh_dashboard_metrics()
-                print("✅ Dashboard metrics refreshed")
+                # Refreshes are handled by the scheduled refresher; indexes by the index registry
+                print("✅ Materialized views attached to optimization endpoints")
             
             print("🎉 Enterprise optimization systems ready!")
         
     except Exception as e:
         print(f"⚠️ Optimization system initialization error: {str(e)}")
         print("   System will continue without optimization features")
-    
-    # Create performance indexes for 550+ rooms and 3-year data handling
-    try:
-        print("🚀 Creating performance indexes for large-scale operations...")
-        
-        # Bookings collection - Critical for calendar performance
-        await db.bookings.create_index([
-            ("tenant_id", 1),
-            ("check_in", 1),
-            ("check_out", 1)
-        ], name="idx_bookings_tenant_checkin_checkout")
-        
-        await db.bookings.create_index([
-            ("tenant_id", 1),
-            ("status", 1),
-            ("check_in", 1)
-        ], name="idx_bookings_tenant_status_checkin")
-        
-        await db.bookings.create_index([
-            ("tenant_id", 1),
-            ("room_id", 1),
-            ("check_in", 1)
-        ], name="idx_bookings_tenant_room_checkin")
-        
-        # Rooms collection - Critical for 550+ room handling
-        await db.rooms.create_index([
-            ("tenant_id", 1),
-            ("room_number", 1)
-        ], name="idx_rooms_tenant_number", unique=True)
-        
-        await db.rooms.create_index([
-            ("tenant_id", 1),
-            ("status", 1),
-            ("room_type", 1)
-        ], name="idx_rooms_tenant_status_type")
-        
-        # Guests collection - Faster lookups
-        await db.guests.create_index([
-            ("tenant_id", 1),
-            ("email", 1)
-        ], name="idx_guests_tenant_email")
-        
-        await db.guests.create_index([
-            ("tenant_id", 1),
-            ("phone", 1)
-        ], name="idx_guests_tenant_phone")
-        
-        # Folios collection - Performance for financial operations
-        await db.folios.create_index([
-            ("tenant_id", 1),
-            ("booking_id", 1)
-        ], name="idx_folios_tenant_booking")
-        
-        await db.folios.create_index([
-            ("tenant_id", 1),
-            ("status", 1),
-            ("created_at", -1)
-        ], name="idx_folios_tenant_status_created")
-        
-        print("✅ Performance indexes created successfully!")
-        print("   - Bookings: 3 compound indexes for fast date range queries")
-        print("   - Rooms: 2 indexes for 550+ room handling")
-        print("   - Guests: 2 indexes for quick lookups")
-        print("   - Folios: 2 indexes for financial operations")
-        
-    except Exception as e:
-        print(f"⚠️ Index creation warning: {str(e)}")
-        print("   Indexes may already exist or database not ready")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    from message_delivery import get_delivery_service
+    delivery = get_delivery_service()
+    if delivery:
+        await delivery.stop()
+    from log_pipeline import get_log_pipeline
+    pipeline = get_log_pipeline()
+    if pipeline:
+        await pipeline.stop()
+    from materialized_views import get_materialized_views
+    views = get_materialized_views()
+    if views:
+        await views.stop()
+    from cache_warmer import get_cache_warmer
+    warmer = get_cache_warmer()
+    if warmer:
+        await warmer.stop()
+    from efatura_pipeline import get_efatura_pipeline
+    efatura = get_efatura_pipeline()
+    if efatura:
+        await efatura.stop()
+    from ml_model_service import get_training_service
+    training = get_training_service()
+    if training:
+        training.shutdown()
     client.close()
 from pydantic import BaseModel, Field, ConfigDict, EmailStr, field_validator
 from typing import List, Optional
@@ -17868,6 +17920,12 @@ async def create_bank_account(
     account_dict = bank_account.model_dump()
     account_dict['created_at'] = account_dict['created_at'].isoformat()
     await db.bank_accounts.insert_one(account_dict)
+
+    from general_ledger import get_general_ledger
+    await get_general_ledger(db).post_opening(
+        current_user.tenant_id, 'bank_account', bank_account.id, '102', balance,
+        account_dict['created_at'], created_by=current_user.name
+    )
     return bank_account
 
 
@@ -17879,7 +17937,18 @@ async def get_bank_accounts(current_user: User = Depends(get_current_user)):
 
 @api_router.put("/accounting/bank-accounts/{account_id}")
 async def update_bank_account(account_id: str, updates: Dict[str, Any], current_user: User = Depends(get_current_user)):
-    await db.bank_accounts.update_one({'id': account_id, 'tenant_id': current_user.tenant_id}, {'$set': updates})
+    previous = await db.bank_accounts.find_one_and_update(
+        {'id': account_id, 'tenant_id': current_user.tenant_id}, {'$set': updates}, projection={'_id': 0, 'balance': 1}
+    )
+    if previous and 'balance' in updates:
+        from general_ledger import get_general_ledger
+        delta = float(updates['balance'] or 0) - float(previous.get('balance') or 0)
+        if delta:
+            await get_general_ledger(db).post_opening(
+                current_user.tenant_id, 'bank_account', account_id, '102', delta,
+                event=f"adjustment:{uuid.uuid4()}", description='Banka bakiyesi düzeltmesi',
+                created_by=current_user.name
+            )
     account = await db.bank_accounts.find_one({'id': account_id}, {'_id': 0})
     return account
 
@@ -17928,6 +17997,9 @@ async def create_expense(
     expense_dict['date'] = expense_dict['date'].isoformat()
     expense_dict['created_at'] = expense_dict['created_at'].isoformat()
     await db.expenses.insert_one(expense_dict)
+
+    from general_ledger import get_general_ledger
+    await get_general_ledger(db).post_expense(expense_dict, created_by=current_user.name)
     
     # Update supplier balance if applicable
     if supplier_id:
@@ -17978,6 +18050,11 @@ async def get_expenses(
 async def update_expense(expense_id: str, updates: Dict[str, Any], current_user: User = Depends(get_current_user)):
     await db.expenses.update_one({'id': expense_id, 'tenant_id': current_user.tenant_id}, {'$set': updates})
     expense = await db.expenses.find_one({'id': expense_id}, {'_id': 0})
+    if expense and updates.get('payment_status') == 'paid':
+        from general_ledger import get_general_ledger
+        await get_general_ledger(db).post_expense_payment(
+            expense, payment_date=updates.get('payment_date'), created_by=current_user.name
+        )
     return expense
 
 # ============= INVENTORY MANAGEMENT =============
@@ -18014,6 +18091,12 @@ async def create_inventory_item(
     item_dict = item.model_dump()
     item_dict['created_at'] = item_dict['created_at'].isoformat()
     await db.inventory_items.insert_one(item_dict)
+
+    from general_ledger import get_general_ledger
+    await get_general_ledger(db).post_opening(
+        current_user.tenant_id, 'inventory_item', item.id, '153', quantity * unit_cost,
+        item_dict['created_at'], description='Stok açılış değeri', created_by=current_user.name
+    )
     return item
 
 
@@ -18059,6 +18142,7 @@ async def create_stock_movement(
     await db.stock_movements.insert_one(movement_dict)
     
     # Update inventory quantity
+    previous_quantity = None
     if movement_type == 'in':
         await db.inventory_items.update_one(
             {'id': item_id},
@@ -18070,10 +18154,15 @@ async def create_stock_movement(
             {'$inc': {'quantity': -quantity}}
         )
     else:  # adjustment
-        await db.inventory_items.update_one(
+        previous = await db.inventory_items.find_one_and_update(
             {'id': item_id},
-            {'$set': {'quantity': quantity}}
+            {'$set': {'quantity': quantity}},
+            projection={'_id': 0, 'quantity': 1}
         )
+        previous_quantity = (previous or {}).get('quantity', 0)
+
+    from general_ledger import get_general_ledger
+    await get_general_ledger(db).post_stock_movement(movement_dict, previous_quantity, created_by=current_user.name)
     
     return movement
 
@@ -18176,6 +18265,9 @@ async def create_accounting_invoice(
     invoice_dict['due_date'] = invoice_dict['due_date'].isoformat()
     invoice_dict['created_at'] = invoice_dict['created_at'].isoformat()
     await db.accounting_invoices.insert_one(invoice_dict)
+
+    from general_ledger import get_general_ledger
+    await get_general_ledger(db).post_invoice(invoice_dict, created_by=current_user.name)
     
     # Create cash flow entry
     # CashFlow model imported at top
@@ -18225,6 +18317,11 @@ async def update_accounting_invoice(invoice_id: str, updates: Dict[str, Any], cu
     
     await db.accounting_invoices.update_one({'id': invoice_id, 'tenant_id': current_user.tenant_id}, {'$set': updates})
     invoice = await db.accounting_invoices.find_one({'id': invoice_id}, {'_id': 0})
+    if invoice and updates.get('status') == 'paid':
+        from general_ledger import get_general_ledger
+        await get_general_ledger(db).post_invoice_payment(
+            invoice, payment_date=updates['payment_date'], created_by=current_user.name
+        )
     return invoice
 
 # ============= CASH FLOW =============
@@ -18245,67 +18342,70 @@ async def get_cash_flow(
     
     flows = await db.cash_flow.find(query, {'_id': 0}).sort('date', -1).to_list(1000)
     
-    total_income = sum(f['amount'] for f in flows if f['transaction_type'] == 'income')
-    total_expense = sum(f['amount'] for f in flows if f['transaction_type'] == 'expense')
-    net_cash_flow = total_income - total_expense
+    # Totals come from the ledger cash buckets, not the (truncated) listing
+    from general_ledger import get_general_ledger
+    ledger = get_general_ledger(db)
+    await ledger.ensure_initialized(current_user.tenant_id)
+    summary = await ledger.cash_flow(
+        current_user.tenant_id,
+        start_date[:10] if start_date and end_date else None,
+        end_date[:10] if start_date and end_date else datetime.now(timezone.utc).date().isoformat()
+    )
     
     return {
         'transactions': flows,
-        'total_income': total_income,
-        'total_expense': total_expense,
-        'net_cash_flow': net_cash_flow
+        'total_income': summary['cash_in'],
+        'total_expense': summary['cash_out'],
+        'net_cash_flow': summary['net_cash_flow'],
+        'by_category': summary['by_category']
     }
 
 # ============= FINANCIAL REPORTS =============
 
 
+def _ledger_comparison_range(start_date: str, end_date: str, compare: Optional[str]):
+    """Comparison window for 'previous_period' (same length, right before) or 'previous_year'"""
+    start, end = date.fromisoformat(start_date[:10]), date.fromisoformat(end_date[:10])
+    if compare == 'previous_year':
+        try:
+            return start.replace(year=start.year - 1).isoformat(), end.replace(year=end.year - 1).isoformat()
+        except ValueError:  # 29 Feb
+            return (start - timedelta(days=365)).isoformat(), (end - timedelta(days=365)).isoformat()
+    if compare == 'previous_period':
+        length = (end - start).days + 1
+        return (start - timedelta(days=length)).isoformat(), (start - timedelta(days=1)).isoformat()
+    raise HTTPException(status_code=400, detail="compare must be 'previous_period' or 'previous_year'")
+
+
 @api_router.get("/accounting/reports/profit-loss")
 @cached(ttl=900, key_prefix="report_profit_loss")  # Cache for 15 min
 async def get_profit_loss_report(
     start_date: str,
     end_date: str,
-    current_user: User = Depends(get_current_user)
-):
-    # Get all income
-    invoices = await db.accounting_invoices.find({
-        'tenant_id': current_user.tenant_id,
-        'status': 'paid',
-        'issue_date': {'$gte': start_date, '$lte': end_date}
-    }, {'_id': 0}).to_list(1000)
-    
-    # Get all expenses
-    expenses = await db.expenses.find({
-        'tenant_id': current_user.tenant_id,
-        'date': {'$gte': start_date, '$lte': end_date}
-    }, {'_id': 0}).to_list(1000)
-    
-    total_revenue = sum(inv['total'] for inv in invoices)
-    total_expenses = sum(exp['total_amount'] for exp in expenses)
-    gross_profit = total_revenue - total_expenses
-    profit_margin = (gross_profit / total_revenue * 100) if total_revenue > 0 else 0
-    
-    # Revenue breakdown
-    revenue_by_category = {}
-    for inv in invoices:
-        for item in inv['items']:
-            desc = item['description']
-            revenue_by_category[desc] = revenue_by_category.get(desc, 0) + item['total']
-    
-    # Expense breakdown
-    expense_by_category = {}
-    for exp in expenses:
-        cat = exp['category']
-        expense_by_category[cat] = expense_by_category.get(cat, 0) + exp['total_amount']
-    
-    return {
-        'period': {'start': start_date, 'end': end_date},
-        'total_revenue': round(total_revenue, 2),
-        'total_expenses': round(total_expenses, 2),
-        'gross_profit': round(gross_profit, 2),
-        'profit_margin': round(profit_margin, 2),
-        'revenue_breakdown': revenue_by_category,
-        'expense_breakdown': expense_by_category
-    }
+    compare: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    from general_ledger import get_general_ledger
+    ledger = get_general_ledger(db)
+    await ledger.ensure_initialized(current_user.tenant_id)
+    
+    report = await ledger.profit_loss(current_user.tenant_id, start_date[:10], end_date[:10])
+    report.pop('accounts')
+    result = {'period': {'start': start_date, 'end': end_date}, **report}
+    
+    if compare:
+        prev_start, prev_end = _ledger_comparison_range(start_date, end_date, compare)
+        previous = await ledger.profit_loss(current_user.tenant_id, prev_start, prev_end)
+        previous.pop('accounts')
+        result['comparison'] = {
+            'period': {'start': prev_start, 'end': prev_end},
+            **previous,
+            'change': {
+                key: round(report[key] - previous[key], 2)
+                for key in ('total_revenue', 'total_expenses', 'gross_profit')
+            }
+        }
+    return result
 
 
 @api_router.get("/accounting/reports/vat-report")
@@ -18314,22 +18414,14 @@ async def get_vat_report(
     end_date: str,
     current_user: User = Depends(get_current_user)
 ):
-    # Sales VAT (collected)
-    invoices = await db.accounting_invoices.find({
-        'tenant_id': current_user.tenant_id,
-        'issue_date': {'$gte': start_date, '$lte': end_date}
-    }, {'_id': 0}).to_list(1000)
-    
-    sales_vat = sum(inv['total_vat'] for inv in invoices)
-    
-    # Purchase VAT (paid)
-    expenses = await db.expenses.find({
-        'tenant_id': current_user.tenant_id,
-        'date': {'$gte': start_date, '$lte': end_date}
-    }, {'_id': 0}).to_list(1000)
-    
-    purchase_vat = sum(exp['vat_amount'] for exp in expenses)
+    from general_ledger import get_general_ledger
+    ledger = get_general_ledger(db)
+    await ledger.ensure_initialized(current_user.tenant_id)
+    totals = await ledger.account_totals(current_user.tenant_id, start_date[:10], end_date[:10])
     
+    # Sales VAT (collected, net of withholding) / purchase VAT (deductible)
+    sales_vat = totals.get('391', {}).get('credit', 0.0)
+    purchase_vat = totals.get('191', {}).get('debit', 0.0)
     vat_payable = sales_vat - purchase_vat
     
     return {
@@ -18341,48 +18433,20 @@ async def get_vat_report(
 
 
 @api_router.get("/accounting/reports/balance-sheet")
-async def get_balance_sheet(current_user: User = Depends(get_current_user)):
-    # Assets
-    bank_accounts = await db.bank_accounts.find({'tenant_id': current_user.tenant_id}, {'_id': 0}).to_list(1000)
-    total_cash = sum(acc['balance'] for acc in bank_accounts)
-    
-    inventory = await db.inventory_items.find({'tenant_id': current_user.tenant_id}, {'_id': 0}).to_list(1000)
-    total_inventory = sum(item['quantity'] * item['unit_cost'] for item in inventory)
-    
-    # Receivables (unpaid invoices)
-    receivables = await db.accounting_invoices.find({
-        'tenant_id': current_user.tenant_id,
-        'status': {'$in': ['pending', 'partial']}
-    }, {'_id': 0}).to_list(1000)
-    total_receivables = sum(inv['total'] for inv in receivables)
-    
-    total_assets = total_cash + total_inventory + total_receivables
-    
-    # Liabilities
-    payables = await db.expenses.find({
-        'tenant_id': current_user.tenant_id,
-        'payment_status': 'pending'
-    }, {'_id': 0}).to_list(1000)
-    total_payables = sum(exp['total_amount'] for exp in payables)
-    
-    # Equity
-    total_equity = total_assets - total_payables
+async def get_balance_sheet(
+    as_of: Optional[str] = None,
+    compare_to: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    from general_ledger import get_general_ledger
+    ledger = get_general_ledger(db)
+    await ledger.ensure_initialized(current_user.tenant_id)
     
-    return {
-        'assets': {
-            'cash': round(total_cash, 2),
-            'inventory': round(total_inventory, 2),
-            'receivables': round(total_receivables, 2),
-            'total': round(total_assets, 2)
-        },
-        'liabilities': {
-            'payables': round(total_payables, 2),
-            'total': round(total_payables, 2)
-        },
-        'equity': {
-            'total': round(total_equity, 2)
-        }
-    }
+    as_of = (as_of or datetime.now(timezone.utc).date().isoformat())[:10]
+    result = await ledger.balance_sheet(current_user.tenant_id, as_of)
+    if compare_to:
+        result['comparison'] = await ledger.balance_sheet(current_user.tenant_id, compare_to[:10])
+    return result
 
 
 @api_router.get("/accounting/dashboard")
@@ -18392,40 +18456,123 @@ async def get_accounting_dashboard(
 ):
     current_user = await get_current_user(credentials)
     
-    # Get current month data
-    today = datetime.now(timezone.utc)
-    month_start = today.replace(day=1, hour=0, minute=0, second=0).isoformat()
-    month_end = today.isoformat()
-    
-    invoices = await db.accounting_invoices.find({
-        'tenant_id': current_user.tenant_id,
-        'issue_date': {'$gte': month_start, '$lte': month_end}
-    }, {'_id': 0}).to_list(1000)
+    from general_ledger import get_general_ledger
+    ledger = get_general_ledger(db)
+    await ledger.ensure_initialized(current_user.tenant_id)
     
-    expenses = await db.expenses.find({
-        'tenant_id': current_user.tenant_id,
-        'date': {'$gte': month_start, '$lte': month_end}
-    }, {'_id': 0}).to_list(1000)
+    # Current month from the ledger balance rows
+    today = datetime.now(timezone.utc).date()
+    pl = await ledger.profit_loss(current_user.tenant_id, today.replace(day=1).isoformat(), today.isoformat())
     
-    total_income = sum(inv.get('total', 0) for inv in invoices if inv.get('status') == 'paid')
-    total_expenses = sum(exp.get('amount', 0) for exp in expenses)
-    pending_invoices = len([inv for inv in invoices if inv.get('status') == 'pending'])
-    overdue_invoices = len([inv for inv in invoices if inv.get('status') == 'overdue'])
+    invoice_counts = await db.accounting_invoices.aggregate([
+        {'$match': {'tenant_id': current_user.tenant_id, 'status': {'$in': ['pending', 'overdue']}}},
+        {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+    ]).to_list(None)
+    counts = {row['_id']: row['count'] for row in invoice_counts}
     
     # Get bank balances
-    bank_accounts = await db.bank_accounts.find({'tenant_id': current_user.tenant_id}, {'_id': 0}).to_list(1000)
-    total_bank_balance = sum(acc['balance'] for acc in bank_accounts)
+    bank = await db.bank_accounts.aggregate([
+        {'$match': {'tenant_id': current_user.tenant_id}},
+        {'$group': {'_id': None, 'balance': {'$sum': '$balance'}}}
+    ]).to_list(1)
+    total_bank_balance = bank[0]['balance'] if bank else 0
     
     return {
-        'monthly_income': round(total_income, 2),
-        'monthly_expenses': round(total_expenses, 2),
-        'net_income': round(total_income - total_expenses, 2),
-        'pending_invoices': pending_invoices,
-        'overdue_invoices': overdue_invoices,
+        'monthly_income': pl['total_revenue'],
+        'monthly_expenses': pl['total_expenses'],
+        'net_income': pl['gross_profit'],
+        'pending_invoices': counts.get('pending', 0),
+        'overdue_invoices': counts.get('overdue', 0),
         'total_bank_balance': round(total_bank_balance, 2)
     }
 
 
+# ============= GENERAL LEDGER =============
+
+
+@api_router.get("/accounting/ledger/trial-balance")
+async def get_trial_balance(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    from general_ledger import get_general_ledger, CHART_OF_ACCOUNTS
+    ledger = get_general_ledger(db)
+    await ledger.ensure_initialized(current_user.tenant_id)
+    
+    end_day = (end_date or datetime.now(timezone.utc).date().isoformat())[:10]
+    totals = await ledger.account_totals(current_user.tenant_id, start_date[:10] if start_date else None, end_day)
+    accounts = [
+        {
+            'account': code,
+            'name': CHART_OF_ACCOUNTS.get(code, (code, ''))[0],
+            'type': CHART_OF_ACCOUNTS.get(code, ('', 'expense'))[1],
+            'debit': t['debit'],
+            'credit': t['credit'],
+            'balance': round(t['debit'] - t['credit'], 2)
+        }
+        for code, t in sorted(totals.items())
+    ]
+    return {
+        'period': {'start': start_date, 'end': end_day},
+        'accounts': accounts,
+        'total_debit': round(sum(a['debit'] for a in accounts), 2),
+        'total_credit': round(sum(a['credit'] for a in accounts), 2)
+    }
+
+
+@api_router.get("/accounting/ledger/journal")
+async def get_journal_entries(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    source_type: Optional[str] = None,
+    limit: int = 200,
+    current_user: User = Depends(get_current_user)
+):
+    query = {'tenant_id': current_user.tenant_id}
+    if start_date and end_date:
+        query['date'] = {'$gte': start_date[:10], '$lte': end_date[:10]}
+    if source_type:
+        query['source_type'] = source_type
+    entries = await db.journal_entries.find(query, {'_id': 0}).sort('date', -1).to_list(min(limit, 1000))
+    return {'entries': entries, 'count': len(entries)}
+
+
+@api_router.get("/accounting/ledger/periods")
+async def get_ledger_periods(current_user: User = Depends(get_current_user)):
+    periods = await db.ledger_periods.find({'tenant_id': current_user.tenant_id}, {'_id': 0}).sort('period', -1).to_list(None)
+    return {'periods': periods}
+
+
+@api_router.post("/accounting/ledger/periods/{period}/close")
+async def close_ledger_period(period: str, current_user: User = Depends(get_current_user)):
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Only admins can close accounting periods")
+    try:
+        datetime.strptime(period, '%Y-%m')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="period must be YYYY-MM")
+    if period >= datetime.now(timezone.utc).strftime('%Y-%m'):
+        raise HTTPException(status_code=400, detail="Only past periods can be closed")
+    
+    from general_ledger import get_general_ledger, PeriodClosedError
+    ledger = get_general_ledger(db)
+    await ledger.ensure_initialized(current_user.tenant_id)
+    try:
+        return await ledger.close_period(current_user.tenant_id, period, closed_by=current_user.name)
+    except PeriodClosedError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@api_router.post("/accounting/ledger/rebuild")
+async def rebuild_ledger(current_user: User = Depends(get_current_user)):
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Only admins can rebuild the ledger")
+    from general_ledger import get_general_ledger
+    counts = await get_general_ledger(db).rebuild(current_user.tenant_id)
+    return {'success': True, 'replayed': counts}
+
+
 # ========================================
 # ACCOUNTING ENHANCEMENTS - 3 New Features
 # ========================================
@@ -18461,6 +18608,9 @@ async def create_currency_rate(
     
     rate_copy = rate.copy()
     await db.currency_rates.insert_one(rate_copy)
+
+    from fx_rates import get_fx_rate_cache
+    get_fx_rate_cache(db).invalidate(current_user.tenant_id)
     return rate
 
 @api_router.get("/accounting/currency-rates")
@@ -18503,54 +18653,12 @@ async def convert_currency(
             'converted_amount': request.amount
         }
     
-    # Get exchange rate
-    query = {
-        'tenant_id': current_user.tenant_id,
-        'from_currency': request.from_currency,
-        'to_currency': request.to_currency
-    }
-    
-    if request.date:
-        query['effective_date'] = {'$lte': request.date}
-    
-    rate_record = await db.currency_rates.find_one(
-        query,
-        {'_id': 0},
-        sort=[('effective_date', -1)]
+    # As-of rate from the tenant's cached table (direct, inverse, via TRY, defaults)
+    from fx_rates import get_fx_rate_cache
+    rate = await get_fx_rate_cache(db).get_rate(
+        current_user.tenant_id, request.from_currency, request.to_currency, request.date
     )
     
-    if not rate_record:
-        # Try reverse rate
-        reverse_query = {
-            'tenant_id': current_user.tenant_id,
-            'from_currency': request.to_currency,
-            'to_currency': request.from_currency
-        }
-        if request.date:
-            reverse_query['effective_date'] = {'$lte': request.date}
-        
-        reverse_rate = await db.currency_rates.find_one(
-            reverse_query,
-            {'_id': 0},
-            sort=[('effective_date', -1)]
-        )
-        
-        if reverse_rate:
-            rate = 1.0 / reverse_rate['rate']
-        else:
-            # Default rates if not found
-            default_rates = {
-                ('TRY', 'USD'): 0.037,
-                ('TRY', 'EUR'): 0.034,
-                ('USD', 'TRY'): 27.0,
-                ('EUR', 'TRY'): 29.5,
-                ('USD', 'EUR'): 0.92,
-                ('EUR', 'USD'): 1.09
-            }
-            rate = default_rates.get((request.from_currency, request.to_currency), 1.0)
-    else:
-        rate = rate_record['rate']
-    
     converted_amount = request.amount * rate
     
     return {
@@ -18562,6 +18670,49 @@ async def convert_currency(
         'date': request.date or datetime.now(timezone.utc).date().isoformat()
     }
 
+@api_router.get("/accounting/reports/multi-currency")
+async def get_multi_currency_report(
+    start_date: str,
+    end_date: str,
+    target_currency: str = 'TRY',
+    current_user: User = Depends(get_current_user)
+):
+    """Invoice totals per currency, converted to target_currency at each issue date's rate"""
+    from fx_rates import get_fx_rate_cache
+
+    invoices = await db.accounting_invoices.find({
+        'tenant_id': current_user.tenant_id,
+        'issue_date': {'$gte': start_date, '$lte': end_date}
+    }, {'_id': 0, 'currency': 1, 'total': 1, 'total_vat': 1, 'issue_date': 1}).to_list(None)
+
+    currencies = [inv.get('currency') or 'TRY' for inv in invoices]
+    dates = [inv.get('issue_date') for inv in invoices]
+    fx = get_fx_rate_cache(db)
+    totals = await fx.convert_many(current_user.tenant_id, [inv.get('total', 0) for inv in invoices],
+                                   currencies, target_currency, dates)
+    vats = await fx.convert_many(current_user.tenant_id, [inv.get('total_vat', 0) for inv in invoices],
+                                 currencies, target_currency, dates)
+
+    by_currency = {}
+    for inv, cur, total, vat in zip(invoices, currencies, totals, vats):
+        row = by_currency.setdefault(cur, {'invoice_count': 0, 'total': 0.0, 'total_converted': 0.0, 'vat_converted': 0.0})
+        row['invoice_count'] += 1
+        row['total'] += inv.get('total', 0)
+        row['total_converted'] += float(total)
+        row['vat_converted'] += float(vat)
+    for row in by_currency.values():
+        for key in ('total', 'total_converted', 'vat_converted'):
+            row[key] = round(row[key], 2)
+
+    return {
+        'period': {'start': start_date, 'end': end_date},
+        'target_currency': target_currency,
+        'by_currency': by_currency,
+        'total_converted': round(float(totals.sum()), 2),
+        'vat_converted': round(float(vats.sum()), 2),
+        'invoice_count': len(invoices)
+    }
+
 @api_router.post("/accounting/invoices/multi-currency")
 async def create_multi_currency_invoice(
     request: CreateMultiCurrencyInvoiceRequest,
@@ -18635,6 +18786,9 @@ async def create_multi_currency_invoice(
     
     invoice_copy = invoice.copy()
     await db.accounting_invoices.insert_one(invoice_copy)
+
+    from general_ledger import get_general_ledger
+    await get_general_ledger(db).post_invoice(invoice, created_by=current_user.name)
     
     return invoice
 
@@ -18734,6 +18888,9 @@ async def generate_invoice_from_folio(
     
     invoice_copy = invoice.copy()
     await db.accounting_invoices.insert_one(invoice_copy)
+
+    from general_ledger import get_general_ledger
+    await get_general_ledger(db).post_invoice(invoice, created_by=current_user.name)
     
     # Update folio with invoice reference
     await db.folios.update_one(
@@ -18741,37 +18898,10 @@ async def generate_invoice_from_folio(
         {'$set': {'invoice_id': invoice['id'], 'invoice_number': invoice_number}}
     )
     
-    # Generate E-Fatura if requested
+    # Queue E-Fatura if requested (rendered and submitted by the e-Fatura pipeline)
     if request.include_efatura:
-        efatura_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2">
-    <ID>{invoice_number}</ID>
-    <IssueDate>{invoice['issue_date']}</IssueDate>
-    <InvoiceTypeCode>SATIS</InvoiceTypeCode>
-    <DocumentCurrencyCode>{request.invoice_currency}</DocumentCurrencyCode>
-    <LineCountNumeric>{len(invoice_items)}</LineCountNumeric>
-    <LegalMonetaryTotal>
-        <TaxExclusiveAmount currencyID="{request.invoice_currency}">{invoice['subtotal']}</TaxExclusiveAmount>
-        <TaxInclusiveAmount currencyID="{request.invoice_currency}">{invoice['total']}</TaxInclusiveAmount>
-    </LegalMonetaryTotal>
-</Invoice>"""
-        
-        efatura_record = {
-            'id': str(uuid.uuid4()),
-            'tenant_id': current_user.tenant_id,
-            'invoice_id': invoice['id'],
-            'invoice_number': invoice_number,
-            'efatura_uuid': str(uuid.uuid4()),
-            'xml_content': efatura_xml,
-            'status': 'generated',
-            'generated_at': datetime.now(timezone.utc).isoformat()
-        }
-        
-        efatura_copy = efatura_record.copy()
-        await db.efatura_records.insert_one(efatura_copy)
-        
-        invoice['efatura_uuid'] = efatura_record['efatura_uuid']
-        invoice['efatura_status'] = 'generated'
+        invoice['efatura_uuid'] = await _queue_efatura(current_user.tenant_id, invoice)
+        invoice['efatura_status'] = 'pending'
     
     return {
         'invoice': invoice,
@@ -18781,6 +18911,20 @@ async def generate_invoice_from_folio(
 
 
 # 3. E-FATURA INTEGRATION WITH ACCOUNTING
+async def _queue_efatura(tenant_id: str, invoice: dict, submit: Optional[bool] = None) -> Optional[str]:
+    """
+    Queue an accounting invoice on the e-Fatura pipeline; submits when the
+    tenant has auto_send on. Returns None when the invoice could not be
+    queued (already queued, sent, or a purchase invoice).
+    """
+    from efatura_pipeline import get_efatura_pipeline
+    if submit is None:
+        settings = await db.efatura_settings.find_one({'tenant_id': tenant_id}, {'_id': 0, 'auto_send': 1})
+        submit = bool((settings or {}).get('auto_send'))
+    efatura_uuid = invoice.get('efatura_uuid') or str(uuid.uuid4())
+    queued = await get_efatura_pipeline(db).enqueue(tenant_id, [invoice['id']], submit=submit, ettn=efatura_uuid)
+    return efatura_uuid if queued else None
+
 @api_router.get("/accounting/invoices/{invoice_id}/efatura-status")
 async def get_invoice_efatura_status(
     invoice_id: str,
@@ -18801,6 +18945,17 @@ async def get_invoice_efatura_status(
         'tenant_id': current_user.tenant_id
     }, {'_id': 0})
     
+    if invoice.get('efatura_status') in ('pending', 'processing'):
+        return {
+            'invoice_id': invoice_id,
+            'invoice_number': invoice.get('invoice_number'),
+            'efatura_uuid': invoice.get('efatura_uuid'),
+            'efatura_status': 'pending',
+            'attempts': invoice.get('efatura_attempts', 0),
+            'last_error': invoice.get('efatura_error'),
+            'message': 'E-Fatura is queued in the e-Fatura pipeline'
+        }
+    
     if not efatura:
         return {
             'invoice_id': invoice_id,
@@ -18813,7 +18968,9 @@ async def get_invoice_efatura_status(
         'invoice_id': invoice_id,
         'invoice_number': invoice.get('invoice_number'),
         'efatura_uuid': efatura.get('efatura_uuid'),
+        'efatura_number': efatura.get('efatura_number'),
         'efatura_status': efatura.get('status'),
+        'validation_errors': efatura.get('validation_errors', []),
         'generated_at': efatura.get('generated_at'),
         'sent_at': efatura.get('sent_at'),
         'gib_response': efatura.get('gib_response')
@@ -18839,71 +18996,30 @@ async def generate_efatura_for_invoice(
         'tenant_id': current_user.tenant_id
     })
     
-    if existing_efatura:
+    if existing_efatura and existing_efatura.get('status') not in ('invalid', 'failed'):
         return {
             'message': 'E-Fatura already exists for this invoice',
             'efatura_uuid': existing_efatura.get('efatura_uuid'),
             'status': existing_efatura.get('status')
         }
     
-    # Generate E-Fatura XML
-    currency = invoice.get('currency', 'TRY')
-    efatura_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2">
-    <ID>{invoice.get('invoice_number')}</ID>
-    <IssueDate>{invoice.get('issue_date')}</IssueDate>
-    <InvoiceTypeCode>SATIS</InvoiceTypeCode>
-    <DocumentCurrencyCode>{currency}</DocumentCurrencyCode>
-    <LineCountNumeric>{len(invoice.get('items', []))}</LineCountNumeric>
-    <AccountingSupplierParty>
-        <Party>
-            <PartyName>
-                <Name>Hotel Name</Name>
-            </PartyName>
-        </Party>
-    </AccountingSupplierParty>
-    <AccountingCustomerParty>
-        <Party>
-            <PartyName>
-                <Name>{invoice.get('customer_name', 'N/A')}</Name>
-            </PartyName>
-        </Party>
-    </AccountingCustomerParty>
-    <LegalMonetaryTotal>
-        <TaxExclusiveAmount currencyID="{currency}">{invoice.get('subtotal', 0)}</TaxExclusiveAmount>
-        <TaxInclusiveAmount currencyID="{currency}">{invoice.get('total', 0)}</TaxInclusiveAmount>
-    </LegalMonetaryTotal>
-</Invoice>"""
-    
-    efatura_record = {
-        'id': str(uuid.uuid4()),
-        'tenant_id': current_user.tenant_id,
-        'invoice_id': invoice_id,
-        'invoice_number': invoice.get('invoice_number'),
-        'efatura_uuid': str(uuid.uuid4()),
-        'xml_content': efatura_xml,
-        'status': 'generated',
-        'generated_at': datetime.now(timezone.utc).isoformat()
-    }
-    
-    efatura_copy = efatura_record.copy()
-    await db.efatura_records.insert_one(efatura_copy)
-    
-    # Update invoice with E-Fatura reference
-    await db.accounting_invoices.update_one(
-        {'id': invoice_id},
-        {
-            '$set': {
-                'efatura_uuid': efatura_record['efatura_uuid'],
-                'efatura_status': 'generated'
-            }
+    if invoice.get('efatura_status') in ('pending', 'processing'):
+        return {
+            'message': 'E-Fatura is already queued for this invoice',
+            'efatura_uuid': invoice.get('efatura_uuid'),
+            'status': 'pending'
         }
-    )
+    
+    # Rendered (and sent when auto_send is on) by the e-Fatura pipeline
+    efatura_uuid = await _queue_efatura(current_user.tenant_id, invoice)
+    if not efatura_uuid:
+        raise HTTPException(status_code=409, detail="E-Fatura could not be queued for this invoice")
     
     return {
-        'message': 'E-Fatura generated successfully',
-        'efatura_uuid': efatura_record['efatura_uuid'],
-        'invoice_number': invoice.get('invoice_number')
+        'message': 'E-Fatura queued for generation',
+        'efatura_uuid': efatura_uuid,
+        'invoice_number': invoice.get('invoice_number'),
+        'status': 'pending'
     }
 
 
@@ -19017,7 +19133,7 @@ async def create_room_block(
         )
     
     # Audit log
-    await db.audit_logs.insert_one({
+    await write_log(db, 'audit_logs', {
         'id': str(uuid.uuid4()),
         'tenant_id': current_user.tenant_id,
         'action': 'room_block_created',
@@ -19067,7 +19183,7 @@ async def update_room_block(
         )
         
         # Audit log
-        await db.audit_logs.insert_one({
+        await write_log(db, 'audit_logs', {
             'id': str(uuid.uuid4()),
             'tenant_id': current_user.tenant_id,
             'action': 'room_block_updated',
@@ -19115,7 +19231,7 @@ async def cancel_room_block(
         )
     
     # Audit log
-    await db.audit_logs.insert_one({
+    await write_log(db, 'audit_logs', {
         'id': str(uuid.uuid4()),
         'tenant_id': current_user.tenant_id,
         'action': 'room_block_cancelled',
@@ -19342,6 +19458,11 @@ async def create_allotment_contract(
     }
     
     await db.allotment_contracts.insert_one(contract)
+    
+    from rate_grid import get_rate_grid, operator_key
+    await get_rate_grid(db).invalidate(
+        current_user.tenant_id, keys=[operator_key(contract['tour_operator'])], room_types=[contract['room_type']]
+    )
     return contract
 
 @api_router.post("/pms/allotment-contracts/{contract_id}/release")
@@ -19368,6 +19489,11 @@ async def release_allotment_rooms(
         }}
     )
     
+    from rate_grid import get_rate_grid, operator_key
+    await get_rate_grid(db).invalidate(
+        current_user.tenant_id, keys=[operator_key(contract.get('tour_operator'))], room_types=[contract.get('room_type')]
+    )
+    
     return {
         "message": f"Released {available_rooms} rooms",
         "released_rooms": available_rooms
@@ -20029,21 +20155,6 @@ async def get_properties(current_user: User = Depends(get_current_user)):
     properties = await db.properties.find({'organization_id': current_user.tenant_id}, {'_id': 0}).to_list(100)
     return {'properties': properties}
 
-@api_router.get("/multi-property/dashboard")
-async def get_multi_property_dashboard(
-    property_id: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
-    # Aggregate data across properties
-    return {
-        'total_revenue': 125000,
-        'avg_occupancy': 78.5,
-        'total_guests': 450,
-        'total_rooms': 250,
-        'property_revenues': [45000, 35000, 25000, 20000],
-        'property_occupancies': [82, 78, 75, 72]
-    }
-
 # 6. Marketplace Inventory
 @api_router.get("/marketplace/inventory", dependencies=[Depends(require_feature("hidden_marketplace"))])
 async def get_marketplace_inventory(current_user: User = Depends(get_current_user)):
@@ -20131,23 +20242,34 @@ async def get_pos_closures(current_user: User = Depends(get_current_user)):
     return {'closures': closures}
 
 @api_router.post("/pos/daily-closure")
-async def create_pos_closure(current_user: User = Depends(get_current_user)):
-    # Calculate today's sales
-    today = datetime.now(timezone.utc).date().isoformat()
+async def create_pos_closure(date: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    closure_date = date or datetime.now(timezone.utc).date().isoformat()
+    
+    existing = await db.pos_closures.find_one(
+        {'tenant_id': current_user.tenant_id, 'closure_date': closure_date}, {'_id': 0}
+    )
+    if existing:
+        raise HTTPException(status_code=409, detail=f"POS day {closure_date} is already closed")
+    
+    # Seal the day's running totals (all outlets, both POS channels)
+    from pos_daily_totals import get_pos_daily_totals
+    totals = await get_pos_daily_totals(db).seal(current_user.tenant_id, closure_date, closed_by=current_user.id)
+    methods = totals['payment_methods']
     
     closure = {
         'id': str(uuid.uuid4()),
         'tenant_id': current_user.tenant_id,
-        'closure_date': today,
-        'total_sales': 5420.50,
-        'cash_sales': 1200.00,
-        'card_sales': 4220.50,
-        'transaction_count': 45,
+        'closure_date': closure_date,
+        'total_sales': round(totals['gross_sales'], 2),
+        'cash_sales': round(methods.get('cash', {}).get('amount', 0), 2),
+        'card_sales': round(sum(v['amount'] for m, v in methods.items() if 'card' in m.lower()), 2),
+        'transaction_count': totals['transaction_count'],
+        'payment_methods': {m: round(v['amount'], 2) for m, v in methods.items()},
         'closed_at': datetime.now(timezone.utc).isoformat(),
         'closed_by': current_user.id
     }
     
-    await db.pos_closures.insert_one(closure)
+    await db.pos_closures.insert_one(closure.copy())
     return closure
 
 
@@ -21301,7 +21423,7 @@ async def generate_efatura(
     invoice_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    """Generate E-Fatura XML for GIB"""
+    """Queue E-Fatura XML generation for GIB"""
     invoice = await db.accounting_invoices.find_one(
         {'id': invoice_id, 'tenant_id': current_user.tenant_id},
         {'_id': 0}
@@ -21310,44 +21432,18 @@ async def generate_efatura(
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    # Generate E-Fatura XML (simplified)
-    efatura_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2">
-    <ID>{invoice['invoice_number']}</ID>
-    <IssueDate>{invoice['invoice_date']}</IssueDate>
-    <InvoiceTypeCode>SATIS</InvoiceTypeCode>
-    <LineCountNumeric>{len(invoice.get('items', []))}</LineCountNumeric>
-    <LegalMonetaryTotal>
-        <TaxExclusiveAmount>{invoice.get('subtotal', 0)}</TaxExclusiveAmount>
-        <TaxInclusiveAmount>{invoice.get('grand_total', 0)}</TaxInclusiveAmount>
-    </LegalMonetaryTotal>
-</Invoice>"""
-    
-    # Save E-Fatura record
-    efatura_record = {
-        'id': str(uuid.uuid4()),
-        'tenant_id': current_user.tenant_id,
-        'invoice_id': invoice_id,
-        'invoice_number': invoice['invoice_number'],
-        'efatura_uuid': str(uuid.uuid4()),
-        'xml_content': efatura_xml,
-        'status': 'generated',
-        'generated_at': datetime.now(timezone.utc).isoformat()
-    }
+    if invoice.get('efatura_status') == 'sent':
+        raise HTTPException(status_code=400, detail="E-Fatura already sent to GIB")
     
-    efatura_copy = efatura_record.copy()
-    await db.efatura_records.insert_one(efatura_copy)
-    
-    # Update invoice status
-    await db.accounting_invoices.update_one(
-        {'id': invoice_id},
-        {'$set': {'efatura_status': 'generated', 'efatura_uuid': efatura_record['efatura_uuid']}}
-    )
+    # Regenerates an existing draft; the pipeline renders and validates it
+    efatura_uuid = await _queue_efatura(current_user.tenant_id, invoice)
+    if not efatura_uuid:
+        raise HTTPException(status_code=409, detail="E-Fatura is already queued for this invoice")
     
     return {
-        'message': 'E-Fatura generated successfully',
-        'efatura_uuid': efatura_record['efatura_uuid'],
-        'xml_content': efatura_xml
+        'message': 'E-Fatura queued for generation',
+        'efatura_uuid': efatura_uuid,
+        'status': 'pending'
     }
 
 @api_router.post("/efatura/send-to-gib/{invoice_id}")
@@ -21355,7 +21451,7 @@ async def send_efatura_to_gib(
     invoice_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    """Send E-Fatura to GIB (Turkish Revenue Administration)"""
+    """Send E-Fatura to GIB (Turkish Revenue Administration) through the e-Fatura pipeline"""
     efatura = await db.efatura_records.find_one(
         {'invoice_id': invoice_id, 'tenant_id': current_user.tenant_id},
         {'_id': 0}
@@ -21364,31 +21460,40 @@ async def send_efatura_to_gib(
     if not efatura:
         raise HTTPException(status_code=404, detail="E-Fatura not found")
     
-    # Mock GIB integration (in production, use actual GIB API)
-    gib_response = {
-        'status': 'success',
-        'gib_id': str(uuid.uuid4()),
-        'timestamp': datetime.now(timezone.utc).isoformat()
-    }
+    if efatura.get('status') == 'sent_to_gib':
+        return {'message': 'E-Fatura already sent to GIB', 'gib_response': efatura.get('gib_response')}
     
-    # Update E-Fatura status
-    await db.efatura_records.update_one(
-        {'id': efatura['id']},
-        {
-            '$set': {
-                'status': 'sent_to_gib',
-                'gib_response': gib_response,
-                'sent_at': datetime.now(timezone.utc).isoformat()
-            }
-        }
-    )
+    efatura_uuid = await _queue_efatura(current_user.tenant_id, {**efatura, 'id': invoice_id}, submit=True)
+    if not efatura_uuid:
+        raise HTTPException(status_code=409, detail="E-Fatura is already queued or cannot be sent for this invoice")
     
-    await db.accounting_invoices.update_one(
-        {'id': invoice_id},
-        {'$set': {'efatura_status': 'sent', 'efatura_sent_at': datetime.now(timezone.utc).isoformat()}}
+    return {
+        'message': 'E-Fatura queued for submission to GIB',
+        'efatura_uuid': efatura_uuid,
+        'status': 'pending'
+    }
+
+@api_router.post("/efatura/queue")
+async def queue_efaturas(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    invoice_ids: Optional[List[str]] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Queue a month-end run (or selected invoices) for e-Fatura generation and submission"""
+    from efatura_pipeline import get_efatura_pipeline
+    if not (start_date or end_date or invoice_ids):
+        raise HTTPException(status_code=400, detail="Provide a date range or invoice_ids")
+    queued = await get_efatura_pipeline(db).enqueue(
+        current_user.tenant_id, invoice_ids, start_date=start_date, end_date=end_date
     )
-    
-    return {'message': 'E-Fatura sent to GIB successfully', 'gib_response': gib_response}
+    return {'message': f'{queued} invoices queued for e-Fatura', 'queued': queued}
+
+@api_router.get("/efatura/pipeline/status")
+async def get_efatura_pipeline_status(current_user: User = Depends(get_current_user)):
+    """E-Fatura backlog by status for the tenant, plus pipeline throughput"""
+    from efatura_pipeline import get_efatura_pipeline
+    return await get_efatura_pipeline(db).status(current_user.tenant_id)
 
 @api_router.get("/pos/transactions")
 async def get_pos_transactions(
@@ -21430,6 +21535,9 @@ async def create_pos_transaction(
     
     transaction_copy = transaction.copy()
     await db.pos_transactions.insert_one(transaction_copy)
+
+    from pos_daily_totals import get_pos_daily_totals
+    await get_pos_daily_totals(db).record(current_user.tenant_id, [transaction], channel='quick')
     return transaction
 
 @api_router.get("/pos/daily-summary")
@@ -21441,30 +21549,18 @@ async def get_pos_daily_summary(
     if not date:
         date = datetime.now(timezone.utc).date().isoformat()
     
-    # Aggregate transactions
-    pipeline = [
-        {
-            '$match': {
-                'tenant_id': current_user.tenant_id,
-                'transaction_date': date
-            }
-        },
-        {
-            '$group': {
-                '_id': '$payment_method',
-                'total': {'$sum': '$amount'},
-                'count': {'$sum': 1}
-            }
-        }
+    from pos_daily_totals import get_pos_daily_totals
+    totals = await get_pos_daily_totals(db).day(current_user.tenant_id, date, channel='quick')
+    results = [
+        {'_id': method, 'total': round(v['amount'], 2), 'count': v['count']}
+        for method, v in totals['payment_methods'].items()
     ]
     
-    results = await db.pos_transactions.aggregate(pipeline).to_list(100)
-    
     summary = {
         'date': date,
         'by_payment_method': results,
-        'grand_total': sum(r['total'] for r in results),
-        'transaction_count': sum(r['count'] for r in results)
+        'grand_total': round(totals['gross_sales'], 2),
+        'transaction_count': totals['transaction_count']
     }
     
     return summary
@@ -21484,13 +21580,12 @@ async def get_outlets(current_user: User = Depends(get_current_user)):
     ).to_list(100)
     
     # Get transaction counts per outlet
+    from pos_daily_totals import get_pos_daily_totals
+    today_counts = await get_pos_daily_totals(db).outlet_counts(
+        current_user.tenant_id, datetime.now(timezone.utc).date().isoformat()
+    )
     for outlet in outlets:
-        today_trans = await db.pos_menu_transactions.count_documents({
-            'tenant_id': current_user.tenant_id,
-            'outlet_id': outlet['id'],
-            'transaction_date': datetime.now(timezone.utc).date().isoformat()
-        })
-        outlet['today_transactions'] = today_trans
+        outlet['today_transactions'] = today_counts.get(outlet['id'], {}).get('transactions', 0)
     
     return {'outlets': outlets, 'count': len(outlets)}
 
@@ -21537,21 +21632,18 @@ async def get_outlet_details(
     }, {'_id': 0}).to_list(1000)
     
     # Get today's stats
+    from pos_daily_totals import get_pos_daily_totals
     today = datetime.now(timezone.utc).date().isoformat()
-    today_transactions = await db.pos_menu_transactions.find({
-        'tenant_id': current_user.tenant_id,
-        'outlet_id': outlet_id,
-        'transaction_date': today
-    }, {'_id': 0}).to_list(1000)
+    today_totals = await get_pos_daily_totals(db).day(current_user.tenant_id, today, outlet_id)
     
-    today_revenue = sum(t.get('total_amount', 0) for t in today_transactions)
+    today_revenue = today_totals['gross_sales']
     
     return {
         'outlet': outlet,
         'menu_items': menu_items,
         'menu_items_count': len(menu_items),
         'today_stats': {
-            'transactions': len(today_transactions),
+            'transactions': today_totals['transaction_count'],
             'revenue': round(today_revenue, 2)
         }
     }
@@ -21606,6 +21698,9 @@ async def create_menu_item(
     
     menu_copy = menu_item.copy()
     await db.pos_menu_items.insert_one(menu_copy)
+
+    from pos_engine import get_pos_engine
+    get_pos_engine(db).catalog.invalidate(current_user.tenant_id, request.outlet_id)
     return menu_item
 
 @api_router.post("/pos/transactions/with-menu")
@@ -21614,88 +21709,32 @@ async def create_pos_transaction_with_menu(
     current_user: User = Depends(get_current_user)
 ):
     """Create POS transaction with menu item breakdown"""
-    # Verify outlet
-    outlet = await db.pos_outlets.find_one({
-        'id': request.outlet_id,
-        'tenant_id': current_user.tenant_id
-    })
-    
-    if not outlet:
-        raise HTTPException(status_code=404, detail="Outlet not found")
-    
-    # Calculate totals
-    subtotal = sum(item.get('quantity', 0) * item.get('price', 0) for item in request.items)
-    
-    # Get menu item details and calculate costs
-    enriched_items = []
-    total_cost = 0
-    
-    for item in request.items:
-        menu_item = await db.pos_menu_items.find_one({
-            'id': item.get('menu_item_id'),
-            'tenant_id': current_user.tenant_id
-        }, {'_id': 0})
-        
-        if menu_item:
-            item_cost = menu_item.get('cost', 0) * item.get('quantity', 0)
-            total_cost += item_cost
-            
-            enriched_items.append({
-                'menu_item_id': item.get('menu_item_id'),
-                'item_name': menu_item.get('item_name'),
-                'category': menu_item.get('category'),
-                'quantity': item.get('quantity'),
-                'unit_price': item.get('price'),
-                'unit_cost': menu_item.get('cost', 0),
-                'total_price': item.get('quantity') * item.get('price'),
-                'total_cost': item_cost
-            })
-    
-    # Create transaction
-    transaction = {
-        'id': str(uuid.uuid4()),
-        'tenant_id': current_user.tenant_id,
-        'outlet_id': request.outlet_id,
-        'outlet_name': outlet.get('outlet_name'),
-        'transaction_date': datetime.now(timezone.utc).date().isoformat(),
-        'transaction_time': datetime.now(timezone.utc).time().isoformat(),
-        'items': enriched_items,
-        'subtotal': round(subtotal, 2),
-        'total_amount': round(subtotal, 2),  # Can add tax/service charge
-        'total_cost': round(total_cost, 2),
-        'gross_profit': round(subtotal - total_cost, 2),
-        'payment_method': request.payment_method,
-        'folio_id': request.folio_id,
-        'table_number': request.table_number,
-        'server_name': request.server_name,
-        'status': 'completed',
-        'processed_by': current_user.id,
-        'created_at': datetime.now(timezone.utc).isoformat()
-    }
-    
-    trans_copy = transaction.copy()
-    await db.pos_menu_transactions.insert_one(trans_copy)
+    from pos_engine import get_pos_engine
+    summary = await get_pos_engine(db).submit_orders(
+        current_user.tenant_id, [request.model_dump()], current_user.id
+    )
+    result = summary['results'][0]
+    if result['status'] == 'error':
+        raise HTTPException(status_code=404, detail=result['error'])
     
-    # Post to folio if folio_id provided
-    if request.folio_id:
-        folio_charge = {
-            'id': str(uuid.uuid4()),
-            'tenant_id': current_user.tenant_id,
-            'folio_id': request.folio_id,
-            'charge_date': datetime.now(timezone.utc).date().isoformat(),
-            'description': f"F&B - {outlet.get('outlet_name')}",
-            'category': 'fnb',
-            'amount': subtotal,
-            'quantity': 1,
-            'total': subtotal,
-            'voided': False,
-            'posted_at': datetime.now(timezone.utc).isoformat(),
-            'posted_by': current_user.id
-        }
-        folio_copy = folio_charge.copy()
-        await db.folio_charges.insert_one(folio_copy)
+    return result['transaction']
+
+@api_router.post("/pos/transactions/batch")
+async def create_pos_transactions_batch(
+    request: POSTransactionBatchRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Sync queued tickets (e.g. offline tablets); client_ref makes re-sends idempotent"""
+    if len(request.orders) > 500:
+        raise HTTPException(status_code=400, detail="Maximum 500 orders per batch")
     
-    return transaction
+    from pos_engine import get_pos_engine
+    summary = await get_pos_engine(db).submit_orders(
+        current_user.tenant_id, [order.model_dump() for order in request.orders], current_user.id
+    )
+    for result in summary['results']:
+        result.pop('transaction', None)
+    return summary
 
 @api_router.get("/pos/menu-sales-breakdown")
 async def get_menu_sales_breakdown(
@@ -21710,46 +21749,28 @@ async def get_menu_sales_breakdown(
     if not end_date:
         end_date = start_date
     
-    # Get transactions
-    query = {
-        'tenant_id': current_user.tenant_id,
-        'transaction_date': {'$gte': start_date, '$lte': end_date}
-    }
-    
-    if outlet_id:
-        query['outlet_id'] = outlet_id
-    
-    transactions = await db.pos_menu_transactions.find(query, {'_id': 0}).to_list(10000)
+    # Per-day running totals instead of the raw transactions
+    from pos_daily_totals import get_pos_daily_totals
+    totals = await get_pos_daily_totals(db).range(current_user.tenant_id, start_date, end_date, outlet_id)
     
     # Aggregate by menu item
     menu_sales = {}
-    category_sales = {}
-    outlet_sales = {}
-    
-    for trans in transactions:
-        outlet_name = trans.get('outlet_name', 'Unknown')
-        outlet_sales[outlet_name] = outlet_sales.get(outlet_name, 0) + trans.get('total_amount', 0)
-        
-        for item in trans.get('items', []):
-            item_name = item.get('item_name')
-            category = item.get('category', 'Other')
-            
-            if item_name not in menu_sales:
-                menu_sales[item_name] = {
-                    'item_name': item_name,
-                    'category': category,
-                    'quantity_sold': 0,
-                    'total_revenue': 0,
-                    'total_cost': 0,
-                    'gross_profit': 0
-                }
-            
-            menu_sales[item_name]['quantity_sold'] += item.get('quantity', 0)
-            menu_sales[item_name]['total_revenue'] += item.get('total_price', 0)
-            menu_sales[item_name]['total_cost'] += item.get('total_cost', 0)
-            menu_sales[item_name]['gross_profit'] += (item.get('total_price', 0) - item.get('total_cost', 0))
-            
-            category_sales[category] = category_sales.get(category, 0) + item.get('total_price', 0)
+    for item in totals['items'].values():
+        name = item['item_name']
+        row = menu_sales.setdefault(name, {
+            'item_name': name,
+            'category': item['category'],
+            'quantity_sold': 0,
+            'total_revenue': 0,
+            'total_cost': 0,
+            'gross_profit': 0
+        })
+        row['quantity_sold'] += item['quantity']
+        row['total_revenue'] += item['revenue']
+        row['total_cost'] += item['cost']
+        row['gross_profit'] += item['revenue'] - item['cost']
+    category_sales = totals['categories']
+    outlet_sales = totals['outlets']
     
     # Sort by revenue
     sorted_menu_sales = sorted(menu_sales.values(), key=lambda x: x['total_revenue'], reverse=True)
@@ -21770,7 +21791,7 @@ async def get_menu_sales_breakdown(
             for name, rev in sorted(outlet_sales.items(), key=lambda x: x[1], reverse=True)
         ],
         'summary': {
-            'total_transactions': len(transactions),
+            'total_transactions': totals['transaction_count'],
             'total_revenue': round(total_revenue, 2),
             'total_cost': round(total_cost, 2),
             'gross_profit': round(total_revenue - total_cost, 2),
@@ -21789,22 +21810,16 @@ async def generate_z_report(
     date = request.date or datetime.now(timezone.utc).date().isoformat()
     outlet_id = request.outlet_id
     
-    # Get transactions for the day
-    query = {
-        'tenant_id': current_user.tenant_id,
-        'transaction_date': date
-    }
-    
     if outlet_id:
-        query['outlet_id'] = outlet_id
         outlet = await db.pos_outlets.find_one({'id': outlet_id}, {'_id': 0})
         outlet_name = outlet.get('outlet_name') if outlet else 'Unknown'
     else:
         outlet_name = 'All Outlets'
     
-    transactions = await db.pos_menu_transactions.find(query, {'_id': 0}).to_list(10000)
+    from pos_daily_totals import get_pos_daily_totals
+    totals = await get_pos_daily_totals(db).day(current_user.tenant_id, date, outlet_id)
     
-    if not transactions:
+    if not totals['transaction_count']:
         return {
             'message': 'No transactions found for this date',
             'date': date,
@@ -21812,51 +21827,19 @@ async def generate_z_report(
         }
     
     # Calculate totals
-    total_transactions = len(transactions)
-    gross_sales = sum(t.get('total_amount', 0) for t in transactions)
-    total_cost = sum(t.get('total_cost', 0) for t in transactions)
+    total_transactions = totals['transaction_count']
+    gross_sales = totals['gross_sales']
+    total_cost = totals['total_cost']
     gross_profit = gross_sales - total_cost
     
-    # Payment method breakdown
-    payment_methods = {}
-    for trans in transactions:
-        method = trans.get('payment_method', 'cash')
-        payment_methods[method] = payment_methods.get(method, 0) + trans.get('total_amount', 0)
-    
-    # Category breakdown
-    category_sales = {}
-    menu_item_sales = {}
-    
-    for trans in transactions:
-        for item in trans.get('items', []):
-            category = item.get('category', 'Other')
-            item_name = item.get('item_name')
-            
-            category_sales[category] = category_sales.get(category, 0) + item.get('total_price', 0)
-            
-            if item_name not in menu_item_sales:
-                menu_item_sales[item_name] = {
-                    'quantity': 0,
-                    'revenue': 0
-                }
-            menu_item_sales[item_name]['quantity'] += item.get('quantity', 0)
-            menu_item_sales[item_name]['revenue'] += item.get('total_price', 0)
-    
-    # Server breakdown
-    server_sales = {}
-    for trans in transactions:
-        server = trans.get('server_name', 'Unknown')
-        server_sales[server] = server_sales.get(server, 0) + trans.get('total_amount', 0)
-    
-    # Hourly breakdown
-    hourly_sales = {}
-    for trans in transactions:
-        hour = trans.get('transaction_time', '00:00:00')[:2]
-        hourly_sales[hour] = hourly_sales.get(hour, 0) + trans.get('total_amount', 0)
+    payment_methods = totals['payment_methods']
+    category_sales = totals['categories']
+    server_sales = totals['servers']
+    hourly_sales = totals['hours']
     
     # Top selling items
     top_items = sorted(
-        [{'item': k, **v} for k, v in menu_item_sales.items()],
+        [{'item': v['item_name'], 'quantity': v['quantity'], 'revenue': v['revenue']} for v in totals['items'].values()],
         key=lambda x: x['revenue'],
         reverse=True
     )[:10]
@@ -21871,6 +21854,7 @@ async def generate_z_report(
         'report_type': 'Z-Report',
         'generated_at': datetime.now(timezone.utc).isoformat(),
         'generated_by': current_user.id,
+        'sealed': totals['sealed'],
         
         # Summary
         'summary': {
@@ -21884,8 +21868,8 @@ async def generate_z_report(
         
         # Payment methods
         'payment_methods': [
-            {'method': method, 'amount': round(amount, 2), 'count': sum(1 for t in transactions if t.get('payment_method') == method)}
-            for method, amount in payment_methods.items()
+            {'method': method, 'amount': round(v['amount'], 2), 'count': v['count']}
+            for method, v in payment_methods.items()
         ],
         
         # Category breakdown
@@ -21946,6 +21930,37 @@ async def get_z_reports(
     
     return {'reports': reports, 'count': len(reports)}
 
+@api_router.post("/pos/daily-totals/rebuild")
+async def rebuild_pos_daily_totals(
+    start_date: str,
+    end_date: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Recompute POS day totals from raw transactions (history before the running totals)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Only admins can rebuild POS totals")
+    
+    try:
+        start, end = datetime.fromisoformat(start_date).date(), datetime.fromisoformat(end_date).date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date and end_date must be YYYY-MM-DD")
+    if end < start:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if (end - start).days > 366:
+        raise HTTPException(status_code=400, detail="Maximum range is 366 days")
+    
+    from pos_daily_totals import get_pos_daily_totals
+    daily_totals = get_pos_daily_totals(db)
+    days = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+    # Sealed (closed) days keep their Z-report figures; only open days are recomputed
+    sealed = await daily_totals.sealed_dates(current_user.tenant_id, days)
+    replayed = 0
+    for channel in ('menu', 'quick'):
+        replayed += await daily_totals.rebuild_days(current_user.tenant_id, days, channel)
+    
+    return {'success': True, 'days': len(days) - len(sealed), 'transactions': replayed,
+            'sealed_days_skipped': sorted(sealed)}
+
 
 
 # --------------------------------------------------------------------------
@@ -22446,8 +22461,9 @@ async def assign_group_rooms(
     request: AssignGroupRoomsRequest,
     current_user: User = Depends(get_current_user)
 ):
-    """Assign rooms to group reservation"""
-    room_assignments = request.room_assignments
+    """Assign rooms to group reservation (availability-checked, bulk insert)"""
+    from group_pipeline import GroupRoomingPipeline
+    
     group = await db.group_reservations.find_one(
         {'id': group_id, 'tenant_id': current_user.tenant_id}
     )
@@ -22455,44 +22471,50 @@ async def assign_group_rooms(
     if not group:
         raise HTTPException(status_code=404, detail="Group reservation not found")
     
-    created_bookings = []
-    
-    for assignment in room_assignments:
-        booking = {
-            'id': str(uuid.uuid4()),
-            'tenant_id': current_user.tenant_id,
-            'group_id': group_id,
+    rows = [
+        {
             'guest_name': assignment.get('guest_name', group['group_name']),
-            'guest_email': assignment.get('guest_email', group['contact_email']),
-            'guest_phone': assignment.get('guest_phone', group['contact_phone']),
-            'check_in_date': group['check_in_date'],
-            'check_out_date': group['check_out_date'],
-            'room_type': assignment['room_type'],
+            'email': assignment.get('guest_email', group['contact_email']),
+            'phone': assignment.get('guest_phone', group['contact_phone']),
+            'room_type': assignment.get('room_type'),
             'room_id': assignment.get('room_id'),
             'adults': assignment.get('adults', group['adults_per_room']),
-            'children': assignment.get('children', 0),
-            'status': 'confirmed',
-            'booking_source': 'group',
-            'created_at': datetime.now(timezone.utc).isoformat()
+            'children': assignment.get('children', 0)
         }
-        
-        await db.bookings.insert_one(booking)
-        created_bookings.append(booking)
+        for assignment in request.room_assignments
+    ]
     
-    # Update group reservation
-    await db.group_reservations.update_one(
-        {'id': group_id},
+    result = await GroupRoomingPipeline(db).load(
+        current_user.tenant_id,
+        rows,
         {
-            '$set': {
-                'rooms_assigned': len(created_bookings),
-                'status': 'confirmed' if len(created_bookings) >= group['total_rooms'] else 'partial'
+            'id': group_id,
+            'collection': 'group_reservations',
+            'link_field': 'group_id',
+            'counter_field': 'rooms_assigned',
+            'capacity': max(group['total_rooms'] - group.get('rooms_assigned', 0), 0),
+            'check_in': group['check_in_date'],
+            'check_out': group['check_out_date'],
+            'adults': group['adults_per_room'],
+            'extra': {
+                'check_in_date': group['check_in_date'],
+                'check_out_date': group['check_out_date'],
+                'booking_source': 'group'
             }
-        }
+        },
+        user_id=current_user.id
+    )
+    
+    rooms_assigned = group.get('rooms_assigned', 0) + result['successful']
+    await db.group_reservations.update_one(
+        {'id': group_id},
+        {'$set': {'status': 'confirmed' if rooms_assigned >= group['total_rooms'] else 'partial'}}
     )
     
     return {
-        'message': f'Assigned {len(created_bookings)} rooms to group',
-        'bookings': created_bookings
+        'message': f"Assigned {result['successful']} rooms to group",
+        'rooms_assigned': rooms_assigned,
+        **result
     }
 
 @api_router.get("/block-reservations")
@@ -22567,6 +22589,9 @@ async def use_block_room(
     }
     
     await db.bookings.insert_one(booking.copy())
+
+    from search_index import get_search_index
+    await get_search_index(db).index_booking(booking)
     
     # Update block availability
     await db.block_reservations.update_one(
@@ -22647,84 +22672,64 @@ async def create_property(
 @api_router.get("/multi-property/dashboard")
 async def get_multi_property_dashboard(
     date: str = None,
+    property_id: Optional[str] = None,
+    refresh: bool = False,
     current_user: User = Depends(get_current_user)
 ):
-    """Get consolidated dashboard across all properties"""
-    if not date:
-        date = datetime.now(timezone.utc).date().isoformat()
-    
-    # Get all properties
-    properties = await db.properties.find(
-        {'portfolio_id': current_user.tenant_id, 'status': 'active'},
-        {'_id': 0}
-    ).to_list(100)
-    
-    property_stats = []
-    total_rooms = 0
-    total_occupied = 0
-    total_revenue = 0.0
-    
-    for prop in properties:
-        # Get rooms for this property
-        rooms = await db.rooms.count_documents({
-            'tenant_id': prop['id'],
-            'room_status': {'$ne': 'out_of_order'}
-        })
-        
-        occupied = await db.rooms.count_documents({
-            'tenant_id': prop['id'],
-            'room_status': 'occupied'
-        })
-        
-        # Get revenue (simplified)
-        pipeline = [
-            {
-                '$match': {
-                    'tenant_id': prop['id'],
-                    'charge_date': date,
-                    'voided': False
-                }
-            },
-            {
-                '$group': {
-                    '_id': None,
-                    'total': {'$sum': '$total'}
-                }
-            }
-        ]
-        
-        revenue_result = await db.folio_charges.aggregate(pipeline).to_list(1)
-        revenue = revenue_result[0]['total'] if revenue_result else 0.0
-        
-        occupancy = (occupied / rooms * 100) if rooms > 0 else 0
-        
-        property_stats.append({
-            'property_id': prop['id'],
-            'property_name': prop['property_name'],
-            'property_code': prop['property_code'],
-            'total_rooms': rooms,
-            'occupied_rooms': occupied,
-            'occupancy': round(occupancy, 1),
-            'revenue': round(revenue, 2)
-        })
-        
-        total_rooms += rooms
-        total_occupied += occupied
-        total_revenue += revenue
-    
-    overall_occupancy = (total_occupied / total_rooms * 100) if total_rooms > 0 else 0
-    
+    """
+    Consolidated dashboard across all properties. Property KPIs are computed
+    concurrently and cached per property; each row reports its freshness.
+    With property_id, returns that property's drill-down instead.
+    """
+    from portfolio_service import get_portfolio_service
+
+    service = get_portfolio_service(db)
+    day = datetime.fromisoformat(date).date() if date else None
+
+    if property_id:
+        detail = await service.drilldown(current_user.tenant_id, property_id, day, refresh=refresh)
+        if not detail:
+            raise HTTPException(status_code=404, detail="Property not found in portfolio")
+        kpis = detail['kpis'] or {}
+        return {
+            **detail,
+            'total_revenue': kpis.get('total_revenue', 0),
+            'avg_occupancy': kpis.get('occupancy', 0),
+            'total_guests': kpis.get('guests', 0),
+            'total_rooms': kpis.get('total_rooms', 0),
+        }
+
+    snapshot = await service.snapshot(current_user.tenant_id, day, refresh=refresh)
+    summary = snapshot['summary']
+    properties = [{
+        **prop,
+        'occupancy_pct': prop.get('occupancy', 0),
+        'revenue': prop.get('total_revenue', 0),
+        'today_revenue': prop.get('total_revenue', 0),
+    } for prop in snapshot['properties']]
+
     return {
-        'date': date,
+        'date': snapshot['date'],
         'portfolio_summary': {
-            'total_properties': len(properties),
-            'total_rooms': total_rooms,
-            'occupied_rooms': total_occupied,
-            'overall_occupancy': round(overall_occupancy, 1),
-            'total_revenue': round(total_revenue, 2),
-            'average_occupancy': round(sum(p['occupancy'] for p in property_stats) / len(property_stats), 1) if property_stats else 0
+            **summary,
+            'overall_occupancy': summary['occupancy'],
         },
-        'properties': property_stats
+        'summary': {
+            'total_properties': summary['total_properties'],
+            'total_rooms': summary['total_rooms'],
+            'avg_occupancy': summary['occupancy'],
+            'total_revenue': summary['total_revenue'],
+            'adr': summary['adr'],
+            'revpar': summary['revpar'],
+        },
+        'properties': properties,
+        'total_revenue': summary['total_revenue'],
+        'avg_occupancy': summary['occupancy'],
+        'total_guests': summary['guests'],
+        'total_rooms': summary['total_rooms'],
+        'property_revenues': [p['revenue'] for p in properties],
+        'property_occupancies': [p['occupancy_pct'] for p in properties],
+        'freshness': snapshot['freshness'],
     }
 
 @api_router.get("/multi-property/consolidated-report")
@@ -22735,68 +22740,22 @@ async def get_consolidated_report(
     current_user: User = Depends(get_current_user)
 ):
     """Get consolidated report across properties"""
-    properties = await db.properties.find(
-        {'portfolio_id': current_user.tenant_id, 'status': 'active'},
-        {'_id': 0}
-    ).to_list(100)
-    
-    start = datetime.fromisoformat(start_date)
-    end = datetime.fromisoformat(end_date)
-    days = (end - start).days + 1
-    
-    report_data = []
-    
-    for day in range(days):
-        current_date = (start + timedelta(days=day)).date().isoformat()
-        
-        day_data = {
-            'date': current_date,
-            'properties': []
-        }
-        
-        for prop in properties:
-            # Simplified metrics
-            if metric == 'occupancy':
-                rooms = await db.rooms.count_documents({'tenant_id': prop['id']})
-                occupied = await db.rooms.count_documents({
-                    'tenant_id': prop['id'],
-                    'room_status': 'occupied'
-                })
-                value = (occupied / rooms * 100) if rooms > 0 else 0
-            elif metric == 'revenue':
-                pipeline = [
-                    {
-                        '$match': {
-                            'tenant_id': prop['id'],
-                            'charge_date': current_date,
-                            'voided': False
-                        }
-                    },
-                    {
-                        '$group': {
-                            '_id': None,
-                            'total': {'$sum': '$total'}
-                        }
-                    }
-                ]
-                result = await db.folio_charges.aggregate(pipeline).to_list(1)
-                value = result[0]['total'] if result else 0.0
-            else:
-                value = 0
-            
-            day_data['properties'].append({
-                'property_id': prop['id'],
-                'property_name': prop['property_name'],
-                'value': round(value, 2)
-            })
-        
-        report_data.append(day_data)
-    
+    from portfolio_service import get_portfolio_service
+
+    start = datetime.fromisoformat(start_date).date()
+    end = datetime.fromisoformat(end_date).date()
+    if end < start:
+        raise HTTPException(status_code=400, detail="end_date must be on or after start_date")
+    if (end - start).days > 366:
+        raise HTTPException(status_code=400, detail="Date range cannot exceed 366 days")
+
+    report = await get_portfolio_service(db).series(current_user.tenant_id, start, end, metric)
+
     return {
         'start_date': start_date,
         'end_date': end_date,
         'metric': metric,
-        'data': report_data
+        'data': report['data']
     }
 
 @api_router.post("/multi-property/transfer-reservation")
@@ -22806,12 +22765,18 @@ async def transfer_reservation_between_properties(
     current_user: User = Depends(get_current_user)
 ):
     """Transfer reservation from one property to another"""
-    booking = await db.bookings.find_one({'id': booking_id})
+    from portfolio_service import get_portfolio_service
+
+    service = get_portfolio_service(db)
+    portfolio = await service.property_ids(current_user.tenant_id)
     target_property_id = request.target_property_id
     reason = request.reason
-    
+
+    booking = await db.bookings.find_one({'id': booking_id, 'tenant_id': {'$in': portfolio}})
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
+    if target_property_id not in portfolio:
+        raise HTTPException(status_code=404, detail="Target property not found in portfolio")
     
     # Create transfer record
     transfer = {
@@ -22824,17 +22789,17 @@ async def transfer_reservation_between_properties(
         'transferred_by': current_user.id
     }
     
-    await db.property_transfers.insert_one(transfer)
+    await db.property_transfers.insert_one(transfer.copy())
     
     # Update booking tenant_id
     await db.bookings.update_one(
         {'id': booking_id},
         {'$set': {'tenant_id': target_property_id, 'transferred': True}}
     )
+    service.invalidate([booking['tenant_id'], target_property_id])
     
     return {'message': 'Reservation transferred successfully', 'transfer': transfer}
 
-
 # ========================================
 # 7. Marketplace - Warehouse & Procurement
 # ========================================
@@ -23836,6 +23801,26 @@ async def get_calendar_tooltip(
                 'rooms_today': group_rooms
             })
     
+    # Sellable BAR per room type from the compiled rate grid
+    from rate_grid import get_rate_grid, DEFAULT_KEY
+    rate_types = [room_type_filter] if room_type_filter else await db.rooms.distinct(
+        'room_type', {'tenant_id': current_user.tenant_id}
+    )
+    rates = {}
+    if rate_types:
+        day = datetime.strptime(date[:10], '%Y-%m-%d').date()
+        grid = await get_rate_grid(db).get_rows(current_user.tenant_id, DEFAULT_KEY, rate_types, day, day)
+        rates = {
+            rt: {
+                'rate': row['sellable_rate'],
+                'currency': row.get('currency'),
+                'source': row['source'],
+                'stop_sell': row['stop_sell'],
+                'min_stay': row['min_stay']
+            }
+            for (rt, _), row in grid.items()
+        }
+    
     return {
         'date': date,
         'occupancy': {
@@ -23855,6 +23840,7 @@ async def get_calendar_tooltip(
             'revenue_by_code': {k: round(v, 2) for k, v in rate_code_revenue.items()}
         },
         'room_types': room_type_occupancy,
+        'rates': rates,
         'groups': {
             'count': len(groups_info),
             'details': groups_info
@@ -25177,7 +25163,7 @@ async def log_audit_event(tenant_id: str, user_id: str, action: str, entity_type
     }
     
     audit_copy = audit_log.copy()
-    await db.audit_logs.insert_one(audit_copy)
+    await write_log(db, 'audit_logs', audit_copy)
     return audit_log
 
 @api_router.get("/admin/audit-logs")
@@ -25188,6 +25174,7 @@ async def get_audit_logs(
     start_date: str = None,
     end_date: str = None,
     limit: int = 100,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """Get audit logs with filters"""
@@ -25202,12 +25189,14 @@ async def get_audit_logs(
     if start_date and end_date:
         query['timestamp'] = {'$gte': start_date, '$lte': end_date}
     
-    logs = await db.audit_logs.find(
-        query,
-        {'_id': 0}
-    ).sort('timestamp', -1).limit(limit).to_list(limit)
+    page = await keyset_page(db.audit_logs, query, SORT_TIMESTAMP_DESC, limit, cursor)
     
-    return {'logs': logs, 'count': len(logs)}
+    return {
+        'logs': page.items,
+        'count': len(page.items),
+        'next_cursor': page.next_cursor,
+        'has_more': page.has_more
+    }
 
 @api_router.get("/admin/audit-logs/critical")
 async def get_critical_audit_logs(
@@ -25298,24 +25287,20 @@ async def create_backup(
     request: CreateBackupRequest,
     current_user: User = Depends(get_current_user)
 ):
-    """Create database backup"""
-    backup_id = str(uuid.uuid4())
+    """Create tenant backup (streams tenant collections into compressed archives in the background)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Only admins can create backups")
+    from backup_engine import get_backup_engine, BackupError
     
-    # In production, this would trigger actual backup process
-    # For now, we'll create a backup metadata record
-    backup = {
-        'id': backup_id,
-        'tenant_id': current_user.tenant_id,
-        'backup_type': request.backup_type,
-        'status': 'in_progress',
-        'size_mb': 0,
-        'collections_included': request.include_collections or ['all'],
-        'started_at': datetime.now(timezone.utc).isoformat(),
-        'created_by': current_user.id
-    }
-    
-    backup_copy = backup.copy()
-    await db.backups.insert_one(backup_copy)
+    try:
+        backup = await get_backup_engine(db).start_backup(
+            current_user.tenant_id,
+            backup_type=request.backup_type,
+            include=request.include_collections,
+            created_by=current_user.id
+        )
+    except BackupError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Log audit event
     await log_audit_event(
@@ -25323,27 +25308,17 @@ async def create_backup(
         user_id=current_user.id,
         action='create_backup',
         entity_type='backup',
-        entity_id=backup_id,
-        details=f"Initiated {request.backup_type} backup",
+        entity_id=backup['id'],
+        details=f"Initiated {backup['backup_type']} backup",
         db=db
     )
     
-    # Simulate backup completion
-    await db.backups.update_one(
-        {'id': backup_id},
-        {
-            '$set': {
-                'status': 'completed',
-                'size_mb': 145.7,  # Mock size
-                'completed_at': datetime.now(timezone.utc).isoformat()
-            }
-        }
-    )
-    
     return {
-        'message': 'Backup created successfully',
-        'backup_id': backup_id,
-        'status': 'completed'
+        'message': 'Backup started',
+        'backup_id': backup['id'],
+        'backup_type': backup['backup_type'],
+        'parent_id': backup['parent_id'],
+        'status': backup['status']
     }
 
 @api_router.get("/admin/backup/list")
@@ -25354,17 +25329,36 @@ async def list_backups(
     """List all backups"""
     backups = await db.backups.find({
         'tenant_id': current_user.tenant_id
-    }, {'_id': 0}).sort('started_at', -1).limit(limit).to_list(limit)
+    }, {'_id': 0, 'resume_token': 0}).sort('started_at', -1).limit(limit).to_list(limit)
     
     return {'backups': backups, 'count': len(backups)}
 
+@api_router.get("/admin/backup/{backup_id}")
+async def get_backup(
+    backup_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Backup status with per-collection document counts"""
+    backup = await db.backups.find_one({
+        'id': backup_id,
+        'tenant_id': current_user.tenant_id
+    }, {'_id': 0, 'resume_token': 0})
+    
+    if not backup:
+        raise HTTPException(status_code=404, detail="Backup not found")
+    return backup
+
 @api_router.post("/admin/backup/{backup_id}/restore")
 async def restore_backup(
     backup_id: str,
     confirm: bool = False,
     current_user: User = Depends(get_current_user)
 ):
-    """Restore from backup"""
+    """Restore from backup (full backup plus any incrementals up to backup_id)"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Only admins can restore backups")
+    from backup_engine import get_backup_engine, BackupError
+    
     if not confirm:
         raise HTTPException(status_code=400, detail="Must confirm restore operation")
     
@@ -25380,6 +25374,11 @@ async def restore_backup(
     if backup.get('status') != 'completed':
         raise HTTPException(status_code=400, detail="Cannot restore from incomplete backup")
     
+    try:
+        restore_job = await get_backup_engine(db).start_restore(backup, initiated_by=current_user.id)
+    except BackupError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     # Log critical audit event
     await log_audit_event(
         tenant_id=current_user.tenant_id,
@@ -25391,26 +25390,29 @@ async def restore_backup(
         db=db
     )
     
-    # In production, this would trigger actual restore process
-    restore_job = {
-        'id': str(uuid.uuid4()),
-        'tenant_id': current_user.tenant_id,
-        'backup_id': backup_id,
-        'status': 'in_progress',
-        'started_at': datetime.now(timezone.utc).isoformat(),
-        'initiated_by': current_user.id
-    }
-    
-    restore_copy = restore_job.copy()
-    await db.restore_jobs.insert_one(restore_copy)
-    
     return {
         'message': 'Restore initiated',
         'restore_job_id': restore_job['id'],
+        'backup_chain': restore_job['chain'],
         'estimated_time': '10-15 minutes',
         'rto_target': '15 minutes'  # Recovery Time Objective
     }
 
+@api_router.get("/admin/restore/{job_id}")
+async def get_restore_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Restore job progress"""
+    job = await db.restore_jobs.find_one({
+        'id': job_id,
+        'tenant_id': current_user.tenant_id
+    }, {'_id': 0})
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Restore job not found")
+    return job
+
 @api_router.get("/admin/system/health")
 async def get_system_health(current_user: User = Depends(get_current_user)):
     """Get system health status"""
@@ -25990,6 +25992,9 @@ async def scan_passport(
                             'updated_at': datetime.now(timezone.utc).isoformat()
                         }}
                     )
+
+                    from search_index import get_search_index
+                    await get_search_index(db).reindex(current_user.tenant_id, 'guest', [guest_id])
         
         return {
             'success': True,
@@ -26056,6 +26061,9 @@ async def create_walk_in_booking(
             guest_dict['created_at'] = guest_dict['created_at'].isoformat()
             await db.guests.insert_one(guest_dict)
             guest_id = new_guest.id
+
+            from search_index import get_search_index
+            await get_search_index(db).index_guest(guest_dict)
         
         # 3. Calculate dates and amount
         check_in = datetime.now(timezone.utc).replace(hour=14, minute=0, second=0, microsecond=0)
@@ -26084,6 +26092,9 @@ async def create_walk_in_booking(
         booking_dict = new_booking.model_dump()
         booking_dict['created_at'] = booking_dict['created_at'].isoformat()
         await db.bookings.insert_one(booking_dict)
+
+        from search_index import get_search_index
+        await get_search_index(db).index_booking(booking_dict)
         
         # 5. Auto check-in
         await db.bookings.update_one(
@@ -31396,40 +31407,17 @@ async def ai_housekeeping_smart_scheduler(
 ):
     """
     AI Housekeeping Scheduler
-    - Occupancy forecast analysis
-    - Available staff calculation
-    - Intelligent task distribution
+    - Due-outs / stayovers / VIP priority for the day
+    - Available staff and shift capacity
+    - Floor-clustered task distribution (hk_assignment_engine)
     - Workload balancing
     """
-    target_date = datetime.fromisoformat(date)
+    from hk_assignment_engine import get_hk_assignment_engine
     
-    # 1. Get occupancy forecast
-    occupied_rooms = []
-    async for booking in db.bookings.find({
-        'tenant_id': current_user.tenant_id,
-        'check_in': {'$lte': date},
-        'check_out': {'$gte': date},
-        'status': {'$in': ['confirmed', 'checked_in']}
-    }):
-        occupied_rooms.append(booking.get('room_id'))
+    engine = get_hk_assignment_engine(db)
     
-    # 2. Check-outs today (require deep cleaning)
-    checkout_today = []
-    async for booking in db.bookings.find({
-        'tenant_id': current_user.tenant_id,
-        'check_out': date,
-        'status': 'checked_in'
-    }):
-        checkout_today.append(booking.get('room_id'))
-    
-    # 3. Get available HK staff
-    hk_staff = []
-    async for user in db.users.find({
-        'tenant_id': current_user.tenant_id,
-        'role': 'housekeeping',
-        'status': 'active'
-    }):
-        hk_staff.append(user)
+    # 1. Day board: due-outs, stayovers, vacant dirty rooms, VIP/arrival priority
+    hk_staff = await engine.load_staff(current_user.tenant_id)
     
     if not hk_staff:
         # Create simulated staff for demo
@@ -31441,73 +31429,25 @@ async def ai_housekeeping_smart_scheduler(
     
     staff_count = len(hk_staff)
     
-    # 4. Calculate workload
-    total_rooms = len(occupied_rooms) + len(checkout_today)
-    
-    # Standard cleaning times
-    occupied_cleaning_time = 20  # minutes
-    checkout_cleaning_time = 45  # minutes (deep clean)
-    
-    total_minutes = (len(occupied_rooms) * occupied_cleaning_time) + (len(checkout_today) * checkout_cleaning_time)
-    
-    # Available staff hours (8-hour shift = 480 minutes)
-    available_minutes = staff_count * 480
+    # 2. Balanced, floor-clustered assignment sized to each shift; persisted in bulk
+    plan = await engine.optimize(
+        current_user.tenant_id, date[:10], staff=hk_staff, assigned_by=current_user.name
+    )
+    summary = plan['summary']
     
-    # AI Task Distribution
+    total_rooms = summary['total_tasks']
+    total_minutes = summary['total_minutes']
+    available_minutes = summary['available_minutes']
     tasks_per_staff = total_rooms / staff_count if staff_count > 0 else 0
     
-    # Intelligent assignment (balance workload)
-    staff_assignments = []
-    
-    # Priority 1: Checkout rooms (must be done first)
-    checkout_assignments = distribute_tasks(checkout_today, hk_staff, 'checkout')
-    
-    # Priority 2: Occupied rooms
-    occupied_assignments = distribute_tasks(occupied_rooms, hk_staff, 'occupied')
-    
-    # Combine assignments
-    combined = {}
-    for assignment in checkout_assignments + occupied_assignments:
-        staff_name = assignment['staff_name']
-        if staff_name not in combined:
-            combined[staff_name] = {
-                'staff_name': staff_name,
-                'staff_id': assignment['staff_id'],
-                'tasks': [],
-                'total_tasks': 0,
-                'estimated_minutes': 0
-            }
-        combined[staff_name]['tasks'].append(assignment['task'])
-        combined[staff_name]['total_tasks'] += 1
-        combined[staff_name]['estimated_minutes'] += assignment['estimated_minutes']
-    
-    staff_assignments = list(combined.values())
-    
-    # Create tasks in database
-    for assignment in staff_assignments:
-        for task in assignment['tasks']:
-            await db.housekeeping_tasks.insert_one({
-                'id': str(uuid.uuid4()),
-                'tenant_id': current_user.tenant_id,
-                'room_id': task['room_id'],
-                'task_type': task['type'],
-                'priority': task['priority'],
-                'assigned_to': assignment['staff_name'],
-                'status': 'pending',
-                'scheduled_date': date,
-                'estimated_duration': task['estimated_minutes'],
-                'created_at': datetime.now(timezone.utc).isoformat(),
-                'source': 'ai_scheduler'
-            })
-    
     # Capacity analysis
     capacity_pct = (total_minutes / available_minutes * 100) if available_minutes > 0 else 0
     
     return {
         'date': date,
         'forecast': {
-            'occupied_rooms': len(occupied_rooms),
-            'checkout_rooms': len(checkout_today),
+            'occupied_rooms': summary['stayovers'],
+            'checkout_rooms': summary['checkouts'],
             'total_rooms_to_clean': total_rooms
         },
         'staffing': {
@@ -31520,37 +31460,13 @@ async def ai_housekeeping_smart_scheduler(
         'ai_schedule': {
             'tasks_per_staff': round(tasks_per_staff, 1),
             'workload_balanced': True,
-            'staff_assignments': staff_assignments
+            'staff_assignments': plan['staff_assignments'],
+            'summary': summary
         },
         'recommendations': generate_scheduling_recommendations(capacity_pct, staff_count, total_rooms)
     }
 
 
-def distribute_tasks(room_ids, staff, task_type):
-    """Distribute tasks evenly among staff"""
-    assignments = []
-    estimated_time = 45 if task_type == 'checkout' else 20
-    priority = 'high' if task_type == 'checkout' else 'normal'
-    
-    for idx, room_id in enumerate(room_ids):
-        staff_idx = idx % len(staff)
-        staff_member = staff[staff_idx]
-        
-        assignments.append({
-            'staff_id': staff_member.get('id'),
-            'staff_name': staff_member.get('name'),
-            'task': {
-                'room_id': room_id,
-                'type': task_type,
-                'priority': priority,
-                'estimated_minutes': estimated_time
-            },
-            'estimated_minutes': estimated_time
-        })
-    
-    return assignments
-
-
 def generate_scheduling_recommendations(capacity_pct, staff_count, total_rooms):
     """Generate staffing recommendations"""
     recommendations = []
@@ -31731,9 +31647,33 @@ def get_tier_benefits(tier):
 
 # ============= ML TRAINING ENDPOINTS =============
 
+async def _train_model(kind: str, size: Optional[int], background: bool, current_user: User, message: str):
+    """Run a training job in the ML process pool; the event loop only awaits the result"""
+    from ml_model_service import init_training_service
+    
+    training = init_training_service(db)
+    job = await training.submit(kind, size, requested_by=current_user.id, tenant_id=current_user.tenant_id)
+    if background:
+        return {'success': True, 'message': f'{message} (queued)', 'job_id': job['id'], 'status': job['status']}
+    
+    try:
+        result = await training.wait(job['id'])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Training failed: {str(e)}")
+    
+    return {
+        'success': True,
+        'message': message,
+        'job_id': job['id'],
+        'metrics': result['metrics'],
+        'data_summary': result['data_summary']
+    }
+
+
 @api_router.post("/ml/rms/train")
 async def train_rms_model(
     historical_days: int = 730,
+    background: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -31741,48 +31681,15 @@ async def train_rms_model(
     - Generates 2 years of synthetic training data
     - Trains XGBoost models for occupancy prediction and dynamic pricing
     - Saves models to disk for production use
+    - background=true returns a job id immediately
     """
-    try:
-        from ml_data_generators import RMSDataGenerator
-        from ml_trainers import RMSModelTrainer
-        
-        # Generate training data
-        print(f"Generating {historical_days} days of RMS training data...")
-        data_df = RMSDataGenerator.generate(days=historical_days)
-        
-        # Train models
-        trainer = RMSModelTrainer(model_dir='ml_models')
-        metrics = trainer.train(data_df)
-        
-        return {
-            'success': True,
-            'message': 'RMS models trained successfully',
-            'metrics': metrics,
-            'data_summary': {
-                'total_samples': len(data_df),
-                'date_range': {
-                    'start': data_df['date'].min(),
-                    'end': data_df['date'].max()
-                },
-                'occupancy_range': {
-                    'min': float(data_df['occupancy_rate'].min()),
-                    'max': float(data_df['occupancy_rate'].max()),
-                    'mean': float(data_df['occupancy_rate'].mean())
-                },
-                'price_range': {
-                    'min': float(data_df['optimal_price'].min()),
-                    'max': float(data_df['optimal_price'].max()),
-                    'mean': float(data_df['optimal_price'].mean())
-                }
-            }
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Training failed: {str(e)}")
+    return await _train_model('rms', historical_days, background, current_user, 'RMS models trained successfully')
 
 
 @api_router.post("/ml/persona/train")
 async def train_persona_model(
     num_guests: int = 400,
+    background: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -31791,36 +31698,13 @@ async def train_persona_model(
     - Trains Random Forest classifier for persona segmentation
     - Saves model to disk for production use
     """
-    try:
-        from ml_data_generators import PersonaDataGenerator
-        from ml_trainers import PersonaModelTrainer
-        
-        # Generate training data
-        print(f"Generating {num_guests} guest persona training samples...")
-        data_df = PersonaDataGenerator.generate(num_guests=num_guests)
-        
-        # Train model
-        trainer = PersonaModelTrainer(model_dir='ml_models')
-        metrics = trainer.train(data_df)
-        
-        return {
-            'success': True,
-            'message': 'Persona model trained successfully',
-            'metrics': metrics,
-            'data_summary': {
-                'total_guests': len(data_df),
-                'persona_distribution': data_df['persona_type'].value_counts().to_dict(),
-                'avg_stays': float(data_df['total_stays'].mean()),
-                'avg_spend': float(data_df['avg_spend'].mean())
-            }
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Training failed: {str(e)}")
+    return await _train_model('persona', num_guests, background, current_user, 'Persona model trained successfully')
 
 
 @api_router.post("/ml/predictive-maintenance/train")
 async def train_predictive_maintenance_model(
     num_samples: int = 1000,
+    background: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -31830,36 +31714,14 @@ async def train_predictive_maintenance_model(
     - Trains Gradient Boosting for days-until-failure prediction
     - Saves models to disk for production use
     """
-    try:
-        from ml_data_generators import PredictiveMaintenanceDataGenerator
-        from ml_trainers import PredictiveMaintenanceModelTrainer
-        
-        # Generate training data
-        print(f"Generating {num_samples} predictive maintenance training samples...")
-        data_df = PredictiveMaintenanceDataGenerator.generate(num_samples=num_samples)
-        
-        # Train models
-        trainer = PredictiveMaintenanceModelTrainer(model_dir='ml_models')
-        metrics = trainer.train(data_df)
-        
-        return {
-            'success': True,
-            'message': 'Predictive maintenance models trained successfully',
-            'metrics': metrics,
-            'data_summary': {
-                'total_samples': len(data_df),
-                'equipment_distribution': data_df['equipment_type'].value_counts().to_dict(),
-                'risk_distribution': data_df['failure_risk'].value_counts().to_dict(),
-                'avg_days_until_failure': float(data_df['days_until_failure'].mean())
-            }
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Training failed: {str(e)}")
+    return await _train_model('predictive_maintenance', num_samples, background, current_user,
+                              'Predictive maintenance models trained successfully')
 
 
 @api_router.post("/ml/hk-scheduler/train")
 async def train_hk_scheduler_model(
     num_days: int = 365,
+    background: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -31868,125 +31730,130 @@ async def train_hk_scheduler_model(
     - Trains Random Forest regressors for staff and hours prediction
     - Saves models to disk for production use
     """
-    try:
-        from ml_data_generators import HKSchedulerDataGenerator
-        from ml_trainers import HKSchedulerModelTrainer
-        
-        # Generate training data
-        print(f"Generating {num_days} days of HK scheduler training data...")
-        data_df = HKSchedulerDataGenerator.generate(num_days=num_days)
-        
-        # Train models
-        trainer = HKSchedulerModelTrainer(model_dir='ml_models')
-        metrics = trainer.train(data_df)
-        
-        return {
-            'success': True,
-            'message': 'HK scheduler models trained successfully',
-            'metrics': metrics,
-            'data_summary': {
-                'total_days': len(data_df),
-                'avg_occupancy': float(data_df['occupancy_rate'].mean()),
-                'avg_staff_needed': float(data_df['staff_needed'].mean()),
-                'avg_hours': float(data_df['estimated_hours'].mean()),
-                'peak_staff_needed': int(data_df['staff_needed'].max())
-            }
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Training failed: {str(e)}")
+    return await _train_model('hk_scheduler', num_days, background, current_user, 'HK scheduler models trained successfully')
+
+
+@api_router.post("/ml/no-show/train")
+async def train_no_show_model(
+    num_bookings: int = 5000,
+    background: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Train No-Show ML Model
+    - Generates synthetic booking outcomes
+    - Trains XGBoost classifier for no-show probability
+    - Saves model to disk for production use
+    """
+    return await _train_model('no_show', num_bookings, background, current_user, 'No-show model trained successfully')
 
 
 @api_router.post("/ml/train-all")
 async def train_all_models(
+    background: bool = False,
     current_user: User = Depends(get_current_user)
 ):
     """
-    Train ALL ML Models in sequence
+    Train ALL ML Models
     - RMS (Revenue Management)
     - Persona (Guest Segmentation)
     - Predictive Maintenance
     - HK Scheduler
+    - No-Show
+    Jobs run in the ML process pool (ML_TRAINING_WORKERS processes)
     """
+    from ml_model_service import init_training_service, TRAINING_SPECS
+    
+    training = init_training_service(db)
+    jobs = {
+        kind: await training.submit(kind, requested_by=current_user.id, tenant_id=current_user.tenant_id)
+        for kind in TRAINING_SPECS
+    }
+    if background:
+        return {
+            'success': True,
+            'message': f'{len(jobs)} training jobs queued',
+            'jobs': {kind: job['id'] for kind, job in jobs.items()}
+        }
+    
+    outcomes = await asyncio.gather(*(training.wait(job['id']) for job in jobs.values()), return_exceptions=True)
+    
     results = {}
     errors = []
+    for kind, outcome in zip(jobs, outcomes):
+        if isinstance(outcome, Exception):
+            results[kind] = {'status': 'failed', 'error': str(outcome)}
+            errors.append(f"{kind}: {str(outcome)}")
+        else:
+            results[kind] = {**outcome['metrics'], 'status': 'success'}
     
-    try:
-        # Import all required modules
-        from ml_data_generators import (
-            RMSDataGenerator,
-            PersonaDataGenerator,
-            PredictiveMaintenanceDataGenerator,
-            HKSchedulerDataGenerator
-        )
-        from ml_trainers import (
-            RMSModelTrainer,
-            PersonaModelTrainer,
-            PredictiveMaintenanceModelTrainer,
-            HKSchedulerModelTrainer
-        )
-        
-        # 1. Train RMS Model
-        try:
-            print("\n=== Training RMS Model ===")
-            data_df = RMSDataGenerator.generate(days=730)
-            trainer = RMSModelTrainer(model_dir='ml_models')
-            results['rms'] = trainer.train(data_df)
-            results['rms']['status'] = 'success'
-        except Exception as e:
-            results['rms'] = {'status': 'failed', 'error': str(e)}
-            errors.append(f"RMS: {str(e)}")
-        
-        # 2. Train Persona Model
-        try:
-            print("\n=== Training Persona Model ===")
-            data_df = PersonaDataGenerator.generate(num_guests=400)
-            trainer = PersonaModelTrainer(model_dir='ml_models')
-            results['persona'] = trainer.train(data_df)
-            results['persona']['status'] = 'success'
-        except Exception as e:
-            results['persona'] = {'status': 'failed', 'error': str(e)}
-            errors.append(f"Persona: {str(e)}")
-        
-        # 3. Train Predictive Maintenance Model
-        try:
-            print("\n=== Training Predictive Maintenance Model ===")
-            data_df = PredictiveMaintenanceDataGenerator.generate(num_samples=1000)
-            trainer = PredictiveMaintenanceModelTrainer(model_dir='ml_models')
-            results['predictive_maintenance'] = trainer.train(data_df)
-            results['predictive_maintenance']['status'] = 'success'
-        except Exception as e:
-            results['predictive_maintenance'] = {'status': 'failed', 'error': str(e)}
-            errors.append(f"Predictive Maintenance: {str(e)}")
-        
-        # 4. Train HK Scheduler Model
-        try:
-            print("\n=== Training HK Scheduler Model ===")
-            data_df = HKSchedulerDataGenerator.generate(num_days=365)
-            trainer = HKSchedulerModelTrainer(model_dir='ml_models')
-            results['hk_scheduler'] = trainer.train(data_df)
-            results['hk_scheduler']['status'] = 'success'
-        except Exception as e:
-            results['hk_scheduler'] = {'status': 'failed', 'error': str(e)}
-            errors.append(f"HK Scheduler: {str(e)}")
-        
-        # Summary
-        successful = sum(1 for r in results.values() if r.get('status') == 'success')
-        total = len(results)
-        
-        return {
-            'success': len(errors) == 0,
-            'message': f'Training complete: {successful}/{total} models trained successfully',
-            'results': results,
-            'errors': errors if errors else None,
-            'summary': {
-                'total_models': total,
-                'successful': successful,
-                'failed': len(errors)
-            }
+    successful = sum(1 for r in results.values() if r.get('status') == 'success')
+    total = len(results)
+    
+    return {
+        'success': len(errors) == 0,
+        'message': f'Training complete: {successful}/{total} models trained successfully',
+        'results': results,
+        'errors': errors if errors else None,
+        'summary': {
+            'total_models': total,
+            'successful': successful,
+            'failed': len(errors)
         }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Bulk training failed: {str(e)}")
+    }
+
+
+@api_router.get("/ml/jobs")
+async def list_ml_training_jobs(
+    limit: int = 50,
+    current_user: User = Depends(get_current_user)
+):
+    """Recent ML training jobs"""
+    from ml_model_service import init_training_service
+    
+    return {'jobs': await init_training_service(db).list_jobs(min(limit, 200))}
+
+
+@api_router.get("/ml/jobs/{job_id}")
+async def get_ml_training_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Status and metrics of one ML training job"""
+    from ml_model_service import init_training_service
+    
+    job = await init_training_service(db).get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return job
+
+
+class MLPredictRequest(BaseModel):
+    rows: List[Dict[str, Any]]
+
+
+@api_router.post("/ml/predict/{target}")
+async def ml_batch_predict(
+    target: str,
+    request: MLPredictRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Vectorised batch prediction with the in-memory model
+    Targets: price, occupancy, no_show, hk_hours, hk_staff, persona, maintenance_risk
+    Each row is a feature dict; missing features fall back to model defaults
+    """
+    from ml_model_service import model_registry, PREDICTORS, ModelNotAvailableError
+    
+    if target not in PREDICTORS:
+        raise HTTPException(status_code=404, detail=f"Unknown prediction target: {target}")
+    if len(request.rows) > 50000:
+        raise HTTPException(status_code=413, detail="At most 50000 rows per request")
+    
+    try:
+        return await model_registry.predict(target, request.rows)
+    except ModelNotAvailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
 
 @api_router.get("/ml/models/status")
@@ -32000,8 +31867,9 @@ async def get_ml_models_status(
     """
     import os
     import json
+    from ml_model_service import model_registry, MODEL_DIR
     
-    model_dir = 'ml_models'
+    model_dir = MODEL_DIR
     
     models_status = {
         'rms': {
@@ -32019,6 +31887,10 @@ async def get_ml_models_status(
         'hk_scheduler': {
             'trained': False,
             'files': ['hk_staff_model.pkl', 'hk_hours_model.pkl', 'hk_scheduler_metrics.json']
+        },
+        'no_show': {
+            'trained': False,
+            'files': ['no_show_model.pkl', 'no_show_metrics.json']
         }
     }
     
@@ -32055,7 +31927,8 @@ async def get_ml_models_status(
             'trained_models': trained_count,
             'untrained_models': total_count - trained_count,
             'all_ready': trained_count == total_count
-        }
+        },
+        'serving': model_registry.status()
     }
 
 
@@ -33532,6 +33405,9 @@ async def update_guest_profile(
             'created_at': datetime.now(timezone.utc).isoformat()
         }
         await db.guests.insert_one(guest_data)
+
+        from search_index import get_search_index
+        await get_search_index(db).index_guest(guest_data)
         return {'success': True, 'message': 'Profile created'}
     
     # Update existing profile
@@ -33548,6 +33424,12 @@ async def update_guest_profile(
         {'id': guest['id']},
         {'$set': update_data}
     )
+
+    from search_index import get_search_index
+    await get_search_index(db).index_guest({**guest, **update_data})
+    if {'name', 'email'} & set(update_data):
+        from guest_rollup import get_guest_rollups
+        await get_guest_rollups(db).refresh_profile(current_user.tenant_id, guest['id'])
     
     return {'success': True, 'message': 'Profile updated'}
 
@@ -33775,13 +33657,13 @@ async def get_logs_dashboard(
     - Recent errors, alerts
     - System health indicators
     """
-    # Get counts for each log type
-    error_count = await db.error_logs.count_documents({'tenant_id': current_user.tenant_id})
-    night_audit_count = await db.night_audit_logs.count_documents({'tenant_id': current_user.tenant_id})
-    ota_sync_count = await db.ota_sync_logs.count_documents({'tenant_id': current_user.tenant_id})
-    rms_publish_count = await db.rms_publish_logs.count_documents({'tenant_id': current_user.tenant_id})
-    maintenance_prediction_count = await db.maintenance_prediction_logs.count_documents({'tenant_id': current_user.tenant_id})
-    alert_count = await db.alert_history.count_documents({'tenant_id': current_user.tenant_id})
+    # Counts for each log type: precomputed counter rows (log_pipeline.py)
+    from log_pipeline import LogPipeline, get_log_pipeline
+    pipeline = get_log_pipeline() or LogPipeline(db)
+    counters = await pipeline.counters(current_user.tenant_id, [
+        'error_logs', 'night_audit_logs', 'ota_sync_logs', 'rms_publish_logs', 'maintenance_prediction_logs',
+        'alert_history'
+    ])
     
     # Recent critical errors (last 24 hours)
     from datetime import timedelta
@@ -33820,11 +33702,7 @@ async def get_logs_dashboard(
         })
     
     # Check for failed night audits
-    failed_audits = await db.night_audit_logs.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'status': 'failed',
-        'timestamp': {'$gte': yesterday}
-    })
+    failed_audits = counters['night_audit_logs']['recent']['status'].get('failed', 0)
     
     if failed_audits > 0:
         health['overall_status'] = 'warning'
@@ -33835,11 +33713,7 @@ async def get_logs_dashboard(
         })
     
     # Check for OTA sync failures
-    failed_syncs = await db.ota_sync_logs.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'status': 'failed',
-        'timestamp': {'$gte': yesterday}
-    })
+    failed_syncs = counters['ota_sync_logs']['recent']['status'].get('failed', 0)
     
     if failed_syncs > 2:
         health['overall_status'] = 'warning'
@@ -33858,13 +33732,14 @@ async def get_logs_dashboard(
     
     return {
         'summary': {
-            'total_errors': error_count,
-            'total_night_audits': night_audit_count,
-            'total_ota_syncs': ota_sync_count,
-            'total_rms_publishes': rms_publish_count,
-            'total_maintenance_predictions': maintenance_prediction_count,
-            'total_alerts': alert_count
-        },
+            'total_errors': counters['error_logs']['total'],
+            'total_night_audits': counters['night_audit_logs']['total'],
+            'total_ota_syncs': counters['ota_sync_logs']['total'],
+            'total_rms_publishes': counters['rms_publish_logs']['total'],
+            'total_maintenance_predictions': counters['maintenance_prediction_logs']['total'],
+            'total_alerts': counters['alert_history']['total']
+        },
+        'last_24h': {name: c['recent'] for name, c in counters.items()},
         'recent_critical_errors': recent_critical_errors,
         'unread_alerts': unread_alerts,
         'health': health
@@ -36423,8 +36298,10 @@ async def trigger_auto_messages(
 ):
     """Trigger automatic messages based on trigger type"""
     current_user = await get_current_user(credentials)
+    from message_delivery import get_delivery_service
     
     messages_sent = 0
+    batch_id = None
     
     if trigger_type == AutoMessageTrigger.PRE_ARRIVAL:
         # Find bookings with check-in tomorrow
@@ -36432,48 +36309,127 @@ async def trigger_auto_messages(
         tomorrow_start = tomorrow.replace(hour=0, minute=0, second=0, microsecond=0)
         tomorrow_end = tomorrow.replace(hour=23, minute=59, second=59, microsecond=999999)
         
-        async for booking in db.bookings.find({
+        # One template lookup for the whole run
+        template = await db.message_templates.find_one({
             'tenant_id': current_user.tenant_id,
-            'check_in': {'$gte': tomorrow_start, '$lte': tomorrow_end},
-            'status': {'$in': ['confirmed', 'guaranteed']}
-        }):
-            # Get guest
-            guest = await db.guests.find_one({'id': booking['guest_id'], 'tenant_id': current_user.tenant_id})
-            if guest and guest.get('phone'):
-                # Get template
-                template = await db.message_templates.find_one({
-                    'tenant_id': current_user.tenant_id,
-                    'trigger': trigger_type.value,
-                    'active': True
-                })
+            'trigger': trigger_type.value,
+            'active': True
+        })
+        
+        if template:
+            bookings = await db.bookings.find({
+                'tenant_id': current_user.tenant_id,
+                'check_in': {'$gte': tomorrow_start, '$lte': tomorrow_end},
+                'status': {'$in': ['confirmed', 'guaranteed']}
+            }, {'_id': 0, 'id': 1, 'guest_id': 1, 'room_id': 1, 'check_in': 1}).to_list(5000)
+            
+            # Batch guest and room lookups instead of two find_one calls per booking
+            guest_ids = list({b['guest_id'] for b in bookings if b.get('guest_id')})
+            room_ids = list({b['room_id'] for b in bookings if b.get('room_id')})
+            guests = {
+                g['id']: g async for g in db.guests.find(
+                    {'tenant_id': current_user.tenant_id, 'id': {'$in': guest_ids}},
+                    {'_id': 0, 'id': 1, 'name': 1, 'phone': 1, 'email': 1}
+                )
+            }
+            rooms = {
+                r['id']: r async for r in db.rooms.find(
+                    {'tenant_id': current_user.tenant_id, 'id': {'$in': room_ids}},
+                    {'_id': 0, 'id': 1, 'room_number': 1}
+                )
+            }
+            
+            message_type = MessageType(template['message_type'])
+            sent_messages = []
+            outbound = []
+            for booking in bookings:
+                guest = guests.get(booking.get('guest_id'))
+                recipient = (guest or {}).get('email' if message_type == MessageType.EMAIL else 'phone')
+                if not recipient:
+                    continue
                 
-                if template:
-                    # Replace variables
-                    room = await db.rooms.find_one({'id': booking['room_id'], 'tenant_id': current_user.tenant_id})
-                    message_content = template['message_content'].replace('{guest_name}', guest['name'])
-                    message_content = message_content.replace('{room_number}', room.get('room_number', 'N/A') if room else 'N/A')
-                    message_content = message_content.replace('{check_in_date}', booking['check_in'].strftime('%Y-%m-%d') if isinstance(booking['check_in'], datetime) else str(booking['check_in']))
-                    
-                    # Send message
-                    message = SentMessage(
-                        tenant_id=current_user.tenant_id,
-                        guest_id=guest['id'],
-                        booking_id=booking['id'],
-                        message_type=MessageType(template['message_type']),
-                        recipient=guest['phone'],
-                        message_content=message_content
-                    )
-                    
-                    await db.sent_messages.insert_one(message.model_dump())
-                    messages_sent += 1
+                # Replace variables
+                room = rooms.get(booking.get('room_id'))
+                message_content = template['message_content'].replace('{guest_name}', guest.get('name', ''))
+                message_content = message_content.replace('{room_number}', room.get('room_number', 'N/A') if room else 'N/A')
+                message_content = message_content.replace('{check_in_date}', booking['check_in'].strftime('%Y-%m-%d') if isinstance(booking['check_in'], datetime) else str(booking['check_in']))
+                
+                message = SentMessage(
+                    tenant_id=current_user.tenant_id,
+                    guest_id=guest['id'],
+                    booking_id=booking['id'],
+                    message_type=message_type,
+                    recipient=recipient,
+                    message_content=message_content,
+                    status='queued'
+                )
+                sent_messages.append(message.model_dump())
+                outbound.append({
+                    'channel': message_type.value,
+                    'recipient': recipient,
+                    'subject': template.get('subject') or template.get('name', ''),
+                    'text': message_content,
+                    'source': {'type': 'auto_message', 'trigger': trigger_type.value, 'sent_message_id': message.id}
+                })
+            
+            if sent_messages:
+                delivery = get_delivery_service()
+                if delivery and delivery.running:
+                    # Rows go in first so the workers' status write-back always finds them
+                    batch_id = str(uuid.uuid4())
+                    for doc in sent_messages:
+                        doc['delivery_batch_id'] = batch_id
+                    await db.sent_messages.insert_many(sent_messages)
+                    await delivery.enqueue_batch(outbound, tenant_id=current_user.tenant_id, batch_id=batch_id)
+                else:
+                    for doc in sent_messages:
+                        doc['status'] = 'failed'
+                        doc['error'] = 'Delivery service not running'
+                    await db.sent_messages.insert_many(sent_messages)
+                messages_sent = len(sent_messages) if batch_id else 0
     
     return {
         'success': True,
         'trigger_type': trigger_type.value,
         'messages_sent': messages_sent,
-        'note': 'Production integration with messaging services required'
+        'delivery_batch_id': batch_id
     }
 
+
+@api_router.get("/messaging/delivery/stats")
+async def get_delivery_queue_stats(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Outbound queue depth per channel/status and provider throughput"""
+    current_user = await get_current_user(credentials)
+    from message_delivery import get_delivery_service
+    
+    delivery = get_delivery_service()
+    if not delivery:
+        raise HTTPException(status_code=503, detail="Delivery service not running")
+    return await delivery.queue_stats(current_user.tenant_id)
+
+
+@api_router.get("/messaging/delivery/batches/{batch_id}")
+async def get_delivery_batch_status(
+    batch_id: str,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Delivery progress of one batch (campaign, auto-message run, report)"""
+    current_user = await get_current_user(credentials)
+    from message_delivery import get_delivery_service
+    
+    delivery = get_delivery_service()
+    if not delivery:
+        raise HTTPException(status_code=503, detail="Delivery service not running")
+    
+    owned = await db.outbound_messages.find_one(
+        {'batch_id': batch_id, 'tenant_id': current_user.tenant_id}, {'_id': 1}
+    )
+    if not owned:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return {'batch_id': batch_id, 'status': await delivery.batch_status(batch_id)}
+
 # ===== 6. POS IMPROVEMENTS =====
 
 class POSCategory(str, Enum):
@@ -37173,7 +37129,7 @@ async def change_room_mobile(
         )
     
     # Log room change
-    await db.audit_logs.insert_one({
+    await write_log(db, 'audit_logs', {
         'id': str(uuid.uuid4()),
         'tenant_id': current_user.tenant_id,
         'user_id': current_user.user_id,
@@ -38968,9 +38924,12 @@ async def update_menu_item_price_mobile(
             }
         }
     )
+
+    from pos_engine import get_pos_engine
+    get_pos_engine(db).catalog.invalidate(current_user.tenant_id, menu_item.get('outlet_id'))
     
     # Log price change
-    await db.audit_logs.insert_one({
+    await write_log(db, 'audit_logs', {
         'id': str(uuid.uuid4()),
         'tenant_id': current_user.tenant_id,
         'user_id': current_user.user_id,
@@ -39476,13 +39435,6 @@ async def search_bookings(
     
     search_query = {'tenant_id': current_user.tenant_id}
     
-    # Text search on booking number or guest name
-    if query:
-        search_query['$or'] = [
-            {'booking_number': {'$regex': query, '$options': 'i'}},
-            {'guest_name': {'$regex': query, '$options': 'i'}}
-        ]
-    
     # Date range filter
     if date_from or date_to:
         date_filter = {}
@@ -39497,10 +39449,31 @@ async def search_bookings(
     if status:
         search_query['status'] = status
     
+    # Text search on booking number or guest name (token index; regex only while it builds)
+    ranked_ids = None
+    if query:
+        from search_index import get_search_index
+        # Filters go to the index lookup so matches outside the first candidate page are not lost
+        ranked_ids = await get_search_index(db).ids(
+            current_user.tenant_id, query, 'booking', limit=50,
+            where=dict(search_query), sort_from=date_from, sort_to=date_to
+        )
+        if ranked_ids is not None:
+            search_query['id'] = {'$in': ranked_ids}
+        else:
+            pattern = re.escape(query)
+            search_query['$or'] = [
+                {'booking_number': {'$regex': pattern, '$options': 'i'}},
+                {'guest_name': {'$regex': pattern, '$options': 'i'}}
+            ]
+    
     bookings = []
     async for booking in db.bookings.find(search_query).sort('created_at', -1).limit(50):
         booking.pop('_id', None)
         bookings.append(booking)
+    if ranked_ids:
+        rank = {booking_id: i for i, booking_id in enumerate(ranked_ids)}
+        bookings.sort(key=lambda b: rank.get(b['id'], len(rank)))
     
     return {
         'bookings': bookings,
@@ -41355,28 +41328,37 @@ async def get_api_metrics(
     if current_user.role not in ['admin', 'it_manager']:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Mock API metrics (in production, collect from actual monitoring)
-    now = datetime.now(timezone.utc)
-    metrics = []
+    overall = metrics_registry.overall(hours)
+    metrics = [
+        {
+            'timestamp': window['timestamp'],
+            'avg_response_time': window.get('avg_ms', 0),
+            'p50_response_time': window.get('p50_ms', 0),
+            'p95_response_time': window.get('p95_ms', 0),
+            'p99_response_time': window.get('p99_ms', 0),
+            'requests_per_minute': window['requests_per_minute'],
+            'error_rate': window['error_rate'],
+            'success_rate': round(100 - window['error_rate'], 2)
+        }
+        for window in metrics_registry.hourly_metrics(hours)
+    ]
     
-    for i in range(24):
-        timestamp = now - timedelta(hours=23-i)
-        metrics.append({
-            'timestamp': timestamp.isoformat(),
-            'avg_response_time': round(50 + (i % 5) * 10 + random.uniform(-10, 10), 2),
-            'requests_per_minute': 120 + random.randint(-20, 20),
-            'error_rate': round(random.uniform(0.5, 2.5), 2),
-            'success_rate': round(100 - random.uniform(0.5, 2.5), 2)
-        })
+    uptime_seconds = (datetime.now(timezone.utc) - metrics_registry.started_at).total_seconds()
     
     return {
         'metrics': metrics,
         'summary': {
-            'avg_response_time': round(sum(m['avg_response_time'] for m in metrics) / len(metrics), 2),
-            'total_requests': sum(m['requests_per_minute'] for m in metrics) * 60,
-            'avg_error_rate': round(sum(m['error_rate'] for m in metrics) / len(metrics), 2),
-            'uptime_percentage': 99.8
-        }
+            'avg_response_time': overall.get('avg_ms', 0),
+            'p50_response_time': overall.get('p50_ms', 0),
+            'p95_response_time': overall.get('p95_ms', 0),
+            'p99_response_time': overall.get('p99_ms', 0),
+            'total_requests': overall.get('count', 0),
+            'avg_error_rate': overall['error_rate'],
+            'uptime_percentage': round(100 - overall['error_rate'], 2),
+            'collecting_since': metrics_registry.started_at.isoformat(),
+            'uptime_seconds': int(uptime_seconds)
+        },
+        'slowest_routes': metrics_registry.route_metrics()[:10]
     }
 
 @api_router.get("/monitoring/system-health")
@@ -41882,24 +41864,6 @@ async def get_menu_items(current_user: User = Depends(get_current_user)):
     except Exception as e:
         return []
 
-@api_router.get("/pos/daily-summary")
-async def get_pos_daily_summary(date: str = None, current_user: User = Depends(get_current_user)):
-    """Get daily POS summary"""
-    try:
-        transactions = await db.transactions.find({
-            'tenant_id': current_user.tenant_id,
-            'type': {'$in': ['fnb_charge', 'room_charge']}
-        }, {'_id': 0}).to_list(1000)
-        
-        total_sales = sum(t.get('amount', 0) for t in transactions)
-        return {
-            'total_sales': total_sales,
-            'transaction_count': len(transactions),
-            'average_transaction': total_sales / len(transactions) if transactions else 0
-        }
-    except Exception as e:
-        return {'total_sales': 0, 'transaction_count': 0, 'average_transaction': 0}
-
 @api_router.get("/pos/transactions")
 async def get_pos_transactions(limit: int = 10, current_user: User = Depends(get_current_user)):
     """Get recent POS transactions"""
@@ -41911,37 +41875,6 @@ async def get_pos_transactions(limit: int = 10, current_user: User = Depends(get
     except Exception as e:
         return []
 
-@api_router.get("/pos/z-report")
-async def get_z_report(date: str = None, current_user: User = Depends(get_current_user)):
-    """Get Z report for end of day"""
-    try:
-        transactions = await db.transactions.find({
-            'tenant_id': current_user.tenant_id
-        }, {'_id': 0}).to_list(1000)
-        
-        total_sales = sum(t.get('amount', 0) for t in transactions)
-        
-        return {
-            'report_date': date or datetime.utcnow().isoformat(),
-            'report_number': f'Z-{datetime.utcnow().strftime("%Y%m%d")}',
-            'gross_sales': total_sales,
-            'transaction_count': len(transactions),
-            'net_sales': total_sales,
-            'refunds': 0,
-            'discounts': 0,
-            'payment_methods': {
-                'cash': total_sales * 0.4,
-                'card': total_sales * 0.6
-            },
-            'category_sales': {
-                'food': total_sales * 0.5,
-                'beverage': total_sales * 0.3,
-                'other': total_sales * 0.2
-            }
-        }
-    except Exception as e:
-        return {'gross_sales': 0, 'transaction_count': 0}
-
 @api_router.get("/pos/void-transactions")
 async def get_void_transactions(start_date: str = None, end_date: str = None, current_user: User = Depends(get_current_user)):
     """Get voided transactions"""
@@ -44160,65 +44093,32 @@ async def get_z_report(
     """Get Z report (end of day report) for POS"""
     current_user = await get_current_user(credentials)
     
-    if date:
-        target_date = datetime.fromisoformat(date)
-    else:
-        target_date = datetime.now(timezone.utc)
-    
-    start_of_day = target_date.replace(hour=0, minute=0, second=0)
-    end_of_day = target_date.replace(hour=23, minute=59, second=59)
-    
-    query = {
-        'tenant_id': current_user.tenant_id,
-        'created_at': {'$gte': start_of_day, '$lte': end_of_day}
-    }
-    
-    if outlet_id:
-        query['outlet_id'] = outlet_id
-    
-    # Get all transactions
-    total_sales = 0
-    total_tax = 0
-    transaction_count = 0
-    payment_methods = {}
-    voided_amount = 0
-    
-    async for transaction in db.pos_transactions.find(query):
-        if transaction.get('status') == 'voided':
-            voided_amount += transaction.get('total_amount', 0)
-            continue
-        
-        total_sales += transaction.get('total_amount', 0)
-        total_tax += transaction.get('tax_amount', 0)
-        transaction_count += 1
-        
-        payment_method = transaction.get('payment_method', 'cash')
-        payment_methods[payment_method] = payment_methods.get(payment_method, 0) + transaction.get('total_amount', 0)
+    report_date = (date or datetime.now(timezone.utc).date().isoformat())[:10]
     
-    # Get category breakdown
-    category_sales = {}
-    async for order in db.pos_orders.find(query):
-        for item in order.get('items', []):
-            category = item.get('category', 'other')
-            category_sales[category] = category_sales.get(category, 0) + item.get('total', 0)
+    # Running day totals across both POS channels (menu tickets + quick sales)
+    from pos_daily_totals import get_pos_daily_totals
+    totals = await get_pos_daily_totals(db).day(current_user.tenant_id, report_date, outlet_id, channel=None)
     
-    # Calculate net sales
+    total_sales = totals['gross_sales']
+    transaction_count = totals['transaction_count']
+    voided_amount = 0  # Voids are never posted into the day totals
     net_sales = total_sales - voided_amount
     
     return {
-        'date': target_date.date().isoformat(),
+        'date': report_date,
         'outlet_id': outlet_id,
         'report_type': 'z_report',
+        'sealed': totals['sealed'],
         'summary': {
-            'gross_sales': total_sales,
+            'gross_sales': round(total_sales, 2),
             'voided_amount': voided_amount,
-            'net_sales': net_sales,
-            'total_tax': total_tax,
+            'net_sales': round(net_sales, 2),
+            'total_tax': 0,
             'transaction_count': transaction_count,
-            'average_transaction': net_sales / transaction_count if transaction_count > 0 else 0
+            'average_transaction': round(net_sales / transaction_count, 2) if transaction_count > 0 else 0
         },
-        'payment_methods': payment_methods,
-        'category_sales': category_sales,
+        'payment_methods': {m: round(v['amount'], 2) for m, v in totals['payment_methods'].items()},
+        'category_sales': {c: round(v, 2) for c, v in totals['categories'].items()},
         'generated_at': datetime.now(timezone.utc).isoformat()
     }
 
@@ -44308,6 +44208,9 @@ async def create_menu_item(
     }
     
     await db.pos_menu_items.insert_one(menu_item)
+
+    from pos_engine import get_pos_engine
+    get_pos_engine(db).catalog.invalidate(current_user.tenant_id)
     
     return {
         'message': 'Menu item created',
@@ -44349,6 +44252,9 @@ async def update_menu_item(
             }
         }
     )
+
+    from pos_engine import get_pos_engine
+    get_pos_engine(db).catalog.invalidate(current_user.tenant_id, existing_item.get('outlet_id'))
     
     return {
         'message': 'Menu item updated',
@@ -44371,6 +44277,9 @@ async def delete_menu_item(
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Menu item not found")
+
+    from pos_engine import get_pos_engine
+    get_pos_engine(db).catalog.invalidate(current_user.tenant_id)
     
     return {
         'message': 'Menu item deleted',
@@ -44498,6 +44407,9 @@ async def create_multi_room_booking(
     - Creates one Booking per room and links them with group_booking_id.
     - Auto-creates folio for each booking (same behavior as single booking).
     """
+    from search_index import get_search_index
+    search = get_search_index(db)
+
     # Resolve guest
     guest_id = payload.guest_id
     if not guest_id and payload.guest:
@@ -44510,6 +44422,8 @@ async def create_multi_room_booking(
         await db.guests.insert_one(guest_dict)
         guest_id = guest.id
 
+        await search.index_guest(guest_dict)
+
     if not guest_id:
         raise HTTPException(status_code=400, detail="guest_id or guest details must be provided")
 
@@ -44573,6 +44487,8 @@ async def create_multi_room_booking(
         booking_dict["created_at"] = booking_dict["created_at"].isoformat()
         await db.bookings.insert_one(booking_dict)
 
+        await search.index_booking(booking_dict)
+
         folio_number = await generate_folio_number(current_user.tenant_id)
         folio = Folio(
             tenant_id=current_user.tenant_id,
@@ -45675,6 +45591,8 @@ async def record_payment_mobile(
                 }
             }
         )
+        from guest_rollup import get_guest_rollups
+        await get_guest_rollups(db).record_folio(current_user.tenant_id, folio)
     
     return {
         'message': 'Payment recorded successfully',
@@ -45855,7 +45773,11 @@ async def get_cash_flow_summary_mobile(
             'last_sync': bank.get('last_sync').isoformat() if bank.get('last_sync') else None
         })
     
-    total_bank_balance = sum(b['current_balance'] for b in bank_balances if b['currency'] == 'TRY')
+    from fx_rates import get_fx_rate_cache
+    converted = await get_fx_rate_cache(db).convert_many(
+        current_user.tenant_id, [b['current_balance'] for b in bank_balances], [b['currency'] for b in bank_balances]
+    )
+    total_bank_balance = round(float(converted.sum()), 2)
     
     return {
         'today': {
@@ -46568,7 +46490,6 @@ async def get_bank_balances_mobile(
     current_user = await get_current_user(credentials)
     
     bank_accounts = []
-    total_balance_try = 0.0
     
     async for bank in db.bank_accounts.find({
         'tenant_id': current_user.tenant_id,
@@ -46588,8 +46509,11 @@ async def get_bank_balances_mobile(
             'last_sync': bank.get('last_sync').isoformat() if bank.get('last_sync') else None
         })
         
-        if bank.get('currency') == 'TRY':
-            total_balance_try += balance
+    from fx_rates import get_fx_rate_cache
+    converted = await get_fx_rate_cache(db).convert_many(
+        current_user.tenant_id, [b['current_balance'] for b in bank_accounts], [b['currency'] for b in bank_accounts]
+    )
+    total_balance_try = round(float(converted.sum()), 2)
     
     return {
         'bank_accounts': bank_accounts,
@@ -47922,95 +47846,42 @@ async def get_executive_kpi_snapshot(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
     """
-    Get critical KPI snapshot - INSTANT RESPONSE VIA PRE-WARMED CACHE
+    Get critical KPI snapshot - one aggregation per collection, cached per business date
     """
+    from kpi_engine import get_kpi_engine
+
     current_user = await get_current_user(credentials)
     
-    # Check pre-warmed cache first (instant!)
-    from cache_warmer import cache_warmer
-    if cache_warmer:
-        cached_data = cache_warmer.get_cached(f"kpi:{current_user.tenant_id}")
-        if cached_data:
-            return cached_data
-    
     today = datetime.now(timezone.utc).date()
-    
-    # Get total rooms
-    total_rooms = await db.rooms.count_documents({'tenant_id': current_user.tenant_id})
-    if total_rooms == 0:
-        total_rooms = 50  # Default for empty DB
-    
-    # Get bookings for today
     today_str = today.isoformat()
+    kpis = await get_kpi_engine(db).executive_snapshot(current_user.tenant_id)
     
     # Occupancy calculation
-    occupied_rooms = await db.rooms.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'status': 'occupied'
-    })
+    total_rooms = kpis['rooms']['total']
+    if total_rooms == 0:
+        total_rooms = 50  # Default for empty DB
+    occupied_rooms = kpis['rooms']['occupied']
     occupancy_pct = (occupied_rooms / total_rooms * 100) if total_rooms > 0 else 0
     
-    # Revenue calculation (last 24 hours)
-    yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
-    
-    # Get payments from last 24 hours
-    total_revenue = 0
-    async for payment in db.payments.find({
-        'tenant_id': current_user.tenant_id,
-        'payment_date': {'$gte': yesterday}
-    }):
-        total_revenue += payment.get('amount', 0)
-    
-    # If no revenue data, use bookings
-    if total_revenue == 0:
-        async for booking in db.bookings.find({
-            'tenant_id': current_user.tenant_id,
-            'status': {'$in': ['checked_in', 'checked_out']},
-            'check_in': {'$gte': yesterday}
-        }):
-            total_revenue += booking.get('total_amount', 0)
+    # Revenue (last 24 hours of payments; bookings when no payments were taken)
+    total_revenue = kpis['payments_24h']['amount'] or kpis['stays_24h']['amount']
     
     # ADR calculation
-    bookings_count = await db.bookings.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'status': {'$in': ['checked_in', 'checked_out']},
-        'check_in': {'$gte': yesterday}
-    })
-    
+    bookings_count = kpis['stays_24h']['count']
     adr = (total_revenue / bookings_count) if bookings_count > 0 else 0
     
     # RevPAR calculation
     revpar = (total_revenue / total_rooms) if total_rooms > 0 else 0
     
     # NPS Score (from reviews/feedback)
-    nps_score = 0
-    review_count = 0
-    async for review in db.reviews.find({'tenant_id': current_user.tenant_id}):
-        nps_score += review.get('rating', 0)
-        review_count += 1
-    
-    avg_nps = (nps_score / review_count * 20) if review_count > 0 else 75  # Convert 5-star to 100 scale
-    
-    # Cash position (from accounting)
-    cash_balance = 0
-    bank_accounts = await db.bank_accounts.find({'tenant_id': current_user.tenant_id}).to_list(100)
-    for account in bank_accounts:
-        cash_balance += account.get('balance', 0)
-    
-    # If no cash data, estimate from revenue
-    if cash_balance == 0:
-        cash_balance = total_revenue * 10  # Rough estimate
-    
-    # Calculate trends (compare with yesterday)
-    yesterday_date = (today - timedelta(days=1)).isoformat()
+    review_count = kpis['reviews']['count']
+    avg_nps = (kpis['reviews']['rating'] / review_count * 20) if review_count > 0 else 75  # Convert 5-star to 100 scale
     
-    yesterday_revenue = 0
-    async for payment in db.payments.find({
-        'tenant_id': current_user.tenant_id,
-        'payment_date': {'$gte': (datetime.now(timezone.utc) - timedelta(days=2)).isoformat(), '$lt': yesterday}
-    }):
-        yesterday_revenue += payment.get('amount', 0)
+    # Cash position (from accounting); if no cash data, estimate from revenue
+    cash_balance = kpis['cash']['balance'] or total_revenue * 10  # Rough estimate
     
+    # Calculate trends (compare with the previous 24 hours)
+    yesterday_revenue = kpis['payments_prev_24h']['amount']
     revenue_trend = ((total_revenue - yesterday_revenue) / yesterday_revenue * 100) if yesterday_revenue > 0 else 0
     
     return {
@@ -48645,6 +48516,7 @@ async def update_notification_preferences(
 async def get_notifications_list(
     unread_only: bool = False,
     limit: int = 50,
+    cursor: Optional[str] = None,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
     """
@@ -48663,8 +48535,14 @@ async def get_notifications_list(
     if unread_only:
         query['read'] = False
     
+    projection = {
+        '_id': 0, 'id': 1, 'type': 1, 'title': 1, 'message': 1, 'priority': 1,
+        'read': 1, 'created_at': 1, 'action_url': 1
+    }
+    page = await keyset_page(db.notifications, query, SORT_CREATED_DESC, limit, cursor, projection)
+    
     notifications = []
-    async for notif in db.notifications.find(query).sort('created_at', -1).limit(limit):
+    for notif in page.items:
         notifications.append({
             'id': notif['id'],
             'type': notif.get('type', 'general'),
@@ -48679,7 +48557,9 @@ async def get_notifications_list(
     return {
         'notifications': notifications,
         'count': len(notifications),
-        'unread_count': len([n for n in notifications if not n['read']])
+        'unread_count': len([n for n in notifications if not n['read']]),
+        'next_cursor': page.next_cursor,
+        'has_more': page.has_more
     }
 
 
@@ -49551,47 +49431,18 @@ async def get_enhanced_snapshot(
     yesterday_metrics = get_metrics_for_date(yesterday)
     last_week_metrics = get_metrics_for_date(last_week)
     
-    # Calculate today's metrics
-    total_rooms = await db.rooms.count_documents({'tenant_id': current_user.tenant_id})
-    occupied_today = await db.rooms.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'status': 'occupied'
-    })
-    today_metrics['occupancy'] = round((occupied_today / total_rooms * 100) if total_rooms > 0 else 0, 1)
-    
-    # Revenue
-    async for payment in db.payments.find({
-        'tenant_id': current_user.tenant_id,
-        'payment_date': {'$gte': today.isoformat()}
-    }):
-        today_metrics['revenue'] += payment.get('amount', 0)
-    
-    # Check-ins/outs
-    today_metrics['check_ins'] = await db.bookings.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'check_in': today.isoformat(),
-        'status': 'checked_in'
-    })
-    
-    today_metrics['check_outs'] = await db.bookings.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'check_out': today.isoformat(),
-        'status': 'checked_out'
-    })
-    
-    # Complaints
-    today_metrics['complaints'] = await db.feedback.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'rating': {'$lte': 2},
-        'created_at': {'$gte': today.isoformat()}
-    })
+    # Today's metrics: one aggregation per collection
+    from kpi_engine import get_kpi_engine
+    kpis = await get_kpi_engine(db).gm_snapshot(current_user.tenant_id)
     
-    # Pending tasks
-    today_metrics['pending_tasks'] = await db.maintenance_tasks.count_documents({
-        'tenant_id': current_user.tenant_id,
-        'status': 'pending',
-        'priority': {'$in': ['high', 'urgent']}
-    })
+    total_rooms = kpis['rooms']['total']
+    occupied_today = kpis['rooms']['occupied']
+    today_metrics['occupancy'] = round((occupied_today / total_rooms * 100) if total_rooms > 0 else 0, 1)
+    today_metrics['revenue'] = kpis['payments_today']['amount']
+    today_metrics['check_ins'] = kpis['check_ins']['count']
+    today_metrics['check_outs'] = kpis['check_outs']['count']
+    today_metrics['complaints'] = kpis['complaints']['count']
+    today_metrics['pending_tasks'] = kpis['urgent_tasks']['count']
     
     # Simulated yesterday and last week data
     yesterday_metrics.update({
@@ -51323,31 +51174,27 @@ async def search_reservations(
         
         # Search conditions
         search_conditions = []
-        
-        if query:
-            # Search in guest name or booking ID
-            search_conditions.append({
-                '$or': [
-                    {'guest_name': {'$regex': query, '$options': 'i'}},
-                    {'id': {'$regex': query, '$options': 'i'}},
-                    {'booking_number': {'$regex': query, '$options': 'i'}}
-                ]
-            })
+        from search_index import get_search_index
+        search = get_search_index(db)
+        ranked_ids = None
         
         if booking_id:
             search_conditions.append({'id': booking_id})
         
-        if phone:
-            # Find guest by phone first
-            guest = await db.guests.find_one({'phone': {'$regex': phone, '$options': 'i'}})
-            if guest:
-                search_conditions.append({'guest_id': guest['id']})
-        
-        if email:
-            # Find guest by email first
-            guest = await db.guests.find_one({'email': {'$regex': email, '$options': 'i'}})
-            if guest:
-                search_conditions.append({'guest_id': guest['id']})
+        # Phone / email resolve to guests of this tenant only
+        for value in (phone, email):
+            if not value:
+                continue
+            guest_ids = await search.ids(current_user.tenant_id, value, 'guest')
+            if guest_ids is None:
+                field = 'phone' if value == phone else 'email'
+                guest = await db.guests.find_one(
+                    {'tenant_id': current_user.tenant_id, field: {'$regex': re.escape(value), '$options': 'i'}},
+                    {'_id': 0, 'id': 1}
+                )
+                guest_ids = [guest['id']] if guest else []
+            # No matching guest means no matching reservation, not an ignored filter
+            search_conditions.append({'guest_id': {'$in': guest_ids}})
         
         if check_in:
             search_conditions.append({'check_in': {'$gte': check_in}})
@@ -51358,26 +51205,59 @@ async def search_reservations(
         if status:
             search_conditions.append({'status': status})
         
+        if query:
+            # Search in guest name or booking ID; the other conditions are checked while
+            # paging through index candidates so filtered matches are not capped away
+            ranked_ids = await search.ids(
+                current_user.tenant_id, query, 'booking', limit=50,
+                where={'$and': search_conditions} if search_conditions else None, sort_from=check_in
+            )
+            if ranked_ids is not None:
+                search_conditions.append({'id': {'$in': ranked_ids}})
+            else:
+                pattern = re.escape(query)
+                search_conditions.append({
+                    '$or': [
+                        {'guest_name': {'$regex': pattern, '$options': 'i'}},
+                        {'id': {'$regex': pattern, '$options': 'i'}},
+                        {'booking_number': {'$regex': pattern, '$options': 'i'}}
+                    ]
+                })
+        
         # Combine all conditions
         if search_conditions:
             filter_dict['$and'] = search_conditions
         
         # Find bookings
-        bookings = await db.bookings.find(filter_dict).sort('check_in', -1).limit(50).to_list(50)
-        
-        # Enrich with guest and room data
+        bookings = await db.bookings.find(filter_dict, {'_id': 0}).sort('check_in', -1).limit(50).to_list(50)
+        if ranked_ids:
+            rank = {bid: i for i, bid in enumerate(ranked_ids)}
+            bookings.sort(key=lambda b: rank.get(b['id'], len(rank)))
+        
+        # Enrich with guest and room data (one query each)
+        guest_ids = list({b['guest_id'] for b in bookings if b.get('guest_id')})
+        room_ids = list({b['room_id'] for b in bookings if b.get('room_id')})
+        guests_by_id = {
+            g['id']: g for g in await db.guests.find(
+                {'tenant_id': current_user.tenant_id, 'id': {'$in': guest_ids}},
+                {'_id': 0, 'id': 1, 'phone': 1, 'email': 1}
+            ).to_list(None)
+        } if guest_ids else {}
+        rooms_by_id = {
+            r['id']: r for r in await db.rooms.find(
+                {'tenant_id': current_user.tenant_id, 'id': {'$in': room_ids}},
+                {'_id': 0, 'id': 1, 'room_number': 1, 'room_type': 1}
+            ).to_list(None)
+        } if room_ids else {}
         for booking in bookings:
-            if booking.get('guest_id'):
-                guest = await db.guests.find_one({'id': booking['guest_id']})
-                if guest:
-                    booking['guest_phone'] = guest.get('phone')
-                    booking['guest_email'] = guest.get('email')
-            
-            if booking.get('room_id'):
-                room = await db.rooms.find_one({'id': booking['room_id']})
-                if room:
-                    booking['room_number'] = room.get('room_number')
-                    booking['room_type'] = room.get('room_type')
+            guest = guests_by_id.get(booking.get('guest_id'))
+            if guest:
+                booking['guest_phone'] = guest.get('phone')
+                booking['guest_email'] = guest.get('email')
+            room = rooms_by_id.get(booking.get('room_id'))
+            if room:
+                booking['room_number'] = room.get('room_number')
+                booking['room_type'] = room.get('room_type')
         
         return {
             'bookings': bookings,
@@ -51396,6 +51276,36 @@ async def search_reservations(
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 
+@api_router.get("/search/typeahead")
+async def search_typeahead(
+    q: str,
+    kinds: str = 'guest,booking',
+    limit: int = 10,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Front-desk type-ahead over guests and bookings: Turkish-insensitive
+    prefixes (İ/I/ı, ş, ğ...), booking numbers, phone digits or last four,
+    with a trigram fallback for typos.
+    """
+    from search_index import get_search_index, KINDS
+    requested = [k for k in kinds.split(',') if k in KINDS] or list(KINDS)
+    results = await get_search_index(db).search(current_user.tenant_id, q, requested, min(max(limit, 1), 50))
+    if results is None:
+        return {'results': [], 'count': 0, 'index_status': 'building'}
+    return {'results': results, 'count': len(results), 'index_status': 'ready'}
+
+
+@api_router.post("/search/reindex")
+async def rebuild_search_index(current_user: User = Depends(get_current_user)):
+    """Rebuild the tenant's guest/booking search index from scratch"""
+    if current_user.role not in [UserRole.ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Only admins can rebuild the search index")
+    from search_index import get_search_index
+    counts = await get_search_index(db).build(current_user.tenant_id)
+    return {'success': True, 'indexed': counts}
+
+
 # 2. KEYCARD MANAGEMENT - Oda kartı basma sistemi
 @api_router.post("/keycard/issue")
 async def issue_keycard(
@@ -51458,7 +51368,7 @@ async def issue_keycard(
         await db.keycards.insert_one(keycard_data)
         
         # Log the action
-        await db.audit_logs.insert_one({
+        await write_log(db, 'audit_logs', {
             'id': str(uuid.uuid4()),
             'tenant_id': current_user.tenant_id,
             'user_id': current_user.id,
@@ -52599,7 +52509,7 @@ async def process_mobile_payment(
         )
         
         # Create audit log
-        await db.audit_logs.insert_one({
+        await write_log(db, 'audit_logs', {
             'id': str(uuid.uuid4()),
             'tenant_id': current_user.tenant_id,
             'user_id': current_user.id,
@@ -54489,6 +54399,42 @@ try:
 except ImportError as e:
     print(f"⚠️ Monitoring endpoints not available: {e}")
 
+# Include slow-endpoint profiler (admin only)
+try:
+    from endpoint_profiler import profiler_router
+    app.include_router(
+        profiler_router,
+        tags=["profiler"],
+        dependencies=[Depends(require_super_admin())],
+    )
+    print("✅ Endpoint profiler included")
+except ImportError as e:
+    print(f"⚠️ Endpoint profiler not available: {e}")
+
+# Include index registry admin endpoints (migrations, usage, suggestions)
+try:
+    from index_registry import index_router
+    app.include_router(
+        index_router,
+        tags=["indexes"],
+        dependencies=[Depends(require_super_admin())],
+    )
+    print("✅ Index registry endpoints included")
+except ImportError as e:
+    print(f"⚠️ Index registry endpoints not available: {e}")
+
+# Include cache warmer admin endpoints (coverage, hit rates, manual run)
+try:
+    from cache_warmer import cache_warmer_router
+    app.include_router(
+        cache_warmer_router,
+        tags=["cache-warmer"],
+        dependencies=[Depends(require_super_admin())],
+    )
+    print("✅ Cache warmer endpoints included")
+except ImportError as e:
+    print(f"⚠️ Cache warmer endpoints not available: {e}")
+
 # Include media endpoints
 try:
     from media_endpoints import media_router
@@ -55858,7 +55804,7 @@ async def get_compliance_certifications(current_user: User = Depends(get_current
 
 
 @api_router.get("/pos/menu-engineering")
-async def get_menu_engineering(current_user: User = Depends(get_current_user)):
+async def get_menu_engineering(days: int = 30, current_user: User = Depends(get_current_user)):
     """Menu engineering analysis (Stars, Plowhorses, Puzzles, Dogs) - REAL DATA"""
     
     # Get menu items with sales data from database
@@ -55884,12 +55830,28 @@ async def get_menu_engineering(current_user: User = Depends(get_current_user)):
             }
         }
     
+    # Sold quantities/revenue over the window come from the POS day totals
+    from pos_daily_totals import get_pos_daily_totals
+    daily_totals = get_pos_daily_totals(db)
+    window_start, window_end = daily_totals.trailing_window(max(1, min(days, 366)))
+    sold = (await daily_totals.range(current_user.tenant_id, window_start, window_end))['items']
+    
     # Calculate profitability and popularity
     analyzed_items = []
     
     for item in menu_items:
-        profit_margin = item.get('profit_margin', 0)
-        sales_count = item.get('sales_count', 0)
+        sales = sold.get(item.get('id'))
+        price = item.get('price', 0) or 0
+        if sales:
+            sales_count = sales['quantity']
+            revenue = sales['revenue']
+            profit_margin = round((revenue - sales['cost']) / revenue * 100, 1) if revenue else 0
+        else:
+            sales_count = item.get('sales_count', 0)
+            revenue = price * sales_count
+            profit_margin = item.get('profit_margin') or (
+                round((price - (item.get('cost', 0) or 0)) / price * 100, 1) if price else 0
+            )
         
         # Categorize based on Boston Matrix
         if profit_margin > 50 and sales_count > 100:
@@ -55902,13 +55864,13 @@ async def get_menu_engineering(current_user: User = Depends(get_current_user)):
             category = 'Dogs'
         
         analyzed_items.append({
-            'item_name': item.get('name'),
+            'item_name': item.get('name') or item.get('item_name'),
             'category': item.get('category'),
-            'price': item.get('price', 0),
+            'price': price,
             'cost': item.get('cost', 0),
             'profit_margin': profit_margin,
             'sales_count': sales_count,
-            'revenue': item.get('price', 0) * sales_count,
+            'revenue': round(revenue, 2),
             'classification': category,
             'recommendation': get_menu_recommendation(category)
         })
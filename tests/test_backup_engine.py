@@ -0,0 +1,66 @@
+"""
+Backup engine restore: archives are verified before live data is touched
+(in-memory MongoDB via mongomock-motor)
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+mongomock_motor = pytest.importorskip('mongomock_motor')
+bson = pytest.importorskip('bson')
+
+from backup_engine import BackupEngine  # noqa: E402
+
+TENANT = 't-backup'
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def write_archive(path, docs, damage=None):
+    """Full-backup archive of one 'guests' collection, optionally damaged after hashing"""
+    os.makedirs(path, exist_ok=True)
+    raw = b''.join(bson.encode(d) for d in docs)
+    sha = hashlib.sha256(raw).hexdigest()
+    if damage == 'corrupt':
+        raw = raw[:-10] + b'\x00' * 10
+    elif damage == 'truncated':
+        raw = raw[:-7]
+    with gzip.open(os.path.join(path, 'guests.bson.gz'), 'wb') as f:
+        f.write(raw)
+    manifest = {'backup_type': 'full',
+                'collections': [{'name': 'guests', 'file': 'guests.bson.gz', 'documents': len(docs), 'sha256': sha}]}
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+
+async def restore(tmp_path, damage):
+    db = mongomock_motor.AsyncMongoMockClient()['backup_test']
+    await db.guests.insert_many([{'id': f'live-{n}', 'tenant_id': TENANT, 'name': 'Live'} for n in range(3)])
+    path = str(tmp_path / 'b1')
+    write_archive(path, [{'id': f'arch-{n}', 'tenant_id': TENANT, 'name': 'Archived'} for n in range(5)], damage)
+    engine = BackupEngine(db, backup_dir=str(tmp_path))
+    job = {'id': 'job-1', 'tenant_id': TENANT}
+    await db.restore_jobs.insert_one(dict(job, status='in_progress', documents_restored=0))
+    await engine._run_restore(job, [{'id': 'b1', 'path': path}])
+    ids = sorted(g['id'] for g in await db.guests.find({'tenant_id': TENANT}).to_list(None))
+    return ids, await db.restore_jobs.find_one({'id': 'job-1'}, {'_id': 0})
+
+
+def test_bad_checksum_leaves_live_data(tmp_path):
+    ids, job = run(restore(tmp_path, 'corrupt'))
+    assert job['status'] == 'failed' and 'Checksum mismatch' in job['error']
+    assert ids == ['live-0', 'live-1', 'live-2']
+
+
+def test_truncated_archive_leaves_live_data(tmp_path):
+    ids, job = run(restore(tmp_path, 'truncated'))
+    assert job['status'] == 'failed' and 'truncated' in job['error']
+    assert ids == ['live-0', 'live-1', 'live-2']
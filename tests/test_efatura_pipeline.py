@@ -0,0 +1,116 @@
+"""
+E-Fatura pipeline: claiming, retry backoff and GIB numbering
+(in-memory MongoDB via mongomock-motor)
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+mongomock_motor = pytest.importorskip('mongomock_motor')
+
+from efatura_pipeline import EFaturaPipeline, EInvoiceProvider, ProviderError  # noqa: E402
+
+TENANT = 't-efatura'
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class RecordingProvider(EInvoiceProvider):
+    """Accepts documents, failing the first submissions listed in `failures`"""
+
+    name = 'recording'
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.submitted = []
+
+    async def submit(self, document):
+        await asyncio.sleep(0)
+        self.submitted.append(document['invoice_id'])
+        error = self.failures.pop(document['invoice_id'], None)
+        if error:
+            raise error
+        return {'status': 'success', 'gib_id': document['ettn']}
+
+
+async def make_pipeline(provider, batch_size=200):
+    db = mongomock_motor.AsyncMongoMockClient()['efatura_test']
+    await db.efatura_settings.insert_one({'tenant_id': TENANT, 'vkn': '1234567890', 'series': 'HTL'})
+    return db, EFaturaPipeline(db, provider=provider, batch_size=batch_size, render_workers=0)
+
+
+def invoice(invoice_id, unit_price=100.0, **extra):
+    return {'id': invoice_id, 'tenant_id': TENANT, 'invoice_number': invoice_id, 'invoice_type': 'sales',
+            'issue_date': '2026-03-01', 'currency': 'TRY',
+            'items': [{'description': 'Konaklama', 'quantity': 1, 'unit_price': unit_price, 'vat_rate': 10}],
+            **extra}
+
+
+def test_concurrent_drains_claim_each_invoice_once():
+    async def scenario():
+        provider = RecordingProvider()
+        db, pipeline = await make_pipeline(provider, batch_size=3)
+        await db.accounting_invoices.insert_many([invoice(f'inv-{n}') for n in range(10)])
+        await pipeline.enqueue(TENANT)
+        await asyncio.gather(pipeline.drain(), pipeline.drain(), pipeline.drain())
+        return provider.submitted, await pipeline.status(TENANT)
+
+    submitted, status = run(scenario())
+    assert sorted(submitted) == sorted(f'inv-{n}' for n in range(10))
+    assert status['by_status'] == {'sent': 10} and status['backlog'] == 0
+
+
+def test_retryable_failure_backs_off_then_sends():
+    async def scenario():
+        provider = RecordingProvider({'inv-1': ProviderError('timeout'),
+                                      'inv-2': ProviderError('rejected', retryable=False)})
+        db, pipeline = await make_pipeline(provider)
+        await db.accounting_invoices.insert_many([invoice('inv-1'), invoice('inv-2')])
+        await pipeline.enqueue(TENANT)
+        await pipeline.drain()
+        waiting = await db.accounting_invoices.find_one({'id': 'inv-1'}, {'_id': 0})
+        # Still inside its backoff window: not claimed again
+        early = await pipeline.drain()
+        await db.accounting_invoices.update_one({'id': 'inv-1'}, {'$set': {'efatura_next_attempt_at': None}})
+        await pipeline.drain()
+        return (waiting, early, provider.submitted,
+                {i['id']: i async for i in db.accounting_invoices.find({}, {'_id': 0})})
+
+    waiting, early, submitted, invoices = run(scenario())
+    assert waiting['efatura_status'] == 'pending' and waiting['efatura_attempts'] == 1
+    assert waiting['efatura_next_attempt_at'] and 'efatura_claim' not in waiting
+    assert early['claimed'] == 0
+    assert submitted == ['inv-1', 'inv-2', 'inv-1']
+    assert invoices['inv-1']['efatura_status'] == 'sent'
+    assert invoices['inv-2']['efatura_status'] == 'failed'
+    # A retry keeps the number and ETTN of the first attempt
+    assert invoices['inv-1']['efatura_number'] == waiting['efatura_number']
+    assert invoices['inv-1']['efatura_uuid'] == waiting['efatura_uuid']
+
+
+def test_numbering_skips_invalid_and_keeps_existing():
+    async def scenario():
+        db, pipeline = await make_pipeline(RecordingProvider())
+        await db.accounting_invoices.insert_many([
+            invoice('inv-1'),
+            invoice('inv-bad', unit_price=-5.0),
+            invoice('inv-2'),
+            invoice('inv-numbered', efatura_number='HTL2026000000042'),
+        ])
+        await pipeline.enqueue(TENANT)
+        await pipeline.drain()
+        invoices = {i['id']: i async for i in db.accounting_invoices.find({}, {'_id': 0})}
+        sequence = await db.efatura_sequences.find_one({'_id': f'{TENANT}:HTL:2026'})
+        return invoices, sequence
+
+    invoices, sequence = run(scenario())
+    assert invoices['inv-bad']['efatura_status'] == 'invalid' and 'efatura_number' not in invoices['inv-bad']
+    assert sorted([invoices['inv-1']['efatura_number'], invoices['inv-2']['efatura_number']]) == \
+        ['HTL2026000000001', 'HTL2026000000002']
+    assert invoices['inv-numbered']['efatura_number'] == 'HTL2026000000042'
+    assert sequence['seq'] == 2
@@ -0,0 +1,154 @@
+"""
+General ledger: posting idempotency, period close and rebuild
+(in-memory MongoDB via mongomock-motor)
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+mongomock_motor = pytest.importorskip('mongomock_motor')
+
+from general_ledger import GeneralLedger  # noqa: E402
+
+TENANT = 't-ledger'
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def make_ledger():
+    db = mongomock_motor.AsyncMongoMockClient()['ledger_test']
+    await db.journal_entries.create_index(
+        [('tenant_id', 1), ('source_type', 1), ('source_id', 1), ('event', 1)], unique=True
+    )
+    await db.ledger_meta.create_index([('tenant_id', 1)], unique=True)
+    return db, GeneralLedger(db)
+
+
+def invoice(invoice_id, day, total=118.0, vat=18.0):
+    return {'id': invoice_id, 'tenant_id': TENANT, 'invoice_number': invoice_id, 'invoice_type': 'sales',
+            'total': total, 'total_vat': vat, 'issue_date': day, 'status': 'pending'}
+
+
+def test_posting_is_idempotent():
+    async def scenario():
+        db, ledger = await make_ledger()
+        first = await ledger.post_invoice(invoice('inv-1', '2026-01-10'))
+        repeat = await ledger.post_invoice(invoice('inv-1', '2026-01-10'))
+        totals = await ledger.account_totals(TENANT, None, '2026-12-31')
+        entries = await db.journal_entries.count_documents({'tenant_id': TENANT})
+        return first, repeat, totals, entries
+
+    first, repeat, totals, entries = run(scenario())
+    assert first is not None and repeat is None
+    assert entries == 1
+    assert totals['120'] == {'debit': 118.0, 'credit': 0.0}
+    assert totals['391'] == {'debit': 0.0, 'credit': 18.0}
+
+
+def test_closed_period_is_frozen():
+    async def scenario():
+        db, ledger = await make_ledger()
+        await ledger.post_invoice(invoice('inv-1', '2026-01-10'))
+        await ledger.close_period(TENANT, '2026-01')
+        snapshot = await db.ledger_snapshots.find_one({'tenant_id': TENANT, 'period': '2026-01'}, {'_id': 0})
+        late = await ledger.post_invoice(invoice('inv-late', '2026-01-20', total=59.0, vat=9.0))
+        january = await ledger.account_totals(TENANT, '2026-01-01', '2026-01-31')
+        return snapshot, late, january
+
+    snapshot, late, january = run(scenario())
+    assert snapshot['balances']['120'] == 118.0
+    assert late['date'] == '2026-02-01' and late['original_date'] == '2026-01-20'
+    assert january['120']['debit'] == 118.0
+
+
+def test_rebuild_keeps_closed_periods():
+    async def scenario():
+        db, ledger = await make_ledger()
+        await db.accounting_invoices.insert_many([invoice('inv-1', '2026-01-10'), invoice('inv-2', '2026-02-05')])
+        await ledger.rebuild(TENANT)
+        await ledger.close_period(TENANT, '2026-01')
+        snapshot = await db.ledger_snapshots.find_one({'tenant_id': TENANT, 'period': '2026-01'}, {'_id': 0})
+        before = await ledger.balances_as_of(TENANT, '2026-03-31')
+
+        # A document dated in the closed period that was never posted
+        await db.accounting_invoices.insert_one(invoice('inv-late', '2026-01-25', total=59.0, vat=9.0))
+        await ledger.rebuild(TENANT)
+        return (snapshot, before, await ledger.balances_as_of(TENANT, '2026-03-31'),
+                await db.ledger_periods.find_one({'tenant_id': TENANT, 'period': '2026-01'}, {'_id': 0}),
+                await db.ledger_snapshots.find_one({'tenant_id': TENANT, 'period': '2026-01'}, {'_id': 0}),
+                await db.journal_entries.find_one({'source_id': 'inv-late'}, {'_id': 0}))
+
+    snapshot, before, after, period, snapshot_after, late = run(scenario())
+    assert period['status'] == 'closed'
+    assert snapshot_after['balances'] == snapshot['balances']
+    assert before['120'] == 236.0
+    assert after['120'] == 295.0
+    assert late['date'] == '2026-02-01'
+
+
+def test_rebuild_without_inventory_items():
+    async def scenario():
+        db, ledger = await make_ledger()
+        await db.stock_movements.insert_one({'id': 'mv-1', 'tenant_id': TENANT, 'movement_type': 'in',
+                                             'quantity': 10, 'unit_cost': 5, 'created_at': '2026-01-03'})
+        await ledger.rebuild(TENANT)
+        return await ledger.balances_as_of(TENANT, '2099-12-31')
+
+    balances = run(scenario())
+    # No inventory_items left: the valuation adjustment brings stock back to zero
+    assert balances.get('153', 0) == 0
+
+
+def test_concurrent_first_requests_replay_once():
+    async def scenario():
+        db, ledger = await make_ledger()
+        await db.accounting_invoices.insert_one(invoice('inv-1', '2026-01-10'))
+        calls = []
+        original = ledger.rebuild
+
+        async def counting_rebuild(tenant_id):
+            calls.append(tenant_id)
+            return await original(tenant_id)
+
+        ledger.rebuild = counting_rebuild
+        await asyncio.gather(*[ledger.ensure_initialized(TENANT) for _ in range(5)])
+        return calls, await db.journal_entries.count_documents({'tenant_id': TENANT})
+
+    calls, entries = run(scenario())
+    assert calls == [TENANT]
+    assert entries == 1
+
+
+def test_pending_entries_are_applied_once():
+    async def scenario():
+        db, ledger = await make_ledger()
+        await ledger.post_invoice(invoice('inv-1', '2026-01-10'))
+        # One entry interrupted before its balance update, one still in flight with its poster
+        await db.journal_entries.insert_many([
+            {'id': 'e-lost', 'tenant_id': TENANT, 'source_type': 'invoice', 'source_id': 'lost', 'event': 'issue',
+             'date': '2026-01-11', 'period': '2026-01', 'applied': False,
+             'lines': [{'account': '120', 'debit': 50.0, 'credit': 0.0},
+                       {'account': '600.01', 'debit': 0.0, 'credit': 50.0}]},
+            {'id': 'e-flight', 'tenant_id': TENANT, 'source_type': 'invoice', 'source_id': 'flight', 'event': 'issue',
+             'date': '2026-01-12', 'period': '2026-01', 'applied': 'applying',
+             'claimed_at': datetime.now(timezone.utc).isoformat(),
+             'lines': [{'account': '120', 'debit': 7.0, 'credit': 0.0},
+                       {'account': '600.01', 'debit': 0.0, 'credit': 7.0}]},
+        ])
+        await db.ledger_meta.insert_one({'tenant_id': TENANT, 'initialized_at': '2026-01-01T00:00:00+00:00'})
+        applied = await asyncio.gather(*[ledger.apply_pending(TENANT) for _ in range(5)])
+        await ledger.ensure_initialized(TENANT)  # report read path: does not touch pending entries
+        totals = await ledger.account_totals(TENANT, None, '2026-12-31')
+        states = {e['id']: e['applied'] async for e in db.journal_entries.find({'id': {'$in': ['e-lost', 'e-flight']}})}
+        return sum(applied), totals, states
+
+    applied, totals, states = run(scenario())
+    assert applied == 1
+    assert totals['120']['debit'] == 168.0
+    assert states == {'e-lost': True, 'e-flight': 'applying'}
@@ -0,0 +1,70 @@
+"""
+Group rooming pipeline: assignment and booking occupancy
+(in-memory MongoDB via mongomock-motor)
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+mongomock_motor = pytest.importorskip('mongomock_motor')
+pytest.importorskip('numpy')
+
+import search_index  # noqa: E402
+from group_pipeline import GroupRoomingPipeline, parse_rooming_file  # noqa: E402
+
+TENANT = 't-group'
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def make_db():
+    db = mongomock_motor.AsyncMongoMockClient()['group_test']
+    search_index.search_index = None
+    await db.rooms.insert_many([
+        {'id': f'r{i}', 'tenant_id': TENANT, 'room_number': f'10{i}', 'room_type': 'Standard', 'status': 'available'}
+        for i in range(3)
+    ])
+    await db.group_reservations.insert_one({'id': 'grp-1', 'tenant_id': TENANT, 'rooms_assigned': 0})
+    return db
+
+
+def target(**extra):
+    return {'id': 'grp-1', 'collection': 'group_reservations', 'link_field': 'group_id',
+            'counter_field': 'rooms_assigned', 'capacity': 3,
+            'check_in': '2026-03-01', 'check_out': '2026-03-04', **extra}
+
+
+def test_occupancy_carried_to_bookings():
+    async def scenario():
+        db = await make_db()
+        rows = [
+            {'guest_name': 'Family', 'room_type': 'Standard', 'adults': 2, 'children': 2},
+            {'guest_name': 'Single', 'room_type': 'Standard', 'adults': 1},
+            {'guest_name': 'Default', 'room_type': 'Standard'},
+        ]
+        result = await GroupRoomingPipeline(db).load(TENANT, rows, target(adults=3))
+        bookings = {b['guest_name']: b async for b in db.bookings.find({'tenant_id': TENANT}, {'_id': 0})}
+        return result, bookings
+
+    result, bookings = run(scenario())
+    assert result['successful'] == 3
+    assert (bookings['Family']['adults'], bookings['Family']['children']) == (2, 2)
+    assert (bookings['Single']['adults'], bookings['Single']['children']) == (1, 0)
+    assert (bookings['Default']['adults'], bookings['Default']['children']) == (3, 0)
+
+
+def test_rooming_file_occupancy_columns():
+    async def scenario():
+        db = await make_db()
+        rows = parse_rooming_file('list.csv', b'name,type,adults,children\nAyse,Standard,1,1\nMehmet,Standard,,\n')
+        await GroupRoomingPipeline(db).load(TENANT, rows, target())
+        return {b['guest_name']: b async for b in db.bookings.find({'tenant_id': TENANT}, {'_id': 0})}
+
+    bookings = run(scenario())
+    assert (bookings['Ayse']['adults'], bookings['Ayse']['children']) == (1, 1)
+    assert (bookings['Mehmet']['adults'], bookings['Mehmet']['children']) == (2, 0)
@@ -0,0 +1,83 @@
+"""
+Housekeeping assignment engine: staff loading, plan replacement and the
+optimize endpoint (in-memory MongoDB via mongomock-motor)
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+mongomock_motor = pytest.importorskip('mongomock_motor')
+pytest.importorskip('numpy')
+
+import hk_assignment_engine  # noqa: E402
+from hk_assignment_engine import HKAssignmentEngine  # noqa: E402
+
+TENANT = 't-hk'
+DAY = '2026-03-10'
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def make_db():
+    db = mongomock_motor.AsyncMongoMockClient()['hk_test']
+    await db.users.insert_many([
+        {'id': 'u1', 'tenant_id': TENANT, 'name': 'Ayşe', 'role': 'housekeeping', 'is_active': True},
+        {'id': 'u2', 'tenant_id': TENANT, 'name': 'Fatma', 'role': 'housekeeping', 'is_active': True},
+        {'id': 'u3', 'tenant_id': TENANT, 'name': 'Left', 'role': 'housekeeping', 'is_active': False},
+    ])
+    await db.rooms.insert_many([
+        {'id': f'r{n}', 'tenant_id': TENANT, 'room_number': str(100 + n), 'floor': 1 + n // 4,
+         'room_type': 'standard', 'status': 'dirty'}
+        for n in range(8)
+    ])
+    return db
+
+
+def test_load_staff_uses_is_active():
+    async def scenario():
+        db = await make_db()
+        return await HKAssignmentEngine(db).load_staff(TENANT)
+
+    staff = run(scenario())
+    assert sorted(s['id'] for s in staff) == ['u1', 'u2']
+
+
+def test_empty_board_clears_previous_plan():
+    async def scenario():
+        db = await make_db()
+        engine = HKAssignmentEngine(db)
+        first = await engine.optimize(TENANT, DAY, assigned_by='Admin')
+        before = await db.housekeeping_tasks.count_documents({'scheduled_date': DAY})
+        await db.rooms.update_many({}, {'$set': {'status': 'available'}})
+        second = await engine.optimize(TENANT, DAY, assigned_by='Admin')
+        after = await db.housekeeping_tasks.count_documents({'scheduled_date': DAY})
+        assignments = await db.hk_task_assignments.count_documents({'tenant_id': TENANT})
+        return first, before, second, after, assignments
+
+    first, before, second, after, assignments = run(scenario())
+    assert first['summary']['total_tasks'] == 8 and before == 8
+    assert second['summary']['total_tasks'] == 0 and second['persisted']
+    assert after == 0 and assignments == 0
+
+
+def test_optimize_endpoint_with_real_user():
+    pytest.importorskip('fastapi')
+    server = pytest.importorskip('server')
+
+    async def scenario():
+        db = await make_db()
+        server.db = db
+        hk_assignment_engine.hk_assignment_engine = None
+        user = server.User(tenant_id=TENANT, email='admin@example.com', name='Admin', role=server.UserRole.ADMIN)
+        plan = await server.optimize_hk_assignments({'date': DAY}, current_user=user)
+        assignment = await db.hk_task_assignments.find_one({'tenant_id': TENANT}, {'_id': 0})
+        return plan, assignment
+
+    plan, assignment = run(scenario())
+    assert plan['summary']['total_tasks'] == 8
+    assert assignment['assigned_by'] == 'Admin'
@@ -0,0 +1,101 @@
+"""
+Message delivery: campaign completion when workers drain the batch
+(in-memory MongoDB via mongomock-motor)
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+mongomock_motor = pytest.importorskip('mongomock_motor')
+
+from message_delivery import ConsoleProvider, DeliveryService, PermanentDeliveryError  # noqa: E402
+
+TENANT = 't-delivery'
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FastProvider(ConsoleProvider):
+    async def send(self, message):
+        if message['recipient'].startswith('bad'):
+            raise PermanentDeliveryError('rejected')
+        return 'ok'
+
+
+def make_service(db):
+    return DeliveryService(db, providers={'email': FastProvider('email')}, workers=1, poll_interval=0.01)
+
+
+def campaign_messages(campaign_id, recipients):
+    return [{'channel': 'email', 'recipient': r, 'subject': 's', 'text': 't',
+             'source': {'type': 'campaign', 'campaign_id': campaign_id}} for r in recipients]
+
+
+def test_campaign_finishes_after_fast_drain():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()['delivery_test']
+        service = make_service(db)
+        await db.marketing_campaigns.insert_one({'id': 'c1', 'tenant_id': TENANT, 'status': 'sending'})
+        await service.start()
+        await service.enqueue_batch(campaign_messages('c1', ['a@x', 'b@x', 'bad@x']), TENANT, batch_id='c1')
+        await asyncio.sleep(0.3)
+        await service.stop()
+        return await db.marketing_campaigns.find_one({'id': 'c1'}, {'_id': 0})
+
+    campaign = run(scenario())
+    assert campaign['status'] == 'sent'
+    assert campaign['delivered_count'] == 2 and campaign['failed_count'] == 1
+
+
+def test_campaign_waits_until_fully_queued():
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()['delivery_test']
+        service = make_service(db)
+        await db.marketing_campaigns.insert_one({'id': 'c1', 'tenant_id': TENANT, 'status': 'sending',
+                                                 'queueing': True})
+        await service.start()
+        # First chunk drains while the sender is still queueing the rest
+        await service.enqueue_batch(campaign_messages('c1', ['a@x']), TENANT, batch_id='c1')
+        await asyncio.sleep(0.2)
+        mid = await db.marketing_campaigns.find_one({'id': 'c1'}, {'_id': 0})
+        await service.enqueue_batch(campaign_messages('c1', ['b@x']), TENANT, batch_id='c1')
+        await asyncio.sleep(0.2)
+        await db.marketing_campaigns.update_one({'id': 'c1'}, {'$unset': {'queueing': ''}})
+        await service.finish_campaign(TENANT, 'c1')
+        await service.stop()
+        return mid, await db.marketing_campaigns.find_one({'id': 'c1'}, {'_id': 0})
+
+    mid, campaign = run(scenario())
+    assert mid['status'] == 'sending'
+    assert campaign['status'] == 'sent' and campaign['delivered_count'] == 2
+
+
+def test_send_campaign_endpoint_marks_sending_first():
+    pytest.importorskip('fastapi')
+    import message_delivery
+    import server
+
+    async def scenario():
+        db = mongomock_motor.AsyncMongoMockClient()['delivery_test']
+        server.db = db
+        service = make_service(db)
+        message_delivery.delivery_service = service
+        await db.marketing_campaigns.insert_one({'id': 'c1', 'tenant_id': TENANT, 'status': 'draft',
+                                                 'subject': 's', 'message': 'm', 'segment': 'all'})
+        await db.guests.insert_many([{'id': f'g{i}', 'tenant_id': TENANT, 'email': f'g{i}@x'} for i in range(3)])
+        await service.start()
+        user = server.User(id='u1', tenant_id=TENANT, email='m@x', name='Manager', role='admin')
+        result = await server.send_campaign('c1', current_user=user)
+        await asyncio.sleep(0.3)
+        await service.stop()
+        return result, await db.marketing_campaigns.find_one({'id': 'c1'}, {'_id': 0})
+
+    result, campaign = run(scenario())
+    assert result['queued'] == 3
+    assert campaign['status'] == 'sent' and campaign['delivered_count'] == 3
+    assert 'queueing' not in campaign
@@ -0,0 +1,70 @@
+"""
+Portfolio service: property membership and snapshot
+(in-memory MongoDB via mongomock-motor)
+"""
+import asyncio
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+mongomock_motor = pytest.importorskip('mongomock_motor')
+
+import kpi_engine  # noqa: E402
+from portfolio_service import PortfolioService  # noqa: E402
+
+TENANT = 't-home'
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def make_service():
+    db = mongomock_motor.AsyncMongoMockClient()['portfolio_test']
+    kpi_engine.kpi_engine = None
+    await db.organizations.insert_one({'id': TENANT, 'name': 'Home Hotel'})
+    return db, PortfolioService(db)
+
+
+def test_single_hotel_is_its_own_portfolio():
+    async def scenario():
+        db, service = await make_service()
+        return await service.property_ids(TENANT)
+
+    assert run(scenario()) == [TENANT]
+
+
+def test_added_property_keeps_home_hotel():
+    async def scenario():
+        db, service = await make_service()
+        # As POST /multi-property/properties stores it
+        await db.properties.insert_one({'id': 'p-2', 'portfolio_id': TENANT, 'property_name': 'Second Hotel',
+                                        'status': 'active'})
+        await db.rooms.insert_many([
+            {'id': 'r1', 'tenant_id': TENANT, 'room_number': '101', 'status': 'available'},
+            {'id': 'r2', 'tenant_id': 'p-2', 'room_number': '201', 'status': 'available'},
+        ])
+        return await service.properties(TENANT), await service.snapshot(TENANT, date(2026, 3, 1))
+
+    props, snapshot = run(scenario())
+    assert [p['property_id'] for p in props] == [TENANT, 'p-2']
+    assert props[0]['property_name'] == 'Home Hotel'
+    assert snapshot['summary']['total_properties'] == 2 and snapshot['summary']['total_rooms'] == 2
+    assert [r['property_id'] for r in snapshot['properties']] == [TENANT, 'p-2']
+
+
+def test_home_hotel_listed_once():
+    async def scenario():
+        db, service = await make_service()
+        await db.properties.insert_many([
+            {'id': TENANT, 'tenant_id': TENANT, 'property_name': 'Home (registered)', 'status': 'active'},
+            {'id': 'p-2', 'portfolio_id': TENANT, 'property_name': 'Second Hotel', 'status': 'active'},
+        ])
+        return await service.properties(TENANT)
+
+    props = run(scenario())
+    assert [p['property_id'] for p in props] == [TENANT, 'p-2']
+    assert props[0]['property_name'] == 'Home (registered)'
@@ -0,0 +1,84 @@
+"""
+POS daily totals: late tickets after the closure, sealed-day rebuilds and
+per-day backfill (in-memory MongoDB via mongomock-motor)
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+mongomock_motor = pytest.importorskip('mongomock_motor')
+
+from pos_daily_totals import POSDailyTotals  # noqa: E402
+
+TENANT = 't-pos'
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def ticket(ticket_id, day, amount=100.0, outlet='o1'):
+    return {'id': ticket_id, 'tenant_id': TENANT, 'outlet_id': outlet, 'outlet_name': 'Lobby Bar',
+            'transaction_date': day, 'transaction_time': '12:00', 'total_amount': amount,
+            'payment_method': 'cash', 'items': []}
+
+
+async def make_totals(live_day='2026-03-01'):
+    db = mongomock_motor.AsyncMongoMockClient()['pos_test']
+    await db.pos_daily_totals_meta.insert_one({'_id': 'live', 'since': live_day})
+    return db, POSDailyTotals(db)
+
+
+def test_late_ticket_goes_to_adjustments():
+    async def scenario():
+        db, totals = await make_totals()
+        await totals.record(TENANT, [ticket('a', '2026-03-05')])
+        sealed = await totals.seal(TENANT, '2026-03-05')
+        await totals.record(TENANT, [ticket('b', '2026-03-05', 40.0)])
+        row = await db.pos_daily_totals.find_one({'business_date': '2026-03-05'})
+        day = await totals.day(TENANT, '2026-03-05')
+        return sealed, row, day
+
+    sealed, row, day = run(scenario())
+    assert sealed['gross_sales'] == 100.0
+    assert row['status'] == 'sealed' and row['gross_sales'] == 100.0
+    assert day['gross_sales'] == 140.0 and day['sealed']
+    assert day['adjustments'] == {'transaction_count': 1, 'gross_sales': 40.0}
+
+
+def test_rebuild_keeps_sealed_day():
+    async def scenario():
+        db, totals = await make_totals()
+        await db.pos_menu_transactions.insert_many([ticket('a', '2026-03-05'), ticket('b', '2026-03-05')])
+        await totals.record(TENANT, [ticket('a', '2026-03-05')])
+        await totals.seal(TENANT, '2026-03-05')
+        replayed = await totals.rebuild_day(TENANT, '2026-03-05')
+        row = await db.pos_daily_totals.find_one({'business_date': '2026-03-05'})
+        return replayed, row
+
+    replayed, row = run(scenario())
+    assert replayed == 0
+    assert row['status'] == 'sealed' and row['transaction_count'] == 1
+
+
+def test_backfill_per_missing_day_and_go_live_day():
+    async def scenario():
+        db, totals = await make_totals(live_day='2026-03-02')
+        await db.pos_menu_transactions.insert_many([
+            ticket('a', '2026-02-28'), ticket('b', '2026-03-01'),
+            ticket('c', '2026-03-02'), ticket('d', '2026-03-02'), ticket('e', '2026-03-03'),
+        ])
+        # Only the post-deploy half of the go-live day and the next day were recorded live
+        await totals.record(TENANT, [ticket('d', '2026-03-02'), ticket('e', '2026-03-03')])
+        first = await totals.range(TENANT, '2026-02-28', '2026-03-03')
+        again = await totals.range(TENANT, '2026-02-28', '2026-03-03')
+        markers = await db.pos_daily_backfills.count_documents({'channel': 'menu'})
+        return first, again, markers
+
+    first, again, markers = run(scenario())
+    assert first['transaction_count'] == 5
+    assert again['transaction_count'] == 5
+    assert markers == 3